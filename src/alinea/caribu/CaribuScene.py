@@ -24,11 +24,18 @@ from alinea.caribu.file_adaptor import read_can, read_light, read_pattern, \
     read_opt, build_materials
 from alinea.caribu.plantgl_adaptor import scene_to_cscene, mtg_to_cscene
 from alinea.caribu.caribu import raycasting, radiosity, mixed_radiosity, \
-    x_raycasting, x_radiosity, x_mixed_radiosity, opt_string_and_labels, \
-    triangles_string, pattern_string, write_scene
+    monte_carlo, x_raycasting, x_radiosity, x_mixed_radiosity, \
+    x_monte_carlo, x_raycasting_series, x_radiosity_series, \
+    x_mixed_radiosity_series, opt_string_and_labels, x_opt_strings_and_labels, \
+    triangles_string, pattern_string, write_scene, gap_fraction, \
+    hemispherical_cameras
 from alinea.caribu.display import jet_colors, generate_scene, nan_to_zero
-from alinea.caribu.caribu_shell import vperiodise, Path
+from alinea.caribu.light import reduce_lights
+from alinea.caribu.caribu_shell import vperiodise, Path, FormFactorCache, RadiosityState
 from functools import reduce
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
 from alinea.caribu.caributriangleset import AbstractCaribuTriangleSet, CaribuTriangleSet 
 
 import tempfile
@@ -57,6 +64,9 @@ def _convert(output, conv_unit):
         output['area'] = [area * meter_square for area in output['area']]
         for k in ['Eabs', 'Ei', 'Ei_sup', 'Ei_inf']:
             output[k] = [nrj / meter_square for nrj in output[k]]
+            if k + '_se' in output:
+                output[k + '_se'] = [nrj / meter_square for nrj in
+                                     output[k + '_se']]
         if 'sensors' in output:
             output['sensors']['area'] = [area * meter_square for area in output['sensors']['area']]
             for k in ['Ei', 'Ei0']:
@@ -110,7 +120,8 @@ class CaribuScene(object):
 
     def __init__(self, scene=None, light=None, pattern=None, opt=None,
                  soil_reflectance=None, soil_mesh=None, z_soil=None,
-                 scene_unit='m', debug = False, filecache = True):
+                 scene_unit='m', debug = False, filecache = True, ff_cache=None,
+                 radiosity_state=None):
         """ Initialise a CaribuScene
 
         Args:
@@ -156,6 +167,17 @@ class CaribuScene(object):
             scene_unit (str): the unit of length used for scene coordinate
             and for pattern (should be one of class.units default)
                     By default, scene_unit is considered to be 'm' (meter).
+            ff_cache (FormFactorCache): a store of the radiosity form factors,
+            that can be shared between scenes.
+                    If None (default) and filecache is True, form factors are
+                    stored in the scene temporary directory and reused by
+                    successive runs on the same geometry.
+            radiosity_state (RadiosityState): the radiosity solutions of the
+            previous run, used as initial guess by the solver of the next one.
+                    If None (default), a new state is created and successive
+                    runs on the same geometry are warm started. Its iterations
+                    and residual attributes give the solver statistics of the
+                    last run.
 
         Returns:
             A CaribuScene instance
@@ -288,6 +310,12 @@ class CaribuScene(object):
         self.tempdir = None
         if filecache:
             self.tempdir = tempfile.mkdtemp() if not debug else './caribuscene_'+str(id(self))
+            if ff_cache is None:
+                ff_cache = FormFactorCache(os.path.join(self.tempdir, 'ff_cache'))
+        self.ff_cache = ff_cache
+        if radiosity_state is None:
+            radiosity_state = RadiosityState()
+        self.radiosity_state = radiosity_state
         self.canfile = None
         self.optfile = None
 
@@ -475,7 +503,9 @@ class CaribuScene(object):
 
     def run(self, direct=True, infinite=False, d_sphere=0.5, layers=10,
             height=None, screen_size=1536, screen_resolution=None, sensors=None,
-            split_face=False, simplify=False):
+            split_face=False, simplify=False, cluster_ratio=None, tolerance=None,
+            time_budget=None, nb_rays=None, nb_photons=None, seed=0,
+            light_angle=None, light_threshold=0):
         """ Compute illumination using the appropriate caribu algorithm
 
         Args:
@@ -501,6 +531,36 @@ class CaribuScene(object):
             simplify: (bool)  Whether results per band should be simplified to
             a {result_name: property} dict
                     in the case of a monochromatic simulation
+            cluster_ratio: (float) if not None, pure radiosity (direct=False,
+            infinite=False) is computed hierarchically: groups of triangles
+            whose radius is below cluster_ratio times their distance to a
+            receiver are seen as a whole (0 < cluster_ratio < 1).
+            Default is None (all triangles are seen individually)
+            tolerance: (float) if not None, the relative residual at which the
+            radiosity solver stops (direct=False). Default is None (1e-6)
+            time_budget: (float) if not None, the time (s) after which the
+            radiosity solver stops with its partial solution (direct=False).
+            With either of them, the solver statistics of each band (iterations,
+            residual, error_bound, residuals) are stored in self.solver_info
+            nb_rays: (int) if not None, direct lighting (direct=True) is
+            computed by casting nb_rays rays per triangle toward the lights
+            instead of projecting the scene on the screen.
+            Default is None (projection)
+            nb_photons: (int) if not None, rediffusions (direct=False) are
+            computed by tracing nb_photons photons (Monte Carlo) instead of
+            radiosity or mixed radiosity. The standard errors of the
+            per-triangle results are then added to raw with a '_se' suffix
+            (Eabs_se, Ei_se, ...). Default is None (radiosity)
+            seed: (int) the seed of the random streams of the Monte Carlo
+            engine. Default is 0
+            light_angle: (float) if not None, light sources closer than
+            light_angle (deg) are merged before the simulation (see
+            light.reduce_lights), and the number of sources and the angular
+            error of the reduction are stored in self.light_reduction.
+            Default is None (sources are used as they are)
+            light_threshold: (float) with light_angle, the relative
+            horizontal irradiance below which a source is merged into the
+            closest one. Default is 0
 
         Returns:
             - raw (dict of dict) a {band_name: {result_name: property}} dict of dict.
@@ -525,14 +585,22 @@ class CaribuScene(object):
 
         raw, aggregated = {}, {}
         self.soil_raw, self.soil_aggregated = {}, {}
+        self.solver_info = {}
+        self.light_reduction = None
         results = ['Eabs', 'Ei', 'area']
         if split_face:
             results.extend(['Ei_inf', 'Ei_sup'])
+        se_results = []
+        if nb_photons is not None and not direct:
+            se_results = [k + '_se' for k in results if k != 'area']
 
         # convert lights to scene_unit
         lights = self.light
         if self.conv_unit != 1:
             lights = [(e * self.conv_unit ** 2, vect) for e, vect in self.light]
+        if light_angle is not None:
+            lights, self.light_reduction = reduce_lights(lights, max_angle=light_angle,
+                                                         threshold=light_threshold)
 
         if self.scene is not None:
             if self.debug : print ('Prepare scene', len(self.light))
@@ -564,7 +632,8 @@ class CaribuScene(object):
                     albedo = self.soil_reflectance[bands[0]]
 
                 algos = {'raycasting': raycasting, 'radiosity': radiosity,
-                         'mixed_radiosity': mixed_radiosity}
+                         'mixed_radiosity': mixed_radiosity,
+                         'monte_carlo': monte_carlo}
             else:
                 materials = {}
                 if not hasattr(self,'materialvalues') : 
@@ -581,9 +650,10 @@ class CaribuScene(object):
                     albedo = self.soil_reflectance
 
                 algos = {'raycasting': x_raycasting, 'radiosity': x_radiosity,
-                         'mixed_radiosity': x_mixed_radiosity}
+                         'mixed_radiosity': x_mixed_radiosity,
+                         'monte_carlo': x_monte_carlo}
 
-            if not direct and infinite:  # mixed radiosity will be used
+            if not direct and infinite and nb_photons is None:  # mixed radiosity will be used
                 if d_sphere < 0:
                     raise ValueError(
                         'calling radiosity should be done using direct=False and infinite=False')
@@ -601,11 +671,20 @@ class CaribuScene(object):
                 screen_size = self.auto_screen(screen_resolution)
                 print('adjusted projection screen size: ' + str(screen_size))
 
+            sensors_id = None
             if sensors is not None:
                 sensors_id = reduce(lambda x, y: x + y, [[k] * len(v) for k, v in sensors.items()], [])
                 sensors = reduce(lambda x, y: x + y, list(sensors.values()), [])
 
-            if not direct and infinite:  # mixed radiosity
+            if not direct and nb_photons is not None:  # monte carlo
+                out = algos['monte_carlo'](triangles, materials, lights=lights,
+                                           domain=self.pattern if infinite else None,
+                                           soil_reflectance=albedo,
+                                           nb_photons=nb_photons, seed=seed,
+                                           screen_size=screen_size,
+                                           sensors=sensors, debug=self.debug,
+                                           nb_rays=nb_rays)
+            elif not direct and infinite:  # mixed radiosity
                 out = algos['mixed_radiosity'](triangles, materials,
                                                lights=lights,
                                                domain=self.pattern,
@@ -613,10 +692,18 @@ class CaribuScene(object):
                                                diameter=d_sphere, layers=layers,
                                                height=height,
                                                screen_size=screen_size,
-                                               sensors=sensors, debug = self.debug)
+                                               sensors=sensors, debug = self.debug,
+                                               ff_cache=self.ff_cache,
+                                               warm_start=self.radiosity_state,
+                                               tolerance=tolerance,
+                                               time_budget=time_budget)
             elif not direct:  # pure radiosity
                 out = algos['radiosity'](triangles, materials, lights=lights,
-                                         screen_size=screen_size, sensors=sensors, debug = self.debug)
+                                         screen_size=screen_size, sensors=sensors, debug = self.debug,
+                                         ff_cache=self.ff_cache,
+                                         warm_start=self.radiosity_state,
+                                         cluster_ratio=cluster_ratio,
+                                         tolerance=tolerance, time_budget=time_budget)
             else:  # ray_casting
                 if infinite:
                     out = algos['raycasting'](triangles, materials,
@@ -624,7 +711,8 @@ class CaribuScene(object):
                                               domain=self.pattern,
                                               screen_size=screen_size,
                                               sensors=sensors,
-                                              debug = self.debug)
+                                              debug = self.debug,
+                                              nb_rays=nb_rays)
                 else:
                     out = algos['raycasting'](triangles, materials,
                                               lights=lights, domain=None,
@@ -632,37 +720,13 @@ class CaribuScene(object):
                                               sensors=sensors,
                                               debug = self.debug,
                                               canfile = self.canfile,
-                                              optfile = self.optfile)
+                                              optfile = self.optfile,
+                                              nb_rays=nb_rays)
 
             if len(bands) == 1:
                 out = {bands[0]: out}
-            for band in bands:
-                output = _convert(out[band], self.conv_unit)
-                raw[band] = {}
-                aggregated[band] = {}
-                if 'sensors' in output:
-                    sensors = output.pop('sensors')
-                    raw[band]['sensors'] = {}
-                    aggregated[band]['sensors'] = {}
-                    for k in ('Ei', 'Ei0', 'area'):
-                        raw[band]['sensors'][k] = _agregate(sensors[k], sensors_id, list)
-                        if k == 'area':
-                            aggregated[band]['sensors'][k] = _agregate(sensors[k], sensors_id, sum)
-                        else:
-                            aggregated[band]['sensors'][k] = _agregate(
-                                zip(sensors[k], sensors['area']), sensors_id, _wsum)
-                for k in results:
-                    raw[band][k] = _agregate(output[k], groups, list)
-                    if k == 'area':
-                        aggregated[band][k] = _agregate(output[k], groups, sum)
-                    else:
-                        aggregated[band][k] = _agregate(
-                            zip(output[k], output['area']), groups, _wsum)
-                if self.soil is not None:
-                    self.soil_raw[band] = {k: raw[band][k].pop(self.soil_label) for k in
-                                           results}
-                    self.soil_aggregated[band] = {
-                        k: aggregated[band][k].pop(self.soil_label) for k in results}
+            raw, aggregated, self.soil_raw, self.soil_aggregated, self.solver_info = \
+                self._results(out, groups, results, se_results, sensors_id)
 
             if simplify and len(bands) == 1:
                 raw = raw[bands[0]]
@@ -670,6 +734,289 @@ class CaribuScene(object):
 
         return raw, aggregated
 
+    def _results(self, out, groups, results, se_results, sensors_id=None):
+        """ raw and aggregated results (see run) of a {band: output} dict of caribu
+        outputs, with the results of the soil and the solver statistics of each band
+        """
+        raw, aggregated, soil_raw, soil_aggregated, solver_info = {}, {}, {}, {}, {}
+        for band in out:
+            output = _convert(out[band], self.conv_unit)
+            if 'solver' in output:
+                solver_info[band] = output.pop('solver')
+            raw[band] = {}
+            aggregated[band] = {}
+            if 'sensors' in output:
+                sensors = output.pop('sensors')
+                raw[band]['sensors'] = {}
+                aggregated[band]['sensors'] = {}
+                for k in ('Ei', 'Ei0', 'area'):
+                    raw[band]['sensors'][k] = _agregate(sensors[k], sensors_id, list)
+                    if k == 'area':
+                        aggregated[band]['sensors'][k] = _agregate(sensors[k], sensors_id, sum)
+                    else:
+                        aggregated[band]['sensors'][k] = _agregate(
+                            zip(sensors[k], sensors['area']), sensors_id, _wsum)
+            for k in results:
+                raw[band][k] = _agregate(output[k], groups, list)
+                if k == 'area':
+                    aggregated[band][k] = _agregate(output[k], groups, sum)
+                else:
+                    aggregated[band][k] = _agregate(
+                        zip(output[k], output['area']), groups, _wsum)
+            for k in se_results:
+                raw[band][k] = _agregate(output[k], groups, list)
+            if self.soil is not None:
+                soil_raw[band] = {k: raw[band][k].pop(self.soil_label) for k in
+                                  results + se_results}
+                soil_aggregated[band] = {
+                    k: aggregated[band][k].pop(self.soil_label) for k in results}
+        return raw, aggregated, soil_raw, soil_aggregated, solver_info
+
+    def run_series(self, light_sets, direct=True, infinite=False, d_sphere=0.5, layers=10,
+                   height=None, screen_size=1536, screen_resolution=None, sensors=None,
+                   split_face=False, simplify=False, cluster_ratio=None, nb_rays=None,
+                   nb_photons=None, seed=0, batch_size=24, workers=1):
+        """ Compute illumination for a series of light sets (e.g. hourly skies)
+
+        The scene is prepared once, identical light sets are simulated once, and
+        the other ones are simulated by batches of batch_size skies sharing a
+        single caribu run (form factors and solver products are also shared by
+        radiosity). Batches are run by workers concurrent caribu processes.
+        Light sets are read lazily, at most batch_size * workers ahead of the
+        last yielded result, so that long series are streamed (identical light
+        sets further apart are simulated again).
+
+        Args:
+            light_sets: (iterable) the light sets (e.g. a generator), each being a list of
+            (Energy, (vx, vy, vz)) tuples (see setLight)
+            batch_size: (int) the number of skies simulated by a caribu run
+            (the monte carlo engine runs one light set at a time)
+            workers: (int) the number of caribu runs in parallel
+            other args: see run (d_sphere, layers, height, ... nb_photons and
+            seed). The radiosity solver always converges (no tolerance or time
+            budget)
+
+        Returns:
+            a generator of (raw, aggregated) results (see run), one per light
+            set and in their order, all with the same layout. Soil results of
+            the last yielded light set are in self.soil_raw and
+            self.soil_aggregated
+        """
+        if self.scene is None:
+            return
+        results = ['Eabs', 'Ei', 'area']
+        if split_face:
+            results.extend(['Ei_inf', 'Ei_sup'])
+        se_results = []
+        if nb_photons is not None and not direct:
+            se_results = [k + '_se' for k in results if k != 'area']
+
+        if not direct and infinite and nb_photons is None:  # mixed radiosity will be used
+            if d_sphere < 0:
+                raise ValueError(
+                    'calling radiosity should be done using direct=False and infinite=False')
+            d_sphere /= self.conv_unit
+            if height is None:
+                height = self.scene.getZmax()
+            else:
+                height /= self.conv_unit
+        if infinite and self.pattern is None:
+            raise ValueError(
+                'infinite canopy illumination needs a pattern to be defined')
+        if screen_resolution is not None:
+            screen_size = self.auto_screen(screen_resolution)
+
+        # geometry, materials and their caribu encoding, once for all the light sets
+        triangles = self.scene.allvalues(copied=True)
+        groups = self.scene.allids()
+        bands = list(self.material.keys())
+        x_materials = {}
+        for band in bands:
+            x_materials[band] = self.scene.repeat_for_triangles([
+                self.material[band][pid] for pid in self.scene.keys()])
+        albedo = {band: self.soil_reflectance[band] for band in bands}
+        if self.soil is not None:
+            triangles += self.soil
+            groups = groups + [self.soil_label] * len(self.soil)
+            for band in bands:
+                x_materials[band] = x_materials[band] + [(albedo[band],)] * len(self.soil)
+        sensors_id = None
+        if sensors is not None:
+            sensors_id = reduce(lambda x, y: x + y, [[k] * len(v) for k, v in sensors.items()], [])
+            sensors = reduce(lambda x, y: x + y, list(sensors.values()), [])
+        domain = self.pattern if infinite else None
+
+        if not direct and nb_photons is not None:  # monte carlo
+            def simulate(skies):
+                return [x_monte_carlo(triangles, x_materials, lights=lights, domain=domain,
+                                      soil_reflectance=albedo, nb_photons=nb_photons, seed=seed,
+                                      screen_size=screen_size, sensors=sensors,
+                                      debug=self.debug, nb_rays=nb_rays) for lights in skies]
+        elif not direct and infinite:  # mixed radiosity
+            opt_strings, labels = x_opt_strings_and_labels(x_materials, albedo)
+            can_string = triangles_string(triangles, labels)
+
+            def simulate(skies):
+                return x_mixed_radiosity_series(triangles, x_materials, skies, domain=self.pattern,
+                                                soil_reflectance=albedo, diameter=d_sphere,
+                                                layers=layers, height=height,
+                                                screen_size=screen_size, debug=self.debug,
+                                                ff_cache=self.ff_cache,
+                                                canfile=can_string, optfiles=opt_strings)
+        elif not direct:  # pure radiosity
+            opt_strings, labels = x_opt_strings_and_labels(x_materials,
+                                                           {band: -1 for band in bands})
+            can_string = triangles_string(triangles, labels)
+
+            def simulate(skies):
+                return x_radiosity_series(triangles, x_materials, skies, screen_size=screen_size,
+                                          sensors=sensors, debug=self.debug,
+                                          ff_cache=self.ff_cache, cluster_ratio=cluster_ratio,
+                                          canfile=can_string, optfiles=opt_strings)
+        else:  # ray_casting
+            o_string, labels = opt_string_and_labels(x_materials[bands[0]])
+            can_string = triangles_string(triangles, labels)
+
+            def simulate(skies):
+                return x_raycasting_series(triangles, x_materials, skies, domain=domain,
+                                           screen_size=screen_size, sensors=sensors,
+                                           debug=self.debug, nb_rays=nb_rays,
+                                           canfile=can_string, optfile=o_string)
+
+        def process(skies):
+            return [self._results(out, groups, results, se_results, sensors_id)
+                    for out in simulate(skies)]
+
+        # light sets, in scene unit, are keyed to simulate identical ones once. Empty
+        # ones (night) are simulated with a null light to keep the result layout.
+        # They are read lazily, at most batch_size * workers steps ahead of the last
+        # yielded one, and results are dropped after their last use in these steps
+        workers = max(1, workers)
+        look_ahead = batch_size * workers
+        light_sets = iter(light_sets)
+        exhausted = False
+        unique, keys, counts, done = {}, {}, {}, {}
+        steps, batch, pending = deque(), [], deque()
+        index = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                if steps and steps[0] in done:
+                    step = steps.popleft()
+                    counts[step] -= 1
+                    if counts[step] == 0:
+                        del unique[keys.pop(step)], counts[step]
+                        out = done.pop(step)
+                    else:
+                        out = deepcopy(done[step])
+                    raw, aggregated, self.soil_raw, self.soil_aggregated, info = out
+                    if simplify and len(bands) == 1:
+                        raw = raw[bands[0]]
+                        aggregated = aggregated[bands[0]]
+                    yield raw, aggregated
+                elif batch and len(pending) < workers and (
+                        len(batch) == batch_size or exhausted or len(steps) >= look_ahead):
+                    indices = [unique[lights] for lights in batch]
+                    pending.append((indices, executor.submit(
+                        process, [list(lights) for lights in batch])))
+                    batch = []
+                elif not exhausted and len(batch) < batch_size and len(steps) < look_ahead:
+                    try:
+                        lights = next(light_sets)
+                    except StopIteration:
+                        exhausted = True
+                        continue
+                    lights = tuple((float(e) * self.conv_unit ** 2, tuple(map(float, vect)))
+                                   for e, vect in lights) or ((0., (0., 0., -1.)),)
+                    if lights not in unique:
+                        unique[lights], keys[index], counts[index] = index, lights, 0
+                        batch.append(lights)
+                        index += 1
+                    counts[unique[lights]] += 1
+                    steps.append(unique[lights])
+                elif pending:
+                    indices, future = pending.popleft()
+                    done.update(zip(indices, future.result()))
+                else:
+                    break
+
+    def gap_fraction(self, directions=None, infinite=False, screen_size=1536,
+                     screen_resolution=None, nb_rays=None):
+        """ Gap fraction of the scene and area of its primitives seen from a
+        set of directions, computed by projection only (no energy balance)
+
+        Args:
+            directions: (list of tuples) a list of (vx, vy, vz) vectors
+            pointing downward. If None (default), the directions of the lights
+            of the scene are used
+            infinite: (bool) Whether the scene should be considered as infinite
+            (needs a pattern). Gap fractions are only computed in this case
+            screen_size, screen_resolution, nb_rays: see run
+
+        Returns:
+            - gap (list of float) the fraction of the pattern seen from each
+            direction through the scene (1 - ground cover for the vertical),
+            None if infinite is False
+            - projected_area (dict) a {primitive_id: [area,...]} dict of the
+            area (m2) of the primitives seen from each direction, projected on
+            the horizontal plane (area of their shadow on the ground)
+        """
+        if directions is None:
+            directions = [vect for e, vect in self.light]
+        if infinite and self.pattern is None:
+            raise ValueError(
+                'infinite canopy gap fraction needs a pattern to be defined')
+        if screen_resolution is not None:
+            screen_size = self.auto_screen(screen_resolution)
+        triangles = self.scene.allvalues(copied=True)
+        groups = self.scene.allids()
+        out = gap_fraction(triangles, directions,
+                           domain=self.pattern if infinite else None,
+                           screen_size=screen_size, nb_rays=nb_rays,
+                           debug=self.debug)
+        area = out['projected_area'] * self.conv_unit ** 2
+        projected_area = {}
+        for pid, a in zip(groups, area):
+            if pid in projected_area:
+                projected_area[pid] = projected_area[pid] + a
+            else:
+                projected_area[pid] = a
+        projected_area = {pid: a.tolist() for pid, a in projected_area.items()}
+        gap = out['gap_fraction'].tolist() if infinite else None
+        return gap, projected_area
+
+    def hemispherical_photos(self, positions, infinite=False, image_size=128,
+                             nb_rings=9, nb_threads=None):
+        """ Simulated hemispherical photographs (looking upward) of the scene
+        taken at a set of positions, with their gap fraction profiles
+
+        Args:
+            positions: (list of tuples) the (x, y, z) positions (m) of the
+            cameras
+            infinite: (bool) Whether the scene should be considered as infinite
+            (needs a pattern)
+            image_size: (int) the size (pixels) of the square images
+            nb_rings: (int) the number of zenith rings of the gap fraction
+            profiles
+            nb_threads: (int) the number of threads taking the pictures. If None
+            (default), all the cores are used
+
+        Returns:
+            a dict with the images, zenith, gap_fraction and sky_fraction
+            arrays (see caribu.hemispherical_cameras), and primitive_id the
+            primitive of each triangle index found in the images
+        """
+        if infinite and self.pattern is None:
+            raise ValueError(
+                'infinite canopy photographs need a pattern to be defined')
+        triangles = self.scene.allvalues(copied=True)
+        positions = [tuple(x / self.conv_unit for x in p) for p in positions]
+        out = hemispherical_cameras(triangles, positions,
+                                    domain=self.pattern if infinite else None,
+                                    image_size=image_size, nb_rings=nb_rings,
+                                    nb_threads=nb_threads, debug=self.debug)
+        out['primitive_id'] = self.scene.allids()
+        return out
+
     def runPeriodise(self):
         """ Call periodise and modify position of triangle in the scene to fit inside pattern"""
         triangles, groups, materials, bands, albedo = self.as_primitive()
@@ -13,6 +13,9 @@
 Core pythonic functions to call caribu shell.
 """
 
+import os
+import numpy
+
 from alinea.caribu.label import Label
 from alinea.caribu.caribu_shell import Caribu
 
@@ -169,6 +172,25 @@ def get_incident(eabs, materials):
     return [float(e) / a if a != 0 else e for e, a in zip(eabs, alpha)]
 
 
+def source_irradiance(sources, nb_triangles, nb_sources, output='dense'):
+    """ triangles x sources matrix of the surfacic density of direct energy incoming on the triangles from each
+    light source, from the 'sources' entry of caribu outputs (see Caribu.store_sources)
+
+    output is 'dense' (numpy array) or 'sparse' (scipy.sparse csr matrix, for skies with many sources shading
+    most triangles)
+    """
+    if output not in ('dense', 'sparse'):
+        raise ValueError("source output should be 'dense' or 'sparse', not %s" % str(output))
+    index, source = sources['index'], sources['source']
+    values = sources['Ei_sup'] + sources['Ei_inf']
+    if output == 'sparse':
+        from scipy.sparse import csr_matrix
+        return csr_matrix((values, (index, source)), shape=(nb_triangles, nb_sources))
+    res = numpy.zeros((nb_triangles, nb_sources))
+    res[index, source] = values
+    return res
+
+
 def write_scene(triangles, materials, canfile, optfile):
     if len(triangles) != len(materials):
         raise ValueError(len(triangles), len(materials))
@@ -180,7 +202,8 @@ def write_scene(triangles, materials, canfile, optfile):
 
 
 def raycasting(triangles, materials, lights=(default_light,), domain=None,
-               screen_size=1536, sensors=None, debug = False, canfile = None, optfile = None):
+               screen_size=1536, sensors=None, debug = False, canfile = None, optfile = None, nb_rays=None,
+               source_output=None):
     """Compute monochrome illumination of triangles using caribu raycasting mode.
 
     Args:
@@ -200,6 +223,10 @@ def raycasting(triangles, materials, lights=(default_light,), domain=None,
                  if None (default), scene is not repeated
         screen_size: (int) buffer size for projection images (pixels)
         sensors: (list of list of tuples) a list of triangles defining virtual sensors
+        nb_rays: (int) if given, direct lighting is computed by casting nb_rays rays per triangle (bounding volume
+                    hierarchy) instead of projecting the scene on a screen_size x screen_size screen
+        source_output: (str) if 'dense' or 'sparse', the contribution of each light source is also returned
+                    (see source_irradiance)
 
     Returns:
         (dict of str:property) properties computed:
@@ -212,8 +239,12 @@ def raycasting(triangles, materials, lights=(default_light,), domain=None,
           - Ei_sup (float): the surfacic density of energy incoming on the superior face of the triangle
           - sensor (dict): a dict with id, area, surfacic density of incoming
             direct energy and surfacic density of incoming total energy of sensors, if any
+          - Ei_sources (array or sparse matrix): the surfacic density of energy incoming on the triangles (rows)
+            from each light source (columns), if source_output is given. Rows sum to Ei
     """
 
+    if source_output not in (None, 'dense', 'sparse'):
+        raise ValueError("source_output should be None, 'dense' or 'sparse', not %s" % str(source_output))
     if canfile is None or optfile is None:
         o_string, labels = opt_string_and_labels(materials)
         can_string = triangles_string(triangles, labels)
@@ -244,18 +275,23 @@ def raycasting(triangles, materials, lights=(default_light,), domain=None,
                   direct=True,
                   infinitise=infinite,
                   projection_image_size=screen_size,
-                  resdir=None, resfile=None, debug=debug)
+                  resdir=None, resfile=None, debug=debug, nb_rays=nb_rays,
+                  source_output=source_output is not None)
     algo.run()
     out = algo.nrj['band0']['data']
     out['Ei'] = get_incident(out['Eabs'], materials)
     if sensors is not None:
         out['sensors'] = algo.measures['band0']
+    if source_output is not None:
+        out['Ei_sources'] = source_irradiance(algo.nrj['band0']['sources'], len(out['Ei']), len(lights),
+                                              source_output)
 
     return out
 
 
 def x_raycasting(triangles, x_materials, lights=(default_light,), domain=None,
-                 screen_size=1536, sensors=None, debug= False, canfile = None, optfile = None):
+                 screen_size=1536, sensors=None, debug= False, canfile = None, optfile = None, nb_rays=None,
+                 source_output=None):
     """Compute monochrome illumination of triangles using caribu raycasting mode.
 
     Args:
@@ -276,6 +312,10 @@ def x_raycasting(triangles, x_materials, lights=(default_light,), domain=None,
                  if None (default), scene is not repeated
         screen_size: (int) buffer size for projection images (pixels)
         sensors: (list of list of tuples) a list of triangles defining virtual sensors
+        nb_rays: (int) if given, direct lighting is computed by casting nb_rays rays per triangle (bounding volume
+                    hierarchy) instead of projecting the scene on a screen_size x screen_size screen
+        source_output: (str) if 'dense' or 'sparse', the contribution of each light source is also returned
+                    (see raycasting)
 
     Returns:
         a ({band_name: {property_name:property_values} } dict of dict) with  properties:
@@ -288,6 +328,8 @@ def x_raycasting(triangles, x_materials, lights=(default_light,), domain=None,
           - Ei_sup (float): the surfacic density of energy incoming on the superior face of the triangle
           - sensor (dict): a dict with id, area, surfacic density of incoming
             direct energy and surfacic density of incoming total energy of sensors, if any
+          - Ei_sources (array or sparse matrix): the surfacic density of energy incoming on the triangles
+            from each light source, if source_output is given
     """
 
     x_out = {}
@@ -295,7 +337,8 @@ def x_raycasting(triangles, x_materials, lights=(default_light,), domain=None,
     x_materials = {k: v for k, v in x_materials.items()}
     band, materials = x_materials.popitem()
     out = raycasting(triangles, materials, lights=lights, domain=domain,
-                     screen_size=screen_size, sensors=sensors, debug=debug)
+                     screen_size=screen_size, sensors=sensors, debug=debug, nb_rays=nb_rays,
+                     source_output=source_output)
     x_out[band] = out
 
     for band in x_materials:
@@ -310,8 +353,145 @@ def x_raycasting(triangles, x_materials, lights=(default_light,), domain=None,
     return x_out
 
 
+def gap_fraction(triangles, directions, domain=None, screen_size=1536, nb_rays=None, debug=False):
+    """Compute the areas of triangles seen from a set of directions, and the gap fraction of the scene along them.
+
+    Only the projection of caribu raycasting mode is run (no optical properties, energy balance or result files).
+
+    Args:
+        triangles: (list of list of tuples) a list of triangles, each being defined
+                    by an ordered triplet of 3-tuple points coordinates.
+        directions: (list of tuples) a list of (vx, vy, vz) vectors pointing downward
+        domain: (tuple of floats) 2D Coordinates of the domain bounding the scene for its replication.
+                 (xmin, ymin, xmax, ymax) scene is not bounded along z axis
+                 if None (default), scene is not repeated and no gap fraction is computed
+        screen_size: (int) buffer size for projection images (pixels)
+        nb_rays: (int) if given, triangles are seen by casting nb_rays rays per triangle (see raycasting)
+
+    Returns:
+        (dict of str:property) properties computed:
+          - projected_area (array): the area of the triangles (rows) seen from each direction (columns),
+            projected on the horizontal plane (i.e. the area of their shadow on the ground)
+          - covered_fraction (array): the fraction of the domain shaded by the scene along each direction, if domain
+            is given (ground cover for the vertical)
+          - gap_fraction (array): 1 - covered_fraction, if domain is given
+    """
+
+    if len(directions) == 0:
+        raise ValueError('at least one direction is needed')
+    o_string, labels = opt_string_and_labels([(0.1,)] * len(triangles))
+    can_string = triangles_string(triangles, labels)
+    sky_string = light_string([(1, d) for d in directions])
+
+    if domain is None:
+        infinite = False
+        pattern_str = None
+    else:
+        infinite = True
+        pattern_str = pattern_string(domain)
+
+    algo = Caribu(canfile=can_string,
+                  skyfile=sky_string,
+                  optfiles=o_string,
+                  patternfile=pattern_str,
+                  direct=True,
+                  infinitise=infinite,
+                  projection_image_size=screen_size,
+                  resdir=None, resfile=None, debug=debug, nb_rays=nb_rays,
+                  gap_query=True)
+    algo.run()
+    gap = algo.nrj['band0']['gap']
+    area = numpy.zeros((len(triangles), len(directions)))
+    area[gap['index'], gap['source']] = gap['area']
+    out = {'projected_area': area}
+    if domain is not None:
+        x1, y1, x2, y2 = domain
+        out['covered_fraction'] = area.sum(axis=0) / abs((x2 - x1) * (y2 - y1))
+        out['gap_fraction'] = 1 - out['covered_fraction']
+    return out
+
+
+def hemispherical_cameras(triangles, positions, domain=None, image_size=128, nb_rings=9, nb_threads=None,
+                          debug=False):
+    """Take the pictures of a scene by virtual hemispherical cameras looking upward.
+
+    The scene is loaded once for all cameras, and each pixel is the first triangle met by a ray cast toward the
+    upper hemisphere (no light or optical properties involved).
+
+    Args:
+        triangles: (list of list of tuples) a list of triangles, each being defined
+                    by an ordered triplet of 3-tuple points coordinates.
+        positions: (list of tuples) the (x, y, z) positions of the cameras
+        domain: (tuple of floats) 2D Coordinates of the domain bounding the scene for its replication.
+                 (xmin, ymin, xmax, ymax) scene is not bounded along z axis
+                 if None (default), scene is not repeated
+        image_size: (int) the size (pixels) of the square images
+        nb_rings: (int) the number of zenith rings of the gap fraction profiles
+        nb_threads: (int) the number of threads taking the pictures. If None (default), all the cores are used
+
+    Returns:
+        (dict of str:property) properties computed:
+          - images (array): a (cameras x image_size x image_size) array of equidistant projections of the upper
+            hemisphere (the distance to the center is proportional to the zenith angle), rows going toward -y and
+            columns toward +x. Pixels hold the index of the triangle seen, -1 for the sky and -2 out of the
+            hemisphere
+          - zenith (array): the zenith angle (deg) of the middle of the rings
+          - gap_fraction (array): the (cameras x rings) fraction of the pixels of each ring seeing the sky
+          - sky_fraction (array): the fraction of the pixels of the hemisphere seeing the sky, per camera
+    """
+
+    if len(positions) == 0:
+        raise ValueError('at least one camera position is needed')
+    if nb_threads is None:
+        nb_threads = os.cpu_count() or 1
+    o_string, labels = opt_string_and_labels([(0.1,)] * len(triangles))
+    can_string = triangles_string(triangles, labels)
+    positions = numpy.array(positions, dtype=float).reshape((-1, 3))
+
+    if domain is None:
+        infinite = False
+        pattern_str = None
+    else:
+        infinite = True
+        pattern_str = pattern_string(domain)
+        # cameras are moved in the pattern, as the triangles
+        x1, y1, x2, y2 = domain
+        low = numpy.array([min(x1, x2), min(y1, y2)])
+        positions[:, :2] = low + numpy.mod(positions[:, :2] - low, [abs(x2 - x1), abs(y2 - y1)])
+    cam_string = ''.join('%r %r %r\n' % tuple(p) for p in positions.tolist())
+
+    algo = Caribu(canfile=can_string,
+                  skyfile=light_string([default_light]),
+                  optfiles=o_string,
+                  patternfile=pattern_str,
+                  direct=True,
+                  infinitise=infinite,
+                  resdir=None, resfile=None, debug=debug, nb_threads=nb_threads,
+                  cameras=cam_string, camera_size=image_size)
+    algo.run()
+    images = algo.images
+
+    # zenith ring of the pixels (equidistant projection)
+    centers = (numpy.arange(image_size) + 0.5) / image_size * 2 - 1
+    rho = numpy.hypot(centers[None, :], centers[:, None])
+    ring = numpy.minimum((rho * nb_rings).astype(int), nb_rings - 1)
+    ring[rho > 1] = -1
+    inside = ring >= 0
+    sky = (images[:, inside] == -1)
+    counts = numpy.bincount(ring[inside], minlength=nb_rings)
+    gap = numpy.zeros((len(images), nb_rings))
+    for k in range(nb_rings):
+        if counts[k] > 0:
+            gap[:, k] = sky[:, ring[inside] == k].mean(axis=1)
+    return {'images': images,
+            'zenith': (numpy.arange(nb_rings) + 0.5) * 90. / nb_rings,
+            'gap_fraction': gap,
+            'sky_fraction': sky.mean(axis=1)}
+
+
 def radiosity(triangles, materials, lights=(default_light,), screen_size=1536,
-              sensors=None, debug=False):
+              sensors=None, debug=False, ff_cache=None, warm_start=None, cluster_ratio=None,
+              tolerance=None, time_budget=None):
     """Compute monochromatic illumination of triangles using radiosity method.
 
     Args:
@@ -328,6 +508,16 @@ def radiosity(triangles, materials, lights=(default_light,), screen_size=1536,
                 Energy is ligth flux passing throuh a unit area (scene unit) horizontal plane.
         screen_size: (int) buffer size for projection images (pixels)
         sensors: (list of list of tuples) a list of triangles defining virtual sensors
+        ff_cache: (FormFactorCache) a store of form factors to be reused across runs on the same geometry
+        warm_start: (RadiosityState) if given, the solver starts from the solutions of the previous run on the
+                    same geometry and the state is updated with the new ones (see its iterations and residual)
+        cluster_ratio: (float) if given (0 < cluster_ratio < 1), hierarchical radiosity is used: a group of
+                    triangles whose bounding radius is less than cluster_ratio times its distance to a triangle is
+                    seen by it as a whole. Form factors then scale with the size of large scenes, at the price of an
+                    approximation that decreases with cluster_ratio
+        tolerance: (float) if given, relative residual at which the radiosity solver stops (default 1e-6)
+        time_budget: (float) if given, time (s) after which the radiosity solver stops with its partial solution.
+                    With tolerance, this gives quick approximate scattering together with its error (see 'solver')
 
 
     Returns:
@@ -341,6 +531,9 @@ def radiosity(triangles, materials, lights=(default_light,), screen_size=1536,
           - Ei_sup (float): the surfacic density of energy incoming on the superior face of the triangle
           - sensor (dict): a dict with id, area, surfacic density of incoming
             direct energy and surfacic density of incoming total energy of sensors, if any
+          - solver (dict): if tolerance or time_budget is given, the statistics of the radiosity solver:
+            iterations, residual (final relative residual), error_bound (bound of the relative error of the
+            radiosities, None if unknown) and residuals (relative residual after each product by the form factors)
     """
 
     if len(triangles) <= 1:
@@ -364,18 +557,23 @@ def radiosity(triangles, materials, lights=(default_light,), screen_size=1536,
                   infinitise=False,
                   sphere_diameter=-1,
                   projection_image_size=screen_size,
-                  resdir=None, resfile=None,debug=debug)
+                  resdir=None, resfile=None, debug=debug, ff_cache=ff_cache,
+                  warm_start=warm_start, cluster_ratio=cluster_ratio,
+                  solver_tolerance=tolerance, solver_time=time_budget)
     algo.run()
     out = algo.nrj['band0']['data']
     out['Ei'] = get_incident(out['Eabs'], materials)
     if sensors is not None:
         out['sensors'] = algo.measures['band0']
+    if tolerance is not None or time_budget is not None:
+        out['solver'] = algo.solver_info.get('band0')
 
     return out
 
 
 def x_radiosity(triangles, x_materials, lights=(default_light,),
-                screen_size=1536, sensors=None, debug=False):
+                screen_size=1536, sensors=None, debug=False, ff_cache=None, warm_start=None,
+                cluster_ratio=None, tolerance=None, time_budget=None):
     """Compute multi-chromatic illumination of triangles using radiosity method.
 
     Args:
@@ -393,6 +591,16 @@ def x_radiosity(triangles, x_materials, lights=(default_light,),
                 Energy is ligth flux passing throuh a unit area (scene unit) horizontal plane.
         screen_size: (int) buffer size for projection images (pixels)
         sensors: (list of list of tuples) a list of triangles defining virtual sensors
+        ff_cache: (FormFactorCache) a store of form factors to be reused across runs on the same geometry
+        warm_start: (RadiosityState) if given, the solver starts from the solutions of the previous run on the
+                    same geometry and the state is updated with the new ones (see its iterations and residual)
+        cluster_ratio: (float) if given (0 < cluster_ratio < 1), hierarchical radiosity is used: a group of
+                    triangles whose bounding radius is less than cluster_ratio times its distance to a triangle is
+                    seen by it as a whole. Form factors then scale with the size of large scenes, at the price of an
+                    approximation that decreases with cluster_ratio
+        tolerance: (float) if given, relative residual at which the radiosity solver stops (default 1e-6)
+        time_budget: (float) if given, time (s) after which the radiosity solver stops with its partial solution.
+                    With tolerance, this gives quick approximate scattering together with its error (see 'solver')
 
     Returns:
         a {band_name: {property_name:property_values} } dict of dict) with  properties:
@@ -405,6 +613,9 @@ def x_radiosity(triangles, x_materials, lights=(default_light,),
           - Ei_sup (float): the surfacic density of energy incoming on the superior face of the triangle
           - sensor (dict): a dict with id, area, surfacic density of incoming
             direct energy and surfacic density of incoming total energy of sensors, if any
+          - solver (dict): if tolerance or time_budget is given, the statistics of the radiosity solver:
+            iterations, residual (final relative residual), error_bound (bound of the relative error of the
+            radiosities, None if unknown) and residuals (relative residual after each product by the form factors)
     """
 
     if len(triangles) <= 1:
@@ -430,20 +641,24 @@ def x_radiosity(triangles, x_materials, lights=(default_light,),
                     infinitise=False,
                     sphere_diameter=-1,
                     projection_image_size=screen_size,
-                    resdir=None, resfile=None, debug=debug)
+                    resdir=None, resfile=None, debug=debug, ff_cache=ff_cache,
+                    warm_start=warm_start, cluster_ratio=cluster_ratio,
+                    solver_tolerance=tolerance, solver_time=time_budget)
     caribu.run()
     out = {k: v['data'] for k, v in caribu.nrj.items()}
     for band in out:
         out[band]['Ei'] = get_incident(out[band]['Eabs'], x_materials[band])
         if sensors is not None:
             out[band]['sensors'] = caribu.measures[band]
+        if tolerance is not None or time_budget is not None:
+            out[band]['solver'] = caribu.solver_info.get(band)
 
     return out
 
 
 def mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
                     diameter, layers, height, screen_size=1536, sensors=None,
-                    debug=False):
+                    debug=False, ff_cache=None, warm_start=None, tolerance=None, time_budget=None):
     """Compute monochrome illumination of triangles using mixed-radiosity model.
 
     Args:
@@ -465,6 +680,12 @@ def mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
         height: upper limit of canopy layers (scene unit)
         screen_size: (int) buffer size for projection images (pixels)
         sensors: (list of list of tuples) a list of triangles defining virtual sensors
+        ff_cache: (FormFactorCache) a store of form factors to be reused across runs on the same geometry
+        warm_start: (RadiosityState) if given, the solver starts from the solutions of the previous run on the
+                    same geometry and the state is updated with the new ones (see its iterations and residual)
+        tolerance: (float) if given, relative residual at which the radiosity solver stops (default 1e-6)
+        time_budget: (float) if given, time (s) after which the radiosity solver stops with its partial solution.
+                    With tolerance, this gives quick approximate scattering together with its error (see 'solver')
         debug: (bool) Whether Caribu should be called in debug mode
 
     Returns:
@@ -478,6 +699,9 @@ def mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
           - Ei_sup (float): the surfacic density of energy incoming on the superior face of the triangle
           - sensor (dict): a dict with id, area, surfacic density of incoming
             direct energy and surfacic density of incoming total energy of sensors, if any
+          - solver (dict): if tolerance or time_budget is given, the statistics of the radiosity solver:
+            iterations, residual (final relative residual), error_bound (bound of the relative error of the
+            radiosities, None if unknown) and residuals (relative residual after each product by the form factors)
     """
 
     if len(triangles) <= 1:
@@ -506,18 +730,22 @@ def mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
                   can_height=height,
                   sphere_diameter=diameter,
                   projection_image_size=screen_size,
-                  resdir=None, resfile=None, debug=debug)
+                  resdir=None, resfile=None, debug=debug, ff_cache=ff_cache,
+                  warm_start=warm_start, solver_tolerance=tolerance, solver_time=time_budget)
     algo.run()
     out = algo.nrj['band0']['data']
     out['Ei'] = get_incident(out['Eabs'], materials)
     if sensors is not None:
         out['sensors'] = algo.measures['band0']
+    if tolerance is not None or time_budget is not None:
+        out['solver'] = algo.solver_info.get('band0')
 
     return out
 
 
 def x_mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
-                      diameter, layers, height, sensors=None, screen_size=1536, debug=False):
+                      diameter, layers, height, sensors=None, screen_size=1536, debug=False,
+                      ff_cache=None, warm_start=None, tolerance=None, time_budget=None):
     """Compute multi-chromatic illumination of triangles using mixed-radiosity model.
 
     Args:
@@ -540,6 +768,12 @@ def x_mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
         height: upper limit of canopy layers (scene unit)
         screen_size: (int) buffer size for projection images (pixels)
         sensors: (list of list of tuples) a list of triangles defining virtual sensors
+        ff_cache: (FormFactorCache) a store of form factors to be reused across runs on the same geometry
+        warm_start: (RadiosityState) if given, the solver starts from the solutions of the previous run on the
+                    same geometry and the state is updated with the new ones (see its iterations and residual)
+        tolerance: (float) if given, relative residual at which the radiosity solver stops (default 1e-6)
+        time_budget: (float) if given, time (s) after which the radiosity solver stops with its partial solution.
+                    With tolerance, this gives quick approximate scattering together with its error (see 'solver')
 
     Returns:
        a ({band_name: {property_name:property_values} } dict of dict) with  properties:
@@ -552,6 +786,9 @@ def x_mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
           - Ei_sup (float): the surfacic density of energy incoming on the superior face of the triangle
           - sensor (dict): a dict with id, area, surfacic density of incoming
             direct energy and surfacic density of incoming total energy of sensors, if any
+          - solver (dict): if tolerance or time_budget is given, the statistics of the radiosity solver:
+            iterations, residual (final relative residual), error_bound (bound of the relative error of the
+            radiosities, None if unknown) and residuals (relative residual after each product by the form factors)
    """
 
     if len(triangles) <= 1:
@@ -580,10 +817,406 @@ def x_mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
                     can_height=height,
                     sphere_diameter=diameter,
                     projection_image_size=screen_size,
-                    resdir=None, resfile=None, debug=debug)
+                    resdir=None, resfile=None, debug=debug, ff_cache=ff_cache,
+                    warm_start=warm_start, solver_tolerance=tolerance, solver_time=time_budget)
     caribu.run()
     out = {k: v['data'] for k, v in caribu.nrj.items()}
     for band in out:
         out[band]['Ei'] = get_incident(out[band]['Eabs'], materials[band])
+        if tolerance is not None or time_budget is not None:
+            out[band]['solver'] = caribu.solver_info.get(band)
 
     return out
+
+
+def monte_carlo(triangles, materials, lights=(default_light,), domain=None, soil_reflectance=-1,
+                nb_photons=100000, seed=0, screen_size=1536, sensors=None, debug=False, nb_threads=None,
+                nb_rays=None):
+    """Compute monochromatic illumination of triangles, with scattering estimated by photon tracing.
+
+    Direct lighting is computed as for raycasting, then photons emitted by the lit triangles are
+    reflected and transmitted by the triangles they hit, instead of solving the radiosity system.
+    This avoids the cost of the form factors on large scenes, the accuracy being traded for time with
+    nb_photons.
+
+    Args:
+        triangles: (list of list of tuples) a list of triangles, each being defined
+                    by an ordered triplet of 3-tuple points coordinates.
+        materials: (list of tuple) a list of materials defining optical properties of triangles
+                    A material is a 1-, 2- or 4-tuple depending on its optical behavior.
+                    A 1-tuple encode an opaque material characterised by its reflectance
+                    A 2-tuple encode a symmetric translucent material defined by a reflectance and a transmittance
+                    A 4-tuple encode an asymmetric translucent material defined the reflectance and transmittance
+                    of the upper and lower side respectively
+        lights: (list of tuples) a list of (Energy, (vx, vy, vz)) tuples defining ligh sources
+                By default a normalised zenital light is used.
+                Energy is ligth flux passing throuh a unit area (scene unit) horizontal plane.
+        domain: (tuple of floats) 2D Coordinates of the domain bounding the scene for its replication.
+                 (xmin, ymin, xmax, ymax) scene is not bounded along z axis
+                 if None (default), scene is not repeated
+        soil_reflectance: (float) the reflectance of the soil, at z=0 (or at the bottom of the scene if lower),
+                 for an infinite scene (domain given). The soil reflects both the lights and the photons reaching
+                 it. Default is -1 (no soil)
+        nb_photons: (int) the number of photons traced
+        seed: (int) the seed of the random streams. Photons are traced in batches with independent streams,
+                 so that results only depend on nb_photons and seed
+        screen_size: (int) buffer size for projection images (pixels)
+        sensors: (list of list of tuples) a list of triangles defining virtual sensors
+        debug: (bool) Whether Caribu should be called in debug mode
+        nb_threads: (int) the number of threads tracing the photon batches. If None (default), all the cores
+        nb_rays: (int) if given, direct lighting is computed by casting nb_rays rays per triangle instead of
+                 projecting the scene on a screen_size x screen_size screen
+
+    Returns:
+        (dict of str:property) properties computed:
+          - index(int) : the indices of the input triangles present in outputs ?
+          - label(str) : the internal barcode (canlabel) used by caribu (for debuging)
+          - area (float): the individual areas of triangles
+          - Eabs (float): the surfacic density of energy absorbed by the triangles (absorbed_energy / area)
+          - Ei (float): the surfacic density of energy incoming on the triangles
+          - Ei_inf (float): the surfacic density of energy incoming on the inferior face of the triangle
+          - Ei_sup (float): the surfacic density of energy incoming on the superior face of the triangle
+          - Eabs_se, Ei_se, Ei_inf_se, Ei_sup_se (float): the standard errors of Eabs, Ei, Ei_inf and Ei_sup
+            (-1 for Ei_inf of opaque triangles)
+          - sensor (dict): a dict with id, area, surfacic density of incoming
+            direct energy and surfacic density of incoming total energy of sensors, if any
+    """
+
+    o_string, labels = opt_string_and_labels(materials, soil_reflectance)
+    can_string = triangles_string(triangles, labels)
+    sky_string = light_string(lights)
+
+    if domain is None:
+        infinite = False
+        pattern_str = None
+    else:
+        infinite = True
+        pattern_str = pattern_string(domain)
+
+    if sensors is None:
+        sensor_str = None
+    else:
+        sensor_str = sensor_string(sensors)
+
+    if nb_threads is None:
+        nb_threads = os.cpu_count() or 1
+
+    algo = Caribu(canfile=can_string,
+                  skyfile=sky_string,
+                  optfiles=o_string,
+                  patternfile=pattern_str,
+                  sensorfile=sensor_str,
+                  direct=False,
+                  infinitise=infinite,
+                  projection_image_size=screen_size,
+                  resdir=None, resfile=None, debug=debug, nb_threads=nb_threads,
+                  nb_rays=nb_rays, nb_photons=nb_photons, seed=seed)
+    algo.run()
+    out = algo.nrj['band0']['data']
+    out['Ei'] = get_incident(out['Eabs'], materials)
+    out['Ei_se'] = get_incident(out['Eabs_se'], materials)
+    if sensors is not None:
+        out['sensors'] = algo.measures['band0']
+
+    return out
+
+
+def x_monte_carlo(triangles, x_materials, lights=(default_light,), domain=None, soil_reflectance=None,
+                  nb_photons=100000, seed=0, screen_size=1536, sensors=None, debug=False, nb_threads=None,
+                  nb_rays=None):
+    """Compute multi-chromatic illumination of triangles, with scattering estimated by photon tracing.
+
+    Args:
+        triangles: (list of list of tuples) a list of triangles, each being defined
+                    by an ordered triplet of 3-tuple points coordinates.
+        x_materials: (dict of list of tuple) a {band_name: [materials]} dict defining optical properties of triangles
+                    for different band/wavelength
+                    A material is a 1-, 2- or 4-tuple depending on its optical behavior.
+                    A 1-tuple encode an opaque material characterised by its reflectance
+                    A 2-tuple encode a symmetric translucent material defined by a reflectance and a transmittance
+                    A 4-tuple encode an asymmetric translucent material defined the reflectance and transmittance
+                    of the upper and lower side respectively
+        lights: (list of tuples) a list of (Energy, (vx, vy, vz)) tuples defining ligh sources
+                By default a normalised zenital light is used.
+                Energy is ligth flux passing throuh a unit area (scene unit) horizontal plane.
+        domain: (tuple of floats) 2D Coordinates of the domain bounding the scene for its replication.
+                 (xmin, ymin, xmax, ymax) scene is not bounded along z axis
+                 if None (default), scene is not repeated
+        soil_reflectance: (dict of float) a {band_name: reflectance} dict for the reflectances of the soil of an
+                 infinite scene. If None (default), there is no soil
+        nb_photons: (int) the number of photons traced per band
+        seed: (int) the seed of the random streams (see monte_carlo)
+        screen_size: (int) buffer size for projection images (pixels)
+        sensors: (list of list of tuples) a list of triangles defining virtual sensors
+        debug: (bool) Whether Caribu should be called in debug mode
+        nb_threads: (int) the number of threads tracing the photon batches. If None (default), all the cores
+        nb_rays: (int) if given, direct lighting is computed by casting nb_rays rays per triangle instead of
+                 projecting the scene on a screen_size x screen_size screen
+
+    Returns:
+        a {band_name: {property_name:property_values} } dict of dict) with the properties of monte_carlo
+    """
+
+    if soil_reflectance is None:
+        soil_reflectance = {band: -1 for band in x_materials}
+    opt_strings, labels = x_opt_strings_and_labels(x_materials, soil_reflectance)
+    can_string = triangles_string(triangles, labels)
+    sky_string = light_string(lights)
+
+    if domain is None:
+        infinite = False
+        pattern_str = None
+    else:
+        infinite = True
+        pattern_str = pattern_string(domain)
+
+    if sensors is None:
+        sensor_str = None
+    else:
+        sensor_str = sensor_string(sensors)
+
+    if nb_threads is None:
+        nb_threads = os.cpu_count() or 1
+
+    caribu = Caribu(canfile=can_string,
+                    skyfile=sky_string,
+                    optfiles=list(opt_strings.values()),
+                    optnames=list(opt_strings.keys()),
+                    patternfile=pattern_str,
+                    sensorfile=sensor_str,
+                    direct=False,
+                    infinitise=infinite,
+                    projection_image_size=screen_size,
+                    resdir=None, resfile=None, debug=debug, nb_threads=nb_threads,
+                    nb_rays=nb_rays, nb_photons=nb_photons, seed=seed)
+    caribu.run()
+    out = {k: v['data'] for k, v in caribu.nrj.items()}
+    for band in out:
+        out[band]['Ei'] = get_incident(out[band]['Eabs'], x_materials[band])
+        out[band]['Ei_se'] = get_incident(out[band]['Eabs_se'], x_materials[band])
+        if sensors is not None:
+            out[band]['sensors'] = caribu.measures[band]
+
+    return out
+
+
+def x_raycasting_series(triangles, x_materials, light_sets, domain=None, screen_size=1536, sensors=None,
+                        debug=False, nb_rays=None, canfile=None, optfile=None):
+    """Compute multi-chromatic illumination of triangles using caribu raycasting mode, for a series of skies.
+
+    All skies are simulated by a single caribu run sharing the scene, with the first band of x_materials (the
+    others being deduced from the incident energy, as in x_raycasting).
+
+    Args:
+        triangles: (list of list of tuples) a list of triangles, each being defined
+                    by an ordered triplet of 3-tuple points coordinates.
+        x_materials: (dict of list of tuple) a {band_name: [materials]} dict defining optical properties of triangles
+                    for different band/wavelength (see x_raycasting)
+        light_sets: (list of list of tuples) a list of skies, each being a list of (Energy, (vx, vy, vz))
+                    tuples defining light sources (see x_raycasting)
+        domain: (tuple of floats) 2D Coordinates of the domain bounding the scene for its replication.
+                 (xmin, ymin, xmax, ymax) scene is not bounded along z axis
+                 if None (default), scene is not repeated
+        screen_size: (int) buffer size for projection images (pixels)
+        sensors: (list of list of tuples) a list of triangles defining virtual sensors
+        nb_rays: (int) if given, direct lighting is computed by casting nb_rays rays per triangle (see raycasting)
+        canfile, optfile: (str) if given, the can and opt file contents of the scene with the materials of the
+                    first band (see opt_string_and_labels), used instead of encoding triangles and materials
+
+    Returns:
+        a list of {band_name: {property_name:property_values} } dict of dict, one per sky, with the properties
+        returned by x_raycasting
+    """
+
+    if len(light_sets) == 0:
+        raise ValueError('at least one light set is needed')
+
+    bands = list(x_materials)
+    materials = x_materials[bands[0]]
+    if canfile is None or optfile is None:
+        optfile, labels = opt_string_and_labels(materials)
+        canfile = triangles_string(triangles, labels)
+    sky_strings = [light_string(lights) for lights in light_sets]
+
+    if domain is None:
+        infinite = False
+        pattern_str = None
+    else:
+        infinite = True
+        pattern_str = pattern_string(domain)
+
+    if sensors is None:
+        sensor_str = None
+    else:
+        sensor_str = sensor_string(sensors)
+
+    caribu = Caribu(canfile=canfile,
+                    skyfile=sky_strings,
+                    optfiles=optfile,
+                    patternfile=pattern_str,
+                    sensorfile=sensor_str,
+                    direct=True,
+                    infinitise=infinite,
+                    projection_image_size=screen_size,
+                    resdir=None, resfile=None, debug=debug, nb_rays=nb_rays)
+    caribu.run()
+    outs = []
+    for nrj, measures in zip(caribu.nrj_series, caribu.measures_series):
+        out = nrj['band0']['data']
+        out['Ei'] = get_incident(out['Eabs'], materials)
+        if sensors is not None:
+            out['sensors'] = measures['band0']
+        x_out = {bands[0]: out}
+        for band in bands[1:]:
+            x_out[band] = {}
+            absorptance = (_absorptance(m) for m in x_materials[band])
+            for var in out:
+                if var != 'Eabs':
+                    x_out[band][var] = out[var]
+                else:
+                    x_out[band]['Eabs'] = [a * e for a, e in zip(absorptance, out['Ei'])]
+        outs.append(x_out)
+
+    return outs
+
+
+def x_radiosity_series(triangles, x_materials, light_sets, screen_size=1536, sensors=None, debug=False,
+                       ff_cache=None, warm_start=None, cluster_ratio=None, canfile=None, optfiles=None):
+    """Compute multi-chromatic illumination of triangles using radiosity method, for a series of skies.
+
+    All skies are simulated by a single caribu run: the form factors are computed once and the radiosity
+    systems of the skies (that only differ by their right hand side) are solved together, sharing each
+    product by the form factor matrix.
+
+    Args:
+        triangles: (list of list of tuples) a list of triangles, each being defined
+                    by an ordered triplet of 3-tuple points coordinates.
+        x_materials: (dict of list of tuple) a {band_name: [materials]} dict defining optical properties of triangles
+                    for different band/wavelength (see x_radiosity)
+        light_sets: (list of list of tuples) a list of skies, each being a list of (Energy, (vx, vy, vz))
+                    tuples defining light sources (see x_radiosity)
+        screen_size: (int) buffer size for projection images (pixels)
+        sensors: (list of list of tuples) a list of triangles defining virtual sensors
+        ff_cache: (FormFactorCache) a store of form factors to be reused across runs on the same geometry
+        warm_start: (RadiosityState) if given, the solver starts from the solutions of the previous run on the
+                    same geometry and the state is updated with the solutions of the last sky
+        cluster_ratio: (float) if given, hierarchical radiosity is used (see x_radiosity)
+        canfile, optfiles: (str, dict of str) if given, the can file content and the {band_name: opt file content}
+                    dict of the scene (see x_opt_strings_and_labels), used instead of encoding triangles and materials
+
+    Returns:
+        a list of {band_name: {property_name:property_values} } dict of dict, one per sky, with the properties
+        returned by x_radiosity
+    """
+
+    if len(triangles) <= 1:
+        raise ValueError('Radiosity method needs at least two primitives')
+    if len(light_sets) == 0:
+        raise ValueError('at least one light set is needed')
+
+    if canfile is None or optfiles is None:
+        no_soil = {band:-1 for band in x_materials}
+        opt_strings, labels = x_opt_strings_and_labels(x_materials, no_soil)
+        can_string = triangles_string(triangles, labels)
+    else:
+        opt_strings, can_string = optfiles, canfile
+    sky_strings = [light_string(lights) for lights in light_sets]
+
+    if sensors is None:
+        sensor_str = None
+    else:
+        sensor_str = sensor_string(sensors)
+
+    caribu = Caribu(canfile=can_string,
+                    skyfile=sky_strings,
+                    optfiles=list(opt_strings.values()),
+                    optnames=list(opt_strings.keys()),
+                    patternfile=None,
+                    sensorfile=sensor_str,
+                    direct=False,
+                    infinitise=False,
+                    sphere_diameter=-1,
+                    projection_image_size=screen_size,
+                    resdir=None, resfile=None, debug=debug, ff_cache=ff_cache,
+                    warm_start=warm_start, cluster_ratio=cluster_ratio)
+    caribu.run()
+    outs = []
+    for nrj, measures in zip(caribu.nrj_series, caribu.measures_series):
+        out = {k: v['data'] for k, v in nrj.items()}
+        for band in out:
+            out[band]['Ei'] = get_incident(out[band]['Eabs'], x_materials[band])
+            if sensors is not None:
+                out[band]['sensors'] = measures[band]
+        outs.append(out)
+
+    return outs
+
+
+def x_mixed_radiosity_series(triangles, materials, light_sets, domain, soil_reflectance,
+                             diameter, layers, height, screen_size=1536, debug=False,
+                             ff_cache=None, warm_start=None, canfile=None, optfiles=None):
+    """Compute multi-chromatic illumination of triangles using mixed-radiosity model, for a series of skies.
+
+    All skies are simulated by a single caribu run, sharing the form factors and the products of the
+    radiosity solver (see x_radiosity_series).
+
+    Args:
+        triangles: (list of list of tuples) a list of triangles, each being defined
+                    by an ordered triplet of 3-tuple points coordinates.
+        materials: (dict of list of tuple) a {band_name: [materials]} dict defining optical properties of triangles
+                    for different band/wavelength (see x_mixed_radiosity)
+        light_sets: (list of list of tuples) a list of skies, each being a list of (Energy, (vx, vy, vz))
+                    tuples defining light sources
+        domain: (tuple of floats) 2D Coordinates of the domain bounding the scene for its replication.
+                 (xmin, ymin, xmax, ymax) scene is not bounded along z axis
+        soil_reflectance: (dict of float) a {band_name: reflectance} dict for the reflectances of the soil
+        diameter: diameter (scene unit) of the sphere defining the close neighbourhood for local radiosity.
+        layers: vertical subdivisions of scene used for approximation of far contribution
+        height: upper limit of canopy layers (scene unit)
+        screen_size: (int) buffer size for projection images (pixels)
+        ff_cache: (FormFactorCache) a store of form factors to be reused across runs on the same geometry
+        warm_start: (RadiosityState) if given, the solver starts from the solutions of the previous run on the
+                    same geometry and the state is updated with the solutions of the last sky
+        canfile, optfiles: (str, dict of str) if given, the can file content and the {band_name: opt file content}
+                    dict of the scene (see x_radiosity_series)
+
+    Returns:
+        a list of {band_name: {property_name:property_values} } dict of dict, one per sky, with the properties
+        returned by x_mixed_radiosity
+   """
+
+    if len(triangles) <= 1:
+        raise ValueError('Radiosity method needs at least two primitives')
+    if len(light_sets) == 0:
+        raise ValueError('at least one light set is needed')
+
+    if canfile is None or optfiles is None:
+        opt_strings, labels = x_opt_strings_and_labels(materials, soil_reflectance)
+        can_string = triangles_string(triangles, labels)
+    else:
+        opt_strings, can_string = optfiles, canfile
+    sky_strings = [light_string(lights) for lights in light_sets]
+    pattern_str = pattern_string(domain)
+
+    caribu = Caribu(canfile=can_string,
+                    skyfile=sky_strings,
+                    optfiles=list(opt_strings.values()),
+                    optnames=list(opt_strings.keys()),
+                    patternfile=pattern_str,
+                    direct=False,
+                    infinitise=True,
+                    nb_layers=layers,
+                    can_height=height,
+                    sphere_diameter=diameter,
+                    projection_image_size=screen_size,
+                    resdir=None, resfile=None, debug=debug, ff_cache=ff_cache,
+                    warm_start=warm_start)
+    caribu.run()
+    outs = []
+    for nrj in caribu.nrj_series:
+        out = {k: v['data'] for k, v in nrj.items()}
+        for band in out:
+            out[band]['Ei'] = get_incident(out[band]['Eabs'], materials[band])
+        outs.append(out)
+
+    return outs
@@ -25,6 +25,14 @@ import os
 from subprocess import Popen, STDOUT, PIPE
 import tempfile
 import platform
+import ctypes
+import mmap
+import hashlib
+import shutil
+
+import numpy
+
+from alinea.caribu.label import Label
 try:
     from path import Path
 except ImportError:
@@ -37,20 +45,21 @@ except ImportError:
             from IPython.external.path import path as Path
 
 
-def _process(cmd, directory, out):
+def _process(cmd, directory, out, env=None):
     """
     Run a process in a shell.
     Return the outputs in a file or string.
+    env: the environment of the process (if None, the current one)
     """
     # print ">> caribu.py: process(%s) called..."%(cmd)
 
     f = open(out, 'w')
     if platform.system() == 'Darwin':
-        p = Popen(cmd, shell=True, cwd=directory,
+        p = Popen(cmd, shell=True, cwd=directory, env=env,
                   stdin=PIPE, stdout=f, stderr=PIPE)
         status = p.communicate()
     else:
-        p = Popen(cmd, shell=True, cwd=directory,
+        p = Popen(cmd, shell=True, cwd=directory, env=env,
                   stdin=None, stdout=f, stderr=STDOUT)
         status = p.wait()
 
@@ -88,6 +97,21 @@ def _abrev(fnc, maxlg=1):
         return '\n' + '\n'.join(lines[0:maxlg]) + "\n..."
 
 
+def _can_digest(filename, digest):
+    """ update digest with the geometry of a can file, labels being reduced to the transparency and soil flag of
+    the triangles (soil triangles do not exchange with each other and are not clustered)
+    """
+    with open(filename) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0] != 'p':
+                continue
+            lab = Label(fields[2].zfill(12))
+            digest.update(str((lab.transparency, lab.is_soil())).encode())
+            digest.update(' '.join(fields[3:]).encode())
+    return digest
+
+
 class CaribuError(Exception):
     pass
 
@@ -104,6 +128,306 @@ class CaribuRunError(CaribuError):
     pass
 
 
+# Patch record read by Canopy::read_shm (see transf.h) : signed char t; float P[3][3]
+patch_dtype = numpy.dtype([('t', 'i1'), ('P', '<f4', (3, 3))], align=True)
+
+# Etri.bin written by canestrad -b : a 'ETRI' header then packed little-endian records
+etri_header_dtype = numpy.dtype([('magic', 'S4'), ('version', '<i4'), ('nrec', '<i4'), ('recsize', '<i4')])
+etri_dtype = numpy.dtype([('index', '<i4'), ('label', '<f8'), ('area', '<f8'),
+                          ('Eabs', '<f8'), ('Ei_sup', '<f8'), ('Ei_inf', '<f8')])
+
+# Cam.bin written by canestrad -V : a 'CAMS' header then the int32 pixels of the images
+cams_header_dtype = numpy.dtype([('magic', 'S4'), ('nbcam', '<i4'), ('size', '<i4')])
+
+# environment variable switching the engines to lean I/O mode
+lean_io_variable = 'CARIBU_LEAN_IO'
+
+_IPC_CREAT = 0o1000
+_IPC_EXCL = 0o2000
+_IPC_RMID = 0
+
+
+class SharedCanopy(object):
+    """ A scene stored once in a shared memory segment, for canestrad -m
+
+    Canestrad reads the segment with Canopy::read_shm, so that several Caribu
+    runs (possibly in concurrent processes) can light the same scene without
+    writing and parsing their own copy of the .can file.
+    """
+
+    def __init__(self, triangles, labels, domain=None, key=None):
+        """
+        triangles: a list (or a (n, 3, 3) array) of triangles
+        labels: the list of caribu can labels of the triangles (see caribu.encode_labels)
+        domain: (xmin, ymin, xmax, ymax) if not None, triangles are translated so
+                that their centroid lies in the domain, and the scene lifted above
+                the soil, as periodise does
+        key: the key (1-99) of the segment. If None, the first free key is used
+        """
+        if len(triangles) != len(labels):
+            raise CaribuOptionError('The number of triangles and labels should match')
+        patches = numpy.zeros(len(triangles), dtype=patch_dtype)
+        pts = numpy.asarray(triangles, dtype=float).reshape((-1, 3, 3))
+        if domain is not None:
+            x1, y1, x2, y2 = domain
+            bmin = numpy.array((min(x1, x2), min(y1, y2)))
+            bmax = numpy.array((max(x1, x2), max(y1, y2)))
+            g = pts[:, :, :2].mean(axis=1)
+            shift = numpy.ceil((g - bmax) / (bmax - bmin)) * (bmax - bmin)
+            pts[:, :, :2] -= shift[:, numpy.newaxis, :]
+            if len(pts) > 0:
+                minr = (0.01 * pts[:, :, 2].max() + pts[:, :, 2].min()) / 1.01
+                if minr < 0:
+                    pts[:, :, 2] -= minr
+        patches['P'] = pts
+        patches['t'] = [self.patch_code(lab) for lab in labels]
+        digest = hashlib.sha1(patches['P'].tobytes())
+        digest.update((patches['t'] > 0).tobytes())
+        digest.update((patches['t'] == 0).tobytes())
+        self.geometry_digest = digest.hexdigest()
+
+        self.labels = list(labels)
+        self.nb_triangles = len(patches)
+        self.key = None
+        self._shmid = None
+        self._mapping = None
+        self._owner = True
+        self._attach(patches.tobytes(), key)
+
+    @staticmethod
+    def patch_code(label):
+        """ code of a can label in the patch records: 0 soil, -i opaque and i transparent of specie i
+        """
+        lab = Label(str(label).zfill(12))
+        specie = lab.optical_id
+        if specie > 127:
+            raise CaribuOptionError('Shared memory scenes are limited to 127 optical species')
+        if lab.transparency:
+            return specie
+        return -specie
+
+    @property
+    def clef(self):
+        """ the value of canestrad -m option, that encodes the number of triangles with the key """
+        return (self.nb_triangles + 1) * 100 + self.key
+
+    def _attach(self, data, key):
+        keys = range(1, 100) if key is None else (key,)
+        size = max(len(data), patch_dtype.itemsize)
+        if platform.system() == 'Windows':
+            # read_shm opens a file mapping named after the key
+            for k in keys:
+                mapping = mmap.mmap(-1, size, tagname=str(k))
+                if mapping[:size].strip(b'\x00'):
+                    mapping.close()
+                    continue
+                mapping.write(data)
+                self.key, self._mapping = k, mapping
+                return
+        else:
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.shmget.argtypes = (ctypes.c_int, ctypes.c_size_t, ctypes.c_int)
+            libc.shmat.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_int)
+            libc.shmat.restype = ctypes.c_void_p
+            libc.shmdt.argtypes = (ctypes.c_void_p,)
+            for k in keys:
+                shmid = libc.shmget(k, size, _IPC_CREAT | _IPC_EXCL | 0o666)
+                if shmid == -1:
+                    continue
+                addr = libc.shmat(shmid, None, 0)
+                if addr is None or addr == ctypes.c_void_p(-1).value:
+                    libc.shmctl(shmid, _IPC_RMID, None)
+                    raise CaribuIOError('Unable to attach shared memory segment %d' % k)
+                ctypes.memmove(addr, data, len(data))
+                libc.shmdt(ctypes.c_void_p(addr))
+                self.key, self._shmid = k, shmid
+                return
+        raise CaribuIOError('No free shared memory segment for the scene')
+
+    def close(self):
+        """ Remove the segment (only done by the process that created it) """
+        if self._owner:
+            if self._mapping is not None:
+                self._mapping.close()
+            elif self._shmid is not None:
+                libc = ctypes.CDLL(None, use_errno=True)
+                libc.shmctl(self._shmid, _IPC_RMID, None)
+        self._shmid = self._mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def __getstate__(self):
+        # workers only need the key : the segment stays owned by its creator
+        state = dict(self.__dict__)
+        state.update(_owner=False, _shmid=None, _mapping=None)
+        return state
+
+
+class FormFactorCache(object):
+    """ A size-bounded disk store of the form factor matrices computed by canestrad -f
+
+    Matrices only depend on the scene geometry and on the radiosity settings, so that runs with new lights
+    or optical properties on an unchanged scene can read them (canestrad -w) instead of computing them.
+    Least recently used matrices are removed when the store exceeds max_size.
+    """
+    # matrix files written by canestrad (DG_NAME, NZ_NAME, BF_NAME, AM_NAME in system.h)
+    prefixes = ('diag_', 'nz_', 'Bfar_', 'amas_')
+    # prefix of the directories being written or removed, that are not entries of the store
+    staging = 'staging_'
+
+    def __init__(self, directory=None, max_size=2 ** 30):
+        """
+        directory: the directory of the store. If None, a caribu_ff_cache directory of the system temporary
+        directory is used
+        max_size: the maximal size (bytes) of the store
+        """
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), 'caribu_ff_cache')
+        self.directory = Path(directory)
+        self.max_size = max_size
+        if not self.directory.exists():
+            self.directory.makedirs_p()
+
+    def fetch(self, key, directory, name):
+        """ copy the matrices stored under key in directory, named after name. Return False if key is unknown
+        """
+        entry = self.directory / key
+        if not entry.exists():
+            return False
+        # entries are renamed before being removed (see _evict): copies are made under temporary names and only
+        # renamed once all of them succeeded, so that a partial set of matrices is never left in directory
+        copies = []
+        try:
+            for fn in entry.files():
+                copy = Path(directory) / (self.staging + fn.basename() + name)
+                copies.append(copy)
+                fn.copy(copy)
+            entry.utime(None)
+        except (IOError, OSError):
+            # removed meanwhile
+            for copy in copies:
+                if copy.exists():
+                    copy.remove()
+            return False
+        for copy in copies:
+            copy.rename(Path(directory) / copy.basename()[len(self.staging):])
+        return True
+
+    def store(self, key, directory, name):
+        """ store the matrices named after name found in directory under key
+        """
+        entry = self.directory / key
+        tmp = Path(tempfile.mkdtemp(prefix=self.staging, dir=self.directory))
+        for prefix in self.prefixes:
+            fn = Path(directory) / (prefix + name)
+            if fn.exists():
+                fn.copy(tmp / prefix)
+        if entry.exists():
+            tmp.rmtree()
+        else:
+            try:
+                tmp.rename(entry)
+            except OSError:
+                # stored meanwhile by another process
+                tmp.rmtree()
+        self._evict()
+
+    def size(self):
+        return sum(fn.getsize() for fn in self.directory.walkfiles())
+
+    def clear(self):
+        for entry in self.directory.dirs():
+            entry.rmtree()
+
+    def _evict(self):
+        entries = []
+        for entry in self.directory.dirs():
+            # directories being written or removed by other runs
+            if entry.basename().startswith(self.staging):
+                continue
+            try:
+                entries.append((entry.getmtime(), sum(fn.getsize() for fn in entry.files()), entry))
+            except OSError:
+                # removed meanwhile
+                continue
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        # the last stored entry is kept even if larger than max_size
+        for _, size, entry in entries[:-1]:
+            if total <= self.max_size:
+                break
+            total -= size
+            # the entry is atomically moved out of the store first, so that concurrent fetches either get all of
+            # its matrices or none of them
+            trash = Path(tempfile.mktemp(prefix=self.staging, dir=self.directory))
+            try:
+                entry.rename(trash)
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+
+
+class RadiosityState(object):
+    """ The radiosity solutions of the last run, used as initial guess of the solver of the next one (warm start)
+
+    Solutions are kept per band, together with the key of the geometry (see Caribu.form_factor_key) they were
+    computed on. They are dropped when the geometry changes.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.solutions = {}
+        # solver statistics of the last run, per band
+        self.iterations = {}
+        self.residual = {}
+
+    def get(self, key, band):
+        """ the solution of band computed on geometry key, None if unknown """
+        if key != self.key:
+            return None
+        return self.solutions.get(band)
+
+    def update(self, key, band, solution, iterations=None, residual=None):
+        if key != self.key:
+            self.key = key
+            self.solutions = {}
+        self.solutions[band] = solution
+        self.iterations[band] = iterations
+        self.residual[band] = residual
+
+    def clear(self):
+        self.key = None
+        self.solutions = {}
+        self.iterations = {}
+        self.residual = {}
+
+
+def _write_radiosity(filename, solution):
+    """ write a solution in the binary format read by canestrad -x (int n, then n doubles) """
+    solution = numpy.asarray(solution, dtype=numpy.float64)
+    with open(filename, 'wb') as f:
+        numpy.array([len(solution)], dtype=numpy.int32).tofile(f)
+        solution.tofile(f)
+
+
+def _read_radiosity(filename):
+    with open(filename, 'rb') as f:
+        n = numpy.fromfile(f, dtype=numpy.int32, count=1)
+        if len(n) == 0:
+            return None
+        solution = numpy.fromfile(f, dtype=numpy.float64, count=n[0])
+    if len(solution) != n[0]:
+        return None
+    return solution
+
+
 class Caribu(object):
     def __init__(self,
                  canfile=None,
@@ -120,13 +444,31 @@ class Caribu(object):
                  debug=False,
                  resdir="./Run",
                  resfile=None,
-                 projection_image_size=1536
+                 projection_image_size=1536,
+                 shared_canopy=None,
+                 binary_output=False,
+                 lean_io=False,
+                 ff_cache=None,
+                 nb_threads=1,
+                 warm_start=None,
+                 cluster_ratio=None,
+                 solver_tolerance=None,
+                 solver_time=None,
+                 nb_rays=None,
+                 nb_photons=None,
+                 seed=None,
+                 source_output=False,
+                 gap_query=False,
+                 cameras=None,
+                 camera_size=128
                  ):
         """
         Class fo Nested radiosity illumination on a 3D scene.
 
         canfile: file '.can' (or file content) representing 3d scene
-        skyfile: file/file content containing all the light description
+        skyfile: file/file content containing all the light description, or a list of them. Several skies are
+        simulated by a single canestrad call sharing the scene, the form factors and the products of the radiosity
+        solver: their results are stored in nrj_series (one nrj dict per sky, nrj being the one of the first sky)
         optfiles: list of files/files contents defining optical property
         sensorfile: file or file content with virtual sensor positions
         optnames: list of name to be used as keys for output dict (if None use the name of the opt files or
@@ -143,6 +485,41 @@ class Caribu(object):
         store nothing otherwise
         projection_image_size : the size (pixel) of the projection image used to compute the first order lighting
         of the scene
+        shared_canopy : a SharedCanopy holding the scene in shared memory, used by canestrad instead of canfile.
+        canfile is still needed for mixed radiosity (infinite scene with scattering), as s2v reads it
+        binary_output : if True, canestrad writes its results in binary and the data stored in nrj are numpy arrays
+        lean_io : if True, the engines only write the files read by the next stage (no logs, debug or
+        intermediate result files other than those used by Caribu)
+        ff_cache : a FormFactorCache used to reuse form factors computed for the same geometry and radiosity
+        settings by previous runs
+        nb_threads : number of threads used by canestrad to project the light sources (direct lighting)
+        and to compute the form factors of nested radiosity
+        warm_start : a RadiosityState. If given, the radiosity solver starts from the solutions it holds for
+        the same geometry, and the state is updated with the solutions of the run
+        cluster_ratio : if not None, radiosity (sphere_diameter < 0) is hierarchical: a group of primitives whose
+        bounding radius is less than cluster_ratio (0 < cluster_ratio < 1) times its distance to a primitive is seen
+        by this one as a whole, making form factors affordable for large scenes. Lower values are more accurate
+        solver_tolerance : if not None, the relative residual at which the radiosity solver stops (canestrad
+        default is 1e-6)
+        solver_time : if not None, the time (s) after which the radiosity solver stops with its partial solution.
+        solver_info gives the residual reached and a bound of the relative error of the radiosities
+        nb_rays : if not None, canestrad computes the direct lighting by casting nb_rays rays per primitive in a
+        bounding volume hierarchy of the scene, instead of projecting it on a projection_image_size square screen.
+        Its cost follows the scene complexity, and small primitives are sampled whatever their size
+        nb_photons : if not None (and direct is False), scattering is computed by tracing nb_photons photons per
+        band and sky from the first order radiosities, instead of the form factors of (nested) radiosity. The scene
+        is finite, or infinite if infinitise (the soil of the optical files then reflects the photons), and
+        sphere_diameter is ignored. Photons are traced in independent batches spread over nb_threads, whose spread
+        gives the standard errors of the results (Eabs_se, Ei_sup_se and Ei_inf_se in nrj data)
+        seed : the seed of the random streams of the photon batches (canestrad default is 0)
+        source_output : if True, the direct irradiance of the polygons from each light source is also stored in
+        nrj['sources'] (see store_sources), in addition to the totals
+        gap_query : if True, canestrad only projects the scene along the directions of the light sources and nrj
+        holds the area of the polygons seen from each of them (see store_gap), instead of the energy results
+        cameras : file/file content with the positions (one 'x y z' line each) of virtual hemispherical cameras.
+        If given, canestrad only takes their pictures, stored in images (see store_cameras), instead of lighting
+        the scene. The scene is loaded once for all cameras, whose pictures are spread over nb_threads
+        camera_size : the size (pixel) of the square images of the cameras
         """
         if debug:
             print("\n >>>> Caribu.__init__ starts...\n")
@@ -177,6 +554,23 @@ class Caribu(object):
         self.s2v_name = "s2v"
         self.ready = True
         self.img_size = projection_image_size
+        self.shared_canopy = shared_canopy
+        self.binary_output = binary_output
+        self.lean_io = lean_io
+        self.ff_cache = ff_cache
+        self.nb_threads = nb_threads
+        self.warm_start = warm_start
+        self.cluster_ratio = cluster_ratio
+        self.solver_tolerance = solver_tolerance
+        self.solver_time = solver_time
+        self.nb_rays = nb_rays
+        self.nb_photons = nb_photons
+        self.seed = seed
+        self.source_output = source_output
+        self.gap_query = gap_query
+        self.cameras = cameras
+        self.camera_size = camera_size
+        self.images = None
         if debug:
             print("\n <<<< Caribu.__init__ ends...\n")
 
@@ -207,7 +601,7 @@ class Caribu(object):
             mcsail: %s
             periodise: %s
             s2v: %s
-        """ % (_abrev(self.scene), _abrev(self.sky), ' '.join(map(str, _safe_iter(self.optnames))),
+        """ % (_abrev(self.scene), ''.join(map(_abrev, _safe_iter(self.sky))), ' '.join(map(str, _safe_iter(self.optnames))),
                ''.join(map(_abrev, _safe_iter(self.opticals))), self.pattern,_abrev(self.sensor),  self.infinity, self.direct,
                self.nb_layers, self.can_height, self.sphere_diameter, self.form_factor, self.canestra_name,
                self.sail_name, self.periodise_name, self.s2v_name)
@@ -222,19 +616,52 @@ class Caribu(object):
             s += sopt
         return (s)
 
+    def form_factor_key(self):
+        """ key of the form factors of the current run in a FormFactorCache """
+        d = self.tempdir
+        digest = hashlib.sha1()
+        if self.shared_canopy is not None:
+            digest.update(self.shared_canopy.geometry_digest.encode())
+        else:
+            _can_digest(d / self.scene, digest)
+        if self.infinity:
+            digest.update((d / self.pattern).bytes())
+        if self.sensor is not None:
+            digest.update((d / self.sensor).bytes())
+        settings = (self.infinity, self.sphere_diameter, self.nb_layers, self.can_height)
+        if self.cluster_ratio is not None:
+            settings += (self.cluster_ratio,)
+        digest.update(repr(settings).encode())
+        return digest.hexdigest()
+
+    def engine_env(self):
+        """ environment of the engines processes (None means the current one) """
+        if not self.lean_io:
+            return None
+        env = dict(os.environ)
+        env[lean_io_variable] = '1'
+        return env
+
     def show(self, titre="############"):
         print("\n>>> Caribu state in ", titre)
         print(self)
         print("<<<<\n\n")
 
     def init(self):
-        if self.scene == None or self.sky == None or self.opticals == None or self.opticals == []:
+        if (self.scene == None and self.shared_canopy == None) or self.sky == None or self.opticals == None or self.opticals == []:
             raise CaribuOptionError(
                 "Caribu has not been fully initialized: scene, sky, and opticals have to be defined\n     =>  Caribu can not be run... - MC09")
+        if self.scene == None and self.infinity and not self.direct and self.nb_photons is None:
+            raise CaribuOptionError("A scene file is needed by s2v to run mixed radiosity on a shared canopy")
 
         # print "infty, pattern", self.infinity, self.pattern
 
-        if not self.direct:
+        if self.nb_photons is not None:
+            if self.direct:
+                raise CaribuOptionError("nb_photons is only used to compute scattering (direct=False)")
+            if not self.nb_photons >= 1:
+                raise CaribuOptionError("nb_photons should be at least 1")
+        elif not self.direct:
             if self.sphere_diameter < 0:
                 # Compute classic radioity without toric scene
                 if self.infinity:
@@ -244,6 +671,19 @@ class Caribu(object):
                 if not self.infinity:
                     raise CaribuOptionError(
                         "incompatible options for nested radiosity: no infinity &&  sphere_diameter >= 0 ")
+        if self.cluster_ratio is not None:
+            if self.direct or self.sphere_diameter >= 0 or self.nb_photons is not None:
+                raise CaribuOptionError("cluster_ratio is only used by radiosity (sphere_diameter < 0)")
+            if not 0 < self.cluster_ratio < 1:
+                raise CaribuOptionError("cluster_ratio should be in ]0, 1[")
+        if self.solver_tolerance is not None and not self.solver_tolerance > 0:
+            raise CaribuOptionError("solver_tolerance should be positive")
+        if self.solver_time is not None and not self.solver_time > 0:
+            raise CaribuOptionError("solver_time should be positive")
+        if self.nb_rays is not None and not self.nb_rays >= 1:
+            raise CaribuOptionError("nb_rays should be at least 1")
+        if self.cameras is not None and not self.camera_size >= 1:
+            raise CaribuOptionError("camera_size should be at least 1")
 
         if self.pattern == None and self.infinity:
             raise CaribuOptionError('pattern not specified => Caribu canot infinitise the scene')
@@ -255,6 +695,8 @@ class Caribu(object):
         self.nrj = {}
         # sensor measurements
         self.measures = {}
+        # radiosity solver statistics : {band: {'iterations': , 'residual': }}
+        self.solver_info = {}
 
         if self.my_dbg:
             self.show("Caribu::init()")
@@ -277,6 +719,11 @@ class Caribu(object):
         # Copy the files (or file content) in the tempdir
         self.copyfiles()
 
+        # one nrj, measures and solver_info dict per sky (nrj, measures and solver_info are those of the first one)
+        self.nrj_series = [self.nrj] + [{} for sky in self.skies[1:]]
+        self.measures_series = [self.measures] + [{} for sky in self.skies[1:]]
+        self.solver_info_series = [self.solver_info] + [{} for sky in self.skies[1:]]
+
     def init_periodise(self):
         """ init caribuscene for a periodise-only run. """
         if self.scene == None or self.pattern == None:
@@ -308,22 +755,36 @@ class Caribu(object):
     def copyfiles(self, skip_sky=False, skip_pattern=False, skip_opt=False):
         d = self.tempdir
 
-        if str(self.scene).endswith('.can'):
-            fn = Path(self.scene)
-            fn.copy(d / fn.basename())
-        else:
-            fn = d / 'cscene.can'
-            fn.write_text(self.scene)
-        self.scene = Path(fn.basename())
+        if self.scene is not None:
+            if str(self.scene).endswith('.can'):
+                fn = Path(self.scene)
+                fn.copy(d / fn.basename())
+            else:
+                fn = d / 'cscene.can'
+                fn.write_text(self.scene)
+            self.scene = Path(fn.basename())
 
         if not skip_sky:
-            if os.path.exists(self.sky):
-                fn = Path(self.sky)
-                fn.copy(d / fn.basename())
+            if isinstance(self.sky, (list, tuple)):
+                # skies are renamed so that canestrad result files (suffixed by the sky name) are unique
+                self.skies = []
+                for i, sky in enumerate(self.sky):
+                    fn = d / ('sky%d.light' % i)
+                    if os.path.exists(sky):
+                        Path(sky).copy(fn)
+                    else:
+                        fn.write_text(sky)
+                    self.skies.append(Path(fn.basename()))
+                self.sky = self.skies[0]
             else:
-                fn = d / 'sky.light'
-                fn.write_text(self.sky)
-            self.sky = Path(fn.basename())
+                if os.path.exists(self.sky):
+                    fn = Path(self.sky)
+                    fn.copy(d / fn.basename())
+                else:
+                    fn = d / 'sky.light'
+                    fn.write_text(self.sky)
+                self.sky = Path(fn.basename())
+                self.skies = [self.sky]
 
         if not skip_pattern:
             if self.infinity:
@@ -344,6 +805,15 @@ class Caribu(object):
                 fn.write_text(self.sensor)
             self.sensor = Path(fn.basename())
 
+        if self.cameras is not None:
+            if os.path.exists(self.cameras):
+                fn = Path(self.cameras)
+                fn.copy(d / fn.basename())
+            else:
+                fn = d / 'cameras.pos'
+                fn.write_text(self.cameras)
+            self.cameras = Path(fn.basename())
+
         if not skip_opt:
             optn = [x + '.opt' for x in _safe_iter(self.optnames)]
             try:
@@ -371,7 +841,10 @@ class Caribu(object):
                 - label (str): its can label
                 - area (float): its area
                 - Eabs,Ei_sup and Ei_inf (float): surfacic density (energy/s/m2) of, respectively, absorbed energy, irradiance on the adaxial side and irradiance on the abaxial side of polygons
+        Binary files (Etri.bin) are memory-mapped, and their columns stored as numpy arrays
         """
+        if str(filename).endswith('.bin'):
+            return self.store_binary_result(filename, band_name)
 
         f = open(filename)
         doc = f.readline()  # elimine la ligne de commentaire
@@ -397,9 +870,35 @@ class Caribu(object):
             Ei_inf.append(floats[5])
 
         f.close()
+        if self.shared_canopy is not None:
+            # canestrad only knows the patch codes of the shared scene
+            labels = self.shared_canopy.labels
+            label = [str(labels[int(i)]) for i in idx]
         data = {'index': idx, 'label': label, 'area': area, 'Eabs': Eabs, 'Ei_sup': Ei_sup, 'Ei_inf': Ei_inf}
         self.nrj[band_name] = {'doc': doc, 'data': data}
 
+    def store_binary_result(self, filename, band_name):
+        """ store_result for the Etri.bin files written by canestrad -b """
+        header = numpy.fromfile(filename, dtype=etri_header_dtype, count=1)
+        if len(header) == 0 or header['magic'][0] != b'ETRI' or header['recsize'][0] != etri_dtype.itemsize:
+            raise CaribuIOError('%s is not a canestrad binary result file' % filename)
+        nrec = int(header['nrec'][0])
+        if nrec > 0:
+            records = numpy.memmap(filename, dtype=etri_dtype, mode='r',
+                                   offset=etri_header_dtype.itemsize, shape=(nrec,))
+            # columns are copied so that the file can be moved or removed
+            data = {k: numpy.array(records[k]) for k in etri_dtype.names}
+            del records
+        else:
+            data = {k: numpy.zeros(0, dtype=etri_dtype[k]) for k in etri_dtype.names}
+        if self.shared_canopy is not None:
+            labels = numpy.array(self.shared_canopy.labels, dtype=str)
+            data['label'] = labels[data['index']]
+        else:
+            data['label'] = numpy.char.zfill(data['label'].astype(numpy.int64).astype(str), 12)
+        doc = '# canestrad: binary output (%s)\n' % os.path.basename(filename)
+        self.nrj[band_name] = {'doc': doc, 'data': data}
+
     def store_sensor(self, filename, band_name):
         id, eio, ei, area = [], [], [], []
         with open(filename, 'r') as handle:
@@ -412,26 +911,95 @@ class Caribu(object):
                 area.append(floats[3])
         self.measures[band_name] = {'sensor_id': id, 'Ei0': eio, 'Ei': ei, 'area': area}
 
+    def store_solver_info(self, filename, band_name):
+        """ Read the statistics of the radiosity solver (solver.dat): iteration count, final relative residual,
+        bound of the relative error of the radiosities and relative residual after each product by the form factors
+        """
+        if not filename.exists():
+            return
+        with open(filename) as f:
+            lines = f.read().splitlines()
+        fields = lines[0].split()
+        residual = float(fields[1])
+        bound = float(fields[2]) if len(fields) > 2 else -1
+        self.solver_info[band_name] = {'iterations': int(fields[0]),
+                                       'residual': residual if residual >= 0 else None,
+                                       'error_bound': bound if bound >= 0 else None,
+                                       'residuals': [float(r) for r in lines[1].split()] if len(lines) > 1 else []}
+
+    def store_errors(self, filename, band_name):
+        """ Add the standard errors of the Monte Carlo estimates (Emc.vec0) to the data of band_name:
+        Eabs_se, Ei_sup_se and Ei_inf_se, aligned with the other columns
+        """
+        if not filename.exists():
+            return
+        errors = numpy.loadtxt(filename, ndmin=2)
+        data = self.nrj[band_name]['data']
+        for i, k in enumerate(('Eabs_se', 'Ei_sup_se', 'Ei_inf_se')):
+            column = errors[:, i + 1] if len(errors) > 0 else numpy.zeros(0)
+            data[k] = column if self.binary_output else column.tolist()
+
+    def store_sources(self, filename, band_name):
+        """ Add the direct irradiance from each light source (Esrc.vec0) to the entry of band_name, as a 'sources'
+        dictionary of numpy arrays listing the non null contributions:
+            - index (int): the polygon index (row of data)
+            - source (int): the index of the light source in the sky file
+            - Ei_sup, Ei_inf (float): the surfacic density of direct energy incoming from the source on the superior
+            and inferior face of the polygon
+        """
+        values = numpy.loadtxt(filename, ndmin=2)
+        if values.size == 0:
+            values = numpy.zeros((0, 4))
+        self.nrj[band_name]['sources'] = {'index': values[:, 0].astype(int), 'source': values[:, 1].astype(int),
+                                          'Ei_sup': values[:, 2], 'Ei_inf': values[:, 3]}
+
+    def store_gap(self, filename, band_name):
+        """ Add the areas seen from the light sources (Gap.dat) as the entry of band_name: a 'gap' dictionary of
+        numpy arrays listing the non null areas:
+            - index (int): the polygon index
+            - source (int): the index of the light source in the sky file
+            - area (float): the area of the polygon seen from the direction of the source, projected on the
+            horizontal plane (i.e. the area of its shadow on the ground)
+        """
+        values = numpy.loadtxt(filename, ndmin=2)
+        if values.size == 0:
+            values = numpy.zeros((0, 3))
+        self.nrj[band_name] = {'gap': {'index': values[:, 0].astype(int), 'source': values[:, 1].astype(int),
+                                       'area': values[:, 2]}}
+
+    def store_cameras(self, filename):
+        """ Read the pictures of the hemispherical cameras (Cam.bin) into images, a (cameras x size x size) int
+        array. The images are equidistant projections of the upper hemisphere (the distance to the center is
+        proportional to the zenith angle), their rows going toward -y and their columns toward +x. Pixels hold the
+        index of the polygon seen, -1 for the sky and -2 out of the hemisphere
+        """
+        header = numpy.fromfile(filename, dtype=cams_header_dtype, count=1)
+        if len(header) == 0 or header['magic'][0] != b'CAMS':
+            raise CaribuIOError('%s is not a canestrad camera file' % filename)
+        nbcam, size = int(header['nbcam'][0]), int(header['size'][0])
+        images = numpy.fromfile(filename, dtype='<i4', offset=cams_header_dtype.itemsize)
+        self.images = images.reshape((nbcam, size, size)).astype(int)
+
     def run(self):
         """
         The main Caribu program.
         1. Periodise: to convert the scene into an infinite one.
         2. s2v: Surface to volume based on the scene, the height of the canopy and optical prop.
         3. mcsail: mean fluxes in the canopy
-        4. canestra: compute radiosity
+        4. canestra: compute radiosity (all bands at once)
         5. save output on disk if resfile specified
         """
         if self.my_dbg:
             print("\n >>>> Caribu.run() starts...\n")
         self.init()
-        if self.infinity:
+        if self.infinity and self.scene is not None:
             self.periodise()
-        if self.infinity and not self.direct:
+        if self.infinity and not self.direct and self.nb_photons is None:
             self.s2v()
             for opt in self.opticals:
-                self.mcsail(opt)
-        for opt in self.opticals:
-            self.canestra(opt)
+                for sky in self.skies:
+                    self.mcsail(opt, sky)
+        self.canestra(self.opticals)
         if self.resfile is not None:
             import pickle
             file = open(self.resfile, 'w')
@@ -465,7 +1033,7 @@ class Caribu(object):
         cmd = '%s -m %s -8 %s -o %s ' % (self.periodise_name, self.scene, self.pattern, outscene)
         if self.my_dbg:
             print(">>> periodise() : ", cmd)
-        status = _process(cmd, d, d / "periodise.log")
+        status = _process(cmd, d, d / "periodise.log", self.engine_env())
         if (d / outscene).exists():
             self.scene = outscene
         else:
@@ -482,7 +1050,7 @@ class Caribu(object):
             self.s2v_name, self.scene, self.nb_layers, self.can_height, self.pattern) + wavelength
         if self.my_dbg:
             print(">>> s2v() : ", cmd)
-        status = _process(cmd, d, d / "s2v.log")
+        status = _process(cmd, d, d / "s2v.log", self.engine_env())
         # Raise an exception if s2v crashed...
         leafarea = d / 'leafarea'
         if not leafarea.exists():
@@ -492,22 +1060,31 @@ class Caribu(object):
             print(">>>  s2v has not finished properly => STOP")
             raise CaribuRunError(''.join(msg))
 
-    def mcsail(self, opt):
+    def simulation_name(self, optname, sky):
+        """ base name of the files of the simulation of band optname under sky """
+        if len(self.skies) > 1:
+            return str(Path(sky).stripext()) + '_' + optname
+        return optname
+
+    def mcsail(self, opt, sky=None):
         d = self.tempdir
+        if sky is None:
+            sky = self.sky
         optname, ext = Path(opt.basename()).splitext()
+        simname = self.simulation_name(optname, sky)
         (d / optname + '.spec').copy(d / 'spectral')
 
-        cmd = "%s %s " % (self.sail_name, self.sky)
+        cmd = "%s %s " % (self.sail_name, sky)
 
         if self.my_dbg:
             print(">>> mcsail(): ", cmd)
-        logfile = "sail-%s.log" % (optname)
+        logfile = "sail-%s.log" % (simname)
         logfile = d / logfile
-        status = _process(cmd, d, logfile)
+        status = _process(cmd, d, logfile, self.engine_env())
 
         mcsailenv = d / 'mlsail.env'
         if mcsailenv.exists():
-            mcsailenv.move(d / optname + '.env')
+            mcsailenv.move(d / simname + '.env')
         else:
             f = open(logfile)
             msg = f.readlines()
@@ -516,78 +1093,169 @@ class Caribu(object):
             raise CaribuRunError(''.join(msg))
 
     def canestra(self, opt):
-        """Fonction d'appel de l'executable canestrad, code C++ compilee de la radiosite mixte  - MC09"""
+        """Fonction d'appel de l'executable canestrad, code C++ compilee de la radiosite mixte  - MC09
+
+        opt may be a list of optical files: all bands are then simulated by a single canestrad call, sharing the
+        scene loading, the direct projection and the form factors. All the skies are simulated by the same call.
+        """
         # canestrad -M $Sc -8 $argv[6] -l $argv[2] -p $po.opt -e $po.env -s -r  $argv[1] -1
         d = self.tempdir
-        optname, ext = Path(opt.basename()).splitext()
+        opts = [Path(o) for o in _safe_iter(opt)]
+        optnames = [str(Path(o.basename()).stripext()) for o in opts]
+        # simulations are ordered by band, then by sky (-e and -x options)
+        simnames = [self.simulation_name(optname, sky) for optname in optnames for sky in self.skies]
         if self.my_dbg:
-            print(optname)
+            print(optnames)
         str_pattern = str_direct = str_FF = str_diam = str_env = str_sensor = ""
 
         if self.infinity:
             str_pattern = " -8 %s " % (self.pattern)
 
-        if self.direct:
+        ff_key = None
+        x_key = None
+        str_x = ""
+        if self.cameras is not None:
+            str_direct = " -V %s -K %d " % (self.cameras, self.camera_size)
+        elif self.gap_query:
+            str_direct = " -G "
+        elif self.direct:
             str_direct = " -1 "
+        elif self.nb_photons is not None:
+            str_diam = " -P %d " % (self.nb_photons)
+            if self.seed is not None:
+                str_diam += " -z %d " % (self.seed)
         else:
             str_diam = " -d %s " % (self.sphere_diameter)
+            if self.cluster_ratio is not None:
+                str_diam += " -H %s " % (self.cluster_ratio)
+            if self.solver_tolerance is not None:
+                str_diam += " -a %s " % (self.solver_tolerance)
+            if self.solver_time is not None:
+                str_diam += " -c %s " % (self.solver_time)
 
             if self.form_factor:
                 # compute formfactor
                 self.form_factor = False
                 self.FF_name = tempfile.mktemp(prefix="", suffix="", dir="")
                 str_FF = " -f %s " % (self.FF_name)
+                if self.ff_cache is not None:
+                    ff_key = self.form_factor_key()
+                    if self.ff_cache.fetch(ff_key, d, self.FF_name):
+                        str_FF = " -w " + self.FF_name
+                        ff_key = None
             else:
                 str_FF = " -w " + self.FF_name
+            # matrices in the working directory
+            str_FF += " -t .%s " % (os.sep)
             if self.sphere_diameter >= 0:
-                str_env = " -e %s.env " % (optname)
+                str_env = "".join(" -e %s.env " % (simname) for simname in simnames)
+            if self.warm_start is not None:
+                x_key = self.form_factor_key()
+                for optname in optnames:
+                    solution = self.warm_start.get(x_key, optname)
+                    if solution is not None:
+                        for sky in self.skies:
+                            _write_radiosity(d / (self.simulation_name(optname, sky) + '.x'), solution)
+                str_x = "".join(" -x %s.x " % (simname) for simname in simnames)
 
         if self.sensor is not None:
             str_sensor = " -C %s " % (self.sensor)
 
-        str_img = "-L %d" % (self.img_size)
+        str_img = "-L %d -n %d" % (self.img_size, self.nb_threads)
+        if self.nb_rays is not None:
+            str_img += " -N %d" % (self.nb_rays)
+        if self.source_output:
+            str_img += " -D"
 
-        cmd = "%s -M %s -l %s -p %s -A %s %s %s %s %s %s %s " % (
-            self.canestra_name, self.scene, self.sky, opt, str_pattern, str_direct, str_diam, str_FF, str_env, str_img, str_sensor)
+        if self.shared_canopy is None:
+            str_scene = "-M %s" % (self.scene)
+        else:
+            str_scene = "-m %d -o" % (self.shared_canopy.clef)
+        if self.binary_output:
+            str_scene += " -b"
+        str_opt = " -p ".join(opts)
+
+        cmd = "%s %s -l %s -p %s -A %s %s %s %s %s %s %s %s " % (
+            self.canestra_name, str_scene, " -l ".join(self.skies), str_opt, str_pattern, str_direct, str_diam, str_FF, str_env, str_img,
+            str_sensor, str_x)
         if self.my_dbg:
             print((">>> Canestrad(): %s" % (cmd)))
-        status = _process(cmd, self.tempdir, d / "nr.log")
-
-        ficres = d / 'Etri.vec0'
-        ficsens = d / 'solem.dat'
-        if ficres.exists():
-            self.store_result(ficres, str(optname))
-
-            if self.sensor is not None:
-                if ficsens.exists():
-                    self.store_sensor(ficsens, str(optname))
-
-            if self.resdir is not None:
-                # copy result files
-                fdest = Path(optname + ".vec")
-                if self.my_dbg:
-                    print(fdest)
-                ficres.move(self.resdir / fdest)
-
-                if self.sensor is not None:
-                    fdest = Path(optname + ".sens")
-                    if self.my_dbg:
-                        print(fdest)
-                    ficsens.move(self.resdir / fdest)
-        else:
-            f = open(d / "nr.log")
-            msg = f.readlines()
-            f.close()
-            print(">>>  canestra has not finished properly => STOP")
-            raise CaribuRunError(''.join(msg))
+        status = _process(cmd, self.tempdir, d / "nr.log", self.engine_env())
+
+        if self.cameras is not None:
+            if not (d / 'Cam.bin').exists():
+                with open(d / "nr.log") as f:
+                    raise CaribuRunError(f.read())
+            self.store_cameras(d / 'Cam.bin')
+            return
+
+        def _band_file(name, optname, sky):
+            # canestrad suffixes result files with the sky and band names when several skies or bands are simulated
+            root, ext = os.path.splitext(name)
+            if len(self.skies) > 1:
+                root += '_' + str(Path(sky).stripext())
+            if len(opts) > 1:
+                root += '_' + optname
+            return d / (root + ext)
+
+        for k, sky in enumerate(self.skies):
+            self.nrj, self.measures, self.solver_info = \
+                self.nrj_series[k], self.measures_series[k], self.solver_info_series[k]
+            for optname in optnames:
+                simname = self.simulation_name(optname, sky)
+                ficres = _band_file('Etri.bin' if self.binary_output else 'Etri.vec0', optname, sky)
+                ficsens = _band_file('solem.dat', optname, sky)
+                if self.gap_query:
+                    ficres = _band_file('Gap.dat', optname, sky)
+                    if ficres.exists():
+                        self.store_gap(ficres, optname)
+                        continue
+                if ficres.exists():
+                    if ff_key is not None:
+                        self.ff_cache.store(ff_key, d, self.FF_name)
+                        ff_key = None
+                    self.store_result(ficres, optname)
+                    self.store_solver_info(_band_file('solver.dat', optname, sky), optname)
+                    self.store_errors(_band_file('Emc.vec0', optname, sky), optname)
+                    if self.source_output:
+                        self.store_sources(_band_file('Esrc.vec0', optname, sky), optname)
+                    if x_key is not None and (d / (simname + '.x')).exists():
+                        info = self.solver_info.get(optname, {})
+                        self.warm_start.update(x_key, optname, _read_radiosity(d / (simname + '.x')),
+                                               info.get('iterations'), info.get('residual'))
+
+                    if self.sensor is not None:
+                        if ficsens.exists():
+                            self.store_sensor(ficsens, optname)
+
+                    if self.resdir is not None:
+                        # copy result files
+                        fdest = Path(simname + (".bin" if self.binary_output else ".vec"))
+                        if self.my_dbg:
+                            print(fdest)
+                        ficres.move(self.resdir / fdest)
+
+                        if self.sensor is not None:
+                            fdest = Path(simname + ".sens")
+                            if self.my_dbg:
+                                print(fdest)
+                            ficsens.move(self.resdir / fdest)
+                else:
+                    f = open(d / "nr.log")
+                    msg = f.readlines()
+                    f.close()
+                    print(">>>  canestra has not finished properly => STOP")
+                    raise CaribuRunError(''.join(msg))
+        self.nrj, self.measures, self.solver_info = \
+            self.nrj_series[0], self.measures_series[0], self.solver_info_series[0]
 
         if (d / Path("nr.log")).exists():
             # copy log files
-            fic = Path("nr-" + optname + ".log")
+            fic = Path("nr-" + "-".join(optnames) + ".log")
             (d / "nr.log").move(d / fic)
 
         if self.my_dbg:
-            print(">>> caribu.py: Caribu::canestra (%s) finished !" % (optname))
+            print(">>> caribu.py: Caribu::canestra (%s) finished !" % (" ".join(optnames)))
 
 
 def vcaribu(canopy, lightsource, optics, pattern, options):
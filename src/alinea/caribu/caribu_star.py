@@ -41,6 +41,49 @@ def caribu_lighted_scene(scene, directions=1, domain=None, minval=None, maxval=N
     return c_scene.plot(ei, minval=minval, maxval=maxval, display=False)
 
 
+def _star(raw, aggregated, output_by_triangle=False):
+    """ star and exposed area from the (simplified) results of a run """
+    if output_by_triangle:
+        star = raw['Ei']
+        areas = raw['area']
+        exposed_area = {vid: [star[vid][i] * areas[vid][i] for i in range(len(areas[vid]))] for vid in areas}
+    else:
+        star = aggregated['Ei']
+        areas = aggregated['area']
+        exposed_area = {vid: star[vid] * areas[vid] for vid in areas}
+    return star, exposed_area
+
+
+def caribu_stars(scene_geometry, directions=(1, 16), output_by_triangle=False, domain=None, convUnit=0.01):
+    """Compute exposition ('surface_viewed-to_area ratio and exposed surface(m2)') of scene elements for several
+        numbers of directions at once
+
+    The scene is converted once, and all direction sets are lighted by a single caribu run (see
+    CaribuScene.run_series)
+
+    Args:
+        scene_geometry: scene geometry
+        directions (tuple of int): numbers of directions (1, 16 or 46)
+        output_by_triangle (bool): should results be aggregated ?
+        domain: the domain bounding the scene
+        convUnit: (float) Default '0.01'. Conversion factor to get meter from scene length unit.
+
+    Returns:
+        a {directions: (star, exposed_surface)} dict of the results of caribu_star
+    """
+    light_sets = []
+    for d in directions:
+        energie, emission, direction, elevation, azimuth = turtle(sectors=str(d), energy=1)
+        light_sets.append(list(zip(energie, direction)))
+
+    c_scene = CaribuScene(scene=scene_geometry, pattern=domain)
+    if convUnit is not None:
+        c_scene.conv_unit = convUnit
+    series = c_scene.run_series(light_sets, direct=True, infinite=domain is not None, simplify=True,
+                                batch_size=len(light_sets))
+    return {d: _star(raw, aggregated, output_by_triangle) for d, (raw, aggregated) in zip(directions, series)}
+
+
 def caribu_star(scene_geometry, directions=1, output_by_triangle=False, domain=None, convUnit=0.01):
     """Compute exposition ('surface_viewed-to_area ratio and exposed surface(m2)') of scene elements from a given number
         of direction
@@ -59,62 +102,49 @@ def caribu_star(scene_geometry, directions=1, output_by_triangle=False, domain=N
     # TODO : check that sources are okay for star (energy of emisssion should be the one normalised)
 
     c_scene, raw, aggregated = _caribu_call(scene_geometry, str(directions), domain=domain, convUnit=convUnit)
-    if output_by_triangle:
-        star = raw['Ei']
-        areas = raw['area']
-        exposed_area = {vid: [star[vid][i] * areas[vid][i] for i in range(len(areas[vid]))] for vid in areas}
-    else:
-        star = aggregated['Ei']
-        areas = aggregated['area']
-        exposed_area = {vid: star[vid] * areas[vid] for vid in areas}
+    return _star(raw, aggregated, output_by_triangle)
 
-    return star, exposed_area
+
+def _update_stars(g, stars):
+    """ add/update {property_name: values} star properties of g """
+    for name, values in stars.items():
+        if name not in g.properties():
+            g.add_property(name)
+        g.property(name).update(values)
+    return g
+
+
+def caribu_mtg_stars(g, rain_sectors=1, light_sectors=16, output_by_triangle=False, domain=None, convUnit=0.01):
+    """ Compute rain (rain_sectors directions) and light (light_sectors directions) stars and exposed areas of the
+    geometry of g with a single caribu run, and store them as 'rain_star', 'rain_exposed_area', 'light_star' and
+    'light_exposed_area' properties of g
+    """
+    geom = g.property('geometry')
+    stars = caribu_stars(geom, directions=(rain_sectors, light_sectors), output_by_triangle=output_by_triangle,
+                         domain=domain, convUnit=convUnit)
+    rain_star, rain_exposed_area = stars[rain_sectors]
+    light_star, light_exposed_area = stars[light_sectors]
+    return _update_stars(g, {'rain_exposed_area': rain_exposed_area, 'rain_star': rain_star,
+                             'light_exposed_area': light_exposed_area, 'light_star': light_star})
 
 
 def caribu_rain_star(g, output_by_triangle=False, domain=None, convUnit=0.01, dt=1):
     geom = g.property('geometry')
     rain_star, rain_exposed_area = caribu_star(geom, directions=1, output_by_triangle=output_by_triangle,
                                                convUnit=convUnit, domain=domain)
-    if 'rain_exposed_area' not in g.properties():
-        g.add_property('rain_exposed_area')
-    if 'rain_star' not in g.properties():
-        g.add_property('rain_star')
-    g.property('rain_exposed_area').update(rain_exposed_area)
-    g.property('rain_star').update(rain_star)
-    return g
+    return _update_stars(g, {'rain_exposed_area': rain_exposed_area, 'rain_star': rain_star})
 
 
 def caribu_light_star(g, light_sectors=16, output_by_triangle=False, domain=None, convUnit=0.01, trigger=1):
     geom = g.property('geometry')
     light_star, light_exposed_area = caribu_star(geom, directions=light_sectors, output_by_triangle=output_by_triangle,
                                                  convUnit=convUnit, domain=domain)
-    if 'light_exposed_area' not in g.properties():
-        g.add_property('light_exposed_area')
-    if 'light_star' not in g.properties():
-        g.add_property('light_star')
-    g.property('light_exposed_area').update(light_exposed_area)
-    g.property('light_star').update(light_star)
-    return g
+    return _update_stars(g, {'light_exposed_area': light_exposed_area, 'light_star': light_star})
 
 
 def rain_and_light_star(g, light_sectors=16, output_by_triangle=False, domain=None, convUnit=0.01, trigger=1):
-    geom = g.property('geometry')
-    rain_star, rain_exposed_area = caribu_star(geom, directions=light_sectors, output_by_triangle=output_by_triangle,
-                                               convUnit=convUnit, domain=domain)
-
-    if not 'rain_exposed_area' in g.properties():
-        g.add_property('rain_exposed_area')
-    if not 'rain_star' in g.properties():
-        g.add_property('rain_star')
-    if not 'light_exposed_area' in g.properties():
-        g.add_property('light_exposed_area')
-    if not 'light_star' in g.properties():
-        g.add_property('light_star')
-    g.property('rain_exposed_area').update(rain_exposed_area)
-    g.property('light_exposed_area').update(light_exposed_area)
-    g.property('rain_star').update(rain_star)
-    g.property('light_star').update(light_star)
-    return g
+    return caribu_mtg_stars(g, rain_sectors=1, light_sectors=light_sectors, output_by_triangle=output_by_triangle,
+                            domain=domain, convUnit=convUnit)
 
 
 def run_caribu(sources, scene, opticals='stem', optical_properties=None, output_by_triangle=False, domain=None,
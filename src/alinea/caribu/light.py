@@ -1,6 +1,7 @@
 """
 Utilities to create lights
 """
+import numpy
 from numpy import radians, sin, cos, array, ndarray
 
 elevations = [9.23, 9.23, 9.23, 9.23, 9.23, 9.23, 9.23, 9.23, 9.23, 9.23, 10.81, 10.81, 10.81, 10.81, 10.81, 26.57,
@@ -130,3 +131,166 @@ def emission_inv(elevation, energy):
 def diffuse_source(directions=1):
     energie, emission, direction, elevation, azimuth = turtle(sectors=str(directions), energy=1)
     return list(zip(energie, direction))
+
+
+def _sun_clusters(vectors, weights, nb_clusters, iterations=20):
+    """ weighted spherical k-means of unit vectors, initialised with sources
+    evenly spaced in cumulated weight along the sun path (sorted by azimuth)"""
+    order = numpy.lexsort((vectors[:, 2], numpy.arctan2(vectors[:, 1], vectors[:, 0])))
+    cumw = numpy.cumsum(weights[order])
+    seeds = numpy.searchsorted(cumw, (numpy.arange(nb_clusters) + 0.5) / nb_clusters * cumw[-1])
+    centers = vectors[order[numpy.unique(seeds)]]
+    labels = numpy.argmax(vectors.dot(centers.T), axis=1)
+    for _ in range(iterations):
+        sums = numpy.zeros_like(centers)
+        numpy.add.at(sums, labels, vectors * weights[:, None])
+        norms = numpy.linalg.norm(sums, axis=1)
+        centers = sums[norms > 0] / norms[norms > 0, None]
+        new_labels = numpy.argmax(vectors.dot(centers.T), axis=1)
+        if len(centers) == len(sums) and numpy.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+    return labels
+
+
+def _merge_beams(vectors, beams, labels, major=None):
+    """ sums the beams of the unit vectors sharing the same label into one
+    light source per label, with the (horizontal irradiance weighted) mean and
+    max angles (deg) between the vectors and the direction of their source.
+    If major is given, only the vectors it selects set the direction of their
+    source, the others only add their horizontal irradiance to it"""
+    if major is None:
+        major = numpy.ones(len(labels), dtype=bool)
+    irradiance = -beams * vectors[:, 2]
+    bins = numpy.unique(labels)
+    sums = numpy.zeros((labels.max() + 1, 3))
+    numpy.add.at(sums, labels[major], vectors[major] * beams[major, None])
+    sums = sums[bins]
+    centers = sums / numpy.linalg.norm(sums, axis=1)[:, None]
+    energy = numpy.bincount(labels, weights=irradiance)[bins]
+    lights = [(e, tuple(c)) for e, c in zip(energy.tolist(), centers.tolist())]
+
+    index = numpy.searchsorted(bins, labels)
+    angles = numpy.degrees(numpy.arccos(numpy.clip(
+        numpy.sum(vectors * centers[index], axis=1), -1, 1)))
+    error = {'mean': float(numpy.sum(angles * irradiance) / irradiance.sum()),
+             'max': float(angles.max())}
+    return lights, error
+
+
+def cumulative_sky(diffuse, direct, sun_elevation, sun_azimuth, sun_bins=20, sectors='46',
+                   sky_type='soc', orientation=0):
+    """Accumulate the radiations of a period into a fixed set of light sources
+
+    The diffuse radiation of the period is distributed on the turtle sectors
+    and the direct radiation on at most sun_bins directions grouping the
+    successive sun positions, so that the whole period is simulated with a
+    single caribu run. Each sun bin is the sum of the beams it groups: the
+    horizontal irradiance is conserved, as is the irradiance of any plane
+    lit by all of them.
+
+    Args:
+        diffuse: (array-like) horizontal diffuse irradiances of the time steps
+        direct: (array-like) horizontal direct irradiances of the time steps
+        sun_elevation: (array-like) elevation angle (degree, positive) of the
+         sun at the time steps
+        sun_azimuth: (array-like) azimuth angle (degree, from North, positive
+         clockwards) of the sun at the time steps
+        sun_bins: (int) the maximal number of sun directions. If None, each
+         time step gives a sun source
+        sectors: (str) the number of turtle sectors ('16' or '46')
+        sky_type: (str) 'soc' or 'uoc' distribution of diffuse radiation
+        orientation: (float)  the angle (deg, positive clockwise) from X+ to
+         North (default: 0)
+
+    Returns:
+        - a list of (irradiance, (x, y, z)) light sources
+        - a dict with the binning error of the direct radiation: 'mean'
+          (direct irradiance weighted) and 'max' angle (deg) between the sun
+          positions and the direction of their bin
+    """
+    diffuse = numpy.atleast_1d(numpy.asarray(diffuse, dtype=float))
+    direct, elevation, azimuth = [numpy.atleast_1d(numpy.asarray(a, dtype=float)) for a in
+                                  numpy.broadcast_arrays(direct, sun_elevation, sun_azimuth)]
+    lights = []
+    energie, emission, direction, elevation_s, azimuth_s = turtle(sectors=sectors, format=sky_type,
+                                                                 energy=diffuse.sum())
+    lights += [(e, tuple(d)) for e, d in zip(energie, direction) if e > 0]
+
+    sun = (direct > 0) & (elevation > 0)
+    error = {'mean': 0., 'max': 0.}
+    if not sun.any():
+        return lights, error
+    x, y, z = vecteur_direction(elevation[sun], -(azimuth[sun] + orientation))
+    vectors = numpy.stack((x, y, z), axis=1)
+    # beams (normal irradiance) of the sources, pointing to the ground
+    beams = direct[sun] / -vectors[:, 2]
+    if sun_bins is None or sun_bins >= len(vectors):
+        labels = numpy.arange(len(vectors))
+    else:
+        labels = _sun_clusters(vectors, beams, sun_bins)
+    merged, error = _merge_beams(vectors, beams, labels)
+    return lights + merged, error
+
+
+def reduce_lights(lights, max_angle=10, threshold=0):
+    """Reduce the number of directions of a light list
+
+    Sources closer than max_angle are merged into one source summing their
+    beams, so that the horizontal irradiance is conserved, as is the
+    irradiance of any plane lit by all sources of a group. Sources whose
+    horizontal irradiance is below threshold times the total do not move the
+    direction of the groups: their horizontal irradiance is added to the
+    closest group.
+
+    Args:
+        lights: (list) a list of (irradiance, (x, y, z)) light sources
+        max_angle: (float) the maximal angle (deg) between a source
+         (above threshold) and the direction of its group
+        threshold: (float) the relative horizontal irradiance below which a
+         source does not contribute to the direction of its group
+
+    Returns:
+        - the reduced list of (irradiance, (x, y, z)) light sources
+        - a dict with the number of sources ('nb_lights') and the error of the
+          reduction: 'mean' (horizontal irradiance weighted) and 'max' angle
+          (deg) between the sources and the direction of their group
+    """
+    irradiance = numpy.array([float(e) for e, _ in lights])
+    vectors = numpy.array([v for _, v in lights], dtype=float).reshape(-1, 3)
+    norms = numpy.linalg.norm(vectors, axis=1)
+    down = (irradiance > 0) & (vectors[:, 2] < 0)
+    # sources that do not light the ground from above are kept as they are
+    others = [l for l, keep in zip(lights, (irradiance > 0) & ~down) if keep]
+    error = {'nb_lights': len(others), 'mean': 0., 'max': 0.}
+    if not down.any():
+        return others, error
+    vectors = vectors[down] / norms[down, None]
+    irradiance = irradiance[down]
+    beams = irradiance / -vectors[:, 2]
+
+    # groups are led by the brightest sources: members within max_angle / 2 of
+    # their leader are within max_angle of the direction of the group
+    cos_max = numpy.cos(numpy.radians(max_angle) / 2)
+    major = irradiance >= threshold * irradiance.sum()
+    major[numpy.argmax(irradiance)] = True
+    labels = numpy.full(len(vectors), -1)
+    leaders = []
+    for i in numpy.argsort(-beams):
+        if not major[i]:
+            continue
+        if leaders:
+            cosines = vectors[leaders].dot(vectors[i])
+            j = numpy.argmax(cosines)
+            if cosines[j] >= cos_max:
+                labels[i] = j
+                continue
+        labels[i] = len(leaders)
+        leaders.append(i)
+    minor = labels < 0
+    labels[minor] = numpy.argmax(vectors[minor].dot(vectors[leaders].T), axis=1)
+
+    reduced, err = _merge_beams(vectors, beams, labels, major)
+    error.update(err)
+    error['nb_lights'] += len(reduced)
+    return reduced + others, error
@@ -1,76 +1,114 @@
 from math import *
-from numpy import array
+import numpy
+
+from .sky_series import sky_sectors, direction
+
+
+def sector_index(nbp, nbt, elv, azim):
+    """ flat indices (j * nbt + k) of the sectors of a nbp x nbt sky containing
+    the directions of zenithal angles elv and azimuths azim (rad), -1 below
+    the horizon """
+    elv = numpy.asarray(elv, dtype=float)
+    azim = numpy.asarray(azim, dtype=float)
+    k = numpy.floor(elv / (pi / 2 / nbt)).astype(int)
+    j = numpy.floor(numpy.mod(azim, 2 * pi) / (2 * pi / nbp)).astype(int) % nbp
+    return numpy.where((elv >= 0) & (k < nbt), j * nbt + k, -1)
+
 
 class Sky(object):
     def __init__(self,Nbp,Nbt):
         """ initialise sky avec I=0; Nbp=nb secteurs d'azimut, Nbt nombre secteurs zenithaux """
         self.sec = [Nbp,Nbt]
-        self.sky = []
 
         self.dp = 2 * pi / Nbp
         self.dt = pi / 2 / Nbt
 
-        da = self.dp
-        dz = self.dt
-        
-        I=0
-        for j in range(Nbp):
-            for k in range (Nbt):
-              azim,elv = j * da + da / 2, k * dz + dz / 2
-              dir = self.Vdir(elv,azim)        
-              self.sky.append([I] + dir + [j,k])
+        # one row per source: the Nbp x Nbt sectors (j major) then the
+        # sources added at their exact position (set_Rsun2)
+        self.I = numpy.zeros(Nbp * Nbt)
+        self.dirs = sky_sectors(Nbp, Nbt)[1]
+        j, k = numpy.meshgrid(numpy.arange(Nbp), numpy.arange(Nbt), indexing='ij')
+        self.jk = numpy.stack((j.ravel(), k.ravel()), axis=-1)
+
+    @property
+    def nsec(self):
+        return self.sec[0] * self.sec[1]
+
+    @property
+    def sky(self):
+        """ sources as a list of [I, dx, dy, dz, j, k] lists (j, k = -1 for sources
+        at exact position) """
+        return [[i] + d + jk for i, d, jk in zip(self.I.tolist(), self.dirs.tolist(),
+                                                 self.jk.tolist())]
+
+    def lights(self):
+        """ sources as a list of (I, (dx, dy, dz)) caribu light sources """
+        return [(i, tuple(d)) for i, d in zip(self.I.tolist(), self.dirs.tolist())]
+
+    def copy(self):
+        res = Sky(self.sec[0], self.sec[1])
+        res.I = self.I.copy()
+        res.dirs = self.dirs.copy()
+        res.jk = self.jk.copy()
+        return res
 
     def set_Rd(self,Rd,Tsky):
         """  I=Rd distribue selon type de ciel =soc/uoc """
-        Nbp,Nbt=self.sec[0],self.sec[1]
-        da,dz = self.dp,self.dt
-    
-        count=0
-        for j in range(Nbp):
-            for k in range (Nbt):
-              azim,elv = j * da + da / 2, k * dz + dz / 2
-              if(Tsky=='soc'):
-                  I = self.soc (elv, dz, azim, da) * Rd
-              else:
-                  I = self.uoc (elv, dz, azim, da) * Rd
-
-              self.sky[count][0] = I 
-              count+=1
+        weights = sky_sectors(self.sec[0], self.sec[1], 'soc' if Tsky == 'soc' else 'uoc')[0]
+        self.I[:self.nsec] = weights * Rd
 
     def set_Rsun(self,sun):
         """ I=sun.Rsun;  ajoute sun dans secteur selon elv et azim """
-        Nbp,Nbt=self.sec[0],self.sec[1]
-
-        sect_sun = self.Which_SkySec(Nbp,Nbt,sun._get_pos_astro())
-        for i in range(len(self.sky)):
-            if self.sky[i][4]==sect_sun[0] and self.sky[i][5]==sect_sun[1]:
-                self.sky[i][0]+=sun.Rsun #ajoute le soleil
+        elv, azim = sun._get_pos_astro()
+        i = int(sector_index(self.sec[0], self.sec[1], elv, azim))
+        if i >= 0:
+            self.I[i] += sun.Rsun #ajoute le soleil
 
     def set_Rsun2(self,sun):
         """ ajoute sun position exacte en rajoutant une ligne au ciel discretise """
         elv, azim = sun._get_pos_astro()
-        dir = self.Vdir(elv,azim)
-        I = sun.Rsun
-        self.sky.append([I]+dir+[-1,-1])
+        self.I = numpy.append(self.I, sun.Rsun)
+        self.dirs = numpy.vstack((self.dirs, direction(elv, azim)))
+        self.jk = numpy.vstack((self.jk, [-1, -1]))
+
+    def add_series(self, Rd=0, Tsky='soc', Rsun=0, elv=None, azim=None):
+        """ accumulates a series of skies in one array operation: the diffuse
+        radiations Rd distributed according to Tsky, and the suns of radiations
+        Rsun and positions (elv, azim) (see sky_series.sun_position) binned in
+        the sectors containing them. Suns below the horizon are ignored """
+        weights = sky_sectors(self.sec[0], self.sec[1], 'soc' if Tsky == 'soc' else 'uoc')[0]
+        self.I[:self.nsec] += weights * numpy.sum(Rd)
+        if elv is not None:
+            idx = sector_index(self.sec[0], self.sec[1], elv, azim).ravel()
+            rsun = numpy.broadcast_to(numpy.asarray(Rsun, dtype=float), idx.shape).ravel()
+            day = idx >= 0
+            self.I[:self.nsec] += numpy.bincount(idx[day], rsun[day], minlength=self.nsec)
+
+    @staticmethod
+    def merge(skies):
+        """ sum of skies of same sectors: sector intensities are summed, sources at
+        exact position are gathered """
+        sec = skies[0].sec
+        if any(s.sec != sec for s in skies):
+            raise ValueError("sky sectors do not match!")
+        res = Sky(sec[0], sec[1])
+        nsec = res.nsec
+        res.I = numpy.concatenate([numpy.sum([s.I[:nsec] for s in skies], axis=0)] +
+                                  [s.I[nsec:] for s in skies])
+        res.dirs = numpy.concatenate([res.dirs] + [s.dirs[nsec:] for s in skies])
+        res.jk = numpy.concatenate([res.jk] + [s.jk[nsec:] for s in skies])
+        return res
 
     def __add__(self,sky2):
         """ ajoute 2 ciels ; surcharge +"""
         if self.sec!=sky2.sec:
             print("sky sectors do not match!")
         else:
-            res=Sky(self.sec[0],self.sec[1])
-            for i in range(len(self.sky)):
-                res.sky[i][0]=self.sky[i][0]+sky2.sky[i][0]
-
-            return res
+            return Sky.merge([self, sky2])
 
     def get_Rs(self):
         """ calcule du rayonnement total  """
-        res=0
-        for i in range(len(self.sky)):
-            res=res+self.sky[i][0]
-
-        return res
+        return float(self.I.sum())
 
     def uoc (self, teta, dt, phi, dp):
         """ teta: angle zenithal; phi: angle azimutal du soleil """
@@ -79,7 +117,7 @@ class Sky(object):
         y = cos(teta+dt)
         E = (x*x-y*y)*dp/2./pi
         return E
-    
+
     def soc (self, teta, dt, phi, dp):
         """ teta: angle zenithal; phi: angle azimutal du soleil """
         dt /= 2.
@@ -100,28 +138,20 @@ class Sky(object):
     def Which_SkySec(self,nbp,nbt,SunPos):
         """ retourne les indices (zenith,azim) du secteur de ciel dans lequel setrouve le soleil; nbt et nbp sont les nb de secteurs zenitaux et azimutaux """
         """ retourne -1 la nuit """
-        elv,azim=SunPos[0],SunPos[1]
-        if elv<0:
+        i = int(sector_index(nbp, nbt, SunPos[0], SunPos[1]))
+        if i < 0:
             return [-1,-1]
         else:
-            Belv=array(list(range(nbt)))*(pi/(2*nbt)) #vecteur bornes des secteurs elv
-            Bazim=array(list(range(nbp)))*(2*pi/(nbp)) - pi 
-            Velv=abs(Belv-elv).tolist() # liste des distances des bornes a azim
-            Vazim=abs(Bazim-azim).tolist()
-            Ielv=Velv.index(min(Velv)) # recupere index de la distance mini
-            Iazim=Vazim.index(min(Vazim))
-            return [Ielv,Iazim]
+            return [i % nbt, i // nbt]
 
     def Noralised_Sky(self):
         """ si RS >0, copie vraie du ciel avec somme des intensites = 1 """
         Rs = self.get_Rs()
-        res = Sky(self.sec[0], self.sec[1])
-        
-
+        res = self.copy()
         if Rs>0.:
-            for i in range(len(res.sky)):
-              res.sky[i][0] = self.sky[i][0]/Rs
-              
+            res.I /= Rs
+        else:
+            res.I[:] = 0
         return res
 
 
@@ -139,8 +169,3 @@ class Sky(object):
         s4=Sky(4,3)
         sun1=Sun()
         s4.set_Rsun(sun1)
-
-
-# a finir
-# quid de la boucle?
-# traitements en amont + spitters
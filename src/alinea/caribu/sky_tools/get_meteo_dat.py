@@ -6,7 +6,8 @@ class get_meteo_dat(object):
 
 
     def __call__(self, Tab_Rg, group, indice):
-        DOY, HU = int(Tab_Rg[group][0][indice+1]), int(Tab_Rg[group][1][indice+1]) 
-        Rd = float(Tab_Rg[group][2][indice+1])*float(Tab_Rg[group][3][indice+1])*3600/1000000 #integre W.m-2 sur pas de temps (1h)
-        Rsun = float(Tab_Rg[group][2][indice+1])*(1-float(Tab_Rg[group][3][indice+1]))*3600/1000000 #integre W.m-2 sur pas de temps (1h)
+        row = Tab_Rg[group][indice]
+        DOY, HU = int(row[0]), int(row[1])
+        Rd = float(row[2])*float(row[3])*3600/1000000 #integre W.m-2 sur pas de temps (1h)
+        Rsun = float(row[2])*(1-float(row[3]))*3600/1000000 #integre W.m-2 sur pas de temps (1h)
         return  Rd, Rsun, DOY, HU #Rd, Rsun en MJ.m-2
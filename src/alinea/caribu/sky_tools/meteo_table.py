@@ -0,0 +1,131 @@
+""" Columnar reader of meteo tables
+
+Meteo files are delimited text files with a header line, e.g.:
+
+    DOY;Hour;Rg;RdRg;Group
+    1;1;0;1;0
+
+They are loaded in one pass into numpy structured arrays with one typed field
+per column (int for the columns listed in int_columns, float otherwise), that
+read_meteo_file, spitters_horaire, group_seq and get_meteo_dat consume
+directly. Long (multi-year) files can be streamed by chunks of rows
+(iter_meteo) or by groups (iter_groups).
+"""
+import numpy
+from itertools import islice
+
+from .sky_series import diffuse_fraction
+
+
+def _header(f, delimiter):
+    for line in f:
+        if line.strip():
+            return [name.strip() for name in line.split(delimiter)]
+    return []
+
+
+def _table(lines, names, delimiter, int_columns):
+    dtype = [(name, int if name in int_columns else float) for name in names]
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        return numpy.zeros(0, dtype=dtype)
+    values = numpy.loadtxt(lines, delimiter=delimiter, dtype=float, ndmin=2)
+    if values.shape[1] != len(names):
+        raise ValueError('meteo table has %d columns, header has %d' % (values.shape[1], len(names)))
+    table = numpy.empty(len(values), dtype=dtype)
+    for i, name in enumerate(names):
+        table[name] = values[:, i]
+    return table
+
+
+def read_meteo(filename, delimiter=';', int_columns=('DOY', 'Group')):
+    """ Read a meteo file into a structured array
+
+    Args:
+        filename: (str) path to the file
+        delimiter: (str) the column separator
+        int_columns: (tuple of str) names of the integer columns
+
+    Returns:
+        a numpy structured array with one field per column of the header
+    """
+    with open(filename) as f:
+        names = _header(f, delimiter)
+        return _table(f, names, delimiter, int_columns)
+
+
+def iter_meteo(filename, chunk_size=8760, delimiter=';', int_columns=('DOY', 'Group')):
+    """ Iterate over the rows of a meteo file by chunks of chunk_size rows
+
+    Returns:
+        a generator of numpy structured arrays (see read_meteo)
+    """
+    with open(filename) as f:
+        names = _header(f, delimiter)
+        while True:
+            lines = list(islice(f, chunk_size))
+            if not lines:
+                break
+            table = _table(lines, names, delimiter, int_columns)
+            if len(table):
+                yield table
+
+
+def split_groups(table, column=-1):
+    """ Split a table into the sequences of rows having the same value in column
+    (name or index, default to the last column)
+
+    Returns:
+        a list of structured arrays (views of table)
+    """
+    if len(table) == 0:
+        return []
+    if not isinstance(column, str):
+        column = table.dtype.names[column]
+    values = table[column]
+    return numpy.split(table, numpy.flatnonzero(values[1:] != values[:-1]) + 1)
+
+
+def iter_groups(filename, chunk_size=8760, column=-1, delimiter=';',
+                int_columns=('DOY', 'Group')):
+    """ Iterate over the groups of rows of a meteo file (see split_groups),
+    reading it by chunks of chunk_size rows
+
+    Returns:
+        a generator of numpy structured arrays
+    """
+    pending = None
+    for table in iter_meteo(filename, chunk_size, delimiter, int_columns):
+        if pending is not None:
+            table = numpy.concatenate((pending, table))
+        groups = split_groups(table, column)
+        for group in groups[:-1]:
+            yield group
+        pending = groups[-1]
+    if pending is not None:
+        yield pending
+
+
+def add_diffuse_fraction(table, latitude, name='RdRg'):
+    """ Diffuse / global ratio of the rows of a table (see
+    sky_series.diffuse_fraction) added as a new column before the last
+    one (the group), or replacing the values of column name
+
+    The first three columns are the day of year, the hour (UTC) and the global
+    radiation (W.m-2)
+
+    Returns:
+        a new structured array
+    """
+    doy, hour, rg = [table[n] for n in table.dtype.names[:3]]
+    frac = diffuse_fraction(rg, doy, hour, latitude)
+    if name in table.dtype.names:
+        res = table.copy()
+    else:
+        names = list(table.dtype.names)
+        descr = [(n, table.dtype[n]) for n in names]
+        res = numpy.empty(len(table), dtype=descr[:-1] + [(name, float)] + descr[-1:])
+        for n in names:
+            res[n] = table[n]
+    res[name] = frac
+    return res
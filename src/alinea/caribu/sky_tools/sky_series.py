@@ -0,0 +1,158 @@
+""" Vectorized solar geometry, diffuse/direct partitioning and sky generation
+
+Numpy versions of Sun, spitters_horaire, Sky, Gensun and get_meteo_dat for whole
+time series: the arguments are arrays (or scalars) of day of year, hour and
+latitude that are broadcast together. The formulas (and constants) are those of
+the scalar tools, so that the light lists are the same as those built step by
+step with GenSky, Gensun and add_sun.
+As in Sun and Sky, 'elevation' is the zenithal angle (0 = zenith, pi/2 = horizon)
+"""
+import numpy
+
+
+def decli_sun(doy):
+    """ solar declination (rad) as a function of the day of year (Sun.DecliSun)"""
+    alpha = 2 * 3.14 * (numpy.asarray(doy, dtype=float) - 1) / 365
+    return 0.006918 - 0.399912 * numpy.cos(alpha) + 0.070257 * numpy.sin(alpha)
+
+
+def sun_position(doy, hour_tu, latitude):
+    """ zenithal angle and azimuth (rad, North = 0, East = pi/2) of the sun
+
+    Args:
+        doy: (array of int) days of year
+        hour_tu: (array of float) hours (UTC)
+        latitude: (array of float) latitudes (degrees)
+
+    Returns:
+        (elevation, azimuth) arrays with the broadcast shape of the arguments
+    """
+    lat = 3.14 / 180 * numpy.asarray(latitude, dtype=float)
+    dec = decli_sun(doy)
+    ah = 2 * numpy.pi / 24 * (numpy.asarray(hour_tu, dtype=float) - 12)
+    elev = 3.14 / 2 - numpy.arcsin(numpy.sin(lat) * numpy.sin(dec) +
+                                   numpy.cos(lat) * numpy.cos(dec) * numpy.cos(ah))
+    azim = -numpy.arctan2(numpy.sin(ah),
+                          numpy.sin(lat) * numpy.cos(ah) - numpy.cos(lat) * numpy.tan(dec))
+    return elev, azim
+
+
+def direction(elevation, azimuth):
+    """ direction vectors (pointing to the ground) of sources of given
+    zenithal angles and azimuths (rad), in an array of shape (..., 3)"""
+    elevation = numpy.asarray(elevation, dtype=float)
+    azimuth = numpy.asarray(azimuth, dtype=float)
+    return numpy.stack((numpy.sin(elevation) * numpy.cos(azimuth),
+                        numpy.sin(elevation) * numpy.sin(azimuth),
+                        -numpy.cos(elevation)), axis=-1)
+
+
+def diffuse_fraction(rg, doy, hour_tu, latitude):
+    """ hourly diffuse / global ratio of Spitters (spitters_horaire.RdRsH)
+
+    Args:
+        rg: (array of float) global radiation (W.m-2)
+        doy: (array of int) days of year
+        hour_tu: (array of float) hours (UTC)
+        latitude: (array of float) latitudes (degrees)
+
+    Returns:
+        an array with the broadcast shape of the arguments (1 when the sun is
+        below the horizon)
+    """
+    rg = numpy.asarray(rg, dtype=float)
+    doy = numpy.asarray(doy, dtype=float)
+    hrad = 2 * numpy.pi / 24 * (numpy.asarray(hour_tu, dtype=float) - 12)
+    lat = numpy.radians(numpy.asarray(latitude, dtype=float))
+    alpha = 2 * numpy.pi * (doy - 1) / 365
+    dec = 0.006918 - 0.399912 * numpy.cos(alpha) + 0.070257 * numpy.sin(alpha)
+    costheta = numpy.sin(lat) * numpy.sin(dec) + numpy.cos(lat) * numpy.cos(dec) * numpy.cos(hrad)
+    io = 1370 * (1 + 0.033 * numpy.cos(2 * numpy.pi * (doy - 4) / 366))
+    so = io * costheta
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        rsrso = numpy.where(so > 0, rg / numpy.where(so > 0, so, 1), 0)
+    r = 0.847 - 1.61 * costheta + 1.04 * costheta * costheta
+    k = (1.47 - r) / 1.66
+    return numpy.select([rsrso <= 0.22, rsrso <= 0.35, rsrso <= k],
+                        [1., 1 - 6.4 * (rsrso - 0.22) ** 2, 1.47 - 1.66 * rsrso], r)
+
+
+def sky_sectors(nazi, nzen, sky_type='soc'):
+    """ relative horizontal irradiance and direction of the sectors of a sky
+    discretised in nazi azimuthal x nzen zenithal sectors (Sky.set_Rd)
+
+    Returns:
+        (weights, directions) arrays of shapes (nazi * nzen,) and (nazi * nzen, 3),
+        in the order of Sky.sky
+    """
+    da = 2 * numpy.pi / nazi
+    dz = numpy.pi / 2 / nzen
+    j, k = numpy.meshgrid(numpy.arange(nazi), numpy.arange(nzen), indexing='ij')
+    azim = (j * da + da / 2).ravel()
+    elv = (k * dz + dz / 2).ravel()
+    x = numpy.cos(elv - dz / 2)
+    y = numpy.cos(elv + dz / 2)
+    if sky_type == 'soc':
+        weights = (3 / 14. * (x * x - y * y) + 6 / 21. * (x * x * x - y * y * y)) * da / numpy.pi
+    else:
+        weights = (x * x - y * y) * da / 2. / numpy.pi
+    return weights, direction(elv, azim)
+
+
+def sky_arrays(rg, doy, hour_tu, latitude, nazi=4, nzen=3, sky_type='soc', rdrg=None,
+               unit=0.0036):
+    """ energies and directions of the light sources of a time series of skies
+
+    Each sky is made of the nazi x nzen diffuse sectors and of the sun at its
+    exact position (GenSky, Gensun and add_sun)
+
+    Args:
+        rg: (array of float) global radiation (W.m-2)
+        doy: (array of int) days of year
+        hour_tu: (array of float) hours (UTC)
+        latitude: (array of float) latitudes (degrees)
+        nazi, nzen: (int) number of azimuthal and zenithal sectors of the sky
+        sky_type: (str) 'soc' or 'uoc' distribution of diffuse radiation
+        rdrg: (array of float) diffuse / global ratio. If None (default), it
+        is estimated with diffuse_fraction
+        unit: (float) factor converting rg into the energy of the sources.
+        Default converts W.m-2 during one hour into MJ.m-2, as get_meteo_dat
+
+    Returns:
+        (energies, sectors, sun) arrays of shapes (n, nazi * nzen + 1),
+        (nazi * nzen, 3) and (n, 3), n being the size of the broadcast arguments
+        (flattened in C order): the energies of the sectors and of the sun
+        (last column, 0 when the sun is below the horizon), the directions of
+        the sectors and those of the sun.
+    """
+    rg, doy, hour_tu, latitude = [a.ravel() for a in numpy.broadcast_arrays(
+        numpy.asarray(rg, dtype=float), doy, hour_tu, latitude)]
+    if rdrg is None:
+        rdrg = diffuse_fraction(rg, doy, hour_tu, latitude)
+    rdrg = numpy.broadcast_to(numpy.asarray(rdrg, dtype=float).ravel(), rg.shape)
+    weights, sectors = sky_sectors(nazi, nzen, sky_type)
+    rd = rg * rdrg * unit
+    rsun = rg * (1 - rdrg) * unit
+    sun = direction(*sun_position(doy, hour_tu, latitude))
+    rsun = numpy.where(sun[:, 2] < 0, rsun, 0)
+    energies = numpy.concatenate((rd[:, None] * weights, rsun[:, None]), axis=1)
+    return energies, sectors, sun
+
+
+def sky_series(rg, doy, hour_tu, latitude, nazi=4, nzen=3, sky_type='soc', rdrg=None,
+               unit=0.0036):
+    """ light lists of a time series of skies
+
+    Args: see sky_arrays
+
+    Returns:
+        a list of lists of (energy, (vx, vy, vz)) caribu light sources, one per
+        time step, sources without energy being omitted
+    """
+    energies, sectors, sun = sky_arrays(rg, doy, hour_tu, latitude, nazi=nazi, nzen=nzen,
+                                        sky_type=sky_type, rdrg=rdrg, unit=unit)
+    sectors = [tuple(d) for d in sectors.tolist()]
+    lights = []
+    for e, d in zip(energies.tolist(), sun.tolist()):
+        lights.append([(ei, di) for ei, di in zip(e, sectors + [tuple(d)]) if ei > 0])
+    return lights
@@ -1,5 +1,6 @@
 ############ G Louarn - adaptation de spitters.c EGC grignon
 from math import *
+from .meteo_table import add_diffuse_fraction
 
 def DecliSun(DOY):
     """ Declinaison (rad) du soleil en fonction du jour de l'annee """
@@ -59,15 +60,8 @@ class spitters_horaire(object):
 
 
     def __call__(self, Tab_Rg, latitude):
-        """ calcule RdRg et ajoute le resultat dans dans Tab_Rg """
-        for group in range(len(Tab_Rg)):
-            Tab_Rg[group].append(["RdRg"])
-            for i in range(1,len(Tab_Rg[group][0])):
-                Rg,DOY,heureTU = float(Tab_Rg[group][2][i]),int(Tab_Rg[group][0][i]),float(Tab_Rg[group][1][i])
-                frac = self.RdRsH (Rg,DOY,heureTU,latitude)
-                Tab_Rg[group][4].append(str(frac))
-        
-            Tab_Rg[group][3],Tab_Rg[group][4] = Tab_Rg[group][4],Tab_Rg[group][3]
+        """ calcule RdRg et ajoute le resultat dans dans Tab_Rg (avant derniere colonne) """
+        Tab_Rg = [add_diffuse_fraction(group, latitude) for group in Tab_Rg]
 
         return (Tab_Rg,)
     
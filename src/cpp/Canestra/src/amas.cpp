@@ -0,0 +1,244 @@
+//Radiosite hierarchique : octree des diffuseurs et radiosites moyennes des
+//amas (cf. amas.h)
+
+#include <iostream>
+using namespace std ;
+
+#include <cmath>
+#include <cstdio>
+#include <vector>
+
+#include "canopy.h"
+#include "outils.h"
+#include "bzh.h"
+#include "ff.h"
+#define _AMAS
+#include "amas.h"
+
+//nb max de diffuseurs d'une feuille, profondeur max de l'octree
+#define FEUILLE_AMAS 8
+#define PROF_AMAS 24
+
+struct Amas {
+  double bmin[3],bmax[3];    // boite englobante des sommets
+  double G[3],R;             // centre et rayon de la sphere englobante
+  int fils[8],nbfils;
+  int deb,fin;               // diffuseurs de l'amas : diff[deb..fin-1]
+  double P[NB_DIR_AMAS];     // surface projetee des faces vues de la direction k
+  float couv[NB_DIR_AMAS];   // part de la boite couverte vue de la direction k
+};
+
+// les fils sont ranges avant leur pere : la racine est le dernier amas et
+// les radiosites moyennes peuvent etre calculees dans l'ordre des amas
+static vector<Amas> amas;
+static vector<Diffuseur*> diff;
+static double dir_amas[NB_DIR_AMAS][3];
+static int face0; // colonne de la premiere inconnue d'amas (nb_face)
+
+// surface de la face de diffE vue de la direction d (unitaire, de diffE vers
+// l'observateur), face vue dans *face
+static double vu_de(Diffuseur *diffE,const double *d,int *face) {
+  Vecteur n=diffE->primi().normal();
+  double c=n[0]*d[0]+n[1]*d[1]+n[2]*d[2];
+
+  if(diffE->isopaque()) {
+    *face=diffE->num((unsigned char)0);
+    //opaque vu par derriere : cache (cf. proj_ortho())
+    return (c>0)? diffE->surface()*c : 0.0;
+  }
+  *face=diffE->num((unsigned char)((c>0)? 0 : 1));
+  return diffE->surface()*fabs(c);
+}//vu_de()
+
+// taux de couverture de la boite et surfaces projetees de l'amas a : part
+// des rayons traversant la boite qui rencontrent une face, les faces etant
+// supposees reparties independamment dans la boite
+static void couverture(Amas &a) {
+  int i,k,face;
+  double L[3],S,s;
+
+  for(i=0;i<3;i++)
+    L[i]=a.bmax[i]-a.bmin[i];
+  for(k=0;k<NB_DIR_AMAS;k++) {
+    const double *d=dir_amas[k];
+    double trou=1.0;
+    S=fabs(d[0])*L[1]*L[2]+fabs(d[1])*L[0]*L[2]+fabs(d[2])*L[0]*L[1];
+    a.P[k]=0.0;
+    for(i=a.deb;i<a.fin;i++) {
+      s=vu_de(diff[i],d,&face);
+      a.P[k]+=s;
+      if(S>0)
+	trou*=1.0-min(1.0,s/S);
+    }
+    a.couv[k]=(S>0 && a.P[k]>0)? 1.0-trou : 0.0;
+  }
+}//couverture()
+
+static int construit(int deb,int fin,int prof) {
+  Amas a;
+  int i,o,n,d;
+  Point C;
+  vector<Diffuseur*> octant[8];
+
+  a.deb=deb; a.fin=fin; a.nbfils=0;
+  for(i=0;i<3;i++) {
+    a.bmin[i]=1e30; a.bmax[i]=-1e30;
+  }
+  for(n=deb;n<fin;n++)
+    for(o=0;o<diff[n]->primi().nb_sommet();o++)
+      for(i=0;i<3;i++) {
+	a.bmin[i]=min(a.bmin[i],(double)diff[n]->primi().sommets(o)[i]);
+	a.bmax[i]=max(a.bmax[i],(double)diff[n]->primi().sommets(o)[i]);
+      }
+  a.R=0.0;
+  for(i=0;i<3;i++) {
+    a.G[i]=(a.bmin[i]+a.bmax[i])/2.;
+    a.R+=(a.bmax[i]-a.G[i])*(a.bmax[i]-a.G[i]);
+  }
+  a.R=sqrt(a.R);
+  if(fin-deb>FEUILLE_AMAS && prof<PROF_AMAS) {
+    //partage selon l'octant du centre des diffuseurs
+    for(n=deb;n<fin;n++) {
+      C=diff[n]->centre();
+      o=((C[0]>a.G[0])?1:0)+((C[1]>a.G[1])?2:0)+((C[2]>a.G[2])?4:0);
+      octant[o].push_back(diff[n]);
+    }
+    for(o=0;o<8;o++)
+      if((int)octant[o].size()==fin-deb)
+	break;
+    if(o==8) {//sinon centres confondus : feuille
+      n=deb;
+      for(o=0;o<8;o++) {
+	if(octant[o].empty())
+	  continue;
+	d=n;
+	for(i=0;i<(int)octant[o].size();i++)
+	  diff[n++]=octant[o][i];
+	a.fils[a.nbfils++]=construit(d,n,prof+1);
+      }
+    }
+  }
+  couverture(a);
+  amas.push_back(a);
+  return amas.size()-1;
+}//construit()
+
+// ecrit les radiosites moyennes des amas en fonction de celles des faces
+// (feuilles) ou des fils : pour chaque inconnue, int nb, nb int colonnes
+// puis nb float poids
+static void ecrit_amas(const char *nom,int nb_face) {
+  FILE *fam;
+  int a,k,f,face,nb,nbcol=amas.size()*NB_DIR_AMAS;
+  vector<int> col;
+  vector<float> poids;
+  double s;
+
+  fam=fopen(nom,"wb");
+  if(fam==NULL) {
+    Ferr <<"<!> amas.cpp <ecrit_amas> Unable to open the file "<<nom<<'\n';
+    exit(15);
+  }
+  fwrite(&nb_face,sizeof(int),1,fam);
+  fwrite(&nbcol,sizeof(int),1,fam);
+  for(a=0;a<(int)amas.size();a++)
+    for(k=0;k<NB_DIR_AMAS;k++) {
+      Amas &am=amas[a];
+      col.clear(); poids.clear();
+      if(am.P[k]>0) {
+	if(am.nbfils==0)
+	  for(f=am.deb;f<am.fin;f++) {
+	    s=vu_de(diff[f],dir_amas[k],&face);
+	    if(s>0) {
+	      col.push_back(face);
+	      poids.push_back(s/am.P[k]);
+	    }
+	  }
+	else
+	  for(f=0;f<am.nbfils;f++)
+	    if(amas[am.fils[f]].P[k]>0) {
+	      col.push_back(face0+NB_DIR_AMAS*am.fils[f]+k);
+	      poids.push_back(amas[am.fils[f]].P[k]/am.P[k]);
+	    }
+      }
+      nb=col.size();
+      fwrite(&nb,sizeof(int),1,fam);
+      fwrite(col.data(),sizeof(int),nb,fam);
+      fwrite(poids.data(),sizeof(float),nb,fam);
+    }
+  fclose(fam);
+}//ecrit_amas()
+
+int init_amas(Diffuseur **Tdiff,unsigned int nbdiff,int nb_face) {
+  unsigned int n;
+  int i,j,k,l;
+
+  //directions de vue : centre des faces, aretes et sommets du cube
+  k=0;
+  for(i=-1;i<=1;i++)
+    for(j=-1;j<=1;j++)
+      for(l=-1;l<=1;l++)
+	if(i!=0 || j!=0 || l!=0) {
+	  double nd=sqrt((double)(i*i+j*j+l*l));
+	  dir_amas[k][0]=i/nd; dir_amas[k][1]=j/nd; dir_amas[k][2]=l/nd;
+	  k++;
+	}
+  face0=nb_face;
+  amas.clear(); diff.clear();
+  //le sol (interactions sol-sol exclues) et les capteurs restent hors amas
+  for(n=0;n<nbdiff;n++)
+    if(Tdiff[n]->isreal() && Tdiff[n]->primi().name()!=0)
+      diff.push_back(Tdiff[n]);
+  if(!diff.empty())
+    construit(0,diff.size(),0);
+  ecrit_amas(pcAmName,nb_face);
+  Ferr <<" Radiosite hierarchique : "<<(int)amas.size()<<" amas de "<<(int)diff.size()
+       <<" diffuseurs, vus d'un bloc si rayon < "<<RAMAS<<" x distance\n";
+  return amas.size()*NB_DIR_AMAS;
+}//init_amas()
+
+void parcours_amas(Diffuseur *R,vector<Diffuseur*> &proches) {
+  int a,k,kv,f;
+  double d[3],dist,ps,psv;
+  Point G=R->centre();
+  vector<int> pile;
+
+  proches.clear();
+  if(amas.empty())
+    return;
+  pile.push_back(amas.size()-1);
+  while(!pile.empty()) {
+    a=pile.back();
+    pile.pop_back();
+    Amas &am=amas[a];
+    for(k=0;k<3;k++)
+      d[k]=G[k]-am.G[k];
+    dist=sqrt(d[0]*d[0]+d[1]*d[1]+d[2]*d[2]);
+    if(am.R<RAMAS*dist) {//amas vu d'un bloc, dans la direction de vue la plus proche
+      kv=0; psv=-2.0;
+      for(k=0;k<NB_DIR_AMAS;k++) {
+	ps=(d[0]*dir_amas[k][0]+d[1]*dir_amas[k][1]+d[2]*dir_amas[k][2])/dist;
+	if(ps>psv) {
+	  psv=ps; kv=k;
+	}
+      }
+      if(am.couv[kv]>0) {
+	reel bmin[3],bmax[3];
+	for(k=0;k<3;k++) {
+	  bmin[k]=am.bmin[k]; bmax[k]=am.bmax[k];
+	}
+	proj_amas(bmin,bmax,am.couv[kv],face0+NB_DIR_AMAS*a+kv,a);
+      }
+    }
+    else if(am.nbfils==0)
+      for(f=am.deb;f<am.fin;f++)
+	proches.push_back(diff[f]);
+    else
+      for(f=0;f<am.nbfils;f++)
+	pile.push_back(am.fils[f]);
+  }
+}//parcours_amas()
+
+void libere_amas() {
+  amas.clear();
+  diff.clear();
+}//libere_amas()
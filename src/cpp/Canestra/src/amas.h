@@ -0,0 +1,31 @@
+//Radiosite hierarchique (option -H) : les diffuseurs reels (hors sol et
+//capteurs) sont regroupes en amas par un octree. Un amas dont le rayon est
+//inferieur a RAMAS fois sa distance au recepteur est projete d'un bloc
+//(proj_amas(), ff.cpp) : le recepteur le voit avec la radiosite moyenne des
+//faces de l'amas orientees vers lui. Ces radiosites moyennes sont des
+//inconnues supplementaires (colonnes nb_face+NB_DIR_AMAS*a+k de la matrice
+//des FF), calculees a partir des radiosites des faces par le solveur
+//(fichier pcAmName).
+
+#undef EXTR
+#ifdef _AMAS
+#define EXTR
+#else
+#define EXTR extern
+#endif
+
+#include <vector>
+
+//nombre de directions de vue des amas (directions du cube)
+#define NB_DIR_AMAS 26
+
+//rapport rayon/distance en dessous duquel un amas est vu d'un bloc (0 : pas d'amas)
+EXTR double RAMAS;
+
+//construit les amas des diffuseurs, ecrit pcAmName et renvoie le nombre de
+//colonnes supplementaires de la matrice des FF
+EXTR int init_amas(Diffuseur **Tdiff,unsigned int nbdiff,int nb_face);
+//amas vus d'un bloc depuis le diffuseur R (colonne de l'inconnue de l'amas,
+//projetes par proj_amas()) et diffuseurs a projeter un par un
+EXTR void parcours_amas(Diffuseur *R,std::vector<Diffuseur*> &proches);
+EXTR void libere_amas();
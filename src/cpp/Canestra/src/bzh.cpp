@@ -16,6 +16,7 @@ extern "C" {
 char pcNzName[128];
 char pcDgName[128];
 char pcBfName[128];
+char pcAmName[128];
 
 
 // Test de la fonction ANSI remove
@@ -66,11 +67,12 @@ void placenette(char *ficname){
   remove(ficname);
 }
 
-/** Efface la matrice diagonale, les non_zeros et les Bfar */
+/** Efface la matrice diagonale, les non_zeros, les Bfar et les amas */
 void PlaceNette(void) {
   placenette(pcNzName);
   placenette(pcDgName);
   placenette(pcBfName);
+  placenette(pcAmName);
   // Tremove(".\\toto");
 }
 
@@ -93,6 +95,7 @@ void hdmat_init(char *dir,char *rootname){
   sprintf(pcDgName,"%s%s%s",dir, DG_NAME, tempo);
   sprintf(pcNzName,"%s%s%s",dir, NZ_NAME, tempo);
   sprintf(pcBfName,"%s%s%s",dir, BF_NAME, tempo);
+  sprintf(pcAmName,"%s%s%s",dir, AM_NAME, tempo);
   
   if(true || verbose) 
     Ferr <<"HDMatrices : NZ="  << pcNzName<<", DG="  << pcDgName
@@ -117,6 +120,7 @@ void hdmat_majname(char *dir,char*suff){
   sprintf(pcDgName,"%s%s%s",dir, DG_NAME, tempo);
   sprintf(pcNzName,"%s%s%s",dir, NZ_NAME, tempo);
   sprintf(pcBfName,"%s%s%s",dir, BF_NAME, tempo);
+  sprintf(pcAmName,"%s%s%s",dir, AM_NAME, tempo);
 
   if(true || verbose) {
     Ferr <<"HDMatrices : NZ="  << pcNzName<<", DG="  << pcDgName
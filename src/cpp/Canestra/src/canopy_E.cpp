@@ -8,6 +8,10 @@ using namespace std ;
 
 #include <cmath>
 #include <cstdio>
+#include <vector>
+#include <algorithm>
+#include <thread>
+#include <mutex>
 
 #include "outils.h"
 #include "chrono.h"
@@ -15,6 +19,10 @@ using namespace std ;
 #include "canopy.h"
 #include "ff.h"
 #include "Mmath.h"
+#ifdef _HD
+#include "amas.h"
+#endif
+#include "rayons.h"
 
 //#define FFs
 #ifdef FFs
@@ -44,6 +52,7 @@ typedef struct{
 static Chrono chron;
 static Chrono tps;
 static int proj_cpt;
+static mutex mutex_ferr; // Ferr depuis les threads de projplan et calc_FF_Bfar
 #define PAUSE(msg)  printf(msg);printf("- Taper la touche Any");getchar();
 
 
@@ -133,10 +142,38 @@ void zFF(void *, int, int, void*);
 
 
 //+************ zproj()
+// prim : indice+1 du diffuseur dans Tdiff (cf. TamponZ)
 void zproj(void * Zprim, int i, int j, void* prim) {
-  ((Diffuseur***) Zprim)[i][j] = (Diffuseur *) prim;
+  ((unsigned int**) Zprim)[i][j] = (unsigned int)(size_t) prim;
 }//zproj()
 
+//-************ TamponZ ****************************
+// Tampons de projplan() et data3d() : Z-buffer et diffuseur vu par pixel
+// (indice dans Tdiff + 1, 0 si aucun : 4 octets au lieu d'un pointeur), chacun
+// en un bloc contigu adresse par lignes, plus la copie du Z-buffer utilisee par
+// infinitise() en scene infinie. eclairement_direct() les alloue une fois par
+// thread et les reutilise pour toutes les directions.
+struct TamponZ {
+  int Tx,Ty;
+  vector<REELLE> z,z0;
+  vector<unsigned int> prim;
+  vector<REELLE*> Zbuf;
+  vector<unsigned int*> Zprim;
+  TamponZ(int tx,int ty,bool infty) :
+    Tx(tx),Ty(ty),z((size_t)tx*ty),prim((size_t)tx*ty),Zbuf(tx),Zprim(tx) {
+    if(infty)
+      z0.resize((size_t)tx*ty);
+    for(int i=0;i<tx;i++) {
+      Zbuf[i]=z.data()+(size_t)i*ty;
+      Zprim[i]=prim.data()+(size_t)i*ty;
+    }
+  }
+  void raz() {
+    fill(z.begin(),z.end(),(REELLE)99999999999.9);
+    fill(prim.begin(),prim.end(),0u);
+  }
+};
+
 //+************ zFF()
 void zFF(void *, int, int, void*) {
 
@@ -168,32 +205,151 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
 			  char * envname,
 			  bool bias,
 			  double denv,
-			  int nbsim) {
-  int p,t,b,nb_rec=0,nb_emi=0,nb_test=0,cum_box=0,nb_error=0,nb_ff,nop=0;;
-  unsigned char i,nb_box,pr=0;
-  int pmax,tmax,inc[3],Gi[3];
-  int n,i_sup,i_inf=0,idx,idxn;
-  Diffuseur *diffR, *diffE;
-  BSP *box;
-  Boxi Tabox[8];
-  Point G,T;
-  reel move[2];
-  double mid,S[3],dGS[3],d2env=denv*denv,ff,dER2; //attention aux tests entre d et d^2
-  bool rechauffe,sol,select;
+			  int nbsim,
+			  int nbth) {
+  int th,stat[5]={0,0,0,0,0};//nb_rec,nb_test,nb_emi,cum_box,nb_error cumules
+  double d2env=denv*denv; //attention aux tests entre d et d^2
+  unsigned int nr;
+  vector<thread> pool;
+  mutex mutex_stat;
+  bool hierarchie=false;
+  int nbamas=0;
   
   if(verbose>1) {
     Ferr <<"Canopy::calc_FF_Bfar() denv=Rsph="  << denv
 	 <<" ; taille_vox = "  << mesh.taille()<<'\n' ;
   }
+  // Les recepteurs sont repartis en blocs contigus sur nbth threads : buffers
+  // de projection par thread (ff.cpp), lignes de FF ecrites par bloc puis
+  // fusionnees dans l'ordre des diffuseurs par stat_NFF()
+  liste_diff();
+#ifndef _HD
+  nbth=1;//FF (meschach) : pas d'ecriture concurrente
+#endif
+  if(nbth>(int)nbdiff) nbth=nbdiff;
+  if(nbth<1) nbth=1;
 #ifdef _HD
-  init_NFF(envname,Esource,Ldiff.card(),radim,denv,bias);
+  // radiosite hierarchique (-H) : amas lointains vus d'un bloc
+  if(RAMAS>0) {
+    if(infty)
+      Ferr <<"<!> Radiosite hierarchique ignoree pour une scene infinie\n";
+    else {
+      hierarchie=true;
+      nbamas=init_amas(Tdiff,nbdiff,radim);
+    }
+  }
+  init_NFF(envname,Esource,Ldiff.card(),radim,denv,bias,nbth,nbamas);
 #else
-  SPROW	*r_sup,*r_inf;
   init_NFF(envname,Esource,denv,bias);
 #endif
-  for(Ldiff.debut();! Ldiff.finito();Ldiff.suivant()){
+  // faces sup actives : les threads ne changent plus la face active des
+  // diffuseurs (cf. Diffuseur::num_vu(), num(face), rho(face), tau(face))
+  for(nr=0;nr<nbdiff;nr++)
+    Tdiff[nr]->active((unsigned char)0);
+  auto calcule=[&](int th){
+  int b,nb_rec=0,nb_emi=0,nb_test=0,cum_box=0,nb_error=0,nb_ff,nop=0,proj_cpt=0;
+  unsigned char i,nb_box;
+  int inc[3],Gi[3];
+  int n,i_sup,i_inf=0,idx,idxn;
+  unsigned int nr,nr_e;
+  Diffuseur *diffR, *diffE;
+  BSP *box;
+  Boxi Tabox[8];
+  Point G,T;
+  reel move[2],dec0[2]={0.,0.};
+  vector<Diffuseur*> proches;
+  double mid,S[3],dGS[3],dER2;
+  bool sol,select;
+  Chrono tps;
+#ifndef _HD
+  SPROW	*r_sup,*r_inf;
+#endif
+  init_thread_NFF(th);
+  // projection de l'emetteur diffE (decale de dec) sur le recepteur diffR
+  auto emetteur=[&](Diffuseur *diffE,reel *dec){
+    if (diffE->isreal() && diffE!=diffR) 
+      //si diffE n'est pas un capteur virtuel et si pas cas Diagonale : FF=1
+      if(!(sol && diffE->primi().name()==0)) {
+        //interaction sol-sol (H sol plan)
+        //cas du diffuseur patche
+        //tmax=diffE->nb_patch();
+        //for(t=0;t<tmax;t++) {
+        //diffE->select_patch(t);
+
+        nb_test++;
+        //OLD si bias==false, test de distance pas fait et triangle traite
+         //OLDif(!(bias && G.dist2(T)> d2env)) {
+        // si bias==false, test de distance point-triangle
+        // si bias==true , triangle teste que si  G.dist2(T)>d2env est faux
+        T=diffE->centre();
+        T[0]+=dec[0];
+        T[1]+=dec[1]; 
+        if(bias){
+          dER2= G.dist2(T);
+          select = dER2<d2env;
+        }else{
+          /* version exacte, mais trop lent 
+          // a optimiser !!!
+          char polystr[255],str[100];
+          Polygone *E; // Perte du polymorphisme(a voir)
+
+          sprintf(polystr,"%d ",diffE->primi().nb_sommet());
+          for(signed char p=0;p<diffE->primi().nb_sommet();p++){
+            sprintf(str," %g %g %g ",
+                    diffE->primi().sommets(p)[0]+dec[0],
+                    diffE->primi().sommets(p)[1]+dec[1],
+                    diffE->primi().sommets(p)[2]);
+            strcat(polystr,str);
+          } 
+          //printf("polystr = %s\n",polystr);
+          E = new Polygone(polystr,1,NULL,NULL,false);
+          T=E->centre();
+          dER2=E->distance2_point(G);
+          delete E;
+          */
+          // calcul un sous estimateur de la dist au triangle pour selectionner les projetes
+          Point I;
+          I=G;
+          I[0]-=dec[0];
+          I[1]-=dec[1];
+          select=diffE->primi().appart_sphere(I,denv);
+          //printf("denv=%g, select=%d\n",denv,(int) select);//I.show();diffE->show();
+        }
+        if(select){
+          Vecteur dir(G,T);
+          if(dir.prod_scalaire(diffE->normal())!=0){
+            nb_ff++;
+            n=diffE->num_vu(dir);
+            //Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
+#ifdef _HD
+            idx= ADS_val(n);
+#else
+            idx=(int) sp_get_val(FF,i_sup,n);
+#endif
+            idxn=(dec[0]==0 && dec[1]==0)?2:3;
+            //if( sprow_idx(r_sup,n)<0) {
+            if(((idx*idxn)/2)%3 == 0){
+              //Anti-Doublon System
+              if(idx+idxn==5) nb_error++;
+#ifdef _HD
+              ADS_maj(n,idx+idxn);
+#else
+              sp_set_val(FF,i_sup,n,idx+idxn);
+#endif
+              // Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
+              proj_ortho(diffE,dec,n);
+              //Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
+              nb_emi++; proj_cpt++;
+
+            }//if pas deja traite
+          }//if pas parllele a la direction
+        }//if diffE dans l'envt
+        //}//for nb patch diffE (t)  
+      }//if pas sol-sol //if diffE != diffR
+  };//emetteur()
+  for(nr=th*nbdiff/nbth;nr<(th+1)*nbdiff/nbth;nr++){
     nb_ff=0;
-    diffR=Ldiff.contenu();
+    diffR=Tdiff[nr];
     sol = (diffR->primi().name()==0)? true : false;
     //pmax=diffR->nb_patch();
     // printf("[calc_FF_Bfar] diffR = %d\n",diffR->num());
@@ -205,22 +361,19 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
     //printf("* pmax = %d\n",pmax); 
     //for(p=0;p<pmax;p++) {//cas du diffuseur patche
     //diffR->select_patch(p);
-    diffR->active(0);//active la face sup
     init_proj(diffR);
     G=diffR->centre();
-    i_sup=diffR->num();
+    i_sup=diffR->num((unsigned char)0);
     //printf("\n %d -",i_sup);
 #ifndef _HD
     r_sup = FF->row+ i_sup;
 #endif
     if(!diffR->isopaque()) {
-      diffR->togle_face();
-      i_inf=diffR->num();
+      i_inf=diffR->num((unsigned char)1);
       // printf(" %d ",i_inf);
 #ifndef _HD
       r_inf = FF->row+ i_inf;
 #endif
-      diffR->togle_face();
     }
     nb_box=0;
     for(i=0;i<3;i++) {
@@ -317,100 +470,30 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
       tps.Start(); 
       //Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
     }
+#ifdef _HD
+    if(hierarchie) {//amas lointains projetes d'un bloc, diffuseurs proches un par un
+      parcours_amas(diffR,proches);
+      for(nr_e=0;nr_e<proches.size();nr_e++)
+	emetteur(proches[nr_e],dec0);
+    }
+    else
+#endif
     for(b=0;b<nb_box;b++) {//loop sur les boites dans denv
       box=Tabox[b].box;
       //printf("Boite no %d/%d  = dx = %f, dy = %f\n",b,nb_box,Tabox[b].inc[0],Tabox[b].inc[1]);
       // Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
       //Ferr << "Boite no "<<b<<'\n';
       //loop sur les diffuseurs de la boite
-      for(box->Ldiff.debut();! box->Ldiff.finito();box->Ldiff.suivant()){
+      //(parcours par noeud : le curseur de la liste est partage entre threads)
+      for(Noeud<Diffuseur *> *noeud=box->Ldiff.tete();noeud!=NULL;noeud=noeud->next()){
 	//Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
-	diffE=box->Ldiff.contenu();
-	if (diffE->isreal() && diffE!=diffR) 
-	  //si diffE n'est pas un capteur virtuel et si pas cas Diagonale : FF=1
-	  if(!(sol && diffE->primi().name()==0)) {
-	    //interaction sol-sol (H sol plan)
-	    //cas du diffuseur patche
-	    //tmax=diffE->nb_patch();
-	    //for(t=0;t<tmax;t++) {
-	    //diffE->select_patch(t);
-	    
-	    nb_test++;
-	    //OLD si bias==false, test de distance pas fait et triangle traite
-	     //OLDif(!(bias && G.dist2(T)> d2env)) {
-	    // si bias==false, test de distance point-triangle
-	    // si bias==true , triangle teste que si  G.dist2(T)>d2env est faux
-	    T=diffE->centre();
-	    T[0]+=Tabox[b].inc[0];
-	    T[1]+=Tabox[b].inc[1]; 
-	    if(bias){
-	      dER2= G.dist2(T);
-	      select = dER2<d2env;
-	    }else{
-              /* version exacte, mais trop lent 
-	      // a optimiser !!!
-	      char polystr[255],str[100];
-	      Polygone *E; // Perte du polymorphisme(a voir)
-     
-	      sprintf(polystr,"%d ",diffE->primi().nb_sommet());
-	      for(signed char p=0;p<diffE->primi().nb_sommet();p++){
-		sprintf(str," %g %g %g ",
-			diffE->primi().sommets(p)[0]+Tabox[b].inc[0],
-			diffE->primi().sommets(p)[1]+Tabox[b].inc[1],
-			diffE->primi().sommets(p)[2]);
-		strcat(polystr,str);
-	      } 
-	      //printf("polystr = %s\n",polystr);
-	      E = new Polygone(polystr,1,NULL,NULL,false);
-	      T=E->centre();
-	      dER2=E->distance2_point(G);
-	      delete E;
-	      */
-	      // calcul un sous estimateur de la dist au triangle pour selectionner les projetes
-	      Point I;
-	      I=G;
-	      I[0]-=Tabox[b].inc[0];
-	      I[1]-=Tabox[b].inc[1];
-	      select=diffE->primi().appart_sphere(I,denv);
-	      //printf("denv=%g, select=%d\n",denv,(int) select);//I.show();diffE->show();
-	    }
-	    if(select){
-	      Vecteur dir(G,T);
-	      if(dir.prod_scalaire(diffE->normal())!=0){
-		nb_ff++;
-		diffE->active(dir);
-		n=diffE->num();
-		//Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
-#ifdef _HD
-		idx= ADS_val(n);
-#else
-		idx=(int) sp_get_val(FF,i_sup,n);
-#endif
-		idxn=(Tabox[b].inc[0]==0 && Tabox[b].inc[1]==0)?2:3;
-		//if( sprow_idx(r_sup,n)<0) {
-		if(((idx*idxn)/2)%3 == 0){
-		  //Anti-Doublon System
-		  if(idx+idxn==5) nb_error++;
-#ifdef _HD
-		  ADS_maj(n,idx+idxn);
-#else
-		  sp_set_val(FF,i_sup,n,idx+idxn);
-#endif
-		  // Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
-		  proj_ortho(diffE,Tabox[b].inc);
-		  //Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
-		  nb_emi++; proj_cpt++;
-		  
-		}//if pas deja traite
-	      }//if pas parllele a la direction
-	    }//if diffE dans l'envt
-	    //}//for nb patch diffE (t)	 
-	  }//if pas sol-sol //if diffE != diffR
+	emetteur(noeud->donne(),Tabox[b].inc);
       }//for box->Ldiff 
     }//jqa nb_box(b) (ou if rechauffe si AntiDoublon)
     nb_rec++;
     //Calcul des FF en fct des Buffers
     if(verbose>3){
+      lock_guard<mutex> verrou(mutex_ferr);
       tps.Stop();
       cout<<++nop<<" : proj ortho-sph de "<<nb_ff<<" T en "<<tps<<endl;
       //Bug MC2006: ++nop est fait deux fois!!
@@ -425,27 +508,45 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
 #endif    //chron.Stop();
 
     if(verbose>4){
+      lock_guard<mutex> verrou(mutex_ferr);
       Ferr <<__FILE__ <<" : "<< __LINE__<< " : ";
       Ferr<<proj_cpt<<'\n'<<" NFF computed "<<'\n';
     }
 
     //}//for nb patch diffR
-  }//for Ldiff
+  }//for Tdiff (bloc du thread)
+  fin_thread_NFF();
+  lock_guard<mutex> verrou(mutex_stat);
+  stat[0]+=nb_rec; stat[1]+=nb_test; stat[2]+=nb_emi;
+  stat[3]+=cum_box; stat[4]+=nb_error;
+  };//calcule()
+  if(nbth==1)
+    calcule(0);
+  else{
+    for(th=0;th<nbth;th++)
+      pool.push_back(thread(calcule,th));
+    for(th=0;th<nbth;th++)
+      pool[th].join();
+  }
 
   stat_NFF(); 
+#ifdef _HD
+  if(hierarchie)
+    libere_amas();
+#endif
 
 #define EPSILON 1E-6
 #define NONZERO(A) if ((A<EPSILON)&&(A>-EPSILON)){A= A>0 ? EPSILON: -EPSILON;}
-  double dummy = (double)nb_rec ;
+  double dummy = (double)stat[0] ;
   NONZERO(dummy) ;
-  cout<<"\tmean(diff/patch)     = "<<nb_test/dummy<<"\n";
-  cout<<"\tmean(diff_proj/patch)= "<<nb_emi/dummy<<"\n";
-  cout<<"\tmean(box/patch)      = "<<cum_box/dummy<<"\n";
+  cout<<"\tmean(diff/patch)     = "<<stat[1]/dummy<<"\n";
+  cout<<"\tmean(diff_proj/patch)= "<<stat[2]/dummy<<"\n";
+  cout<<"\tmean(box/patch)      = "<<stat[3]/dummy<<"\n";
   cout<<endl;
   // ,nb_test/(double)nb_rec,nb_emi/(double)nb_rec,cum_box/(double)nb_rec);
   if(infty && denv>=min(delta[0],delta[1]))
     Ferr <<"####>> Nb Erreurs dues a active_face et infini = "
-	 << nb_error<<"\n" ;
+	 << stat[4]<<"\n" ;
 }//Canopy::calc_FF_Bfar()
 #ifndef _HD
 #ifdef FFs
@@ -502,34 +603,119 @@ void Canopy::calc_FF(SPMAT *FF){
 
 #endif
 
-void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
-  int i,j,k,l,img_surf;
+//-************ Canopy::liste_diff() **************************
+// Copie de Ldiff dans Tdiff : projplan parcourt les diffuseurs par indice,
+// le curseur de ListeD ne pouvant etre partage entre threads.
+void Canopy::liste_diff() {
+  unsigned int n=0;
+  if(Tdiff!=NULL && nbdiff==Ldiff.card())
+    return;
+  delete [] Tdiff;
+  nbdiff=Ldiff.card();
+  Tdiff=new Diffuseur*[nbdiff];
+  for(Ldiff.debut();! Ldiff.finito();Ldiff.suivant())
+    Tdiff[n++]=Ldiff.contenu();
+}//Canopy::liste_diff()
+
+//-************ Canopy::eclairement_direct() ********************
+// Eclairement direct (geometrique) cumule sur les nbdir sources : Esup recu
+// en reflexion et Einf en transmission, par face. Les directions sont reparties
+// en blocs contigus sur nbth threads (un Z-buffer et un cumul par thread), les
+// cumuls etant ensuite sommes dans l'ordre des threads => resultat
+// reproductible pour un nombre de threads donne.
+// Si nbray>0, la projection est remplacee par un lancer de rayons (rayplan())
+// dans une BVH commune aux threads.
+// Si Esrc!=NULL (tableau de radim listes), Esrc[i] recoit en plus les
+// contributions non nulles de chaque source a Esup[i], par source croissante.
+void Canopy::eclairement_direct(int nbdir,Vecteur *visee,double *Esource,bool infty,
+				double *Esup,double *Einf,int nbth,Esources *Esrc) {
+  int t;
+  unsigned int i;
+  double **cumul;
+  vector<thread> pool;
+  // (face, source, E) de chaque thread, dans l'ordre des sources
+  vector< vector< pair<unsigned int,pair<int,double> > > > parsource;
+
+  if(nbth>nbdir) nbth=nbdir;
+  if(nbth<1) nbth=1;
+  liste_diff();
+  if(nbray>0)
+    init_rayons(Tdiff,nbdiff);
+  cumul=new double*[nbth];
+  if(Esrc!=NULL)
+    parsource.resize(nbth);
+  for(t=0;t<nbth;t++){
+    cumul[t]=new double[2*radim];
+    for(i=0;i<2*radim;i++)
+      cumul[t][i]=0.0;
+  }
+  auto projette=[&](int t){
+    double *Bsource=new double[radim],*Ct=cumul[t];
+    TamponZ *tz=NULL;
+    unsigned int i;
+    int d;
+    if(nbray==0)
+      tz=new TamponZ(Timg,Timg,infty);
+    for(d=t*nbdir/nbth;d<(t+1)*nbdir/nbth;d++){
+      for(i=0;i<radim;i++)
+	Bsource[i]=0.0;
+      if(nbray>0)
+	rayplan(visee[d],infty,Bsource);
+      else
+	projplan(visee[d],infty,Bsource,*tz);
+      for(i=0;i<radim;i++) {
+	// Cumule les contrib des differents angles solides
+	if(Bsource[i]>0){
+	  Ct[i]+=Esource[d]*Bsource[i];
+	  if(Esrc!=NULL && Esource[d]!=0)
+	    parsource[t].push_back(make_pair(i,make_pair(d,Esource[d]*Bsource[i])));
+	}
+	else if(Bsource[i]<0)
+	  Ct[radim+i]-=Esource[d]*Bsource[i];
+      }
+    }
+    delete tz;
+    delete [] Bsource;
+  };
+  if(nbth==1)
+    projette(0);
+  else{
+    for(t=0;t<nbth;t++)
+      pool.push_back(thread(projette,t));
+    for(t=0;t<nbth;t++)
+      pool[t].join();
+  }
+  for(i=0;i<radim;i++)
+    Esup[i]=Einf[i]=0.0;
+  for(t=0;t<nbth;t++){
+    for(i=0;i<radim;i++){
+      Esup[i]+=cumul[t][i];
+      Einf[i]+=cumul[t][radim+i];
+    }
+    delete [] cumul[t];
+  }
+  delete [] cumul;
+  if(Esrc!=NULL){
+    for(i=0;i<radim;i++)
+      Esrc[i].clear();
+    for(t=0;t<nbth;t++)
+      for(auto &c : parsource[t])
+	Esrc[c.first].push_back(c.second);
+  }
+  if(nbray>0)
+    libere_rayons();
+}//Canopy::eclairement_direct()
+
+void Canopy::projplan(Vecteur &visee,bool infty, double* Bo,TamponZ &tz) {
+  int i,j,k,l;
+  unsigned int n;
   Point roof[4];
-  REELLE **Zbuf,**pZbuf,*ptZ;
+  REELLE **Zbuf=tz.Zbuf.data();
+  unsigned int **Zprim=tz.Zprim.data();
   double tx,ty,costeta,Apix;
-  Diffuseur ***Zprim,***pZprim;
   l=0;
-  //   Tabdyn<REELLE, 2> Zbuf(img->taille(0),img->taille(1));
-  //Tabdyn<Diffuseur *, 2> Zprim(img->taille(0),img->taille(1));
   if(verbose>2) printf("%c => projplan() DEBUT res. %d x %d\n",7, Timg,Timg);
-  Zbuf= new REELLE*[Timg];
-  pZbuf=Zbuf;
-  img_surf=Timg*Timg;
-  for(i=0;i<Timg;i++,pZbuf++) {
-    (*pZbuf)=new REELLE[Timg];
-  }
-  pZbuf=Zbuf;
-  for(i=0;i<Timg;i++,pZbuf++) {
-    ptZ=*pZbuf;
-    for(j=0;j<Timg;j++,ptZ++)
-      *ptZ=99999999999.9;
-  }
-  Zprim=new Diffuseur**[Timg];
-  for(i=0,pZprim=Zprim;i<Timg;i++,pZprim++) {
-    (*pZprim)=new Diffuseur*[Timg];
-    for(j=0;j<Timg;j++,ptZ++)
-    (*pZprim)[j]=NULL;
-  }
+  tz.raz();
   //&&&&&& ProjPlan() &&&&&&&&&
   //calcul de laposition de l'ecran en fonction des bornes de la scene
   Point Ecran[4];
@@ -539,7 +725,10 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
   costeta=-visee[2];
   
   if(fabs(visee[2]+1.0)<1e-6) {  
-    Ferr<<"Projplan(): cas de la visee verticale\n";
+    {
+      lock_guard<mutex> verrou(mutex_ferr);
+      Ferr<<"Projplan(): cas de la visee verticale\n";
+    }
     Ecran[0][0]=vmin[0];
     Ecran[0][1]=vmax[1];
     Ecran[1][0]=vmin[0];
@@ -680,9 +869,10 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
   // Cas des primitives (non capteurs virtuels)
   // int comptr;
   //comptr=0;
-  for(Ldiff.debut();(! Ldiff.finito()) && Ldiff.contenu()->isreal();Ldiff.suivant()){
+  liste_diff();
+  for(n=0;n<nbdiff && Tdiff[n]->isreal();n++){
     //Ferr<<"* diff no. "<<++comptr<<endl;
-    pdiff=Ldiff.contenu();
+    pdiff=Tdiff[n];
     pastoutvu=false;
     //cout <<"Canopy[projplan] primitive = "<<pdiff->primi().name()<<endl;
     //cout <<"Canopy[projplan] P{Re} = ";Ecran[i+1].show();
@@ -759,7 +949,7 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
 	  printf(" \t\tB[0]= %g, B[1]=%g, B[2]=%g\n",B[0], B[1],B[2]);
 	  printf(" \t\tC[0]= %g, C[1]=%g, C[2]=%g\n",C[0], C[1],C[2]);
 	  */
-	  colorie_triangle(pdiff,Zprim,Zbuf, c,a,b,Timg,Timg,du,dv,zproj);
+	  colorie_triangle((void*)(size_t)(n+1),Zprim,Zbuf, c,a,b,Timg,Timg,du,dv,zproj);
 	}
 	if(down) {
 	  if (up) { k=j; j=i; i=l; }
@@ -770,7 +960,7 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
 	  printf(" \t\tB[0]= %g, B[1]=%g, B[2]=%g\n",B[0], B[1],B[2]);
 	  printf(" \t\tC[0]= %g, C[1]=%g, C[2]=%g\n",C[0], C[1],C[2]);
 	  */
-	  colorie_triangle(pdiff,Zprim,Zbuf, a,b,c, Timg,Timg,du,dv,zproj);
+	  colorie_triangle((void*)(size_t)(n+1),Zprim,Zbuf, a,b,c, Timg,Timg,du,dv,zproj);
 	}// if down
       }//if pas un triangle plat
     }//if !pastoutvu 
@@ -790,7 +980,7 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
       }
     cdist=tan(Macos(-visee[2]))*dv/(double)Timg;
     //infinitisation sans duplication des primi (juste ombrage)
-    infinitise((void ***)Zprim,Zbuf,cdist,roofi,Timg,Timg,false);
+    infinitise(Zprim,Zbuf,cdist,roofi,Timg,Timg,false,tz.z0.data());
     for(i=0;i<4;i++)
       delete [] roofi[i];
     delete [] roofi;
@@ -804,9 +994,10 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
   // Cas des capteurs virtuels 
   if(nbcell>0){  
     int nbpix;
-    for( ;! Ldiff.finito();Ldiff.suivant()){
-      pdiff=Ldiff.contenu();
+    for( ;n<nbdiff;n++){
+      pdiff=Tdiff[n];
       if(pdiff->isreal()){
+	lock_guard<mutex> verrou(mutex_ferr);
 	Ferr <<"<!> Attention triangle reel dans la liste capteur virtuel!!\n";
 	continue;
       }
@@ -890,13 +1081,12 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
   
   //maj de l'image en fonction de Zprim
   double cocnomen,alt;
-  int nummer;
   double cocmax=0, cocmin=99999999999.,altmin=99999999.,altmax=0;
   //calcul de l'eclairage direct
   if(verbose>1) printf("projplan() : du=%lf - dv=%lf =>  Apix= %lf\n",du,dv,Apix);
   for(i=0;i<Timg;i++)
     for(j=0;j<Timg;j++) {
-      pdiff=Zprim[i][j];
+      pdiff=(Zprim[i][j]==0)? NULL : Tdiff[Zprim[i][j]-1];
       if(0){
 	cocnomen=(pdiff==NULL)? 0:pdiff->primi().name()/1e7;
 	alt=(pdiff==NULL)? 0: 100*Zbuf[i][j];
@@ -905,22 +1095,12 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
 	altmax=(alt>altmax) ? alt:altmax;
 	altmin=(alt<altmin) ? alt:altmin;
       }
-      //calcul de la visibilite'
+      //calcul de la visibilite' (face active inchangee : projplan multithread)
       if(pdiff!=NULL) {
-	nummer=pdiff->num();
-	pdiff->active(visee);
-        //printf("projplan : img(%d,%d)=%d\n",i,j,pdiff->num());
-	Bo[pdiff->num()]+=Apix;
-	if(!pdiff->isopaque()) {
-	  pdiff->togle_face();
-	  Bo[pdiff->num()]-=Apix;
-	  pdiff->togle_face();
-	}//si transparent
-	pdiff->activ_num(nummer);
-        if(pdiff->num()!=nummer){
-	  Ferr <<" pdiff->num()!=nummer\n" ;
-          exit(5);
-        }
+        //printf("projplan : img(%d,%d)=%d\n",i,j,pdiff->num_vu(visee));
+	Bo[pdiff->num_vu(visee)]+=Apix;
+	if(!pdiff->isopaque())
+	  Bo[pdiff->num_dos(visee)]-=Apix;
       }
     }
 
@@ -938,7 +1118,7 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
  cocmin-=((cocmax-cocmin>0?cocmax-cocmin:1))/10.;
  for(i=Timg-1;i>=0;i--)
    for(j=Timg-1;j>=0;j--) {
-     pdiff=Zprim[i][j];
+     pdiff=(Zprim[i][j]==0)? NULL : Tdiff[Zprim[i][j]-1];
      alt=(pdiff==NULL)? altmax: 100*Zbuf[i][j];
      bit= (unsigned char) ((alt-altmin)/(altmax-altmin)*255);
      bit=(bit>255|| bit<0)?255:bit;
@@ -951,14 +1131,6 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
  fclose(fz);
  fclose(fprim);
  */
- // libere les Xbuff
- pZbuf=Zbuf;
- for(i=0;i<Timg;i++,pZbuf++) 
-   delete [] (*pZbuf);
- delete []  Zbuf;
- for(i=0,pZprim=Zprim;i<Timg;i++,pZprim++) 
-   delete [] (*pZprim);
- delete Zprim;
  if(verbose>2) printf("<= projplan() FIN\n%c",7);
 }//Canopy::projplan()
 
@@ -1130,15 +1302,15 @@ void colorie_triangle( void * tria,void *Zprim, REELLE **Zbuf,const Punkt a,cons
 
 void Canopy::data3d(int tx,int ty,Vecteur &visee,
 		    bool infty,long int **&Zno){
-  int i,j,k,l,img_surf;
+  int i,j,k,l;
+  unsigned int n;
   Image imgZ (tx,ty,(char*)"proz.ppm");
   long int **pZno;
-  REELLE **Zbuf,**pZbuf,*ptZ;
   float emax[3],emin[3],dz;
   Point roof[4];
-  Diffuseur ***Zprim,***pZprim;
-  //   Tabdyn<double, 2> Zbuf(img->taille(0),img->taille(1));
-  //Tabdyn<Diffuseur *, 2> Zprim(img->taille(0),img->taille(1));
+  TamponZ tz(imgZ.taille(0),imgZ.taille(1),false);
+  REELLE **Zbuf=tz.Zbuf.data();
+  unsigned int **Zprim=tz.Zprim.data();
   l=0;
   Zno= new long*[imgZ.taille(0)];
   pZno=Zno;
@@ -1148,24 +1320,7 @@ void Canopy::data3d(int tx,int ty,Vecteur &visee,
       (*pZno)[j]=-1;
   }
   
-  Zbuf= new REELLE*[imgZ.taille(0)];
-  pZbuf=Zbuf;
-  img_surf=imgZ.taille(0)*imgZ.taille(1);
-  for(i=0;i<imgZ.taille(0);i++,pZbuf++) {
-    (*pZbuf)=new REELLE[imgZ.taille(1)];
-  }
-  pZbuf=Zbuf;
-  for(i=0;i<imgZ.taille(0);i++,pZbuf++) {
-    ptZ=*pZbuf;
-    for(j=0;j<imgZ.taille(1);j++,ptZ++)
-      *ptZ=99999999999.9;
-  }
-  Zprim=new Diffuseur**[imgZ.taille(0)];
-  for(i=0,pZprim=Zprim;i<imgZ.taille(0);i++,pZprim++) {
-    (*pZprim)=new Diffuseur*[imgZ.taille(1)];
-    for(j=0;j<imgZ.taille(1);j++,ptZ++)
-    (*pZprim)[j]=NULL;
-  }
+  tz.raz();
 
   //&&&&&& Data3d &&&&&&&&&
   //calcul de la position de l'ecran en fonction des bornes de la scene
@@ -1344,8 +1499,9 @@ void Canopy::data3d(int tx,int ty,Vecteur &visee,
   delta[2][1]=emax[1]-emin[1];
 
   if(ofset==1) SvE=Ecran[0]; else SvE=Ecran[1];
-  for(Ldiff.debut();! Ldiff.finito();Ldiff.suivant()){
-    pdiff=Ldiff.contenu();
+  liste_diff();
+  for(n=0;n<nbdiff;n++){
+    pdiff=Tdiff[n];
     pastoutvu=false;
     //cout <<"Canopy[data3D] primitive = "<<pdiff->primi().name()<<endl;
     //cout <<"Canopy[data3d] P{Re} = ";Ecran[i+1].show();
@@ -1425,7 +1581,7 @@ void Canopy::data3d(int tx,int ty,Vecteur &visee,
 	       printf(" \t\tB[0]= %g, B[1]=%g, B[2]=%g\n",B[0], B[1],B[2]);
 	       printf(" \t\tC[0]= %g, C[1]=%g, C[2]=%g\n",C[0], C[1],C[2]);
 	       */  
-	    colorie_triangle(pdiff,Zprim,Zbuf, c,a,b,imgZ.taille(0),imgZ.taille(1),du,dv,zproj);
+	    colorie_triangle((void*)(size_t)(n+1),Zprim,Zbuf, c,a,b,imgZ.taille(0),imgZ.taille(1),du,dv,zproj);
 	  }
 	  if(down) {
 	    if (up) { k=j; j=i; i=l; }
@@ -1436,7 +1592,7 @@ void Canopy::data3d(int tx,int ty,Vecteur &visee,
 	       printf(" \t\tB[0]= %g, B[1]=%g, B[2]=%g\n",B[0], B[1],B[2]);
 	       printf(" \t\tC[0]= %g, C[1]=%g, C[2]=%g\n",C[0], C[1],C[2]);
 	       */ 
-	    colorie_triangle(pdiff,Zprim,Zbuf, a,b,c, imgZ.taille(0),imgZ.taille(1),du,dv,zproj);
+	    colorie_triangle((void*)(size_t)(n+1),Zprim,Zbuf, a,b,c, imgZ.taille(0),imgZ.taille(1),du,dv,zproj);
 	  }// if down
 	}//if pas un triangle plat
       }//if !pastoutvu 
@@ -1467,7 +1623,7 @@ void Canopy::data3d(int tx,int ty,Vecteur &visee,
     */
     cdist=tan(Macos(-visee[2]))*dv/(double)imgZ.taille(1);
     //cout<<" cdist = " <<cdist;
-    infinitise((void ***)Zprim,Zbuf,cdist,roofi,imgZ.taille(0),imgZ.taille(1),true);
+    infinitise(Zprim,Zbuf,cdist,roofi,imgZ.taille(0),imgZ.taille(1),true);
     for(i=0;i<4;i++)
       delete [] roofi[i];
     delete [] roofi;
@@ -1475,7 +1631,7 @@ void Canopy::data3d(int tx,int ty,Vecteur &visee,
   //remplissage du No buffer
   for(i=0;i<imgZ.taille(0);i++)
     for(j=0;j<imgZ.taille(1);j++) {
-      pdiff=Zprim[i][j];
+      pdiff=(Zprim[i][j]==0)? NULL : Tdiff[Zprim[i][j]-1];
       alt=(pdiff==NULL)? 0: 100*Zbuf[i][j];
       imgZ.maj(imgZ.taille(0)-1-i,imgZ.taille(1)-1-j,alt);
       if(pdiff!=NULL) {
@@ -1487,14 +1643,6 @@ void Canopy::data3d(int tx,int ty,Vecteur &visee,
   imgZ.sauve();
   //liberez la memoire!
   imgZ.free();
-  // libere les Xbuff
-  pZbuf=Zbuf;
-  for(i=0;i<imgZ.taille(0);i++,pZbuf++) 
-    delete [] (*pZbuf);
-  delete []  Zbuf;
-  for(i=0,pZprim=Zprim;i<imgZ.taille(0);i++,pZprim++) 
-    delete [] (*pZprim);
-  delete Zprim;
 }//Canopy::data3d()
 
 
@@ -21,6 +21,7 @@ using namespace std ;
 
 #include "canopy.h"
 #include "outils.h"
+#include <system.h>
 
 /*
 char clef_seg_in[12] ;	//  version char* de la clef numerique
@@ -131,8 +132,6 @@ long int Canopy::parse_can(char *ngeom,char *nopti,char * name8,reel *bornemin,r
   char c, line[256];
   double popt[4];
   int nbopt=0,ii=0;
-  Tabdyn<Actop*,1> tabopaque;
-  Tabdyn<Actop*,2> tabtransp;
   Actop *testopt; 
    
   if (!fopti){
@@ -441,8 +440,6 @@ long int Canopy::parse_can(char *ngeom,char *nopti,char * name8,reel *bornemin,r
     //bornemin[i]-=(bmax[i]-bmin[i])/100.0; 
     //bornemax[i]+=(bmax[i]-bmin[i])/100.0;
   }
-  tabopaque.free();
-  tabtransp.free();
   nb_face=diff->idx;
   nbprim=Ldiff.card();
 
@@ -515,21 +512,25 @@ long int Canopy::parse_can(char *ngeom,char *nopti,char * name8,reel *bornemin,r
  
   //mise en tableau
   FILE* fcan;
-  fcan=fopen("scene.can","w");
+  fcan=(LEAN_IO)? NULL : fopen("scene.can","w");
   TabDiff= new Diffuseur *[radim];
   for(Ldiff.debut(),i=0;! Ldiff.finito();Ldiff.suivant()){
     diff=Ldiff.contenu();
     // Ecriture du .can (apres nettoyage de parse_can et ajout du sol)
-    prim=&(diff->primi());
-    fprintf(fcan,"p  1 %.0f %d \t",prim->name()*1000.,prim->nb_sommet());
-    for(char iii=0;iii<prim->nb_sommet();iii++)
-      fprintf(fcan," %lf %lf %lf  ",prim->sommets(iii)[0],prim->sommets(iii)[1],prim->sommets(iii)[2]);
-    fprintf(fcan," \n");
+    if(fcan!=NULL){
+      prim=&(diff->primi());
+      fprintf(fcan,"p  1 %.0f %d \t",prim->name()*1000.,prim->nb_sommet());
+      for(char iii=0;iii<prim->nb_sommet();iii++)
+	fprintf(fcan," %lf %lf %lf  ",prim->sommets(iii)[0],prim->sommets(iii)[1],prim->sommets(iii)[2]);
+      fprintf(fcan," \n");
+    }
     //Remplissage du tableau TabDiff
     TabDiff[i++]=diff;
     if(!diff->isopaque())
       TabDiff[i++]=diff;
   }// for Ldiff
+  if(fcan!=NULL)
+    fclose(fcan);
   return radim;
 }//parse_can()
 
@@ -551,8 +552,6 @@ long int Canopy::read_shm(
   char c, line[256];
   double popt[4];
   int nbopt=0,ii=0;
-  Tabdyn<Actop*,1> tabopaque;
-  Tabdyn<Actop*,2> tabtransp;
   Actop *testopt; 
   Patch *Ts;
 
@@ -571,13 +570,20 @@ long int Canopy::read_shm(
 #ifndef WIN32
   // Unix
   int shmid;
-  shmid=shmget((key_t)clef,SEGSIZE*sizeof(Patch) ,IPC_CREAT|0666);
+  // le segment est cree par l'appelant (caribu, SharedCanopy) :
+  // on n'en demande que les Nt patchs, sans limite SEGSIZE
+  shmid=shmget((key_t)clef,(Nt>0? Nt : 1)*sizeof(Patch) ,0666);
   if(shmid==-1){//en cas de pb
     Ferr << "<!> ouverture du segment partage no. "<< clef
 	 <<" impossible =>exit" << "\n" ;
     exit(12);
   }
-  Ts=(Patch *)shmat(shmid,0,int(NULL));
+  Ts=(Patch *)shmat(shmid,0,SHM_RDONLY);
+  if(Ts==(Patch *)-1){
+    Ferr << "<!> attachement du segment partage no. "<< clef
+	 <<" impossible =>exit" << "\n" ;
+    exit(12);
+  }
 #else
   // Win NT
      char clef_seg_in[12] ;	//  version char* de la clef numerique
@@ -691,6 +697,9 @@ long int Canopy::read_shm(
     if(min[0]>max[0]){ //primitive rejete
       Ferr <<" *****  Primitive rejete car min>max!?: libelle = "<<nom<<" - No="<<it<<'\n' ;
       rejet=true;
+      Ldiff0.ajoute(fabs(nom));
+      delete prim;
+      Nrejet++;
     }
     /* Traitement des a-cheval ici et non dans BSP::volume_englobant,
        co parcinopy a cause de visu3d.C*/
@@ -727,6 +736,7 @@ long int Canopy::read_shm(
       }//if infty
       if(rejet) {
 	Ferr<<"* Prim no "<<it<<" ==> rejettee"<<"\n";
+	Ldiff0.ajoute(fabs(nom));
 	delete prim;
 	Nrejet++;
       }
@@ -747,6 +757,7 @@ long int Canopy::read_shm(
 	//cout<<"numero = "<<diff->num()<<'\n' ;//endl;
 	diff->acv=acv;
 	Ldiff.ajoute(diff);
+	Ldiff0.ajoute(-1); //bon triangle : code label <0 - MC10
 	nbp++;
       }//else rejected primi
     }//if valid
@@ -755,7 +766,7 @@ long int Canopy::read_shm(
   //liberation du shm
 #ifndef WIN32
   // Unix
-  shmdt((void*)(size_t)shmid);
+  shmdt((void*)Ts);
 #else
   // Win NT
     UnmapViewOfFile(lpSharedSegIn) ; // invalidation du ptr sur mem partagee
@@ -848,8 +859,6 @@ long int Canopy::read_shm(
     //bornemin[i]-=(bmax[i]-bmin[i])/100.0; 
     //bornemax[i]+=(bmax[i]-bmin[i])/100.0;
   }
-  tabopaque.free();
-  tabtransp.free();
   nb_face=diff->idx;
   nbprim=Ldiff.card();
 
@@ -925,26 +934,91 @@ long int Canopy::read_shm(
 
   //mise en tableau
   FILE* fcan;
-  fcan=fopen("scene.can","w");
+  fcan=(LEAN_IO)? NULL : fopen("scene.can","w");
   TabDiff= new Diffuseur *[radim];
   for(Ldiff.debut(),i=0;! Ldiff.finito();Ldiff.suivant()){
     diff=Ldiff.contenu();
     // Ecriture du .can (apres nettoyage de parse_can et ajout du sol)
-    prim=&(diff->primi());
-    fprintf(fcan,"p  1 %.0f %d \t",prim->name()*1000.,prim->nb_sommet());
-    for(char iii=0;iii<prim->nb_sommet();iii++)
-      fprintf(fcan," %lf %lf %lf  ",prim->sommets(iii)[0],prim->sommets(iii)[1],prim->sommets(iii)[2]);
-    fprintf(fcan," \n");
+    if(fcan!=NULL){
+      prim=&(diff->primi());
+      fprintf(fcan,"p  1 %.0f %d \t",prim->name()*1000.,prim->nb_sommet());
+      for(char iii=0;iii<prim->nb_sommet();iii++)
+	fprintf(fcan," %lf %lf %lf  ",prim->sommets(iii)[0],prim->sommets(iii)[1],prim->sommets(iii)[2]);
+      fprintf(fcan," \n");
+    }
     TabDiff[i++]=diff;
     if(!diff->isopaque())
       TabDiff[i++]=diff;
   }
-  fclose(fcan);
+  if(fcan!=NULL)
+    fclose(fcan);
   return radim;
 }//read_shm()
 
 ///////////////////////// FIN READ_SHM
 
+//-********************   Canopy::maj_opt()    ***********************
+// Relit un fichier .opt (autre bande spectrale) : les Actop charges par
+// parse_can/read_shm sont mis a jour sur place, les diffuseurs pointant dessus.
+// Le fichier doit decrire le meme nombre d'especes.
+static void maj_actop(Actop *actop,ifstream &fopti,bool opac){
+  Lambert *lu,*act;
+  lu=dynamic_cast<Lambert*>(lectop(fopti,opac));
+  act=dynamic_cast<Lambert*>(actop);
+  raus(lu==NULL || act==NULL,"Canopy[maj_opt] seules les prop. optiques lambertiennes sont gerees!");
+  act->maj(lu->rho(),lu->tau());
+  delete lu;
+}//maj_actop()
+
+void Canopy::maj_opt(char *nopti){
+  ifstream fopti(nopti,ios::in);
+  char c, line[256];
+  int nbopt=0,ii=0;
+
+  if (!fopti){
+    Ferr << "ERREUR - Impossible d'ouvrir :"<<nopti<<'\n' ;
+    exit(9);
+  }
+  do{
+    fopti>>c;
+    if(!fopti) break;
+    switch(c) {
+    case '#':
+      fopti.getline(line,256);
+      break;
+    case 'n':
+      fopti>>ii;
+      if(ii!=(int)tabtransp.maxi()[0]) {
+	Ferr<<" Canopy[maj_opt] "<<nopti<<" : "<<ii<<" especes au lieu de "
+	    <<tabtransp.maxi()[0]<<'\n';
+	syntax_error(nopti);
+      }
+      fopti.getline(line,256);
+      break; 
+    case 's':
+      if(ii==0) syntax_error(nopti);
+      maj_actop(tabopaque(nbopt),fopti,true);
+      nbopt++;
+      fopti.getline(line,256);
+      break;
+    case 'e':
+      if(ii==0) syntax_error(nopti);
+      maj_actop(tabopaque(nbopt),fopti,true);
+      maj_actop(tabtransp(nbopt-1,0),fopti,false);
+      maj_actop(tabtransp(nbopt-1,1),fopti,false); //face inf
+      nbopt++;
+      fopti.getline(line,256);
+      break; 
+    default  :
+      syntax_error(nopti);  
+    }//switch c
+  } while(fopti && (nbopt<=ii));
+  if(nbopt<ii)  
+    syntax_error(nopti);  
+  if(verbose>1) 
+    Ferr<<"-_-_-_-_-_  Proprietes optiques "<<nopti<<" chargees\n";
+}//maj_opt()
+
 #ifdef _NRJ
 // OBSOLESCENT- JUIN 97
 //-********************   Canopy:: xabs()    *******************
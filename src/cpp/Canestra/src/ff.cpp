@@ -6,6 +6,9 @@ using namespace std ;
 #include <cstdio>
 #include <cmath>
 #include <ctime>
+#include <string>
+#include <vector>
+#include <mutex>
 
 
 #include "Mmath.h"
@@ -41,30 +44,43 @@ typedef struct {
   double C;
 } MPE;
 */
-// Chronometrage
-time_t Tnff=0, Tproj=0, dTnff, dTproj,now;
+// Chronometrage (par thread, cumule par fin_thread_NFF())
+static thread_local time_t Tnff=0, Tproj=0, dTnff, dTproj,now;
 
 //Variables globales
+// Les diffuseurs recepteurs sont traites en parallele (Canopy::calc_FF_Bfar) :
+// tout ce qui depend du recepteur ou de la projection en cours est propre a
+// chaque thread (thread_local), le reste est en lecture seule apres init_NFF()
 
-static double dFF,mpe[3][4],denv,neginvR;
-static double *mpei;
-static double &mpe_00=mpe[0][0],&mpe_01=mpe[0][1],&mpe_02=mpe[0][2],&mpe_03=mpe[0][3];
-static double &mpe_10=mpe[1][0],&mpe_11=mpe[1][1],&mpe_12=mpe[1][2],&mpe_13=mpe[1][3];
-static double &mpe_20=mpe[2][0],&mpe_21=mpe[2][1],&mpe_22=mpe[2][2],&mpe_23=mpe[2][3];
+static double dFF,denv,neginvR;
+static thread_local double mpe[3][4];
+static thread_local double *mpei;
+static thread_local double &mpe_00=mpe[0][0],&mpe_01=mpe[0][1],&mpe_02=mpe[0][2],&mpe_03=mpe[0][3];
+static thread_local double &mpe_10=mpe[1][0],&mpe_11=mpe[1][1],&mpe_12=mpe[1][2],&mpe_13=mpe[1][3];
+static thread_local double &mpe_20=mpe[2][0],&mpe_21=mpe[2][1],&mpe_22=mpe[2][2],&mpe_23=mpe[2][3];
 
-static double RE[4],REt[4];
+static thread_local double RE[4],REt[4];
 //variable propre a diffR
-static bool transp,acv;
-static Vecteur u,v,w;
-static Point Pp[3],Ps[3],O,P,mid[2],So[3];
-static double M[3][3],b[3];
-static Diffuseur * receiver;
-static unsigned long int ff_cum,vfar_cum,far_cum,glop_cum;
-static double nbFF=0;
+static bool acv;
+static thread_local bool transp;
+static thread_local Vecteur u,v,w;
+static thread_local Point Pp[3],Ps[3],O,P,mid[2],So[3];
+static thread_local double M[3][3],b[3];
+static thread_local Diffuseur * receiver;
+static thread_local unsigned long int ff_cum,vfar_cum,far_cum,glop_cum;
+static thread_local double nbFF=0;
+// cumul des stats des threads
+static struct {
+  unsigned long int ff,vfar,far,glop;
+  double nbFF;
+  time_t proj,nff;
+} cumul;
+static mutex mutex_nff;
 //zbuff
 //pd static  et template avec le cstructeur
-static Tabdyn<Diffuseur *,2> DbuffS,DbuffI;
-static Tabdyn<float,2> ZbuffS,ZbuffI;
+//num de la face du diffuseur vue par le recepteur (-1 : rien de vu)
+static thread_local Tabdyn<int,2> DbuffS,DbuffI;
+static thread_local Tabdyn<float,2> ZbuffS,ZbuffI;
 static double* rhotab;//H : image carree NBxNB
 static double* i2stab;//tabule le chgt de coord
 static Tabdyn<double,2> Tenv;
@@ -78,15 +94,45 @@ static double *Eclt;
 // Bug en lecture binaire sur SGI 64
 //static unsigned long int nb_prim,nb_face,diag_idx,ff_idx;
 static int nb_prim,nb_face,diag_idx,ff_idx;
+// colonnes de la matrice : faces puis inconnues des amas (cf. amas.h)
+static int nb_col;
 
 static Tabdyn<int,1>diag;
-static Tabdyn<int,1>ligne;
-static Tabdyn<double,2>bfc;
+static thread_local Tabdyn<int,1>ligne;
+static thread_local Tabdyn<double,2>bfc;
+// fichiers des FF et des coeff de Bfar du thread : le thread 0 ecrit dans
+// pcNzName et pcBfName, les autres dans des fichiers suffixes fusionnes par
+// stat_NFF() dans l'ordre des threads (i.e. des diffuseurs)
+static thread_local int ith;
+static thread_local FILE *fnz,*fbf;
+static int nbthread=1;
+// par thread et par ligne traitee : nnz et transp, pour remplir diag
+static vector< vector<int> > tabdiag;
 #endif
 //fin des declarations
 
 #define PAUSE(msg)  printf(msg);printf("- Taper la touche Any");getchar();
 
+#ifdef _HD
+static string nom_part(const char *nom,int t) {
+  return (t==0)? string(nom) : string(nom)+"."+to_string(t);
+}
+// ajoute le fichier du thread t a la fin de nom et le detruit
+static void fusion_part(const char *nom,int t) {
+  FILE *fpart,*ffin;
+  char tampon[65536];
+  size_t lu;
+  string part=nom_part(nom,t);
+  fpart=fopen(part.c_str(),"rb");
+  ffin=fopen(nom,"ab");
+  while((lu=fread(tampon,1,sizeof(tampon),fpart))>0)
+    fwrite(tampon,1,lu,ffin);
+  fclose(ffin);
+  fclose(fpart);
+  remove(part.c_str());
+}
+#endif
+
 static inline void glob2loc(Point &P,Point &Pl) {
   //chgt de repere x,y,y -> u,v,w
   Vecteur T(P);
@@ -272,7 +318,7 @@ static inline void centre(Point &M, Point &A, Point &B, Point &C) {
 
 //init_NFF()
 #ifdef _HD
-void   init_NFF(char * EnvName,double *Esource,int nbpr,int nbf,double &Rsph,bool bias) {
+void   init_NFF(char * EnvName,double *Esource,int nbpr,int nbf,double &Rsph,bool bias,int nbth,int nbamas) {
 #else
 void   init_NFF(char * EnvName,double *Esource,double &Rsph,bool bias) {
 #endif
@@ -289,10 +335,6 @@ void   init_NFF(char * EnvName,double *Esource,double &Rsph,bool bias) {
     Ferr <<"*** Resolution du disque de projection :  "  
 	 << NB<<"x"  << NB<<'\n' ;
   MB=NB;
-  DbuffS.alloue(NB,MB);
-  DbuffI.alloue(NB,MB);
-  ZbuffS.alloue(NB,MB);
-  ZbuffI.alloue(NB,MB);
 #ifdef _KONTAC
    tabnc.alloue(NB,MB);
    tabnc.maj(0);
@@ -301,14 +343,18 @@ void   init_NFF(char * EnvName,double *Esource,double &Rsph,bool bias) {
   dimension=(int)(NB/4.0*(NB/2.0+1));
   rhotab=new double[dimension];
   i2stab=new double[NB];
-  ff_cum=vfar_cum=far_cum=glop_cum=0;
+  cumul.ff=cumul.vfar=cumul.far=cumul.glop=0;
+  cumul.nbFF=0;
+  cumul.proj=cumul.nff=0;
 #ifdef _HD
   nb_prim=nbpr;
   nb_face=nbf;
+  nb_col=nbf+nbamas;
   diag_idx=0;
   diag.alloue(nb_prim+1);
   diag(0)=1;
-  ligne.alloue(nb_face);
+  nbthread=(nbth<1)? 1 : nbth;
+  tabdiag.assign(nbthread,vector<int>());
 #endif
   for(i=0;i<NB;i++) {
     i2stab[i]=(2*i+1)/(double)NB-1.0;
@@ -355,7 +401,6 @@ void   init_NFF(char * EnvName,double *Esource,double &Rsph,bool bias) {
     fscanf(fenv,"%d %lf",&Nc,&dzc);
     if(verbose>3) printf("Nc = %d - dz = %lf\n",Nc,dzc);
 #ifdef _HD    
-    bfc.alloue(4,Nc+1);
     FILE* ffb;
     if(verbose>5) 
       Ferr<<"FF.cpp: init_NFF(): file "<<pcBfName<<" open for writing\n"; 
@@ -374,6 +419,48 @@ void   init_NFF(char * EnvName,double *Esource,double &Rsph,bool bias) {
   //printf("***  SPEED_INC = ");scanf("%d",&SPEED_INC);
   //printf(" speed_inc =%d\n",SPEED_INC);
 }//init_NFF
+
+//init_thread_NFF : buffers (et fichiers en HD) du thread t
+void init_thread_NFF(int t) {
+  DbuffS.alloue(NB,MB);
+  DbuffI.alloue(NB,MB);
+  ZbuffS.alloue(NB,MB);
+  ZbuffI.alloue(NB,MB);
+  ff_cum=vfar_cum=far_cum=glop_cum=0;
+  nbFF=0;
+  Tproj=Tnff=0;
+#ifdef _HD
+  ith=t;
+  ligne.alloue(nb_col);
+  fnz=fopen(nom_part(pcNzName,t).c_str(),(t==0)? "ab" : "wb");
+  if(Nc>0) {
+    bfc.alloue(4,Nc+1);
+    fbf=fopen(nom_part(pcBfName,t).c_str(),(t==0)? "ab" : "wb");
+  }
+#endif
+}//init_thread_NFF
+
+//fin_thread_NFF : libere les buffers du thread et cumule ses stats
+void fin_thread_NFF() {
+#ifdef _HD
+  fclose(fnz);
+  ligne.free();
+  if(Nc>0) {
+    fclose(fbf);
+    bfc.free();
+  }
+#endif
+  ZbuffI.free(); ZbuffS.free();
+  DbuffI.free(); DbuffS.free();
+  lock_guard<mutex> verrou(mutex_nff);
+  cumul.ff+=ff_cum;
+  cumul.vfar+=vfar_cum;
+  cumul.far+=far_cum;
+  cumul.glop+=glop_cum;
+  cumul.nbFF+=nbFF;
+  cumul.proj+=Tproj;
+  cumul.nff+=Tnff;
+}//fin_thread_NFF
 //init_proj (en fct de diffR)
 
 #ifdef _HD
@@ -404,18 +491,18 @@ void init_proj(Diffuseur * diffR ) {
   //u.show(); v.show();w.show();
   receiver=diffR;
   //init des Buffers
-  DbuffS.maj(NULL);
+  DbuffS.maj(-1);
   ZbuffS.maj(99999999999.9);
   if(transp) {
-    DbuffI.maj(NULL);
+    DbuffI.maj(-1);
     ZbuffI.maj(999999999999.9);
   }
 }//init_proj()
 
 //Projection orthospherique (cas du triangle)
 //variable locale (globale ) a proj_ortho
-static double x,y,extrem,div_extr,den_extr,pos_extr,speed_B[4];
-void proj_ortho(Diffuseur* E,reel *inc) {
+static thread_local double x,y,extrem,div_extr,den_extr,pos_extr,speed_B[4];
+void proj_ortho(Diffuseur* E,reel *inc,int nE) {
   int i,j,i1,i2,jm,j0;
   signed char pasglop=0,in=0,ins=0,nbd,face,iz0[2]={-1,-1},izm[2]={-1,-1},izp[2]={-1,-1},t;
   //evite les calcul de l'opaque vu par derriee (tige)
@@ -572,6 +659,7 @@ void proj_ortho(Diffuseur* E,reel *inc) {
 	if(init_MPE(i,j)){
 	  Vecteur er;
 	  er.formation_vecteur(O,E->centre());
+	  lock_guard<mutex> verrou(mutex_nff);
 	  Ferr <<" Pas possible de calculer init_MPE : triangle no. "  
 	       << E->num()<<"  biz? en le projetant sur "  << receiver->num()
 	       <<", qui sont a une distance de "  << er.norme()<<'\n' ;
@@ -606,6 +694,7 @@ void proj_ortho(Diffuseur* E,reel *inc) {
 	  if(den_extr==0.) {
 	    Vecteur er;
 	    er.formation_vecteur(O,E->centre());
+	    lock_guard<mutex> verrou(mutex_nff);
 	    Ferr <<"=> ARRET proj_ortho() --->arete no. "  << i
 		 <<" -  den_extr=0!\n" ;
 	    Ferr <<"   triangle no. "<< E->num()<<"  biz? en le projetant sur "
@@ -694,14 +783,14 @@ void proj_ortho(Diffuseur* E,reel *inc) {
 		  if(extrem<ZbuffS(i,j)) {
 		    //cas reflechi
 		    ZbuffS(i,j)=extrem;
-		    DbuffS(i,j)=E;
+		    DbuffS(i,j)=nE;
 		  }
 		}
 		else 
 		  if(extrem<ZbuffI(i,j)) {
 		    //cas transmis
 		    ZbuffI(i,j)=extrem;
-		    DbuffI(i,j)=E;
+		    DbuffI(i,j)=nE;
 		    //printf("ZBUFF(%d,%d) = %lf\n",i,j,ZbuffS(i,j));
 		}
 	      }// if a cheval (traitt special si acv==false)
@@ -720,12 +809,108 @@ void proj_ortho(Diffuseur* E,reel *inc) {
   Tproj-=dTproj;
 }//proj ortho  
 
+//Projection d'un amas (radiosite hierarchique, cf. amas.h) : les proxels
+//dont la direction traverse la boite [bmin,bmax] sont attribues a l'amas nE
+//avec la probabilite couv (tirage fixe par proxel, amas et recepteur), a la
+//distance d'entree dans la boite
+static inline double alea_amas(unsigned int i,unsigned int j,unsigned int g,unsigned int r) {
+  unsigned int h=(i*73856093u)^(j*19349663u)^(g*83492791u)^(r*2654435761u);
+  h^=h>>16; h*=0x7feb352du;
+  h^=h>>15; h*=0x846ca68bu;
+  h^=h>>16;
+  return h/4294967296.0;
+}
+void proj_amas(reel *bmin,reel *bmax,double couv,int nE,unsigned int graine) {
+  int i,j,k,i1,i2,j0,jm;
+  signed char tr,tr1,tr2;
+  double dist,corde,x,y,z,D[3],t0,t1,tin,tout,rho,zmin,zmax;
+  bool vu;
+  Point C,Cl,Sl;
+
+  time(&dTproj);
+  rho=0.0;
+  for(k=0;k<3;k++) {
+    C[k]=(bmin[k]+bmax[k])/2.;
+    rho+=(bmax[k]-C[k])*(bmax[k]-C[k]);
+  }
+  glob2loc(C,Cl);
+  dist=Msqrt(Cl[0]*Cl[0]+Cl[1]*Cl[1]+Cl[2]*Cl[2]);
+  if(dist*dist<=rho)
+    return;
+  //les directions qui rencontrent la sphere englobante sont a moins d'une
+  //corde de celle du centre : rectangle englobant dans le disque
+  corde=2*sin(asin(Msqrt(rho)/dist)/2.);
+  i1=sph2img(max(-1.,Cl[0]/dist-corde)); i1=(i1<=0)? 0 : i1-1;
+  i2=sph2img(min(1.,Cl[0]/dist+corde));  i2=(i2<NB-1)? i2+1 : NB-1;
+  j0=sph2img(max(-1.,Cl[1]/dist-corde)); j0=(j0<=0)? 0 : j0-1;
+  jm=sph2img(min(1.,Cl[1]/dist+corde));  jm=(jm<NB-1)? jm+1 : NB-1;
+  //hemispheres rencontres : cote des sommets de la boite par rapport au
+  //plan du recepteur
+  zmin=1e30; zmax=-1e30;
+  for(k=0;k<8;k++) {
+    Point S((k&1)?bmax[0]:bmin[0],(k&2)?bmax[1]:bmin[1],(k&4)?bmax[2]:bmin[2]);
+    glob2loc(S,Sl);
+    zmin=min(zmin,(double)Sl[2]);
+    zmax=max(zmax,(double)Sl[2]);
+  }
+  tr1=(zmax>0)? 1 : -1;
+  tr2=(zmin<0 && transp)? -1 : 1;
+  if(tr1<tr2)
+    return;
+  for(i=i1;i<=i2;i++) {
+    x=img2sph(i);
+    for(j=j0;j<=jm;j++) {
+      z=sqrtab(i,j);
+      if(z<0)//hors du cercle
+	continue;
+      y=img2sph(j);
+      for(tr=tr1;tr>=tr2;tr-=2) {
+	//tirage d'abord : il ecarte la plupart des proxels des amas clairsemes
+	if(alea_amas(i,j,2*graine+((tr<0)?1:0),receiver->num((unsigned char)0))>=couv)
+	  continue;
+	//intersection du rayon O+t*D avec la boite
+	tin=0.0; tout=1e30; vu=true;
+	for(k=0;k<3 && vu;k++) {
+	  D[k]=x*u[k]+y*v[k]+tr*z*w[k];
+	  if(fabs(D[k])<1e-12)
+	    vu=(O[k]>=bmin[k] && O[k]<=bmax[k]);
+	  else {
+	    t0=(bmin[k]-O[k])/D[k];
+	    t1=(bmax[k]-O[k])/D[k];
+	    if(t0>t1) swap(t0,t1);
+	    tin=max(tin,t0);
+	    tout=min(tout,t1);
+	    vu=(tin<=tout);
+	  }
+	}
+	if(!vu || tin<=0.0)
+	  continue;
+	//meme codage de la distance que proj_ortho() : -1/rho
+	t0=-1./tin;
+	if(tr>0) {
+	  if(t0<ZbuffS(i,j)) {
+	    ZbuffS(i,j)=t0;
+	    DbuffS(i,j)=nE;
+	  }
+	}
+	else
+	  if(t0<ZbuffI(i,j)) {
+	    ZbuffI(i,j)=t0;
+	    DbuffI(i,j)=nE;
+	  }
+      }//for tr (hemisphere)
+    }//for j
+  }//for i
+  time(&now);
+  dTproj-=now;
+  Tproj-=dTproj;
+}//proj_amas()
+
 //Nusselt Form-Factor (Renaud, LIFL)
 
 //variable de NFF
-static   Diffuseur *E;
-static  SPROW	*r_sup,*r_inf;
-static   double FFenv,rho[2],tau[2];
+static thread_local SPROW	*r_sup,*r_inf;
+static thread_local double FFenv,rho[2],tau[2];
 
 
 #ifdef _HD
@@ -739,14 +924,13 @@ void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
   //printf("NFF() : DEBUT\n");
   //Chrono
   time(&dTnff);
-  //init des prp optiques
-  rho[0]=receiver->rho();
+  //init des prp optiques (sans changer la face active, le recepteur pouvant
+  //etre projete au meme moment par un autre thread)
+  rho[0]=receiver->rho(0);
   if (transp) {
-    tau[0]=receiver->tau();
-    receiver->togle_face();
-    tau[1]=receiver->tau();
-    rho[1]=receiver->rho();
-    receiver->togle_face();
+    tau[0]=receiver->tau(0);
+    tau[1]=receiver->tau(1);
+    rho[1]=receiver->rho(1);
   }
   //init des lignes
 #ifdef _HD
@@ -769,10 +953,9 @@ void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
   for(i=0;i<NB;i++) {
     for(j=0;j<NB;j++) {
       if(sqrtab(i,j)>=0){//cas ou je suis dans le disque de projection
-	E=DbuffS(i,j);
-	//printf("==> NFF(%d,%d) = %d : ",i,j,(E==NULL)?0:1);
-	if(E!=NULL) {
-	  n=E->num();
+	n=DbuffS(i,j);
+	//printf("==> NFF(%d,%d) = %d : ",i,j,(n<0)?0:1);
+	if(n>=0) {
 	  //face sup en reflectance
 	  ff_cum++;
 #ifdef _HD
@@ -795,7 +978,7 @@ void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
 	  //printf("\t (%d,%d) en far\n",i,j);
 	}
 	if(transp) {
-	  if(E!=NULL) {
+	  if(n>=0) {
 	    //face inf en transmittance
 	    ff_cum++;
 #ifndef _HD
@@ -812,9 +995,8 @@ void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
 	    far_cum++; if(FFenv>0) vfar_cum++;
 	  }
 	  //autre hemisphere
-	  E=DbuffI(i,j);
-	  if(E!=NULL) {
-	    n=E->num();
+	  n=DbuffI(i,j);
+	  if(n>=0) {
 	    //face inf en reflectance
 	    ff_cum++;
 	    ff_cum++;
@@ -848,32 +1030,26 @@ void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
     }//for j
   }//for i
 #ifdef _HD
-  FILE *ffb;
-  //  if(verbose>5)  Ferr<<"FF.cpp: NFF(): file "<<pcNzName<<" open for writing\n"; 
-  ffb=fopen(pcNzName,"ab");
   int tamp[2];
-  for(i=0;i<nb_face;i++) 
+  for(i=0;i<nb_col;i++) 
     if(ligne(i)!=0) {
       nnz++;
       tamp[0]=i;
       tamp[1]=ligne(i);
       // if(i_sup/2==29) printf(" rec %d  - emit = %d - iff = %d\n",i_sup/2,i,ligne(i));
-      fwrite(tamp,sizeof(int),2,ffb);
+      fwrite(tamp,sizeof(int),2,fnz);
       //fprintf(ffa,"%d %d  ",tamp[0],tamp[1]);
     }
-  fclose(ffb);
-  diag(diag_idx+1)=(int)fabs(diag(diag_idx))+nnz;
-  diag_idx++;
+  // diag est rempli par stat_NFF(), dans l'ordre des threads
+  tabdiag[ith].push_back(nnz);
+  tabdiag[ith].push_back(transp);
   nbFF+=nnz;
-  if(transp){
+  if(transp)
     nbFF+=nnz;
-    diag(diag_idx)*=-1;
-  }
-  //printf("diag(%d) = %d, nnz=%d\n",diag_idx,diag(diag_idx),nnz); fflush(stdout);//debug
   
   //remplissage en append du fichier des coeff de la CL des Bfar
   if(Nc>0){
-    ffb=fopen(pcBfName,"ab");
+    FILE *ffb=fbf;
     float clc[2];
     for(i=0;i<=Nc;i++){
       clc[0]=bfc(0,i)*dFF;
@@ -886,7 +1062,6 @@ void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
 	clc[1]=bfc(3,i)*dFF;
 	fwrite(clc,sizeof(float),2,ffb);
       } 
-    fclose(ffb);
   }
 #endif
   time(&now);
@@ -899,6 +1074,9 @@ void stat_NFF() {
 #define EPSILON 1E-6
 #define NONZERO(A) if ((A<EPSILON)&&(A>-EPSILON)){A= A>0 ? EPSILON: -EPSILON;}
   double dummy ;
+  unsigned long int ff_cum=cumul.ff,vfar_cum=cumul.vfar,far_cum=cumul.far,glop_cum=cumul.glop;
+  time_t Tproj=cumul.proj,Tnff=cumul.nff;
+  double nbFF=cumul.nbFF;
 
   dummy= (double)(ff_cum+far_cum) ;
   //Ferr<<"dummy= "<<dummy<<'\n';
@@ -922,7 +1100,23 @@ void stat_NFF() {
   printf("@ Temps total de NFF()        : %d:%d:%d (%ld s)\n\n",(int)(Tnff/3600),(int)((Tnff%3600)/60),(int)(Tnff%60),Tnff);
   fflush(stdout);
 #ifdef _HD
-  int i;
+  int i,t;
+  unsigned int k;
+  //Fusion des fichiers des threads et calcul de diag
+  for(t=1;t<nbthread;t++) {
+    fusion_part(pcNzName,t);
+    if(Nc>0)
+      fusion_part(pcBfName,t);
+  }
+  diag_idx=0;
+  for(t=0;t<nbthread;t++)
+    for(k=0;k<tabdiag[t].size();k+=2) {
+      diag(diag_idx+1)=(int)fabs(diag(diag_idx))+tabdiag[t][k];
+      diag_idx++;
+      if(tabdiag[t][k+1])
+	diag(diag_idx)*=-1;
+    }
+  tabdiag.clear();
   //Ecriture du fichier binaire diag.bzh
   FILE* diagb;
   Ferr<<"FF.cpp: stat_NFF(): file "<<pcDgName<<" open for writing\n"; 
@@ -935,9 +1129,6 @@ void stat_NFF() {
   fclose(diagb);
   //liberez la memoire!
   diag.free();
-  ligne.free();
-  ZbuffI.free(); ZbuffS.free();
-  DbuffI.free(); DbuffS.free();
   delete rhotab; delete i2stab;  
 #endif
 }//stat_NFF()
@@ -7,16 +7,19 @@
 //protos utilise dans Canopy
 
 //partie commune
-EXTR void proj_ortho(Diffuseur* E, reel *);
+EXTR void proj_ortho(Diffuseur* E, reel *,int nE);
+EXTR void proj_amas(reel *bmin,reel *bmax,double couv,int nE,unsigned int graine);
 EXTR void init_proj(Diffuseur * diffR );
 EXTR void stat_NFF();
+EXTR void init_thread_NFF(int t);
+EXTR void fin_thread_NFF();
 
 //partie differente entre version RAM et HD
 #ifdef _HD
 EXTR void NFF(int i_sup,int i_inf,VEC **Cfar);
 EXTR int ADS_val(int n);
 EXTR void ADS_maj(int n,int val);
-EXTR void init_NFF(char * envname,double *Esource,int nbpr,int nbf,double &Rsph,bool bias);
+EXTR void init_NFF(char * envname,double *Esource,int nbpr,int nbf,double &Rsph,bool bias,int nbth=1,int nbamas=0);
 #else
 EXTR void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar);
 EXTR void init_NFF(char * envname,double *Esource,double &Rsph,bool bias);
@@ -8,21 +8,24 @@
 using namespace std;
 
 #include <cmath>
+#include <cstring>
+#include <vector>
 
 #define _INFINI
 #include "infini.h"
 #include "image.h"
 #include "chrono.h"
 
-// global variable
-static Tabdyn<void *,2> Zdat0;
-static Tabdyn<REELLE,2> Zbuf0;
-static void ***Zdat8;
-static REELLE **Zbuf8;
-static double cdist;
-static int **T, Ti,Tj, tr[8];
-static bool duplik;
-static Chrono myclock;
+// global variable (une copie par thread : projplan multithread)
+// Zdat0, Zbuf0 : copies contigues (Ti x Tj) de l'image avant pavage
+static thread_local unsigned int *Zdat0;
+static thread_local REELLE *Zbuf0;
+static thread_local unsigned int **Zdat8;
+static thread_local REELLE **Zbuf8;
+static thread_local double cdist;
+static thread_local int **T, Ti,Tj, tr[8];
+static thread_local bool duplik;
+static thread_local Chrono myclock;
 
 //proto
 void lateral(int x,int y, char idx) ;
@@ -69,10 +72,10 @@ void zbuf(int i,int j) {
   if(j>=0) min[1]=j; else max[1]+=j;
   for(l=min[1];l<max[1];l++)
     for(k=min[0];k<max[0];k++) {
-      d=Zbuf0(k-i,l-j)+cdist*j;
+      d=Zbuf0[(k-i)*Tj+l-j]+cdist*j;
       if( d < Zbuf8[k][l] ) {
 	Zbuf8[k][l]=(REELLE) d;
-	Zdat8[k][l]= duplik?Zdat0(k-i,l-j):NULL;
+	Zdat8[k][l]= duplik?Zdat0[(k-i)*Tj+l-j]:0;
       }
     }      
 }//zbuf()
@@ -96,16 +99,26 @@ void pave(int x,int  y, char idx ) {
 }//pave()
 
 //-***  Exported Functions : infinitise()
-void infinitise(void ***Zprim, REELLE **Zbuf,
-		double cste_dist,int** roof,int Tx, int Ty,bool dupli) {
+void infinitise(unsigned int **Zprim, REELLE **Zbuf,
+		double cste_dist,int** roof,int Tx, int Ty,bool dupli,REELLE *copie) {
   int i,j;
+  vector<REELLE> zloc;
+  vector<unsigned int> dloc;
   if(verbose>1){
     myclock.Start();
     cout<<"* infinitise(): DEBUT\n";
   }
-  //init
-  Zdat0.alloue(Tx,Ty);
-  Zbuf0.alloue(Tx,Ty);
+  //init : sans duplication, seul le Z-buffer est copie
+  if(copie==NULL) {
+    zloc.resize((size_t)Tx*Ty);
+    copie=zloc.data();
+  }
+  Zbuf0=copie;
+  Zdat0=NULL;
+  if(dupli) {
+    dloc.resize((size_t)Tx*Ty);
+    Zdat0=dloc.data();
+  }
   // parameters --> global variables
   Zdat8=Zprim;
   Zbuf8=Zbuf;
@@ -113,12 +126,11 @@ void infinitise(void ***Zprim, REELLE **Zbuf,
   duplik=dupli;
   cdist=cste_dist;
   Ti=Tx;Tj=Ty;
-  for(j=0;j<Ty;j++)
-    for(i=0;i<Tx;i++) {
-      Zdat0(i,j)=Zprim[i][j];
-      Zbuf0(i,j)=Zbuf[i][j];
-
-    }
+  for(i=0;i<Tx;i++) {
+    memcpy(Zbuf0+(size_t)i*Ty,Zbuf[i],Ty*sizeof(REELLE));
+    if(dupli)
+      memcpy(Zdat0+(size_t)i*Ty,Zprim[i],Ty*sizeof(unsigned int));
+  }
   i=j=0;
 
   /* for(int ii=0; ii<4; ii++)
@@ -152,9 +164,6 @@ void infinitise(void ***Zprim, REELLE **Zbuf,
   i+=tr[6];
   j+=tr[7];
   pave(i,j,6); //down
-  //Mr Propre
-  Zdat0.free();
-  Zbuf0.free();
   if(verbose>1){
     myclock.Stop();
     cout<<"\n::::>  Infinitisation en "<<myclock<<endl;
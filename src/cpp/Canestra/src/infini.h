@@ -12,4 +12,7 @@
 
 //protos utilise dans Canopy
 #define REELLE float  
-EXTR void infinitise(void ***Zprim, REELLE **Zbuf, double,int** roof,int Tx, int Ty,bool dupli);
+// Zprim : indice+1 du diffuseur vu par pixel (0 : aucun). copie : tampon de
+// Tx*Ty REELLE pour la copie du Z-buffer (alloue localement si NULL)
+EXTR void infinitise(unsigned int **Zprim, REELLE **Zbuf, double,int** roof,int Tx, int Ty,bool dupli,
+		     REELLE *copie=NULL);
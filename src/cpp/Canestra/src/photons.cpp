@@ -0,0 +1,275 @@
+//Rediffusions par Monte Carlo (option -P) : Canopy::monte_carlo() suit des
+//photons emis selon les radiosites du direct dans les BVH de rayons.cpp, au
+//lieu de calculer les facteurs de forme et de resoudre le systeme lineaire
+
+#include <iostream>
+using namespace std ;
+
+#include <cmath>
+#include <vector>
+#include <random>
+#include <thread>
+#include <atomic>
+#include <algorithm>
+
+#include "canopy.h"
+#include "outils.h"
+#include "rayons.h"
+
+//nb de lots de photons, chacun avec son propre flux aleatoire : les ecarts
+//types sont estimes entre lots et les resultats ne dependent pas du nombre
+//de threads
+#define NB_LOT 16
+//nb max de rebonds d'un photon
+#define REBOND_MAX 1000
+
+// direction tiree selon la loi de Lambert autour de n (unitaire)
+static void lambert(const double *n,mt19937_64 &gen,double *d) {
+  uniform_real_distribution<double> U(0.0,1.0);
+  double u[3],v[3],e[3]={0.0,0.0,0.0},nu,phi,s,c;
+  int k;
+
+  e[(fabs(n[0])<0.6)? 0 : 1]=1.0;
+  u[0]=n[1]*e[2]-n[2]*e[1];
+  u[1]=n[2]*e[0]-n[0]*e[2];
+  u[2]=n[0]*e[1]-n[1]*e[0];
+  nu=sqrt(u[0]*u[0]+u[1]*u[1]+u[2]*u[2]);
+  for(k=0;k<3;k++)
+    u[k]/=nu;
+  v[0]=n[1]*u[2]-n[2]*u[1];
+  v[1]=n[2]*u[0]-n[0]*u[2];
+  v[2]=n[0]*u[1]-n[1]*u[0];
+  phi=2*M_PI*U(gen);
+  s=U(gen);
+  c=sqrt(1.0-s);
+  s=sqrt(s);
+  for(k=0;k<3;k++)
+    d[k]=s*(cos(phi)*u[k]+sin(phi)*v[k])+c*n[k];
+}//lambert()
+
+//-************ Canopy::monte_carlo() ********************
+// B0 : radiosites du direct (source des photons), B : radiosites totales.
+// Chaque photon porte la meme energie ; un diffuseur atteint l'absorbe ou le
+// reflechit (rho) ou le transmet (tau) selon la face touchee. L'eclairement
+// des capteurs compte les photons qui les traversent par dessus. En scene
+// infinie, les photons traversent les copies du motif et le sol (z=min(0,
+// bas de la scene)) reflechit selon sa reflectance (ligne s du .opt) : il
+// emet aussi des photons depuis les points du motif qui voient les nbdir
+// sources (visee, Esource).
+// Esd : ecart type de l'eclairement rediffuse moyen de chaque face, Asd :
+// celui de l'energie absorbee par unite de surface, a l'indice de la face sup
+void Canopy::monte_carlo(int nbdir,Vecteur *visee,double *Esource,double *B0,double *B,
+			 double *Esd,double *Asd,bool infty,int nbth) {
+  unsigned int n,f,fe;
+  int l,t,nl,d;
+  double Ftot,Fsol,w,L[2],zsol,rsol,S,Em,var,a,Al[NB_LOT];
+  vector<double> cumul,cumsrc;
+  vector<int> src;
+  vector<unsigned int> facem;
+  vector<Diffuseur*> dface(radim,(Diffuseur*)NULL);
+  vector< vector<double> > Elot(NB_LOT);
+  vector<thread> pool;
+  atomic<int> suivant(0);
+  Diffuseur *pdiff;
+
+  liste_diff();
+  for(n=0;n<nbdiff;n++) {
+    dface[Tdiff[n]->num((unsigned char)0)]=Tdiff[n];
+    if(!Tdiff[n]->isopaque())
+      dface[Tdiff[n]->num((unsigned char)1)]=Tdiff[n];
+  }
+  for(f=0;f<radim;f++) {
+    B[f]=B0[f];
+    Esd[f]=Asd[f]=0.0;
+  }
+  // repartition de l'energie emise par les faces reelles
+  Ftot=0.0;
+  for(f=0;f<radim;f++)
+    if(dface[f]!=NULL && dface[f]->isreal() && B0[f]>0) {
+      Ftot+=B0[f]*dface[f]->surface();
+      cumul.push_back(Ftot);
+      facem.push_back(f);
+    }
+  L[0]=vmax[0]-vmin[0];
+  L[1]=vmax[1]-vmin[1];
+  zsol=min(0.0,(double)vmin[2]);
+  rsol=0.0;
+  if(infty && tabopaque(0)!=NULL)
+    rsol=max(0.0,tabopaque(0)->rho());
+  // energie reflechie par le sol s'il voyait toutes les sources
+  Fsol=0.0;
+  if(rsol>0)
+    for(d=0;d<nbdir;d++)
+      if(visee[d][2]<0 && Esource[d]>0) {
+	Fsol+=rsol*Esource[d]*L[0]*L[1];
+	cumsrc.push_back(Fsol);
+	src.push_back(d);
+      }
+  if(nbphot<=0 || Ftot+Fsol<=0)
+    return;
+  init_rayons(Tdiff,nbdiff);
+  nl=(nbphot+NB_LOT-1)/NB_LOT;
+  w=(Ftot+Fsol)/nl;
+  Ferr <<" Monte Carlo : "<<nl*NB_LOT<<" photons en "<<NB_LOT<<" lots (graine "<<graine
+       <<"), energie emise = "<<Ftot<<" (diffuseurs) + "<<Fsol<<" (sol au plus)\n";
+
+  auto suit=[&](){
+    uniform_real_distribution<double> U(0.0,1.0);
+    vector<Diffuseur*> vus;
+    Diffuseur *emet,*vu,*exclu;
+    double p[3],q[3],r[3],nrm[3],ns[3],a,b,c,t,ts,x,rho,tau,nv;
+    Point P[3];
+    Vecteur N;
+    unsigned int f;
+    unsigned char cefa;
+    int l,k,s,rebond;
+    bool sol;
+
+    while((l=suivant++)<NB_LOT) {
+      seed_seq sq{graine,(unsigned int)l};
+      mt19937_64 gen(sq);
+      vector<double> &E=Elot[l];
+      E.assign(radim,0.0);
+      for(k=0;k<nl;k++) {
+	// point et direction d'emission
+	x=U(gen)*(Ftot+Fsol);
+	if(x>=Ftot) {//photon du sol, s'il voit la source tiree
+	  s=lower_bound(cumsrc.begin(),cumsrc.end(),x-Ftot)-cumsrc.begin();
+	  Vecteur &v=visee[src[min(s,(int)src.size()-1)]];
+	  nv=sqrt(v[0]*v[0]+v[1]*v[1]+v[2]*v[2]);
+	  for(s=0;s<3;s++)
+	    r[s]=-v[s]/nv;
+	  p[0]=vmin[0]+U(gen)*L[0];
+	  p[1]=vmin[1]+U(gen)*L[1];
+	  p[2]=zsol;
+	  if(!eclaire(p,r,infty,L))
+	    continue;
+	  nrm[0]=nrm[1]=0.0; nrm[2]=1.0;
+	  exclu=NULL;
+	}
+	else {
+	  s=lower_bound(cumul.begin(),cumul.end(),x)-cumul.begin();
+	  f=facem[min(s,(int)facem.size()-1)];
+	  emet=dface[f];
+	  for(s=0;s<3;s++)
+	    P[s]=emet->primi()[s];
+	  a=U(gen); b=U(gen);
+	  if(a+b>1.0) {
+	    a=1.0-a; b=1.0-b;
+	  }
+	  N=emet->primi().normal();
+	  for(s=0;s<3;s++) {
+	    p[s]=P[0][s]+a*(P[1][s]-P[0][s])+b*(P[2][s]-P[0][s]);
+	    nrm[s]=(!emet->isopaque() && f==emet->num((unsigned char)1))? -N[s] : N[s];
+	  }
+	  exclu=emet;
+	}
+	lambert(nrm,gen,r);
+	for(rebond=0;rebond<REBOND_MAX;rebond++) {
+	  vu=impact(p,r,infty,L,exclu,q,&t);
+	  sol=false;
+	  if(infty && r[2]<-1e-12) {
+	    ts=(zsol-p[2])/r[2];
+	    if(ts>=0 && (vu==NULL || ts<t)) {
+	      sol=true;
+	      t=ts;
+	      for(s=0;s<3;s++)
+		q[s]=p[s]+t*r[s];
+	    }
+	  }
+	  // capteurs traverses par dessus
+	  if(nbcell>0) {
+	    capteurs_traverses(p,r,infty,L,(vu!=NULL || sol)? t : 1e30,vus);
+	    for(unsigned int iv=0;iv<vus.size();iv++) {
+	      N=vus[iv]->primi().normal();
+	      if(r[0]*N[0]+r[1]*N[1]+r[2]*N[2]<0)
+		E[vus[iv]->num()]+=w;
+	    }
+	  }
+	  if(sol) {
+	    if(U(gen)>=rsol)
+	      break;
+	    for(s=0;s<2;s++) {
+	      q[s]=vmin[s]+fmod(q[s]-vmin[s],L[s]);
+	      if(q[s]<vmin[s])
+		q[s]+=L[s];
+	    }
+	    nrm[0]=nrm[1]=0.0; nrm[2]=1.0;
+	    lambert(nrm,gen,r);
+	    for(s=0;s<3;s++)
+	      p[s]=q[s];
+	    exclu=NULL;
+	    continue;
+	  }
+	  if(vu==NULL)
+	    break;
+	  N=vu->primi().normal();
+	  c=r[0]*N[0]+r[1]*N[1]+r[2]*N[2];
+	  //opaque touche par derriere : cache sans etre eclaire (cf. proj_ortho())
+	  if(vu->isopaque() && c>0)
+	    break;
+	  cefa=(c<0 || vu->isopaque())? 0 : 1;
+	  E[vu->num(cefa)]+=w;
+	  rho=vu->rho(cefa);
+	  tau=vu->isopaque()? 0.0 : vu->tau(cefa);
+	  for(s=0;s<3;s++)
+	    ns[s]=(c<0)? N[s] : -N[s];
+	  x=U(gen);
+	  if(x<rho)
+	    lambert(ns,gen,r);
+	  else if(x<rho+tau) {
+	    for(s=0;s<3;s++)
+	      ns[s]=-ns[s];
+	    lambert(ns,gen,r);
+	  }
+	  else
+	    break;
+	  for(s=0;s<3;s++)
+	    p[s]=q[s];
+	  exclu=vu;
+	}
+      }
+    }
+  };
+  if(nbth>NB_LOT) nbth=NB_LOT;
+  if(nbth<=1)
+    suit();
+  else{
+    for(t=0;t<nbth;t++)
+      pool.push_back(thread(suit));
+    for(t=0;t<nbth;t++)
+      pool[t].join();
+  }
+  libere_rayons();
+
+  // moyennes et ecarts types entre lots, radiosites rediffusees
+  for(n=0;n<nbdiff;n++) {
+    pdiff=Tdiff[n];
+    S=pdiff->surface();
+    for(l=0;l<NB_LOT;l++)
+      Al[l]=0.0;
+    for(unsigned char cefa=0;cefa<(pdiff->isopaque()? 1 : 2);cefa++) {
+      f=pdiff->num(cefa);
+      Em=var=0.0;
+      for(l=0;l<NB_LOT;l++)
+	Em+=Elot[l][f]/NB_LOT;
+      for(l=0;l<NB_LOT;l++)
+	var+=(Elot[l][f]-Em)*(Elot[l][f]-Em);
+      Esd[f]=sqrt(var/(NB_LOT-1)/NB_LOT)/S;
+      a=1.0-pdiff->rho(cefa)-(pdiff->isopaque()? 0.0 : pdiff->tau(cefa));
+      for(l=0;l<NB_LOT;l++)
+	Al[l]+=a*Elot[l][f];
+      B[f]+=pdiff->rho(cefa)*Em/S;
+      if(!pdiff->isopaque()) {
+	fe=pdiff->num((unsigned char)(1-cefa));
+	B[fe]+=pdiff->tau(cefa)*Em/S;
+      }
+    }
+    Em=var=0.0;
+    for(l=0;l<NB_LOT;l++)
+      Em+=Al[l]/NB_LOT;
+    for(l=0;l<NB_LOT;l++)
+      var+=(Al[l]-Em)*(Al[l]-Em);
+    Asd[pdiff->num((unsigned char)0)]=sqrt(var/(NB_LOT-1)/NB_LOT)/S;
+  }
+}//Canopy::monte_carlo()
@@ -8,6 +8,8 @@
 *************************************************************/
 
 #include <iostream> // introduire la notion de namespace
+#include <vector>
+#include <map>
 using namespace std ;
 
 #include <ferrlog.h>
@@ -35,10 +37,15 @@ extern "C" {
 #ifdef _HD
 #include "solver.h"
 #include "bzh.h"
+#include "amas.h"
 #endif
 
 bool bMemoriseMatrix=false;
 
+// Format de Etri.bin
+#define ETRI_VERSION 1
+#define ETRI_RECSIZE (sizeof(int)+5*sizeof(double))
+
 #include "GetOpt.h"
 
 #define PAUSE(msg)  printf(msg); Ferr <<"- Taper la touche Any" ; getchar() ;
@@ -48,6 +55,17 @@ static  void beep(const char *,int);
 static  void erreur_syntaxe(char *);
 static int options(int argc,char **argv);
 static  void genres();
+static  void etri0(FILE *,int,double,double,double,double,double);
+static  void emc0(FILE *,int,double,double,double);
+static  void esrc0(FILE *,int,double,const Esources &,const Esources *);
+static  vector<int> lignes_etri();
+static  void ecrit_gap(const char *,const vector<Esources> &);
+static  void ecrit_cameras(const char *);
+static  const char *resname(const char *);
+static  string racine(const char *);
+static  bool lit_radiosite(const char *,VEC *);
+static  void ecrit_radiosite(const char *,VEC *);
+static  void bilan_solveur(int,double,double=-1,const vector<float> *hist=NULL);
 
 // Variables globales 
 extern unsigned int NB;
@@ -60,14 +78,27 @@ static FILE * fres;
 static Diffuseur **TabDiff,*diff;
 static Canopy scene;
 static VEC  **B0,**B, **Cenv;
+// ecarts types des rediffusions par Monte Carlo (-P), par simulation
+static vector< vector<double> > Esd,Asd;
+static vector< vector<Esources> > Esrc; //direct par source de chaque ciel (-D)
 static char opak;
 //  Options
 static  unsigned int nb_iter,nbsim;
 static double denv;
 static  bool ffseul, infty, geom, ordre1, 
-  ff_print, bio, byseg, byfile, radonly, memsize,bias;
-static  double seuil;
-static  char *maqname, *envname, *optname, *lightname, *name8; 
+  ff_print, bio, byseg, byfile, tofile, binres, lean, radonly, memsize,bias, parsrc, gap;
+static  double seuil,duree;
+static  int nbthread, tcam;
+static  char *maqname, *envname, *optname, *lightname, *name8, *camname; 
+// Bandes spectrales : un .opt (et un .env) par bande - options -p et -e repetees
+#define NBANDE_MAX 64
+static  char *tabopt[NBANDE_MAX];
+static  unsigned int nbande, ib;
+// Ciels : option -l repetee. Une simulation par bande et par ciel, d'indice
+// isim=ib*nbsky+il, avec son .env (-e) et sa solution initiale (-x, demarrage
+// a chaud du solveur)
+static  vector<char*> tablight, tabenv, tabx;
+static  unsigned int nbsky, il, isim;
 static   int clef_shm=-1;
 static  char *dirname, *matname;
 // Option capteur virtuel - MC0699
@@ -135,7 +166,7 @@ int main(int argc,char **argv){
     //*********** Construction de la double grille ***************
     //pas besoin de grille si reuse ou 1er ordre ou SAIL pur
   
-    if(!(radonly || ordre1 || denv==0))  {
+    if(!(radonly || ordre1 || denv==0 || scene.nbphot>0))  {
       clock.Start();
       //ex-pb effet de bord avec projplan car modifie les bornes => vmin et vmax
       scene.cstruit_grille(denv);
@@ -144,13 +175,29 @@ int main(int argc,char **argv){
     }
     //scene.mesh.visu();
   
+    //*********** Cameras hemispheriques (-V) : ni direct ni bilan d'energie ***
+    if(camname!=NULL){
+      clock.Start();
+      ecrit_cameras("Cam.bin");
+      clock.Stop();
+      Ferr<<">>> Canestra[main] cameras en "<<clock<<'\n' ;
+      Ferr <<"This is the end...\n"<<'\n';
+      Ferr.close();
+      return 0;
+    }
+
     //************ Calcul de l'eclairage direct (soleil & ciel)  ***************
     //    initialisation
-    double *Bsource;
+    double **Esup,**Einf;
     opak=0;
-  
+
     clock.Start();
-    Bsource = new double[scene.radim];
+    // eclairement direct (purement geometrique) cumule sur les sources de
+    // chaque ciel, recu en reflexion (Esup) et en transmission (Einf) : commun
+    // a toutes les bandes
+    Esup = new double*[nbsky];
+    Einf = new double*[nbsky];
+    Esrc.assign((parsrc || gap)? nbsky : 0,vector<Esources>());
     B= B0 = new VEC*[nbsim]; //B=B0 si pas de calcul des rediffusions
     for(i=0;i<nbsim;i++) {
       B0[i] = v_get(scene.radim);
@@ -158,57 +205,49 @@ int main(int argc,char **argv){
 	B0[i]->ve[j]=0.0;
       }
     }
-  
     //    calcul de visibilite (purely geometric)
     Vecteur dir_source;
     double Esource,rho;
-    //     calcul de l'eclairage direct (soleil, ciel)
-    ifstream flight(lightname,ios::in);
-    do {
-      flight>>Esource;
-      if(!flight) 
-          break;
-      flight>>dir_source[0]>>dir_source[1]>>dir_source[2];
-    
-      for(i=0;i<scene.radim;i++) {
-          Bsource[i]=0.0;
-      }
-      scene.projplan(dir_source,infty,Bsource);
-      //recommenter
-      Ferr <<"param. projplan : dir = ("  << dir_source[0]<<"," << dir_source[1]
-	   <<","  << dir_source[2]<<") - Esun = "  << Esource<<'\n' ;
-      for(i=0;i<scene.radim;i++) {   
-	if(Bsource[i]!=0.0) {  
-	  TabDiff[i]->activ_num(i);
-	  if(Bsource[i]>0) 
-	    rho=TabDiff[i]->rho() * Bsource[i] / TabDiff[i]->surface();
-	  else { 
-	    TabDiff[i]->togle_face();
-	    rho=-TabDiff[i]->tau() * Bsource[i] / TabDiff[i]->surface();
-	  }
-	  // Cumule les contrib des differents angles solides
-	  B0[0]->ve[i]+=Esource*rho;
-	  //Ferr <<"i="  << i<<" : Bsource="  << Bsource[i]<<", B0="  
-	  //     << B0[0]->ve[i]<<"\n" ;
-	  TabDiff[i]->active(0);// reactive le diff sur la face sup (defaut)
-	}
-      }   
-    }while(flight);
-    flight.close();
+    // sources de chaque ciel (gardees pour les photons du sol de Monte Carlo)
+    vector< vector<Vecteur> > tabdir(nbsky);
+    vector< vector<double> > tabE(nbsky);
+    for(il=0;il<nbsky;il++){
+      //     lecture des sources (soleil, ciel)
+      ifstream flight(tablight[il],ios::in);
+      do {
+	flight>>Esource;
+	if(!flight)
+	  break;
+	flight>>dir_source[0]>>dir_source[1]>>dir_source[2];
+	Ferr <<"param. projplan : dir = ("  << dir_source[0]<<"," << dir_source[1]
+	     <<","  << dir_source[2]<<") - Esun = "  << Esource<<'\n' ;
+	tabdir[il].push_back(dir_source);
+	tabE[il].push_back(gap? 1.0 : Esource);//-G : aire vue de chaque direction
+      }while(flight);
+      flight.close();
+      //     calcul de l'eclairage direct, directions reparties sur nbthread threads
+      Esup[il] = new double[scene.radim];
+      Einf[il] = new double[scene.radim];
+      if(parsrc || gap)
+	Esrc[il].resize(scene.radim);
+      scene.eclairement_direct(tabdir[il].size(),tabdir[il].data(),tabE[il].data(),infty,
+			       Esup[il],Einf[il],nbthread,(parsrc || gap)? Esrc[il].data() : NULL);
+    }
     clock.Stop();
-    Ferr<<">>> Canestra[main] calcul du direct en "<<clock<<'\n' ; 
-  
-    if(byfile){//ecriture du direct dans un fichier E0	
-      fres=fopen("E0.dat","w");
-      for(j=0;j<scene.radim;j++) {
-	//Ferr <<"B0("  << j<<") ="  << B0[0]->ve[j]<<" - B("  << j<<") ="  
-	//   << B[0]->ve[j]<<" \n" ;
-	fprintf(fres,"%.10lf \n ",B0[0]->ve[j]);
+    Ferr<<">>> Canestra[main] calcul du direct en "<<clock<<'\n' ;
+
+    //*********** Requete de couverture (-G) : ni bilan d'energie ni Etri ******
+    if(gap){
+      for(il=0;il<nbsky;il++){
+	ecrit_gap(resname("Gap.dat"),Esrc[il]);
+	delete [] Esup[il]; delete [] Einf[il];
       }
-      fclose(fres);
-    }//if(byfile)
-    /* ******************************************************************** */
-  
+      delete [] Esup; delete [] Einf;
+      Ferr <<"This is the end...\n"<<'\n';
+      Ferr.close();
+      return 0;
+    }
+
     //*********** Ecriture de resultats partiels  ***************
     if(geom) {
       Point G;
@@ -235,17 +274,13 @@ int main(int argc,char **argv){
 	fprintf(fres,"%d   %lf %lf %lf   %lf %d %.10lf\n",
 		i,G[0],G[1],G[2],teta,istem,surfT);
 	TabDiff[i]->active(0);
-      } 
+      }
       fclose(fres);
     }
     //if geom
     /**************************************************************************/
-	      
-    if(!ordre1){// Calcul des rediffusions
-      //Calcul des FF et des Bfar
-      clock.Start();
-    
-      VEC  *r0,*x;
+
+    if(!ordre1){
       Cenv = new VEC*[nbsim];
       B = new VEC*[nbsim];
       for(i=0;i<nbsim;i++) {
@@ -253,165 +288,256 @@ int main(int argc,char **argv){
 	B[i] = v_get(scene.radim);
 	for(j=0;j<scene.radim;j++)
 	  Cenv[i]->ve[j]=0.0; }
-      if(denv>0){
-#ifdef _HD
-	if(!radonly){//calcul de la matrice des FF
-	  Ferr <<" Version longue : calcul des FF et des Coeff de Bfar"
-	       <<'\n' ;
-	  //fflush(stderr); // Ferr.flush vient d'etr appele
+    }
 
-	  hdmat_init(dirname,matname);
-	  scene.calc_FF_Bfar(Cenv,&Esource,envname,bias,denv,nbsim);
-	}
-	else{
-	  //lecture de la mat. : maj des NzName, DgName et BfName
-	  //et calcul des Bfar	
-	  Ferr <<" Version courte : lecture des FF et des Coeff de Bfar\n" ;
-	  hdmat_majname(dirname,matname);
-	  if(envname!=NULL)
-	    hd_calc_Bfar(Cenv[0],envname,TabDiff,Esource);
+    //*********** Une simulation par bande spectrale (-p et -e) ***************
+    // La scene, la grille, le direct et la matrice des FF sont partages ; seules
+    // les prop. optiques changent (Canopy::maj_opt)
+    // Pour plusieurs ciels (-l repete), seul le second membre B0 change : les
+    // systemes des ciels d'une bande sont resolus ensemble (hd_mgcr_multi)
+    vector<int> num_steps(nbsky);
+    vector<double> residu(nbsky,-1),borne(nbsky,-1);//inconnus sans _HD
+    vector< vector<float> > hist(nbsky);
+    Esd.resize(nbsim); Asd.resize(nbsim);
+    for(ib=0;ib<nbande;ib++){
+      optname=tabopt[ib];
+      if(ib>0)
+	scene.maj_opt(optname);
+      if(nbande>1)
+	Ferr<<">>> Canestra[main] bande "<<ib<<" : "<<optname<<'\n';
+
+      for(il=0;il<nbsky;il++){
+	isim=ib*nbsky+il;
+	lightname=tablight[il];
+	envname=(tabenv.size()>0)? tabenv[isim] : NULL;
+	if(nbsky>1)
+	  Ferr<<">>> Canestra[main] ciel "<<il<<" : "<<lightname<<'\n';
+
+	//    eclairement direct de la bande
+	for(i=0;i<scene.radim;i++) {
+	  if(Esup[il][i]!=0.0 || Einf[il][i]!=0.0) {
+	    TabDiff[i]->activ_num(i);
+	    rho=TabDiff[i]->rho() * Esup[il][i] / TabDiff[i]->surface();
+	    if(Einf[il][i]!=0.0) {
+	      TabDiff[i]->togle_face();
+	      rho+=TabDiff[i]->tau() * Einf[il][i] / TabDiff[i]->surface();
+	    }
+	    B0[isim]->ve[i]=rho;
+	    TabDiff[i]->active(0);// reactive le diff sur la face sup (defaut)
+	  }
 	}
+
+	if(tofile && !lean){//ecriture du direct dans un fichier E0
+	  fres=fopen(resname("E0.dat"),"w");
+	  for(j=0;j<scene.radim;j++) {
+	    //Ferr <<"B0("  << j<<") ="  << B0[0]->ve[j]<<" - B("  << j<<") ="
+	    //   << B[0]->ve[j]<<" \n" ;
+	    fprintf(fres,"%.10lf \n ",B0[isim]->ve[j]);
+	  }
+	  fclose(fres);
+	}//if(tofile)
+	/* ******************************************************************** */
+
+	if(!ordre1){// Calcul des rediffusions
+	  //Calcul des FF et des Bfar
+	  clock.Start();
+
+	  VEC  *r0,*x;
+	  if(scene.nbphot>0){//rediffusions par Monte Carlo : ni FF ni solveur
+	    Esd[isim].resize(scene.radim);
+	    Asd[isim].resize(scene.radim);
+	    scene.monte_carlo(tabdir[il].size(),tabdir[il].data(),tabE[il].data(),B0[isim]->ve,
+			      B[isim]->ve,Esd[isim].data(),Asd[isim].data(),infty,nbthread);
+	    clock.Stop();
+	    Ferr<<">>> Canestra[main] Rediffusions par Monte Carlo en "<<clock<<'\n';
+	  }
+	  else if(denv>0){
+#ifdef _HD
+	    if(!radonly && isim==0){//calcul de la matrice des FF
+	      Ferr <<" Version longue : calcul des FF et des Coeff de Bfar"
+		   <<'\n' ;
+	      //fflush(stderr); // Ferr.flush vient d'etr appele
+
+	      hdmat_init(dirname,matname);
+	      scene.calc_FF_Bfar(Cenv,&Esource,envname,bias,denv,nbsim,nbthread);
+	    }
+	    else{
+	      //lecture de la mat. : maj des NzName, DgName et BfName
+	      //et calcul des Bfar
+	      Ferr <<" Version courte : lecture des FF et des Coeff de Bfar\n" ;
+	      if(isim==0)
+		hdmat_majname(dirname,matname);
+	      // les flux de l'env (mcsail) sont absolus, comme pour calc_FF_Bfar :
+	      // pas de mise a l'echelle par l'energie d'une source
+	      if(envname!=NULL)
+		hd_calc_Bfar(Cenv[isim],envname,TabDiff,1.0);
+	    }
+	    clock.Stop();
+	    Ferr<<">>> Canestra[main] FF et Bfar calcules  en "<<clock<< '\n';
+
+	    if(ff_print && isim==0) {
+	      //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
+	      char carlu;
+	      Ferr <<"* ATTENTION - mode HD - Print la matrice a l'ecran\n"
+		" Le voulez vous reellement \?(o/n)\?"<<'\n' ;
+	      carlu=getchar();
+	      if(carlu=='o' || carlu=='O')
+		print_hd_mat(TabDiff);
+	    }
+	    // FF -> syst. lineaire 1-Xi*Fij
+	    if(verbose>1)
+	      Ferr <<"==>Bi=E+Bfar\n" ;
+	    for(i=0;i<scene.radim;i++)
+	      B0[isim]->ve[i]+=Cenv[isim]->ve[i];
+	    if(tabx.size()>0 && lit_radiosite(tabx[isim],B[isim]))
+	      Ferr <<" MGCR : demarrage a chaud depuis "<<tabx[isim]<<'\n' ;
+	    // resolution apres le dernier ciel de la bande
 #else
-	SPMAT *FF;
-	r0= v_get(scene.radim);
-	FF = sp_get(scene.radim,scene.radim,200);
-	//Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
-	for(i=0;i<scene.radim;i++)
+	    SPMAT *FF;
+	    r0= v_get(scene.radim);
+	    FF = sp_get(scene.radim,scene.radim,200);
+	    //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
+	    for(i=0;i<scene.radim;i++)
 #ifndef BCC32
-	  r0->ve[i]=drand48();
+	      r0->ve[i]=drand48();
 #else
-	r0->ve[i]=rand() / (double) RAND_MAX ;
+	    r0->ve[i]=rand() / (double) RAND_MAX ;
 #endif
-	if(verbose>2) 
-	  Ferr <<"\n--> initialiastion des vecteurs et matrices faites (alloc.)"
-	       <<'\n' ;
-	//PAUSE(" ");
-	if(ffseul) {
-	  //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
-	  scene.calc_FF(FF);
-	  //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
-	}else {
-	  //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
-	  scene.calc_FF_Bfar(FF,Cenv,&Esource,envname,bias,denv,nbsim);
-	  //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
-	}
+	    if(verbose>2)
+	      Ferr <<"\n--> initialiastion des vecteurs et matrices faites (alloc.)"
+		   <<'\n' ;
+	    //PAUSE(" ");
+	    // FF modifiee sur place par les prop. optiques => recalculee par simulation
+	    if(ffseul) {
+	      //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
+	      scene.calc_FF(FF);
+	      //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
+	    }else {
+	      //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
+	      scene.calc_FF_Bfar(FF,Cenv+isim,&Esource,envname,bias,denv,nbsim);
+	      //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
+	    }
+	    clock.Stop();
+	    Ferr<<">>> Canestra[main] FF et Bfar calcules  en "<<clock<< '\n';
+	    //fflush(stderr);
+
+	    /****************************************************/
+
+	    // Resolution du systeme lineaire
+	    if(tabx.size()>0 && lit_radiosite(tabx[isim],B[isim]))
+	      Ferr <<" MGCR : demarrage a chaud depuis "<<tabx[isim]<<'\n' ;
+	    if(ff_print) {
+	      FILE * fff;
+	      fff=fopen("FF.dat","w");
+	      for(i=0;i<FF->m;i++) {
+		for(j=0;j<FF->n;j++) {
+		  fprintf(fff,"%lf  ",sp_get_val(FF,i,j));
+		}
+		fprintf(fff,"\n");
+	      }
+	      fclose(fff);
+	    }//if ff_print
+	    // FF -> syst. lineaire 1-Xi*Fij
+	    SPROW	*r;
+	    unsigned int  len;
+	    double trans,refl,*pval;
+	    opak=0;
+	    for(i=0;i<FF->m;i++) {
+	      B0[isim]->ve[i]+=Cenv[isim]->ve[i];
+	      r = FF->row+i;
+	      len=r->len;
+	      TabDiff[i]->activ_num(i);
+	      refl= -TabDiff[i]->rho();
+	      if(!TabDiff[i]->isopaque()) {
+		TabDiff[i]->togle_face();
+		trans=TabDiff[i]->tau();
+	      }
+	      for(j=0;j<len;j++) {
+		pval=&(r->elt[j].val);
+
+		//Ferr <<" FF("  << i<<",ndx "  << j<<") = "  << *pval<<"\n" ;
+		if(*pval!=1) {
+		  if(*pval>0)
+		    *pval*=refl;
+		  else
+		    *pval*=trans;
+		}
+	      }
+	      TabDiff[i]->active(0);
+	    }
+	    if(ff_print) {
+	      FILE * fff;
+
+	      fff=fopen("M.dat","w");
+	      for(i=0;i<FF->m;i++) {
+		for(j=0;j<FF->n;j++) {
+		  fprintf(fff,"%lf  ",sp_get_val(FF,i,j));
+		}
+		fprintf(fff,"\n");
+	      }
+	      fclose(fff);
+	    }
+	    //sparse matrix resolution (Conjugate Gradient)
+	    // Solve Ax=b; B precondionneur, tol seuil, limit nb_iter_max
+	    //Methode  Leyk's MGCR
+	    clock.Start();
+	    Ferr <<" MGCR : seuil de cvgence = "  << seuil
+		 <<" - nb_iter_max = "  << nb_iter<<"\n " ;
+
+	    B[isim]=iter_spmgcr(FF, (SPMAT *)NULL, B0[isim],seuil, B[isim],
+				20, nb_iter, &num_steps[il]);
+	    clock.Stop();
+	    bilan_solveur(num_steps[il],residu[il]);
+	    Ferr<<">>> Canestra[main] Resolution du SL par MGCR en "<<clock<<'\n';
 #endif
-	clock.Stop();
-	Ferr<<">>> Canestra[main] FF et Bfar calcules  en "<<clock<< '\n';
-	//fflush(stderr);
-      
-	/****************************************************/
-      
-	// Resolution du systeme lineaire
-	int num_steps;
+	  }//if denv<>0
+
+	  /************************************************************************/
+	  else{//SAIL pur
+	    //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
+	    scene.sail_pur(Cenv+isim,&Esource,envname);
+	    for(i=0;i<scene.radim;i++)
+	      B[isim]->ve[i]=B0[isim]->ve[i]+Cenv[isim]->ve[i];
+	  }//if denv==0 ie SAIL pur
+
+	  /**********************************************************************/
+
+	}//if calcul des rediffusions
+      }//for il (ciels)
+
 #ifdef _HD
-	if(ff_print) {
-	  //Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
-	  char carlu;
-	  Ferr <<"* ATTENTION - mode HD - Print la matrice a l'ecran\n"
-	    " Le voulez vous reellement \?(o/n)\?"<<'\n' ;
-	  carlu=getchar();
-	  if(carlu=='o' || carlu=='O')
-	    print_hd_mat(TabDiff);
-	}
-	// FF -> syst. lineaire 1-Xi*Fij
-	if(verbose>1)  
-	  Ferr <<"==>Bi=E+Bfar\n" ;
-	for(i=0;i<scene.radim;i++) 
-	  B0[0]->ve[i]+=Cenv[0]->ve[i];
-      
-	// Solve Ax=b; B precondionneur, tol seuil, limit nb_iter_max
+      if(!ordre1 && denv>0 && scene.nbphot==0){
+	// Solve Ax=b pour tous les ciels de la bande; tol seuil, limit nb_iter_max
 	clock.Start();
 	Ferr <<" MGCR-HD : seuil de cvgence = "  << seuil
-	     <<" - nb_iter_max = "  << nb_iter<<"\n " ;
-      
-	//print_hd_mat(TabDiff);
-	hd_mgcr(B[0],B0[0],TabDiff,seuil,100, nb_iter, &num_steps);
+	     <<" - nb_iter_max = "  << nb_iter<<" - nb de ciels = "<<nbsky<<"\n " ;
 
-#else
-	if(ff_print) {
-	  FILE * fff;
-	  fff=fopen("FF.dat","w");
-	  for(i=0;i<FF->m;i++) {
-	    for(j=0;j<FF->n;j++) {
-	      fprintf(fff,"%lf  ",sp_get_val(FF,i,j));
-	    }
-	    fprintf(fff,"\n");
-	  }
-	  fclose(fff);
-	}//if ff_print  
-	// FF -> syst. lineaire 1-Xi*Fij
-	SPROW	*r;
-	unsigned int  len;
-	double trans,refl,*pval;
-	opak=0;
-	for(i=0;i<FF->m;i++) {
-	  B0[0]->ve[i]+=Cenv[0]->ve[i];
-	  r = FF->row+i;
-	  len=r->len;
-	  TabDiff[i]->activ_num(i);
-	  refl= -TabDiff[i]->rho();
-	  if(!TabDiff[i]->isopaque()) {
-	    TabDiff[i]->togle_face();      
-	    trans=TabDiff[i]->tau();
-	  }
-	  for(j=0;j<len;j++) {
-	    pval=&(r->elt[j].val);
-	  
-	    //Ferr <<" FF("  << i<<",ndx "  << j<<") = "  << *pval<<"\n" ;
-	    if(*pval!=1) {
-	      if(*pval>0)
-		*pval*=refl;
-	      else
-		*pval*=trans;
-	    }
-	  }
-	  TabDiff[i]->active(0);
-	}
-	if(ff_print) {
-	  FILE * fff;
-	
-	  fff=fopen("M.dat","w");
-	  for(i=0;i<FF->m;i++) {
-	    for(j=0;j<FF->n;j++) {
-	      fprintf(fff,"%lf  ",sp_get_val(FF,i,j));
-	    }
-	    fprintf(fff,"\n");
-	  }
-	  fclose(fff);
-	}
-	//sparse matrix resolution (Conjugate Gradient)
-	// Solve Ax=b; B precondionneur, tol seuil, limit nb_iter_max
-	//Methode  Leyk's MGCR
-	clock.Start();
-	Ferr <<" MGCR : seuil de cvgence = "  << seuil
-	     <<" - nb_iter_max = "  << nb_iter<<"\n " ;
-      
-	B[0]=iter_spmgcr(FF, (SPMAT *)NULL, B0[0],seuil, B[0],
-			 20, nb_iter, &num_steps);
-#endif
+	//print_hd_mat(TabDiff);
+	hd_mgcr_multi(nbsky,B+ib*nbsky,B0+ib*nbsky,TabDiff,seuil,100, nb_iter,
+		      num_steps.data(),nbthread,residu.data(),duree,borne.data(),hist.data());
 	clock.Stop();
-	if(num_steps<nb_iter)
-	  Ferr <<" MGCR CONVERGE en "  << num_steps<<" iteration(s) \n" ;
-	else
-	  Ferr <<" MGCRN'A PAS CONVERGE' ! \n" ;
+	for(il=0;il<nbsky;il++){
+	  isim=ib*nbsky+il;
+	  bilan_solveur(num_steps[il],residu[il],borne[il],&hist[il]);
+	}
 	Ferr<<">>> Canestra[main] Resolution du SL par MGCR en "<<clock<<'\n';
-      }//if denv<>0
-
-      /************************************************************************/
-      else{//SAIL pur
-	//Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
-	scene.sail_pur(Cenv,&Esource,envname);
-	for(i=0;i<scene.radim;i++) 
-	  B[0]->ve[i]=B0[0]->ve[i]+Cenv[0]->ve[i];
-      }//if denv==0 ie SAIL pur
-    
-      /**********************************************************************/
-    
-    }//if calcul des rediffusions
-  
-    //Rendu - Traitement des resultats
-    genres();
+      }
+#endif
+
+      //Rendu - Traitement des resultats
+      for(il=0;il<nbsky;il++){
+	isim=ib*nbsky+il;
+	lightname=tablight[il];
+	genres();
+      }
+    }//for ib (bandes)
+    for(il=0;il<nbsky;il++){
+      delete [] Esup[il]; delete [] Einf[il];
+    }
+    delete [] Esup; delete [] Einf;
+#ifdef _HD
+    hd_libere_mat();
+#endif
     // Gestion des fichiers persistants
     if(bMemoriseMatrix==false) {
       EffaceMatrices();
@@ -434,38 +560,38 @@ int main(int argc,char **argv){
   
     if(false && !ordre1){// genere les fichiers .dat de debug B0 et Bf generes
       if(envname != NULL){
-	fres=fopen("Bf.dat","w");
+	fres=fopen(resname("Bf.dat"),"w");
 	for(i=0;i<nbf;i++) 
-	  fprintf(fres,"%lf \n",Cenv[0]->ve[i]);
+	  fprintf(fres,"%lf \n",Cenv[isim]->ve[i]);
 	fclose(fres);
       }
-      fres=fopen("B0.dat","w");
+      fres=fopen(resname("B0.dat"),"w");
       for(j=0;j<nbf;j++) {
-	fprintf(fres,"%.10lf \n ",B0[0]->ve[j]);
+	fprintf(fres,"%.10lf \n ",B0[isim]->ve[j]);
       }
       fclose(fres);
     }// if fichiers .dat de debug B0 et Bf generes
     // Ecriture des radiosites totales => B.dat
-    if(byfile){
-      fres=fopen("B.dat","w");
+    if(tofile && !lean){
+      fres=fopen(resname("B.dat"),"w");
       Ferr <<"==> Impression des resultats radim="  << scene.radim<<", nbcell="  << scene.nbcell<<"\n" ;
       for(j=0;j<nbf;j++) {
-	fprintf(fres,"%.10lf \n ",B[0]->ve[j]);
+	fprintf(fres,"%.10lf \n ",B[isim]->ve[j]);
       }
       fclose(fres);
     }
     // Ecriture des ecliarement des capteurs virtues => solem.dat
     if(scene.nbcell>0){
       //id 1er ordre Total en eclairement et surface
-      fres=fopen("solem.dat","w");
+      fres=fopen(resname("solem.dat"),"w");
       for(j=0;j<scene.nbcell;j++) {
 	fprintf(fres,"%.0lf\t %.10lf\t %.10lf \t%.6lf\n",
 		TabDiff[nbf+j]->primi().name(),
-		B0[0]->ve[nbf+j],B[0]->ve[nbf+j],
+		B0[isim]->ve[nbf+j],B[isim]->ve[nbf+j],
 		TabDiff[nbf+j]->primi().surface());
 	if(0) 
 	  Ferr <<"SOLEM: " << j<<"/" << scene.nbcell<<" radim="  << scene.radim
-	       <<", j+nbf="  << j+nbf<<", B0="  << B0[0]->ve[nbf+j]<<"\n" ;
+	       <<", j+nbf="  << j+nbf<<", B0="  << B0[isim]->ve[nbf+j]<<"\n" ;
       }
       fclose(fres);
     }//if nbcell>0
@@ -473,19 +599,40 @@ int main(int argc,char **argv){
     if(bio){
       reel *Ei,*Eabs,D,D0,D1,r0=0,r1=0,t0=0,t1=0,E0,E1,Esol,Ssol;
       int ia,shmid2=0;
-      FILE *fa=NULL,*fi=NULL,*ft=NULL,*ft0=NULL;
+      FILE *fa=NULL,*fi=NULL,*ft=NULL,*ft0=NULL,*fmc=NULL,*fsrc=NULL;
       double *Te=NULL,surf, nom; 
       int Nt; int Nt0=0;
-      if(byfile) {//by file
-	fa=fopen("Eabs.vec","w");
-	fi=fopen("Einc.vec","w");
-	ft=fopen("Etri.vec","w");    
-	fprintf(ft,"# canestrad: can=%s F8=%s opt=%s light=%s : denv=%.2f direct=%d \n",maqname,name8,optname,lightname,denv,(int)ordre1 );
-	fprintf(ft,"# label1 Area Eabs(E/s/m2) Ei(sup) Ei(inf) (Ex=surfacic density of energy <nrj/s/m2>)\n");
+      if(tofile) {//by file
+	if(!lean){
+	  fa=fopen(resname("Eabs.vec"),"w");
+	  fi=fopen(resname("Einc.vec"),"w");
+	  ft=fopen(resname("Etri.vec"),"w");    
+	  fprintf(ft,"# canestrad: can=%s F8=%s opt=%s light=%s : denv=%.2f direct=%d \n",byfile? maqname : "shm",name8,optname,lightname,denv,(int)ordre1 );
+	  fprintf(ft,"# label1 Area Eabs(E/s/m2) Ei(sup) Ei(inf) (Ex=surfacic density of energy <nrj/s/m2>)\n");
+	}
 	// Version repreannt la liste initiale de triangle du .can pr PyCaribu
-	ft0=fopen("Etri.vec0","w");    
-	fprintf(ft0,"# canestrad: can=%s F8=%s opt=%s light=%s : denv=%.2f direct=%d \n",maqname,name8,optname,lightname,denv,(int)ordre1 );
-	fprintf(ft0,"# No Label1 Area Eabs(E/s/m2) Ei(sup) Ei(inf) (Ex=surfacic density of energy <nrj/s/m2>)\n");
+	if(binres){
+	  // Etri.bin : entete ETRI, version, nb enregistrements (maj a la fin), taille enregistrement
+	  int head[3]={ETRI_VERSION,0,ETRI_RECSIZE};
+	  ft0=fopen(resname("Etri.bin"),"wb");
+	  fwrite("ETRI",1,4,ft0);
+	  fwrite(head,sizeof(int),3,ft0);
+	}
+	else{
+	  ft0=fopen(resname("Etri.vec0"),"w");    
+	  fprintf(ft0,"# canestrad: can=%s F8=%s opt=%s light=%s : denv=%.2f direct=%d \n",byfile? maqname : "shm",name8,optname,lightname,denv,(int)ordre1 );
+	  fprintf(ft0,"# No Label1 Area Eabs(E/s/m2) Ei(sup) Ei(inf) (Ex=surfacic density of energy <nrj/s/m2>)\n");
+	}
+	// Emc.vec0 : ecarts types des resultats de Monte Carlo, lignes de Etri
+	if(scene.nbphot>0 && !ordre1){
+	  fmc=fopen(resname("Emc.vec0"),"w");
+	  fprintf(fmc,"# No sd(Eabs) sd(Ei(sup)) sd(Ei(inf)) (standard errors of the Monte Carlo estimates)\n");
+	}
+	// Esrc.vec0 : eclairement direct par source (-D), lignes de Etri
+	if(parsrc){
+	  fsrc=fopen(resname("Esrc.vec0"),"w");
+	  fprintf(fsrc,"# No Source Ei(sup) Ei(inf) (direct irradiance from each light source, null values omitted)\n");
+	}
       
       }
       else{//by shared memory
@@ -540,9 +687,10 @@ int main(int argc,char **argv){
       scene.Ldiff0.debut(); // ! Ldiff.finito();Ldiff.suivant()){
       for(i=0;i<nbf;i++) {
 	//Geston de la sortie Etrivec0 identique a liste de triangle en entree - MC09
-	while(scene.Ldiff0.contenu()>=0 ){
+	while(tofile && scene.Ldiff0.contenu()>=0 ){
 	  if(scene.Ldiff0.finito()) break;
-	  fprintf(ft0,"%d %.0f 0 NaN NaN NaN\n",Nt0,scene.Ldiff0.contenu());
+	  etri0(ft0,Nt0,scene.Ldiff0.contenu(),0,NAN,NAN,NAN);
+	  emc0(fmc,Nt0,NAN,NAN,NAN);
 	  Nt0++;
 	  // printf("dbg 2, Nt0=%d, Ldiff0()=%d\n", Nt0, scene.Ldiff0.contenu());
 	  scene.Ldiff0.suivant();
@@ -572,22 +720,28 @@ int main(int argc,char **argv){
 	      Ei[i]=Eabs[ia]=-1;
 	    }
 	    else{
-	      Ei[i]=B[0]->ve[i]/diff->rho();
-	      Eabs[ia]=Ei[i]-B[0]->ve[i];
+	      Ei[i]=B[isim]->ve[i]/diff->rho();
+	      Eabs[ia]=Ei[i]-B[isim]->ve[i];
 	    }
-	    if(byfile){
-	      fprintf(fi,"%g\n",Ei[i]);
-	      fprintf(fa,"%g\n",Eabs[ia]*surf);
-	      fprintf(ft,"%.0f %f  %f  %f %f\n",nom, surf, Eabs[ia], Ei[i],-1.);
+	    if(tofile){
+	      if(!lean){
+		fprintf(fi,"%g\n",Ei[i]);
+		fprintf(fa,"%g\n",Eabs[ia]*surf);
+		fprintf(ft,"%.0f %f  %f  %f %f\n",nom, surf, Eabs[ia], Ei[i],-1.);
+	      }
 	      //liste compatible pycaribu - MC09  
-	      fprintf(ft0,"%d %.0f %f  %f  %f %f\n",Nt0,nom, surf, Eabs[ia], Ei[i],-1.);
+	      etri0(ft0,Nt0,nom, surf, Eabs[ia], Ei[i],-1.);
+	      if(fmc!=NULL)
+		emc0(fmc,Nt0,Asd[isim][i],Esd[isim][i],-1.);
+	      if(fsrc!=NULL)
+		esrc0(fsrc,Nt0,surf,Esrc[il][i],NULL);
 	      Nt0++;
 	      scene.Ldiff0.suivant(); 
 	    } else{
 	      Te[ia]=Eabs[ia]*surf;
 	      //MCoct05: caribu4.4
 	      //met dans le SegMem les eclairement des faces sup et inf 
-	      // Bug MC nov05: Te[ia+(Nt+1)]=B[0]->ve[i]*surf; //face sup
+	      // Bug MC nov05: Te[ia+(Nt+1)]=B[isim]->ve[i]*surf; //face sup
 	      Te[ia+(Nt-1)]=Ei[i]*surf; //face sup
 	      Te[ia+2*(Nt-1)]=-surf; //face inf
 	      // Ferr <<"Te["  << ia<<"]="  << Te[ia]<<"\n" ;
@@ -610,36 +764,42 @@ int main(int argc,char **argv){
 	      Eabs[ia]=-1;
 	      Ei[i-1]=Ei[i]=-1;
 	      if(r0==t1)
-		Eabs[ia]=B[0]->ve[i-1]*(1/r0-1)-B[0]->ve[i];
+		Eabs[ia]=B[isim]->ve[i-1]*(1/r0-1)-B[isim]->ve[i];
 	    }
 	    else{
-	      D0= B[0]->ve[i-1]*r1 - B[0]->ve[i]*t1;
-	      D1=r0*B[0]->ve[i] - t0*B[0]->ve[i-1];
+	      D0= B[isim]->ve[i-1]*r1 - B[isim]->ve[i]*t1;
+	      D1=r0*B[isim]->ve[i] - t0*B[isim]->ve[i-1];
 	      Ei[i-1]=D0/D;
 	      Ei[i]=D1/D;
-	      Eabs[ia]= Ei[i-1]+Ei[i] - (B[0]->ve[i-1]+B[0]->ve[i]);
+	      Eabs[ia]= Ei[i-1]+Ei[i] - (B[isim]->ve[i-1]+B[isim]->ve[i]);
 	      /* debug
-		 Ferr  << r0<<"\t"  <<  t1<<"\t= "  <<  B[0]->ve[i-1]<<"\n" ;
-		 Ferr  << t0<<"\t"  <<  r1<<"\t= "  <<  B[0]->ve[i]<<"\n" ;
+		 Ferr  << r0<<"\t"  <<  t1<<"\t= "  <<  B[isim]->ve[i-1]<<"\n" ;
+		 Ferr  << t0<<"\t"  <<  r1<<"\t= "  <<  B[isim]->ve[i]<<"\n" ;
 		 Ferr <<"D0="  << D0<<", D1="  << D1<<", D="  << D<<" => E["  
 		 << i-1<<"]="  << Ei[i-1]<<", E["  << i<<"]="  << Ei[i]
 		 <<", Ea["  <<  ia<<"]="  <<  Eabs[ia]<<"\n\n" ;
 		 /recommenter */
 	    }
-	    if(byfile){
-	      fprintf(fi,"%g\n%g\n",Ei[i-1], Ei[i]);
-	      fprintf(fa,"%g\n",Eabs[ia]*surf);
-	      fprintf(ft,"%.0f %f  %f  %f %f\n",nom, surf, Eabs[ia], Ei[i-1], Ei[i]);
+	    if(tofile){
+	      if(!lean){
+		fprintf(fi,"%g\n%g\n",Ei[i-1], Ei[i]);
+		fprintf(fa,"%g\n",Eabs[ia]*surf);
+		fprintf(ft,"%.0f %f  %f  %f %f\n",nom, surf, Eabs[ia], Ei[i-1], Ei[i]);
+	      }
 	      //liste compatible pycaribu - MC09  
-	      fprintf(ft0,"%d %.0f %f  %f  %f %f\n",Nt0,nom, surf,  Eabs[ia], Ei[i-1], Ei[i]);
+	      etri0(ft0,Nt0,nom, surf,  Eabs[ia], Ei[i-1], Ei[i]);
+	      if(fmc!=NULL)
+		emc0(fmc,Nt0,Asd[isim][i-1],Esd[isim][i-1],Esd[isim][i]);
+	      if(fsrc!=NULL)
+		esrc0(fsrc,Nt0,surf,Esrc[il][i-1],&Esrc[il][i]);
 	      Nt0++;
 	      scene.Ldiff0.suivant();
 	    } else{
 	      Te[ia]=Eabs[ia]*surf;
 	      //MCoct05: caribu4.4
 	      /* Bug 221105 MC
-		 Te[ia+(Nt+1)]=B[0]->ve[i-1]*surf;//face sup 
-		 Te[ia+2*(Nt+1)]=B[0]->ve[i]*surf; //face inf
+		 Te[ia+(Nt+1)]=B[isim]->ve[i-1]*surf;//face sup 
+		 Te[ia+2*(Nt+1)]=B[isim]->ve[i]*surf; //face inf
 	      */
 	      Te[ia+(Nt-1)]=Ei[i-1]*surf;//face sup 
 	      Te[ia+2*(Nt-1)]=Ei[i]*surf; //face inf
@@ -658,12 +818,12 @@ int main(int argc,char **argv){
 	}//if not soil appended
 	else{// soil appended and soil primitive
 	  /* Old version - Modif MC june08
-	     Esol+= B[0]->ve[i]*surf/diff->rho();
+	     Esol+= B[isim]->ve[i]*surf/diff->rho();
 	     Ssol+=surf;
 	  */
-	  Ei[i]=B[0]->ve[i]/diff->rho();
-	  Eabs[ia]=Ei[i]-B[0]->ve[i];
-	  if(byfile){
+	  Ei[i]=B[isim]->ve[i]/diff->rho();
+	  Eabs[ia]=Ei[i]-B[isim]->ve[i];
+	  if(tofile && !lean){
 	    fprintf(fi,"%g\n", Ei[i]);
 	    fprintf(fa,"%g\n",Eabs[ia]*surf);
 	    fprintf(ft,"%.0f %f  %f  %f %f\n",nom, surf, Eabs[ia], Ei[i],-2.);
@@ -674,9 +834,10 @@ int main(int argc,char **argv){
 	} 
       }//for nb_faces 
       //vidage de liste au cas ou - MC09
-      if(!scene.Ldiff0.finito())
+      if(tofile && !scene.Ldiff0.finito())
 	while(scene.Ldiff0.contenu()>=0 ){
-	  fprintf(ft0,"%d %.0f 0 NaN NaN NaN\n",Nt0,scene.Ldiff0.contenu());
+	  etri0(ft0,Nt0,scene.Ldiff0.contenu(),0,NAN,NAN,NAN);
+	  emc0(fmc,Nt0,NAN,NAN,NAN);
 	  Nt0++;
 	  //printf("dbg 6, Nt0=%d, Ldiff0()=%d\n", Nt0, scene.Ldiff0.contenu());
 	  scene.Ldiff0.suivant();
@@ -697,11 +858,21 @@ int main(int argc,char **argv){
 
       //Ferr << "Au max on atteint: Eabs["<<ia<<"]"<<'\n';
 
-      if(byfile){
-	fclose(fi); 
-	fclose(fa);
-	fclose(ft);
+      if(tofile){
+	if(!lean){
+	  fclose(fi); 
+	  fclose(fa);
+	  fclose(ft);
+	}
+	if(binres){// nb d'enregistrements dans l'entete
+	  fseek(ft0,8,SEEK_SET);
+	  fwrite(&Nt0,sizeof(int),1,ft0);
+	}
 	fclose(ft0);
+	if(fmc!=NULL)
+	  fclose(fmc);
+	if(fsrc!=NULL)
+	  fclose(fsrc);
       } else
 #ifndef WIN32
 	// Unix way
@@ -719,6 +890,238 @@ int main(int argc,char **argv){
   }//genres()
 
 
+  //======>  etri0(): une ligne de Etri.vec0, ou un enregistrement de Etri.bin
+  //  Etri.bin (little endian, non aligne) : int32 No, puis float64 Label1,
+  //  Area, Eabs, Ei(sup), Ei(inf)
+  void etri0(FILE *ft0,int no,double nom,double surf,double eabs,double esup,double einf){
+    if(binres){
+      double rec[5]={nom,surf,eabs,esup,einf};
+      fwrite(&no,sizeof(int),1,ft0);
+      fwrite(rec,sizeof(double),5,ft0);
+    }
+    else if(isnan(eabs))
+      fprintf(ft0,"%d %.0f 0 NaN NaN NaN\n",no,nom);
+    else
+      fprintf(ft0,"%d %.0f %f  %f  %f %f\n",no,nom,surf,eabs,esup,einf);
+  }//etri0()
+
+  //======>  emc0(): une ligne de Emc.vec0 (ecarts types de la ligne no de Etri)
+  void emc0(FILE *fmc,int no,double sdabs,double sdsup,double sdinf){
+    if(fmc==NULL)
+      return;
+    if(isnan(sdabs))
+      fprintf(fmc,"%d NaN NaN NaN\n",no);
+    else
+      fprintf(fmc,"%d %g %g %g\n",no,sdabs,sdsup,sdinf);
+  }//emc0()
+
+  //======>  esrc0(): lignes de Esrc.vec0 (ligne no de Etri), une par source
+  //  eclairant la face sup (Esup) ou la face inf (Einf, transparents) ; les
+  //  listes sont triees par source
+  void esrc0(FILE *fsrc,int no,double surf,const Esources &Esup,const Esources *Einf){
+    size_t k=0,l=0,nl=(Einf==NULL)? 0 : Einf->size();
+    while(k<Esup.size() || l<nl){
+      if(l==nl || (k<Esup.size() && Esup[k].first<(*Einf)[l].first)){
+	fprintf(fsrc,"%d %d %.10g 0\n",no,Esup[k].first,Esup[k].second/surf);
+	k++;
+      }
+      else if(k==Esup.size() || (*Einf)[l].first<Esup[k].first){
+	fprintf(fsrc,"%d %d 0 %.10g\n",no,(*Einf)[l].first,(*Einf)[l].second/surf);
+	l++;
+      }
+      else{
+	fprintf(fsrc,"%d %d %.10g %.10g\n",no,Esup[k].first,Esup[k].second/surf,
+		(*Einf)[l].second/surf);
+	k++; l++;
+      }
+    }
+  }//esrc0()
+
+  //======>  lignes_etri(): ligne de Etri de chaque face (-1 pour le sol ajoute),
+  //  dans l'ordre de genres() : les primitives rejetees ont une ligne, les deux
+  //  faces d'un transparent la meme
+  vector<int> lignes_etri(){
+    int nbf=scene.radim-scene.nbcell,Nt0=0;
+    char opaque=0;
+    vector<int> lignes(nbf,-1);
+    scene.Ldiff0.debut();
+    for(i=0;i<(unsigned int)nbf;i++){
+      while(!scene.Ldiff0.finito() && scene.Ldiff0.contenu()>=0){
+	Nt0++;
+	scene.Ldiff0.suivant();
+      }
+      diff=TabDiff[i];
+      if(opaque==2 || diff->isopaque())
+	opaque=0;
+      else
+	opaque++;
+      if(sol && diff->primi().name()==0)
+	continue;
+      lignes[i]=Nt0;
+      if(opaque!=1){
+	Nt0++;
+	scene.Ldiff0.suivant();
+      }
+    }
+    return lignes;
+  }//lignes_etri()
+
+  //======>  ecrit_gap(): aire (projetee sur l'horizontale) de chaque triangle vue
+  //  de chaque direction (-G), deux faces d'un transparent confondues :
+  //  une ligne "No Source Aire" par valeur non nulle, lignes de Etri
+  void ecrit_gap(const char *fic,const vector<Esources> &Esrc){
+    vector<int> lignes=lignes_etri();
+    size_t k,l;
+    FILE *fgap=fopen(fic,"w");
+    fprintf(fgap,"# No Source Area (horizontal projection of the area seen from each direction, null values omitted)\n");
+    for(i=0;i<lignes.size();i++){
+      if(lignes[i]<0)
+	continue;
+      if(i+1<lignes.size() && lignes[i+1]==lignes[i]){//transparent : fusion des faces
+	const Esources &Esup=Esrc[i],&Einf=Esrc[i+1];
+	for(k=l=0;k<Esup.size() || l<Einf.size();){
+	  if(l==Einf.size() || (k<Esup.size() && Esup[k].first<Einf[l].first)){
+	    fprintf(fgap,"%d %d %.10g\n",lignes[i],Esup[k].first,Esup[k].second);
+	    k++;
+	  }
+	  else if(k==Esup.size() || Einf[l].first<Esup[k].first){
+	    fprintf(fgap,"%d %d %.10g\n",lignes[i],Einf[l].first,Einf[l].second);
+	    l++;
+	  }
+	  else{
+	    fprintf(fgap,"%d %d %.10g\n",lignes[i],Esup[k].first,Esup[k].second+Einf[l].second);
+	    k++; l++;
+	  }
+	}
+	i++;
+      }
+      else
+	for(k=0;k<Esrc[i].size();k++)
+	  fprintf(fgap,"%d %d %.10g\n",lignes[i],Esrc[i][k].first,Esrc[i][k].second);
+    }
+    fclose(fgap);
+  }//ecrit_gap()
+
+  //======>  ecrit_cameras(): images des cameras hemispheriques (-V) dont les
+  //  positions "x y z" sont lues dans camname (cf. Canopy::cameras()).
+  //  Cam.bin (little endian) : "CAMS", int32 nb cameras, int32 taille, puis
+  //  les pixels en int32 : ligne de Etri du triangle vu, -1 ciel, -2 hors image
+  void ecrit_cameras(const char *fic){
+    vector<double> pos;
+    double x;
+    int nbcam,k;
+    map<Diffuseur*,int> ligne;
+    vector<int> lignes=lignes_etri();
+    ifstream fcam(camname,ios::in);
+    while(fcam>>x)
+      pos.push_back(x);
+    fcam.close();
+    nbcam=pos.size()/3;
+    vector<int> img((size_t)nbcam*tcam*tcam);
+    scene.cameras(nbcam,pos.data(),tcam,infty,img.data(),nbthread);
+    for(i=0;i<lignes.size();i++)
+      ligne[TabDiff[i]]=lignes[i];
+    for(size_t p=0;p<img.size();p++)
+      if(img[p]>=0){
+	k=ligne[scene.Tdiff[img[p]]];
+	img[p]=(k<0)? -1 : k;//sol ajoute (-s) : vu comme le ciel
+      }
+    FILE *fc=fopen(fic,"wb");
+    fwrite("CAMS",1,4,fc);
+    fwrite(&nbcam,sizeof(int),1,fc);
+    fwrite(&tcam,sizeof(int),1,fc);
+    fwrite(img.data(),sizeof(int),img.size(),fc);
+    fclose(fc);
+  }//ecrit_cameras()
+
+  //======>  resname(): nom du fichier de resultats fic pour la bande courante
+  //  fic si une seule bande, sinon suffixe par le nom du .opt : Etri.vec0 -> Etri_par.vec0
+  const char *resname(const char *fic){
+    static char nom[256];
+    const char *ext;
+    int lr;
+    if(nbande<2 && nbsky<2) 
+      return fic;
+    ext=strchr(fic,'.');
+    lr=snprintf(nom,sizeof(nom),"%.*s",(int)(ext-fic),fic);
+    if(nbsky>1)
+      lr+=snprintf(nom+lr,sizeof(nom)-lr,"_%s",racine(tablight[il]).c_str());
+    if(nbande>1)
+      lr+=snprintf(nom+lr,sizeof(nom)-lr,"_%s",racine(tabopt[ib]).c_str());
+    snprintf(nom+lr,sizeof(nom)-lr,"%s",ext);
+    return nom;
+  }//resname()
+
+  //======> racine(): nom de fichier sans repertoire ni extension
+  string racine(const char *fic){
+    const char *pt,*base=fic;
+    for(pt=fic;*pt;pt++)
+      if(*pt=='/' || *pt=='\\') base=pt+1;
+    pt=strrchr(base,'.');
+    return (pt==NULL)? string(base) : string(base,pt-base);
+  }//racine()
+
+  //======> bilan_solveur(): convergence de la simulation isim
+  // nb d'iterations, residu relatif final et majorant de l'erreur relative
+  // puis residus successifs => solver.dat (lu par Caribu),
+  // solution => fichier -x pour le prochain appel
+  void bilan_solveur(int num_steps,double residu,double borne,const vector<float> *hist){
+    unsigned int k;
+
+    if(duree>0 && (residu>seuil || residu<0) && num_steps<nb_iter)
+      Ferr <<" MGCR ARRETE apres "  << duree<<" s, "<< num_steps<<" iteration(s) - residu = "
+	   << residu<<" - erreur relative < "<<borne<<"\n" ;
+    else if(num_steps<nb_iter)
+      Ferr <<" MGCR CONVERGE en "  << num_steps<<" iteration(s) - residu = "
+	   << residu<<"\n" ;
+    else
+      Ferr <<" MGCRN'A PAS CONVERGE' ! \n" ;
+    if(tofile){
+      fres=fopen(resname("solver.dat"),"w");
+      fprintf(fres,"%d %.6g %.6g\n",num_steps,residu,borne);
+      if(hist!=NULL) {
+	for(k=0;k<hist->size();k++)
+	  fprintf(fres,"%.6g ",(*hist)[k]);
+	fprintf(fres,"\n");
+      }
+      fclose(fres);
+    }
+    if(tabx.size()>0)
+      ecrit_radiosite(tabx[isim],B[isim]);
+  }//bilan_solveur()
+
+  //======> lit_radiosite(): solution initiale du solveur (option -x)
+  // Fichier binaire : int n puis n double. Ignore s'il est absent ou si n
+  // ne correspond pas a la scene (geometrie differente)
+  bool lit_radiosite(const char *fic,VEC *x){
+    FILE *fx;
+    int n;
+    bool ok=false;
+    fx=fopen(fic,"rb");
+    if(fx==NULL)
+      return false;
+    if(fread(&n,sizeof(int),1,fx)==1 && n==(int)x->dim)
+      ok=(fread(x->ve,sizeof(double),n,fx)==(size_t)n);
+    fclose(fx);
+    if(!ok)
+      v_zero(x);
+    return ok;
+  }//lit_radiosite()
+
+  //======> ecrit_radiosite(): sauve la solution pour le prochain appel (-x)
+  void ecrit_radiosite(const char *fic,VEC *x){
+    FILE *fx;
+    int n=x->dim;
+    fx=fopen(fic,"wb");
+    if(fx==NULL){
+      Ferr <<"<!> Impossible d'ecrire "<<fic<<'\n' ;
+      return;
+    }
+    fwrite(&n,sizeof(int),1,fx);
+    fwrite(x->ve,sizeof(double),n,fx);
+    fclose(fx);
+  }//ecrit_radiosite()
+
   //======>  beep(): fait bip !
   inline void beep(const char *msg="M'enfin ...",int nbeep=1){
     cout<<(char) 7 <<msg<<endl;
@@ -730,10 +1133,16 @@ int main(int argc,char **argv){
     Ferr <<"Syntax Error:  the options of "  << prog<<" are \n" ;
     Ferr <<"  -M filename \t File describing the scene\n"	 
       "  -m shm_key\t Shared memory containing the scene\n"	
+      "  -o \t\t With -m, write the results in files (Etri.vec0,...) instead of shared memory\n"
+      "  -b \t\t With -A, write Etri.bin (binary) instead of Etri.vec0\n"
+      "  -D \t\t With -A, write the direct irradiance from each light source (Esrc.vec0)\n"
+      "  -G \t\t Only write the area of the primitives seen from each light direction (Gap.dat)\n"
+      "  -V filename \t Only write the images of hemispherical cameras at the positions of filename (Cam.bin)\n"
+      "  -K nb \t Resolution of the images of the hemispherical cameras [128]\n"
       "  -s Ns\t Append a soil to the scene (Ns is a treshold for the number of triangles)\n"
-      "  -p filename \t File describingthe optical properties\n"
-      "  -l filename \t File describing the light sources\n"	 
-      "  -8 filename \t Infinite periodic canopy \n"	 "  -e filename \t Mean fluxes data (computed by SAIL) \n"
+      "  -p filename \t File describingthe optical properties (repeat for several bands)\n"
+      "  -l filename \t File describing the light sources (repeat for several skies)\n"	 
+      "  -8 filename \t Infinite periodic canopy \n"	 "  -e filename \t Mean fluxes data (computed by SAIL), one per -p and -l (skies of the first band, then of the next one...)\n"
       "  -r Rsph \t Radius of the surrounding sphere \n"
       "  -d Dsph \t Diameter of the surrounding sphere \n"
       "  -F \t\t Print the form factors matrix \n"
@@ -741,8 +1150,14 @@ int main(int argc,char **argv){
       "  -S nb \t Number of simulations [1] \n"
       "  -i nb \t Number of iteration of the CG solver [100]\n" 
       "  -a threshold \t Threshold of the CG solver [1e6] \n"
+      "  -c seconds \t Time budget of the solver: stop with the partial solution [none]\n"
       "  -1 \t\t Compute only the direct lightning \n"
       "  -L nb \t Resolution of the light screen [1536]  \n"
+      "  -N nb \t Direct lighting by ray casting with nb rays per primitive instead of the light screen\n"
+      "  -P nb \t Scattering by Monte Carlo with nb photons per simulation instead of radiosity\n"
+      "  -z seed \t Seed of the Monte Carlo random streams [0]\n"
+      "  -n nb \t Number of threads (direct lightning, form factors, solver, photons) [1]\n"
+      "  -x filename \t Initial guess of the solver, updated with the solution (one per -p and -l, as -e)\n"
       "  -A \t\t Generate  energy vector (Eabs.dat, Einc.dat)\n"
       "  -g \t\t Generate the geometry file (geom.dat)\n"
       "  -B \t\t Test the effect of the choice of inner triangles (bias?) \n"
@@ -753,6 +1168,8 @@ int main(int argc,char **argv){
       "  -f filename \t Simulate and store the matrix in filemane \n"
       "  -w filename\t Read the matrix file to simulate an other radiative case, without to compute form factors \n"
       "  -t dirname \t Name of the directory where the FF file is stored\n"
+      "  -H ratio \t Hierarchical radiosity: groups of primitives whose radius is less than ratio (0<ratio<1)\n"
+      "\t\t times their distance to a primitive are seen by it as a whole (finite scenes)\n"
 #endif	 
       "  -h \t\t This help message "<<'\n' ; // "%c",7);
   }//erreur_syntaxe()
@@ -761,34 +1178,54 @@ int main(int argc,char **argv){
   //======> options(): traite la ligne de commande argv - MC98
   int options(int argc,char **argv){
     int c;
-    GetOpt option(argc,argv,"AC:BFTg1hs:L:M:R:S:8:a:d:e:f:i:l:m:n:p:r:t:v:w:");
+    GetOpt option(argc,argv,"AC:BDFGTbg1hos:H:K:L:M:N:P:R:S:V:8:a:c:d:e:f:i:l:m:n:p:r:t:v:w:x:z:");
   
     // Valeur par defaut des options
-    NB=52; nb_iter=1000; nbsim=1;
+    NB=52; nb_iter=1000; nbsim=1; nbthread=1;
     denv=0.30; seuil=1e-6; //-1 ie seuil_solver=MACHEPS
-    ffseul=infty=geom=ordre1=ff_print=bio=byseg=byfile=radonly=memsize=solem=false;
+    duree=0.0; //pas de limite
+    RAMAS=0.0;
+    ffseul=infty=geom=ordre1=ff_print=bio=byseg=byfile=tofile=binres=radonly=memsize=solem=parsrc=gap=false;
     bias=true;
-    lightname=maqname=envname=optname=name8=dirname=matname=nsolem=NULL;
+    lean=LEAN_IO; // CARIBU_LEAN_IO : ni E0.dat, B.dat, Eabs.vec, Einc.vec, Etri.vec
+    lightname=maqname=envname=optname=name8=dirname=matname=nsolem=camname=NULL;
+    tcam=128;
+    nbande=ib=0;
+    tablight.clear(); tabenv.clear(); tabx.clear();
     sol=0;
     scene.Timg=1536;
+    scene.nbray=0;
+    scene.nbphot=0; scene.graine=0;
     // Traitememnt des options
     if(argc<2){erreur_syntaxe(argv[0]);return 1;}
     while((c=option())!=EOF)
       switch(c) {
       case 'A' : bio =true;                       break;// genere Eabs.dat et Einc.dat
+      case 'b' : binres=true;                    break;// Etri.bin au lieu de Etri.vec0
       case 'B' : bias=false;                      break;// pb des a cheval sur la sphere  
       case 'C' : nsolem=option.optarg; solem=true;break;// solem.can     
+      case 'D' : parsrc=true;                    break;// Esrc.vec0 : direct par source
       case 'F' : ff_print=true;                  break;// FF -> FF.dat
+      case 'G' : gap=ordre1=true;                break;// Gap.dat : aires vues des sources
+      case 'H' : RAMAS=atof(option.optarg);      break;// radiosite hierarchique
+      case 'K' : tcam=atoi(option.optarg);       break;// resolution des cameras
       case 'L' : scene.Timg=atoi(option.optarg); break;//Resolution projplan 
       case 'M' : maqname=option.optarg; byfile=true; break;//maquette .can
+      case 'N' : scene.nbray=atoi(option.optarg); break;//direct par lancer de rayons
+      case 'P' : scene.nbphot=atoi(option.optarg); break;//rediffusions par Monte Carlo
       case 'S' : nbsim=atoi(option.optarg);      break;// nombre de simulations  
       case 'R' : NB=atoi(option.optarg);      break;// Resolution FF
       case 'T' : memsize=true;                   break;// Appel maxmem> maxmem.res mem en Ko 
+      case 'V' : camname=option.optarg;          break;// cameras hemispheriques
       case '1' : ordre1=true;                    break;//stop apres ordre 1
       case '8' : infty=true;name8=option.optarg; break;//infinity  
       case 'a' : seuil=atof(option.optarg);      break;// seuil de convergence
+      case 'c' : duree=atof(option.optarg);      break;// duree max du solveur (s)
       case 'd' : denv=atof(option.optarg)/2.;    break;// diam de la sphere
-      case 'e' : envname=option.optarg;          break;//donnees de l'envt (eg. sail)
+      case 'e' : //donnees de l'envt (eg. sail), une par bande
+	tabenv.push_back(option.optarg);
+	envname=tabenv[0];
+	break;
       case 'f' : matname=option.optarg;
 	radonly=false;
 	bMemoriseMatrix=true;
@@ -796,9 +1233,17 @@ int main(int argc,char **argv){
       case 'g' : geom=true;                     break;
       case 'h' : erreur_syntaxe(argv[0]); return 1;
       case 'i' : nb_iter=atoi(option.optarg);    break;// nbre d'iterations
-      case 'l' : lightname=option.optarg;        break;
+      case 'l' : //sources, une par ciel
+	tablight.push_back(option.optarg);
+	lightname=tablight[0];
+	break;
       case 'm' : clef_shm=atoi(option.optarg);byseg=true; break;// by segmem clef 
-      case 'p' : optname=option.optarg;          break;
+      case 'n' : nbthread=atoi(option.optarg);    break;// threads du direct, des FF et du solveur
+      case 'o' : tofile=true;                     break;// resultats en fichiers meme si -m
+      case 'p' : //prop. optiques, une par bande
+	if(nbande<NBANDE_MAX) tabopt[nbande++]=option.optarg;
+	optname=tabopt[0];
+	break;
       case 'r' : denv=atof(option.optarg);       break;// rayon de la sphere
       case 's' : sol=atoi(option.optarg);;       break;// ajoute un sol
       case 't' : dirname=option.optarg;          break;// specifie le dir des hd mat  ; defaut = /tmp
@@ -808,9 +1253,44 @@ int main(int argc,char **argv){
 	bMemoriseMatrix=true;
 	break;
 	// Without :  lit la matrice pour refaire des calculs en changeant les po ou le sun
+      case 'x' : //solution initiale du solveur, une par bande
+	tabx.push_back(option.optarg);
+	break;
+      case 'z' : scene.graine=atoi(option.optarg); break;// graine de Monte Carlo
       default  : erreur_syntaxe(argv[0]); return 1;
       }// switch
   
+    // par defaut, les resultats suivent la maquette (fichier ou SegMem)
+    tofile=tofile||byfile;
+    nbsky=tablight.size();
+    if(nbande*nbsky>(unsigned int)nbsim) nbsim=nbande*nbsky;
+    if(tabenv.size()>0 && tabenv.size()!=nbande*nbsky){
+      Ferr <<"<!> Fatal error"  << (char)7<<"\n==> Canestra should be called "
+	"with as many -e envname as -p optname times -l lightname\n " ;
+      return 1;
+    }
+    if(scene.nbray<0){
+      Ferr <<"<!> Fatal error"  << (char)7<<"\n==> The number of rays of -N should be positive\n " ;
+      return 1;
+    }
+    if(scene.nbphot<0){
+      Ferr <<"<!> Fatal error"  << (char)7<<"\n==> The number of photons of -P should be positive\n " ;
+      return 1;
+    }
+    if(RAMAS<0 || RAMAS>=1){
+      Ferr <<"<!> Fatal error"  << (char)7<<"\n==> The ratio of -H should be in [0,1[\n " ;
+      return 1;
+    }
+    if(tabx.size()>0 && tabx.size()!=nbande*nbsky){
+      Ferr <<"<!> Fatal error"  << (char)7<<"\n==> Canestra should be called "
+	"with as many -x filename as -p optname times -l lightname\n " ;
+      return 1;
+    }
+    if((nbande>1 || nbsky>1) && !tofile){
+      Ferr <<"<!> Fatal error"  << (char)7<<"\n==> Several -p optname or -l lightname need "
+	"the results in files (-M or -m with -o)\n " ;
+      return 1;
+    }
     if (clef_shm != -1){
       Ferr <<"-------------o clef_shm = "<<clef_shm<<" o---------------"<<'\n';
     }
@@ -828,14 +1308,18 @@ int main(int argc,char **argv){
   
     if(byfile) cout <<"\n Fichier maquette  :: "<<maqname;
     if(byseg ) cout <<"\n SegMem  maquette  :: "<<clef_shm;
-    cout <<"\n Fichier optique   :: "<<optname;
-    cout <<"\n Fichier sources   :: "<<lightname; 
+    for(i=0;i<nbande;i++)
+      cout <<"\n Fichier optique   :: "<<tabopt[i];
+    for(i=0;i<nbsky;i++)
+      cout <<"\n Fichier sources   :: "<<tablight[i]; 
     cout <<"\n Seuil convergence :: "<<seuil;
+    if(duree>0) cout <<"\n Duree solveur     :: "<<duree<<" s";
     cout <<"\n Dist envt (rayon) :: "<<denv;
     if(denv==0) cout <<" ==> <!> SAIL pur";
     if(denv<0){
       cout <<" ==> <!> full-matrix Radiosity (not nested)";
       envname=NULL;
+      tabenv.clear();
     }
     cout<<endl;
     if(matname!=NULL) {
@@ -861,6 +1345,13 @@ int main(int argc,char **argv){
       }
     }
     Ferr <<" Projection disk   :: "  << NB<<"x"  << NB<<"\n" ;
+    if(scene.nbray>0)
+      Ferr <<" Direct            :: lancer de "  << scene.nbray<<" rayon(s) par primitive\n" ;
+    if(scene.nbphot>0 && !ordre1)
+      Ferr <<" Rediffusions      :: Monte Carlo, "  << scene.nbphot<<" photon(s), graine "
+	   << scene.graine<<"\n" ;
+    if(RAMAS>0)
+      Ferr <<" Hierarchique      :: amas si rayon < "  << RAMAS<<" x distance\n" ;
     if(!bias)
       Ferr <<" Option test du biais(?) des triangles a-cheval sur la sphere ACTIVEE\n" ;
     if(envname==NULL && !ordre1){
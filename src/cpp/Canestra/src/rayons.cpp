@@ -0,0 +1,465 @@
+//Eclairement direct par lancer de rayons : BVH des diffuseurs reels (et des
+//capteurs), Canopy::rayplan(), requetes des photons (cf. rayons.h) et
+//cameras hemispheriques (Canopy::cameras())
+
+#include <iostream>
+using namespace std ;
+
+#include <cmath>
+#include <vector>
+#include <map>
+#include <thread>
+#include <algorithm>
+
+#include "canopy.h"
+#include "outils.h"
+#define _RAYONS
+#include "rayons.h"
+
+//nb max de triangles d'une feuille de la BVH
+#define FEUILLE_BVH 4
+
+struct TriBVH {
+  double A[3],AB[3],AC[3];
+  Diffuseur *diff;
+};
+
+// noeuds ranges en profondeur : le fils gauche suit son pere, le fils droit
+// est en deb ; une feuille (nb>0) contient tri[deb..deb+nb-1]
+struct NoeudBVH {
+  double bmin[3],bmax[3];
+  int deb,nb;
+};
+
+struct BVH {
+  vector<TriBVH> tri;
+  vector<NoeudBVH> noeuds;
+};
+
+static BVH reels,capteurs;
+static double eps_bvh; // distance minimale d'une intersection
+
+static inline double centre_tri(const TriBVH &t,int k) {
+  return t.A[k]+(t.AB[k]+t.AC[k])/3.;
+}
+
+// partage median sur l'axe le plus etendu des centres des triangles
+static int construit_bvh(BVH &b,int deb,int fin) {
+  int n,i,k,axe,mil,droit;
+  NoeudBVH nd;
+  double cmin[3],cmax[3],c;
+
+  for(k=0;k<3;k++) {
+    nd.bmin[k]=cmin[k]=1e30;
+    nd.bmax[k]=cmax[k]=-1e30;
+  }
+  for(i=deb;i<fin;i++)
+    for(k=0;k<3;k++) {
+      const TriBVH &t=b.tri[i];
+      nd.bmin[k]=min(nd.bmin[k],min(t.A[k],min(t.A[k]+t.AB[k],t.A[k]+t.AC[k])));
+      nd.bmax[k]=max(nd.bmax[k],max(t.A[k],max(t.A[k]+t.AB[k],t.A[k]+t.AC[k])));
+      c=centre_tri(t,k);
+      cmin[k]=min(cmin[k],c);
+      cmax[k]=max(cmax[k],c);
+    }
+  nd.deb=deb; nd.nb=fin-deb;
+  n=b.noeuds.size();
+  b.noeuds.push_back(nd);
+  axe=0;
+  for(k=1;k<3;k++)
+    if(cmax[k]-cmin[k]>cmax[axe]-cmin[axe])
+      axe=k;
+  if(fin-deb<=FEUILLE_BVH || cmax[axe]<=cmin[axe])//sinon centres confondus : feuille
+    return n;
+  mil=(deb+fin)/2;
+  nth_element(b.tri.begin()+deb,b.tri.begin()+mil,b.tri.begin()+fin,
+	      [axe](const TriBVH &t1,const TriBVH &t2){return centre_tri(t1,axe)<centre_tri(t2,axe);});
+  construit_bvh(b,deb,mil);
+  droit=construit_bvh(b,mil,fin);
+  b.noeuds[n].deb=droit;
+  b.noeuds[n].nb=0;
+  return n;
+}//construit_bvh()
+
+void init_rayons(Diffuseur **Tdiff,unsigned int nbdiff) {
+  unsigned int n;
+  int i,k;
+  TriBVH t;
+  Point P[3];
+
+  libere_rayons();
+  eps_bvh=1e-9;
+  for(n=0;n<nbdiff;n++) {
+    for(i=0;i<3;i++)
+      P[i]=Tdiff[n]->primi()[i];
+    for(k=0;k<3;k++) {
+      t.A[k]=P[0][k];
+      t.AB[k]=P[1][k]-P[0][k];
+      t.AC[k]=P[2][k]-P[0][k];
+    }
+    t.diff=Tdiff[n];
+    if(Tdiff[n]->isreal())
+      reels.tri.push_back(t);
+    else
+      capteurs.tri.push_back(t);
+  }
+  if(!capteurs.tri.empty())
+    construit_bvh(capteurs,0,capteurs.tri.size());
+  if(reels.tri.empty())
+    return;
+  construit_bvh(reels,0,reels.tri.size());
+  eps_bvh=0.0;
+  for(k=0;k<3;k++)
+    eps_bvh+=(reels.noeuds[0].bmax[k]-reels.noeuds[0].bmin[k])*(reels.noeuds[0].bmax[k]-reels.noeuds[0].bmin[k]);
+  eps_bvh=1e-7*sqrt(eps_bvh);
+  Ferr <<" Lancer de rayons : BVH de "<<(int)reels.noeuds.size()<<" noeuds sur "<<(int)reels.tri.size()<<" diffuseurs\n";
+}//init_rayons()
+
+void libere_rayons() {
+  reels.tri.clear();
+  reels.noeuds.clear();
+  capteurs.tri.clear();
+  capteurs.noeuds.clear();
+}//libere_rayons()
+
+// distance d de l'intersection du rayon o+d*r avec le triangle t si
+// eps_bvh<d<tmax, -1 sinon (Moller-Trumbore)
+static inline double intersecte(const TriBVH &t,const double *o,const double *r,double tmax) {
+  double p[3],q[3],s[3],det,u,v,d;
+
+  p[0]=r[1]*t.AC[2]-r[2]*t.AC[1];
+  p[1]=r[2]*t.AC[0]-r[0]*t.AC[2];
+  p[2]=r[0]*t.AC[1]-r[1]*t.AC[0];
+  det=t.AB[0]*p[0]+t.AB[1]*p[1]+t.AB[2]*p[2];
+  if(det==0.0)
+    return -1.0;
+  det=1./det;
+  s[0]=o[0]-t.A[0]; s[1]=o[1]-t.A[1]; s[2]=o[2]-t.A[2];
+  u=(s[0]*p[0]+s[1]*p[1]+s[2]*p[2])*det;
+  if(u<0.0 || u>1.0)
+    return -1.0;
+  q[0]=s[1]*t.AB[2]-s[2]*t.AB[1];
+  q[1]=s[2]*t.AB[0]-s[0]*t.AB[2];
+  q[2]=s[0]*t.AB[1]-s[1]*t.AB[0];
+  v=(r[0]*q[0]+r[1]*q[1]+r[2]*q[2])*det;
+  if(v<0.0 || u+v>1.0)
+    return -1.0;
+  d=(t.AC[0]*q[0]+t.AC[1]*q[1]+t.AC[2]*q[2])*det;
+  return (d>eps_bvh && d<tmax)? d : -1.0;
+}//intersecte()
+
+// parcours des triangles de b rencontres par le rayon o+d*r, eps_bvh<d<*tmax
+// (inv : inverses des composantes de r) : touche(t,d) peut reduire *tmax
+// (recherche de la plus proche intersection) et renvoie true pour arreter
+template<class F>
+static bool parcours(const BVH &b,const double *o,const double *r,const double *inv,
+		     double *tmax,F touche) {
+  int pile[128],np=0,i,k;
+  double t0,t1,ta,tb,d;
+
+  if(b.noeuds.empty())
+    return false;
+  pile[np++]=0;
+  while(np>0) {
+    i=pile[--np];
+    const NoeudBVH &nd=b.noeuds[i];
+    t0=eps_bvh; t1=*tmax;
+    for(k=0;k<3 && t0<=t1;k++) {
+      ta=(nd.bmin[k]-o[k])*inv[k];
+      tb=(nd.bmax[k]-o[k])*inv[k];
+      if(ta>tb) swap(ta,tb);
+      t0=max(t0,ta);
+      t1=min(t1,tb);
+    }
+    if(t0>t1)
+      continue;
+    if(nd.nb>0) {
+      for(k=nd.deb;k<nd.deb+nd.nb;k++)
+	if((d=intersecte(b.tri[k],o,r,*tmax))>0 && touche(b.tri[k],d))
+	  return true;
+    }
+    else {
+      pile[np++]=nd.deb;
+      pile[np++]=i+1;
+    }
+  }
+  return false;
+}//parcours()
+
+// le rayon issu de o dans la direction r rencontre-t-il un diffuseur autre
+// que exclu ?
+static bool ombre(const double *o,const double *r,const double *inv,Diffuseur *exclu) {
+  double tmax=1e30;
+
+  return parcours(reels,o,r,inv,&tmax,
+		  [exclu](const TriBVH &t,double d){return t.diff!=exclu;});
+}//ombre()
+
+// diffuseur reel le plus proche sur le rayon, avant *tmax (mis a jour)
+static Diffuseur *proche(const double *o,const double *r,const double *inv,
+			 Diffuseur *exclu,double *tmax) {
+  Diffuseur *vu=NULL;
+
+  parcours(reels,o,r,inv,tmax,[&](const TriBVH &t,double d){
+      if(t.diff!=exclu) {
+	*tmax=d;
+	vu=t.diff;
+      }
+      return false;});
+  return vu;
+}//proche()
+
+// scene infinie : copies du motif (periodes L) dont le rayon issu de p croise
+// l'emprise rac entre 0 et tlim ; tester la copie decalee de p revient a
+// tester la scene depuis o=p-decalage : copie(o,centre) renvoie true pour
+// arreter (centre : copie d'origine)
+template<class F>
+static bool copies(const double *p,const double *r,double tlim,const double *L,
+		   const NoeudBVH &rac,F copie) {
+  double o[3],x0,x1,y0,y1,ta,tb;
+  int i,j,i0,i1,j0,j1;
+
+  x0=min(p[0],p[0]+r[0]*tlim); x1=max(p[0],p[0]+r[0]*tlim);
+  i0=(int)ceil((x0-rac.bmax[0])/L[0]);
+  i1=(int)floor((x1-rac.bmin[0])/L[0]);
+  o[2]=p[2];
+  for(i=i0;i<=i1;i++) {
+    //portion du rayon au dessus de la copie i (en x)
+    ta=0.0; tb=tlim;
+    if(fabs(r[0])>1e-12) {
+      ta=(rac.bmin[0]+i*L[0]-p[0])/r[0];
+      tb=(rac.bmax[0]+i*L[0]-p[0])/r[0];
+      if(ta>tb) swap(ta,tb);
+      ta=max(ta,0.0);
+      tb=min(tb,tlim);
+      if(ta>tb)
+	continue;
+    }
+    y0=min(p[1]+r[1]*ta,p[1]+r[1]*tb); y1=max(p[1]+r[1]*ta,p[1]+r[1]*tb);
+    j0=(int)ceil((y0-rac.bmax[1])/L[1]);
+    j1=(int)floor((y1-rac.bmin[1])/L[1]);
+    o[0]=p[0]-i*L[0];
+    for(j=j0;j<=j1;j++) {
+      o[1]=p[1]-j*L[1];
+      if(copie(o,i==0 && j==0))
+	return true;
+    }
+  }
+  return false;
+}//copies()
+
+// ombre en scene infinie : jusqu'au sommet du couvert
+static bool ombre_infini(const double *p,const double *r,const double *inv,
+			 const double *L,Diffuseur *exclu) {
+  double ttop;
+
+  if(reels.noeuds.empty())
+    return false;
+  if(r[2]<=1e-9)//rayon rasant : toujours intercepte
+    return true;
+  const NoeudBVH &rac=reels.noeuds[0];
+  ttop=max(0.0,(rac.bmax[2]-p[2])/r[2]);
+  return copies(p,r,ttop,L,rac,[&](const double *o,bool centre){
+      return ombre(o,r,inv,centre? exclu : NULL);});
+}//ombre_infini()
+
+static inline void inverses(const double *r,double *inv) {
+  for(int k=0;k<3;k++)
+    inv[k]=1./((fabs(r[k])>1e-30)? r[k] : 1e-30);
+}
+
+bool eclaire(const double *p,const double *r,bool infty,const double *L) {
+  double inv[3];
+
+  inverses(r,inv);
+  return !((infty)? ombre_infini(p,r,inv,L,NULL) : ombre(p,r,inv,NULL));
+}//eclaire()
+
+// distance de sortie de la tranche [zmin,zmax] de la scene infinie, elargie
+// pour garder les triangles horizontaux de ses bords, et bornee a
+// DMAX_INFINI periodes pour les rayons rasants
+#define DMAX_INFINI 50
+static double sortie_tranche(const double *p,const double *r,const double *L,
+			     double zmin,double zmax) {
+  double tlim=DMAX_INFINI*(L[0]+L[1]),marge=1e-6*(1.0+zmax-zmin);
+
+  zmin-=marge;
+  zmax+=marge;
+
+  if(r[2]>1e-12)
+    tlim=min(tlim,(zmax-p[2])/r[2]);
+  else if(r[2]<-1e-12)
+    tlim=min(tlim,(zmin-p[2])/r[2]);
+  return tlim;
+}//sortie_tranche()
+
+Diffuseur *impact(const double *p,const double *r,bool infty,const double *L,
+		  Diffuseur *exclu,double *q,double *t) {
+  double inv[3],tlim;
+  const double *oo=p;
+  double ov[3];
+  Diffuseur *vu=NULL;
+
+  *t=1e30;
+  if(reels.noeuds.empty())
+    return NULL;
+  inverses(r,inv);
+  if(!infty)
+    vu=proche(p,r,inv,exclu,t);
+  else {
+    const NoeudBVH &rac=reels.noeuds[0];
+    tlim=sortie_tranche(p,r,L,rac.bmin[2],rac.bmax[2]);
+    if(tlim<=0)
+      return NULL;
+    *t=tlim;
+    copies(p,r,tlim,L,rac,[&](const double *o,bool centre){
+	Diffuseur *d=proche(o,r,inv,centre? exclu : NULL,t);
+	if(d!=NULL) {
+	  vu=d;
+	  ov[0]=o[0]; ov[1]=o[1]; ov[2]=o[2];
+	  oo=ov;
+	}
+	return false;});
+  }
+  if(vu!=NULL)
+    for(int k=0;k<3;k++)
+      q[k]=oo[k]+*t*r[k];
+  return vu;
+}//impact()
+
+void capteurs_traverses(const double *p,const double *r,bool infty,const double *L,
+			double t,vector<Diffuseur*> &vus) {
+  double inv[3],tlim;
+
+  vus.clear();
+  if(capteurs.noeuds.empty())
+    return;
+  inverses(r,inv);
+  auto note=[&](const TriBVH &tr,double d){vus.push_back(tr.diff); return false;};
+  if(!infty) {
+    tlim=t;
+    parcours(capteurs,p,r,inv,&tlim,note);
+  }
+  else {
+    const NoeudBVH &rac=capteurs.noeuds[0];
+    t=min(t,sortie_tranche(p,r,L,rac.bmin[2],rac.bmax[2]));
+    if(t<=0)
+      return;
+    copies(p,r,t,L,rac,[&](const double *o,bool centre){
+	tlim=t;
+	parcours(capteurs,o,r,inv,&tlim,note);
+	return false;});
+  }
+}//capteurs_traverses()
+
+//-************ Canopy::rayplan() ********************
+// Equivalent de projplan() par lancer de rayons : Bo recoit la surface vue
+// de la source (ramenee a l'horizontale) des faces des diffuseurs, estimee
+// par nbray points de chaque diffuseur (suite R2, le premier au centre)
+void Canopy::rayplan(Vecteur &visee,bool infty,double *Bo) {
+  unsigned int n;
+  int s,nbvu;
+  double r[3],inv[3],L[2],p[3],a,b,cosn,costeta,val;
+  Point P[3];
+  Vecteur N;
+  Diffuseur *pdiff;
+  const double g1=0.7548776662466927,g2=0.5698402909980532;
+
+  visee.normalise();
+  costeta=-visee[2];
+  if(costeta<=0.0)
+    return;
+  for(s=0;s<3;s++)
+    r[s]=-visee[s];
+  inverses(r,inv);
+  L[0]=vmax[0]-vmin[0];
+  L[1]=vmax[1]-vmin[1];
+  for(n=0;n<nbdiff;n++) {
+    pdiff=Tdiff[n];
+    N=pdiff->primi().normal();
+    cosn=fabs(visee.prod_scalaire(N));
+    //capteur vu par dessous (cf. projplan())
+    if(cosn==0.0 || (!pdiff->isreal() && visee.prod_scalaire(N)>=0))
+      continue;
+    for(s=0;s<3;s++)
+      P[s]=pdiff->primi()[s];
+    nbvu=0;
+    for(s=0;s<nbray;s++) {
+      a=fmod(1./3.+s*g1,1.0);
+      b=fmod(1./3.+s*g2,1.0);
+      if(a+b>1.0) {
+	a=1.0-a; b=1.0-b;
+      }
+      for(int k=0;k<3;k++)
+	p[k]=P[0][k]+a*(P[1][k]-P[0][k])+b*(P[2][k]-P[0][k]);
+      if(!((infty)? ombre_infini(p,r,inv,L,pdiff) : ombre(p,r,inv,pdiff)))
+	nbvu++;
+    }
+    val=nbvu*pdiff->surface()*cosn/nbray/costeta;
+    if(!pdiff->isreal())
+      Bo[pdiff->num()]+=val;
+    else {
+      Bo[pdiff->num_vu(visee)]+=val;
+      if(!pdiff->isopaque())
+	Bo[pdiff->num_dos(visee)]-=val;
+    }
+  }
+}//Canopy::rayplan()
+
+//-************ Canopy::cameras() ********************
+// Cameras hemispheriques virtuelles : images taille x taille du ciel vu des
+// positions pos[3c..3c+2], en projection equidistante (distance au centre
+// proportionnelle a l'angle zenithal), lignes vers -y et colonnes vers +x.
+// Chaque pixel recoit l'indice dans Tdiff du diffuseur reel vu, -1 pour le
+// ciel et -2 hors du cercle. Les cameras sont reparties en blocs contigus sur
+// nbth threads, qui partagent la BVH de rayplan().
+void Canopy::cameras(int nbcam,const double *pos,int taille,bool infty,int *img,int nbth) {
+  int t;
+  unsigned int n;
+  double L[2];
+  vector<thread> pool;
+  map<Diffuseur*,int> indice;
+
+  if(nbth>nbcam) nbth=nbcam;
+  if(nbth<1) nbth=1;
+  liste_diff();
+  init_rayons(Tdiff,nbdiff);
+  for(n=0;n<nbdiff;n++)
+    indice[Tdiff[n]]=n;
+  L[0]=vmax[0]-vmin[0];
+  L[1]=vmax[1]-vmin[1];
+  auto photographie=[&](int t){
+    int c,i,j,*pix;
+    double x,y,rho,teta,phi,r[3],q[3],dist;
+    Diffuseur *vu;
+    for(c=t*nbcam/nbth;c<(t+1)*nbcam/nbth;c++){
+      pix=img+(size_t)c*taille*taille;
+      for(i=0;i<taille;i++)
+	for(j=0;j<taille;j++,pix++){
+	  x=2.*(j+0.5)/taille-1.;
+	  y=1.-2.*(i+0.5)/taille;
+	  rho=sqrt(x*x+y*y);
+	  if(rho>1.){
+	    *pix=-2;
+	    continue;
+	  }
+	  teta=rho*M_PI/2.;
+	  phi=atan2(y,x);
+	  r[0]=sin(teta)*cos(phi);
+	  r[1]=sin(teta)*sin(phi);
+	  r[2]=cos(teta);
+	  vu=impact(pos+3*c,r,infty,L,NULL,q,&dist);
+	  *pix=(vu==NULL)? -1 : indice.find(vu)->second;
+	}
+    }
+  };
+  if(nbth==1)
+    photographie(0);
+  else{
+    for(t=0;t<nbth;t++)
+      pool.push_back(thread(photographie,t));
+    for(t=0;t<nbth;t++)
+      pool[t].join();
+  }
+  libere_rayons();
+}//Canopy::cameras()
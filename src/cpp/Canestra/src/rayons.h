@@ -0,0 +1,34 @@
+//Eclairement direct par lancer de rayons (option -N) : chaque diffuseur est
+//echantillonne par nbray points dont on teste la visibilite vers la source
+//dans une hierarchie de volumes englobants (BVH) des diffuseurs reels, au
+//lieu de la projection dans le Z-buffer de projplan(). Le cout suit la
+//complexite de la scene et non la taille de l'ecran, et les petits triangles
+//ne sont plus perdus entre les pixels. En scene infinie, les rayons
+//traversent les copies periodiques du motif (Canopy::rayplan(), rayons.cpp).
+//Les memes BVH servent au suivi des photons des rediffusions par Monte Carlo
+//(impact(), capteurs_traverses(), cf. photons.cpp).
+
+#include <vector>
+
+#undef EXTR
+#ifdef _RAYONS
+#define EXTR
+#else
+#define EXTR extern
+#endif
+
+//construit la BVH des diffuseurs reels de Tdiff
+EXTR void init_rayons(Diffuseur **Tdiff,unsigned int nbdiff);
+EXTR void libere_rayons();
+
+//diffuseur reel le plus proche sur le rayon issu de p dans la direction r
+//(unitaire), hors exclu, en traversant les copies du motif de periodes L si
+//infty : q recoit le point d'impact ramene dans la copie d'origine et t sa
+//distance. NULL si le rayon sort de la scene
+EXTR Diffuseur *impact(const double *p,const double *r,bool infty,const double *L,
+		       Diffuseur *exclu,double *q,double *t);
+//le point p (hors diffuseurs) voit-il la source de direction r (vers la source) ?
+EXTR bool eclaire(const double *p,const double *r,bool infty,const double *L);
+//capteurs traverses par le rayon avant la distance t
+EXTR void capteurs_traverses(const double *p,const double *r,bool infty,const double *L,
+			     double t,std::vector<Diffuseur*> &vus);
@@ -14,6 +14,12 @@ using namespace std;
 
 #include <cmath>
 #include <cstdio>
+#include <cstdlib>
+#include <string>
+#include <vector>
+#include <thread>
+#include <algorithm>
+#include <chrono>
 
 #include "canopy.h"
 #include "outils.h"
@@ -33,314 +39,513 @@ extern "C" {
 #include "matrix2.h"
 }
 
-static double nff;
+// Matrice des FF en memoire, chargee une seule fois depuis pcDgName et
+// pcNzName (au lieu d'une relecture des fichiers a chaque produit) et
+// partagee par toutes les bandes : stockage CSR par primitive, les
+// colonnes et les FF en pixels (couples j,iff) etant ceux du fichier nz_.
+// Seules les prop. optiques (coef) sont mises a jour par bande.
+static struct {
+  string nom;       // pcNzName charge
+  int n,nd;         // nb de faces, nb de primitives
+  double dff;       // pour passer d'un FF en pixel a un FF reel
+  int *diag;        // debut des lignes (signe<0 : primitive transparente)
+  int *face;        // premiere face de chaque primitive
+  int *nz;          // couples (j,iff)
+  double *coef;     // rho[0],tau[0],rho[1],tau[1] par primitive
+  int nbth;         // nb de threads du produit
+  vector<int> bloc; // decoupage des primitives en blocs de nnz equilibres
+  // radiosite hierarchique (pcAmName, cf. amas.h) : nc inconnues d'amas
+  // (colonnes n a n+nc-1), combinaisons des faces ou des amas precedents
+  int nc;
+  int *adeb,*acol;
+  float *apoids;
+  // norme infinie de la partie hors diagonale (Xi*Fij) pour la bande
+  // courante : ||A^-1||inf <= 1/(1-kmax) si kmax<1
+  double kmax;
+} mat={"",0,0,0.0,NULL,NULL,NULL,NULL,1,vector<int>(),0,NULL,NULL,NULL,0.0};
 
-/* hd_mv_mlt -- hard disk sparse matrix/dense vector multiply
-   -- result is in out, which is returned unless out==NULL on entry
-   --  if out==NULL on entry then the result vector is created */
-VEC *hd_mv_mlt(SPMAT* A,VEC *x,VEC* out) {
-  int	tamp[2],i,is, j_idx,j, n,iff,nd,*diag;//ip : indice prim, is indice face
-  Real	sum, *x_ve,sum2;
-  double dff;//pour passer d'un FF en pixel a un FF reel
-  double rho[2],tau[2],po;
-  Diffuseur **TabDiff=(Diffuseur **)A;
+// nnz minimum par thread : en dessous, le cout des threads l'emporte
+#define NNZ_THREAD 20000
+
+void hd_libere_mat() {
+  delete [] mat.diag; delete [] mat.face;
+  delete [] mat.nz; delete [] mat.coef;
+  delete [] mat.adeb; delete [] mat.acol; delete [] mat.apoids;
+  mat.diag=mat.face=mat.nz=NULL;
+  mat.coef=NULL;
+  mat.adeb=mat.acol=NULL;
+  mat.apoids=NULL;
+  mat.nc=0;
+  mat.nom="";
+}//hd_libere_mat()
+
+// inconnues des amas, absentes si la matrice n'est pas hierarchique
+static void hd_charge_amas() {
+  int a,nb,n;
   FILE *fic;
-  char transp;
-  
-  fic=fopen(pcDgName,"rb");
-  
-  fread(&n,sizeof(int),1,fic);
-  fread(&nd,sizeof(int),1,fic);
-  fread(&dff,sizeof(double),1,fic);
-  if ( ! A || ! x )
-    error(E_NULL,(char*)"hd_mv_mlt");
-  if ( x->dim != n ){
-    Ferr <<"in "  << pcDgName<<" A=" << n<<"^2 but x.dim="<<x->dim<<" !\n" ;
-    error(E_SIZES,(char*)"hd_mv_mlt");
+  vector<int> col;
+  vector<float> poids;
+
+  fic=fopen(pcAmName,"rb");
+  if(fic==NULL)
+    return;
+  if(fread(&n,sizeof(int),1,fic)!=1 || n!=mat.n || fread(&mat.nc,sizeof(int),1,fic)!=1) {
+    Ferr <<"<!> hd_charge_amas() : "<<pcAmName<<" ne correspond pas a "<<pcDgName<<'\n';
+    exit(17);
   }
-  if ( ! out || out->dim < n )
-    out = v_resize(out,n);
-  if ( out == x )
-    error(E_INSITU,(char*)"hd_mv_mlt");
-  x_ve = x->ve;
+  mat.adeb=new int[mat.nc+1];
+  mat.adeb[0]=0;
+  for(a=0;a<mat.nc;a++) {
+    if(fread(&nb,sizeof(int),1,fic)!=1) {
+      Ferr <<"<!> hd_charge_amas() : "<<pcAmName<<" tronque\n";
+      exit(17);
+    }
+    col.resize(col.size()+nb);
+    poids.resize(poids.size()+nb);
+    fread(col.data()+mat.adeb[a],sizeof(int),nb,fic);
+    fread(poids.data()+mat.adeb[a],sizeof(float),nb,fic);
+    mat.adeb[a+1]=mat.adeb[a]+nb;
+  }
+  fclose(fic);
+  mat.acol=new int[col.size()];
+  mat.apoids=new float[poids.size()];
+  copy(col.begin(),col.end(),mat.acol);
+  copy(poids.begin(),poids.end(),mat.apoids);
+  Ferr <<" Radiosite hierarchique : "<<mat.nc<<" inconnues d'amas\n";
+}//hd_charge_amas()
+
+static void hd_charge_mat() {
+  int i,nnz;
+  FILE *fic;
+
+  if(mat.nom==pcNzName)
+    return;
+  hd_libere_mat();
+  fic=fopen(pcDgName,"rb");
+  fread(&mat.n,sizeof(int),1,fic);
+  fread(&mat.nd,sizeof(int),1,fic);
+  fread(&mat.dff,sizeof(double),1,fic);
   //chargement des indices de la diago
-  diag=new int[nd+1];//nd= nb prim + 1
-  fread(diag,sizeof(int),nd+1,fic);
+  mat.diag=new int[mat.nd+1];//nd= nb prim + 1
+  fread(mat.diag,sizeof(int),mat.nd+1,fic);
   fclose(fic);
-  //Produit fait ligne a ligne
+  nnz=abs(mat.diag[mat.nd])-1;
+  mat.nz=new int[2*nnz];
   fic=fopen(pcNzName,"rb");
-  /*  FILE *fica,*f2;
-      fica=fopen("nzero.txt","r");
-      f2=fopen("nzero.dbx","w");
-      */
-  is=0;
-  for ( i = 0; i < nd; i++ ){
-     
-     transp=(diag[i+1]>0)?0:1;
-     //printf(".. i=%d, is=%d, diag=%d, n=%d, nd=%d ",i,is,diag[i+1],n,nd); fflush(stdout);
-     sum=x_ve[is];//la diago vaut 1
-     TabDiff[is]->activ_num(is);
-    rho[0]= -TabDiff[is]->rho();
-    if(transp) {
-      sum2=x_ve[is+1];
-      tau[1]=-TabDiff[is]->tau();
-      TabDiff[is]->togle_face();
-      rho[1]= TabDiff[is]->rho();
-      tau[0]=TabDiff[is]->tau();
-      TabDiff[is]->togle_face();
+  if(nnz>0 && fread(mat.nz,sizeof(int),2*nnz,fic)!=(size_t)(2*nnz)) {
+    Ferr <<"<!> hd_charge_mat() : "<<pcNzName<<" tronque\n";
+    exit(17);
+  }
+  fclose(fic);
+  mat.face=new int[mat.nd+1];
+  mat.face[0]=0;
+  for(i=0;i<mat.nd;i++)
+    mat.face[i+1]=mat.face[i]+((mat.diag[i+1]>0)?1:2);
+  mat.coef=new double[4*mat.nd];
+  mat.nom=pcNzName;
+  Ferr <<" Matrice des FF chargee : "<<mat.n<<" faces, "<<nnz<<" FF non nuls\n";
+  hd_charge_amas();
+}//hd_charge_mat()
+
+// prop. optiques de la bande courante, avec les signes du systeme 1-Xi*Fij
+static void hd_maj_coef(Diffuseur **TabDiff,int nbth) {
+  int i,is,t,nnz,*pnz;
+  unsigned char f;
+  double *c,s,s2;
+
+  for(i=0;i<mat.nd;i++) {
+    is=mat.face[i];
+    c=mat.coef+4*i;
+    f=(TabDiff[is]->num((unsigned char)0)==(unsigned int)is)? 0 : 1;
+    c[0]= -TabDiff[is]->rho(f);
+    c[1]=c[2]=c[3]=0.0;
+    if(mat.diag[i+1]<0) {
+      c[3]= -TabDiff[is]->tau(f);
+      c[2]= TabDiff[is]->rho(1-f);
+      c[1]= TabDiff[is]->tau(1-f);
     }
-    TabDiff[is]->activ_num(is);
-    for (j_idx = (int) fabs(double(diag[i]))-1; j_idx<fabs(double(diag[i+1]))-1; j_idx++) {
-      fread(tamp,sizeof(int),2,fic);
-      j=tamp[0]; iff=tamp[1];
-      /*if(j>=2000) 
-	Ferr <<"Solver : i="  << i<<" : j="  << j<<" - ji-= "  
-	<< diag[i]<<" -ji+="  << diag[i+1]<<"- iff="  << iff<<" \n" ;
-	fprintf(f2,"%d %d  ",j,iff);
-	fscanf(fica,"%d %d",&j,&iff);      
-	if(j>=2000) 
-	Ferr <<"Sol ASCII: i="  << i<<" : j="  << j<<" - ji-= "  
-	<< diag[i]<<" -ji+="  << diag[i+1]<<"- iff="  << iff<<" \n" ;
-       */
-      if(iff>0)
-	po=rho[0];
-      else
-	po=tau[0];
-      sum += x_ve[j]*iff*dff*po;
-      if(transp) {
-	if(iff>0)
-	  po=tau[1];
-	else
-	  po=rho[1];
-	sum2 += x_ve[j]*iff*dff*po;
+  }
+  mat.kmax=0.0;
+  for(i=0;i<mat.nd;i++) {
+    c=mat.coef+4*i;
+    s=s2=0.0;
+    for(pnz=mat.nz+2*(abs(mat.diag[i])-1);pnz<mat.nz+2*(abs(mat.diag[i+1])-1);pnz+=2)
+      if(pnz[1]>0) {
+	s+=pnz[1]*fabs(c[0]); s2+=pnz[1]*fabs(c[3]);
       }
+      else {
+	s-=pnz[1]*fabs(c[1]); s2-=pnz[1]*fabs(c[2]);
+      }
+    mat.kmax=max(mat.kmax,max(s,s2)*mat.dff);
+  }
+  nnz=abs(mat.diag[mat.nd])-1;
+  if(nbth>nnz/NNZ_THREAD) nbth=nnz/NNZ_THREAD;
+  if(nbth<1) nbth=1;
+  mat.nbth=nbth;
+  mat.bloc.assign(1,0);
+  for(i=0,t=1;i<mat.nd && t<nbth;i++)
+    if(abs(mat.diag[i+1])-1 >= (long)t*nnz/nbth) {
+      mat.bloc.push_back(i+1);
+      t++;
     }
-    out->ve[is] = sum;
-     
-    if(transp){
-      out->ve[++is] = sum2;
-      //Ferr <<"T\n" ;
-    }
-    //else
-    //Ferr <<"O\n" ;
+  mat.bloc.push_back(mat.nd);
+}//hd_maj_coef()
 
-    //fflush(stdout);
-      is++;
-    // fprintf(f2,"\n");
+// produit des lignes des primitives p0 a p1-1, pour les m vecteurs x[l]
+// (la matrice n'est parcourue qu'une fois pour tous les seconds membres)
+static void hd_mv_bloc(int m,Real **x,Real **out,int p0,int p1) {
+  int	i,is,j_idx,j,iff,l,*pnz;
+  double dff=mat.dff,po,po2,*c;
+  char transp;
+  vector<Real> sum(m),sum2(m,0.0);
+
+  for ( i = p0; i < p1; i++ ){
+    is=mat.face[i];
+    transp=(mat.diag[i+1]>0)?0:1;
+    c=mat.coef+4*i;//rho[0],tau[0],rho[1],tau[1]
+    for(l=0;l<m;l++) {
+      sum[l]=x[l][is];//la diago vaut 1
+      if(transp)
+	sum2[l]=x[l][is+1];
+    }
+    pnz=mat.nz+2*(abs(mat.diag[i])-1);
+    for (j_idx = abs(mat.diag[i])-1; j_idx<abs(mat.diag[i+1])-1; j_idx++,pnz+=2) {
+      j=pnz[0]; iff=pnz[1];
+      if(iff>0) {
+	po=c[0]; po2=c[3];
+      }
+      else {
+	po=c[1]; po2=c[2];
+      }
+      for(l=0;l<m;l++) {
+	sum[l] += x[l][j]*iff*dff*po;
+	if(transp)
+	  sum2[l] += x[l][j]*iff*dff*po2;
+      }
+    }
+    for(l=0;l<m;l++) {
+      out[l][is] = sum[l];
+      if(transp)
+	out[l][is+1] = sum2[l];
+    }
   }//for i (ligne)
-  fclose(fic);
-  //fclose(fica); fclose(f2);
-  return out;
+}//hd_mv_bloc()
+
+// les m vecteurs prolonges par les radiosites moyennes des amas (radiosite
+// hierarchique), calculees dans l'ordre des amas (fils avant peres)
+static vector< vector<Real> > xamas;
+static void hd_prolonge(int m,Real **x,Real **xa) {
+  int a,k,l;
+  Real s;
+
+  xamas.resize(m);
+  for(l=0;l<m;l++) {
+    xamas[l].resize(mat.n+mat.nc);
+    copy(x[l],x[l]+mat.n,xamas[l].begin());
+    xa[l]=xamas[l].data();
+  }
+  for(l=0;l<m;l++)
+    for(a=0;a<mat.nc;a++) {
+      s=0.0;
+      for(k=mat.adeb[a];k<mat.adeb[a+1];k++)
+	s+=mat.apoids[k]*xa[l][mat.acol[k]];
+      xa[l][mat.n+a]=s;
+    }
+}//hd_prolonge()
+
+/* hd_mv_multi -- produit de la matrice des FF (chargee par hd_mgcr) par m
+   vecteurs : out[l] = A*x[l]
+   -- la matrice est partagee en blocs de lignes traites par mat.nbth threads */
+static void hd_mv_multi(int m,Real **x,Real **out) {
+  int t;
+  vector<thread> pool;
+  vector<Real*> xa;
+
+  if(mat.nc>0) {
+    xa.resize(m);
+    hd_prolonge(m,x,xa.data());
+    x=xa.data();
+  }
+  if(mat.nbth==1)
+    hd_mv_bloc(m,x,out,0,mat.nd);
+  else {
+    for(t=0;t<mat.nbth;t++)
+      pool.push_back(thread(hd_mv_bloc,m,x,out,mat.bloc[t],mat.bloc[t+1]));
+    for(t=0;t<mat.nbth;t++)
+      pool[t].join();
+  }
+}//hd_mv_multi()
+
+// MGCR (Leyk, cf. iter_mgcr de meschach) ecrit pas a pas : chaque systeme
+// attend un produit A*v (A*x au redemarrage, A*s_i dans la base de Krylov),
+// ce qui permet de resoudre ensemble plusieurs seconds membres (un par ciel)
+// en partageant chaque parcours de la matrice.
+enum {MGCR_REDEMARRE,MGCR_ITERE,MGCR_FINI};
+struct Mgcr {
+  VEC *x,*b;
+  VEC *As,*alpha,*beta;
+  MAT *H;
+  vector<VEC*> N;   // s_0,...,s_k : alloues au besoin
+  int k,limit,steps,i;
+  double eps,init_res,dd;
+  char etat;
+  vector<float> hist; // residu relatif apres chaque produit
+  bool jacobi;        // arret sur un pas de Jacobi : residu inconnu
+};
+
+static VEC *mgcr_ligne(Mgcr &m,int i) {
+  while((int)m.N.size()<=i)
+    m.N.push_back(v_get(m.b->dim));
+  return m.N[i];
 }
 
+static void mgcr_init(Mgcr &m,VEC *x,VEC *b,double tol,int krylov,int limit) {
+  int dim;
 
-void hd_mgcr(VEC *x,VEC *b, Diffuseur **TabDiff,double tol,int krylov,int limit, int *steps) {
-  //mise en forme de la structure iterative
-  ITER *ip;
-  
-  ip = iter_get(0,0);
-  ip->Ax = (Fun_Ax) hd_mv_mlt;
-  ip->A_par =TabDiff ;
-  ip->Bx = (Fun_Ax) NULL;
-  ip->B_par = NULL;
-  ip->k = krylov;
-  ip->limit = limit;
-  ip->info = (Fun_info) NULL;
-  ip->b = b;
-  ip->eps = tol;
-  ip->x = x;
-   
-  //resolution proprement dite
-  static VEC *As, *beta, *alpha, *z;
-  static MAT *N, *H;
-  VEC *rr, v, s;  /* additional pointer and structures */
-  Real nres;      /* norm of a residual */
-  Real dd;        /* coefficient d_i */
-  int i,j;
-  int done;      /* if TRUE then stop the iterative process */
-  int dim;       /* dimension of the problem */
-   
-  /* ip cannot be NULL */
-  if (ip == INULL) error(E_NULL,(char*)"hd_mgcr");
-  /* Ax, b and stopping criterion must be given */
-  if (! ip->Ax || ! ip->b || ! ip->stop_crit) 
-    error(E_NULL,(const char*)"hd_mgcr");
+  if (! b || ! x) error(E_NULL,(char*)"hd_mgcr");
   /* at least one direction vector must exist */
-  if ( ip->k <= 0) error(E_BOUNDS,(const char*)"mgcr");
-  /* if the vector x is given then b and x must have the same dimension */
-  if ( ip->x && ip->x->dim != ip->b->dim)
-    error(E_SIZES,(const char*)"hd_mgcr");
-  if (ip->eps <= 0.0) ip->eps = MACHEPS;
-   
-  dim = ip->b->dim;
-  As = v_resize(As,dim);
-  alpha = v_resize(alpha,ip->k);
-  beta = v_resize(beta,ip->k);
-   
-  MEM_STAT_REG(As,TYPE_VEC);
-  MEM_STAT_REG(alpha,TYPE_VEC);
-  MEM_STAT_REG(beta,TYPE_VEC);
-   
-  H = m_resize(H,ip->k,ip->k);
-  N = m_resize(N,ip->k,dim);
-   
-  MEM_STAT_REG(H,TYPE_MAT);
-  MEM_STAT_REG(N,TYPE_MAT);
-   
-  /* v and s are additional pointers to rows of N */
-  /* they must have the same dimension as rows of N */
-  v.dim = v.max_dim = s.dim = s.max_dim = dim;
-   
-   
-  done = FALSE;
-  for (ip->steps = 0; ip->steps < ip->limit; ) {
-    (*ip->Ax)(ip->A_par,ip->x,As);         /* As = A*x */
-    v_sub(ip->b,As,As);                    /* As = b - A*x */
-    rr = As;                               /* rr is an additional pointer */
-      
-    /* norm of the residual */
-    nres = v_norm2(rr);
-    dd = nres;                            /* dd = ||r_i||  */
-      
-    /* check if the norm of the residual is zero */
-    if (ip->steps == 0) {                
-      /* information for a user */
-      if (ip->info) (*ip->info)(ip,nres,As,rr); 
-      ip->init_res = fabs(nres);
+  if (krylov <= 0) error(E_BOUNDS,(char*)"hd_mgcr");
+  if (x->dim != b->dim) error(E_SIZES,(char*)"hd_mgcr");
+  if (b->dim != (unsigned int)mat.n) {
+    Ferr <<"in "  << pcDgName<<" A=" << mat.n<<"^2 but x.dim="<<x->dim<<" !\n" ;
+    error(E_SIZES,(char*)"hd_mgcr");
+  }
+  dim=b->dim;
+  m.x=x; m.b=b;
+  m.k=krylov; m.limit=limit;
+  m.eps=(tol <= 0.0)? MACHEPS : tol;
+  m.As=v_get(dim);
+  m.alpha=v_get(krylov);
+  m.beta=v_get(krylov);
+  m.H=m_get(krylov,krylov);
+  m.steps=m.i=0;
+  m.dd=0.0;
+  m.hist.clear();
+  m.jacobi=false;
+  /* residu de reference : celui de x=0, i.e. ||b||, pour qu'un demarrage a
+     chaud garde le critere d'arret d'un demarrage a froid */
+  m.init_res=v_norm2(b);
+  if (m.init_res == 0.0)
+    v_zero(x);
+  m.etat=(m.steps < m.limit)? MGCR_REDEMARRE : MGCR_FINI;
+}//mgcr_init()
+
+static void mgcr_libere(Mgcr &m) {
+  unsigned int i;
+
+  V_FREE(m.As); V_FREE(m.alpha); V_FREE(m.beta);
+  M_FREE(m.H);
+  for(i=0;i<m.N.size();i++)
+    V_FREE(m.N[i]);
+  m.N.clear();
+}//mgcr_libere()
+
+// vecteur dont le systeme attend le produit par A
+static VEC *mgcr_vecteur(Mgcr &m) {
+  return (m.etat==MGCR_REDEMARRE)? m.x : m.N[m.i];
+}
+
+// fin d'un cycle de Krylov : mise a jour de x par les c_i
+static void mgcr_fin_cycle(Mgcr &m,bool done) {
+  int j;
+
+  if (m.i >= m.k) m.i = m.k - 1;
+  /* use (i+1) by (i+1) submatrix of H */
+  m.H = m_resize(m.H,m.i+1,m.i+1);
+  m.alpha = v_resize(m.alpha,m.i+1);
+  Usolve(m.H,m.alpha,m.alpha,0.0);       /* c_i is saved in alpha */
+  for (j = 0; j <= m.i; j++)
+    v_mltadd(m.x,m.N[j],m.alpha->ve[j],m.x);
+  if (done) {                   /* stop the iterative process */
+    m.etat=MGCR_FINI;
+    return;
+  }
+  m.alpha = v_resize(m.alpha,m.k);
+  m.H = m_resize(m.H,m.k,m.k);
+  m.etat=(m.steps < m.limit)? MGCR_REDEMARRE : MGCR_FINI;
+}//mgcr_fin_cycle()
+
+// arret avant convergence (duree ecoulee) : x garde la partie deja
+// construite du cycle de Krylov en cours ; au debut d'un cycle, x+r=b+Kx est
+// un pas de Jacobi (un rebond de plus), d'erreur au plus kmax fois la
+// precedente
+static void mgcr_arrete(Mgcr &m) {
+  if (m.etat == MGCR_ITERE) {
+    if (m.i > 0) {
+      m.i--;
+      mgcr_fin_cycle(m,true);
     }
-    if (nres == 0.0) { 
-      /* iterative process is finished */
-      done = TRUE; 
-      break;
+    else {
+      v_add(m.x,m.N[0],m.x);
+      m.jacobi=true;
+    }
+  }
+  m.etat=MGCR_FINI;
+}//mgcr_arrete()
+
+// traitement du produit As = A*mgcr_vecteur(m)
+static void mgcr_avance(Mgcr &m) {
+  VEC *rr=m.As,*s,*v;
+  Real nres;
+  int i,j;
+
+  if (m.etat == MGCR_REDEMARRE) {
+    v_sub(m.b,m.As,m.As);                  /* As = b - A*x */
+    nres = v_norm2(rr);
+    m.dd = nres;                           /* dd = ||r_i||  */
+    if (nres == 0.0) {                     /* iterative process is finished */
+      m.etat=MGCR_FINI;
+      return;
     }
-      
     /* save this residual in the first row of N */
-    v.ve = N->me[0];
-    v_copy(rr,&v);
-      
-    for (i = 0; i < ip->k && ip->steps < ip->limit; i++) {
-      ip->steps++;
-      v.ve = N->me[i];                /* pointer to a row of N (=s_i) */
-      /* note that we must use here &v, not v */
-      (*ip->Ax)(ip->A_par,&v,As); 
-      rr = As;                        /* As = A*s_i */
-      
-      if (i < ip->k - 1) {
-	s.ve = N->me[i+1];         /* pointer to a row of N (=s_{i+1}) */
-	v_copy(rr,&s);                   /* s_{i+1} = B*A*s_i */
-	for (j = 0; j <= i-1; j++) {
-	  v.ve = N->me[j+1];      /* pointer to a row of N (=s_{j+1}) */
-	  /* beta->ve[j] = in_prod(&v,rr); */      /* beta_{j,i} */
-	  /* modified Gram-Schmidt algorithm */
-	  beta->ve[j] = in_prod(&v,&s);  	         /* beta_{j,i} */
-	  /* s_{i+1} -= beta_{j,i}*s_{j+1} */
-	  v_mltadd(&s,&v,- beta->ve[j],&s);    
-	}
-	    
-	/* beta_{i,i} = ||s_{i+1}||_2 */
-	beta->ve[i] = nres = v_norm2(&s);     
-	if ( nres <= MACHEPS*ip->init_res) { 
-	  /* s_{i+1} == 0 */
-	  i--;
-	  done = TRUE;
-	  break;
-	}
-	sv_mlt(1.0/nres,&s,&s);           /* normalize s_{i+1} */
-	    
-	v.ve = N->me[0];
-	alpha->ve[i] = in_prod(&v,&s);     /* alpha_i = (s_0 , s_{i+1}) */
-	    
-      }
-      else {
-	for (j = 0; j <= i-1; j++) {
-	  v.ve = N->me[j+1];      /* pointer to a row of N (=s_{j+1}) */
-	  beta->ve[j] = in_prod(&v,rr);       /* beta_{j,i} */
-	}
-	    
-	nres = in_prod(rr,rr);                 /* rr = B*A*s_{k-1} */
-	for (j = 0; j <= i-1; j++)
-	  nres -= beta->ve[j]*beta->ve[j];
-
-	if (sqrt(fabs(nres)) <= MACHEPS*ip->init_res)  {
-	  /* s_k is zero */
-	  i--;
-	  done = TRUE;
-	  break;
-	}
-	if (nres < 0.0) { /* do restart */
-	  i--; 
-	  ip->steps--;
-	  break; 
-	}   
-	beta->ve[i] = sqrt(nres);         /* beta_{k-1,k-1} */
-	    
-	v.ve = N->me[0];
-	alpha->ve[i] = in_prod(&v,rr); 
-	for (j = 0; j <= i-1; j++)
-	  alpha->ve[i] -= beta->ve[j]*alpha->ve[j];
-	alpha->ve[i] /= beta->ve[i];                /* alpha_{k-1} */
-	    
-      }
-	 
-      set_col(H,i,beta);
-
-      /* other method of computing dd */
-      /* if (fabs((double)alpha->ve[i]) > dd)  {     
-	 nres = - dd*dd + alpha->ve[i]*alpha->ve[i];
-	 nres = sqrt((double) nres); 
-	 if (ip->info) (*ip->info)(ip,-nres,VNULL,VNULL);  	
-	 break;     
-	 }  */
-      /* to avoid overflow/underflow in computing dd */
-      /* dd *= cos(asin((double)(alpha->ve[i]/dd))); */
-	 
-      nres = alpha->ve[i]/dd;
-      if (fabs(nres-1.0) <= MACHEPS*ip->init_res) 
-	dd = 0.0;
-      else {
-	nres = 1.0 - nres*nres;
-	if (nres < 0.0) {
-	  nres = sqrt((double) -nres); 
-	  if (ip->info) (*ip->info)(ip,-dd*nres,VNULL,VNULL);  	
-	  break;
-	}
-	dd *= sqrt((double) nres);  
-      }
+    v_copy(rr,mgcr_ligne(m,0));
+    m.i=0;
+    m.steps++;
+    m.etat=MGCR_ITERE;
+    return;
+  }
+
+  i=m.i;                                   /* As = A*s_i */
+  if (i < m.k - 1) {
+    s = mgcr_ligne(m,i+1);
+    v_copy(rr,s);                          /* s_{i+1} = B*A*s_i */
+    for (j = 0; j <= i-1; j++) {
+      v = m.N[j+1];
+      /* modified Gram-Schmidt algorithm */
+      m.beta->ve[j] = in_prod(v,s);        /* beta_{j,i} */
+      v_mltadd(s,v,- m.beta->ve[j],s);     /* s_{i+1} -= beta_{j,i}*s_{j+1} */
+    }
+    /* beta_{i,i} = ||s_{i+1}||_2 */
+    m.beta->ve[i] = nres = v_norm2(s);
+    if ( nres <= MACHEPS*m.init_res) {     /* s_{i+1} == 0 */
+      m.i--;
+      mgcr_fin_cycle(m,true);
+      return;
+    }
+    sv_mlt(1.0/nres,s,s);                  /* normalize s_{i+1} */
+    m.alpha->ve[i] = in_prod(m.N[0],s);    /* alpha_i = (s_0 , s_{i+1}) */
+  }
+  else {
+    for (j = 0; j <= i-1; j++)
+      m.beta->ve[j] = in_prod(m.N[j+1],rr);  /* beta_{j,i} */
+    nres = in_prod(rr,rr);                 /* rr = B*A*s_{k-1} */
+    for (j = 0; j <= i-1; j++)
+      nres -= m.beta->ve[j]*m.beta->ve[j];
+    if (sqrt(fabs(nres)) <= MACHEPS*m.init_res)  { /* s_k is zero */
+      m.i--;
+      mgcr_fin_cycle(m,true);
+      return;
+    }
+    if (nres < 0.0) {                      /* do restart */
+      m.i--;
+      m.steps--;
+      mgcr_fin_cycle(m,false);
+      return;
+    }
+    m.beta->ve[i] = sqrt(nres);            /* beta_{k-1,k-1} */
+    m.alpha->ve[i] = in_prod(m.N[0],rr);
+    for (j = 0; j <= i-1; j++)
+      m.alpha->ve[i] -= m.beta->ve[j]*m.alpha->ve[j];
+    m.alpha->ve[i] /= m.beta->ve[i];       /* alpha_{k-1} */
+  }
+  set_col(m.H,i,m.beta);
+
+  /* to avoid overflow/underflow in computing dd */
+  nres = m.alpha->ve[i]/m.dd;
+  if (fabs(nres-1.0) <= MACHEPS*m.init_res)
+    m.dd = 0.0;
+  else {
+    nres = 1.0 - nres*nres;
+    if (nres < 0.0) {
+      mgcr_fin_cycle(m,false);
+      return;
+    }
+    m.dd *= sqrt((double) nres);
+  }
+  if (m.dd <= m.init_res*m.eps) {          /* stopping criterion is satisfied */
+    mgcr_fin_cycle(m,true);
+    return;
+  }
+  m.i++;
+  if (m.i < m.k && m.steps < m.limit)
+    m.steps++;                             /* attend A*s_{i+1} */
+  else
+    mgcr_fin_cycle(m,false);
+}//mgcr_avance()
 
-      if (ip->info) (*ip->info)(ip,dd,VNULL,VNULL);     
-      if ( ip->stop_crit(ip,dd,VNULL,VNULL) ) {
-	/* stopping criterion is satisfied */
-	done = TRUE;
-	break;
+// Resout les nrhs systemes (1-Xi*Fij) x[l] = b[l] de la bande courante, les
+// produits par la matrice etant faits en une passe pour tous les systemes
+// encore actifs.
+// x en entree : solutions initiales (demarrage a chaud si non nulles)
+// duree : si >0, temps de calcul (s) au dela duquel les systemes non
+// converges sont arretes avec leur solution partielle
+// steps, resid en sortie (si non NULL) : nb d'iterations et residu relatif
+// final (estimation de MGCR, /||b||) de chaque systeme
+// borne en sortie (si non NULL) : majorant de l'erreur relative de x,
+// ||x-x*||inf/||x||inf <= ||b-Ax||/((1-kmax)||x||inf), -1 si inconnu
+// hist en sortie (si non NULL) : residu relatif apres chaque produit
+void hd_mgcr_multi(int nrhs,VEC **x,VEC **b, Diffuseur **TabDiff,double tol,int krylov,int limit,
+		   int *steps,int nbth,double *resid,double duree,double *borne,
+		   vector<float> *hist) {
+  int l,m;
+  double xmax;
+  vector<Mgcr> sys(nrhs);
+  vector<Real*> xv(nrhs),outv(nrhs);
+  vector<int> actif(nrhs);
+  chrono::steady_clock::time_point debut=chrono::steady_clock::now();
+
+  hd_charge_mat();
+  hd_maj_coef(TabDiff,nbth);
+  for(l=0;l<nrhs;l++)
+    mgcr_init(sys[l],x[l],b[l],tol,krylov,limit);
+  for(;;) {
+    for(l=m=0;l<nrhs;l++)
+      if(sys[l].etat!=MGCR_FINI) {
+	actif[m]=l;
+	xv[m]=mgcr_vecteur(sys[l])->ve;
+	outv[m]=sys[l].As->ve;
+	m++;
       }
-	 
-    } /* end of for */
-      
-    if (i >= ip->k) i = ip->k - 1;
-      
-    /* use (i+1) by (i+1) submatrix of H */
-    H = m_resize(H,i+1,i+1);
-    alpha = v_resize(alpha,i+1);
-    Usolve(H,alpha,alpha,0.0);       /* c_i is saved in alpha */
-      
-    for (j = 0; j <= i; j++) {
-      v.ve = N->me[j];
-      v_mltadd(ip->x,&v,alpha->ve[j],ip->x);
+    if(m==0)
+      break;
+    hd_mv_multi(m,xv.data(),outv.data());
+    for(l=0;l<m;l++) {
+      Mgcr &s=sys[actif[l]];
+      mgcr_avance(s);
+      s.hist.push_back((s.init_res > 0.0)? s.dd/s.init_res : 0.0);
     }
-      
-      
-    if (done) break;              /* stop the iterative process */
-    alpha = v_resize(alpha,ip->k);
-    H = m_resize(H,ip->k,ip->k);
-      
-  }  /* end of while */
-   
-  /* return ip->x;                return the solution */
-  //Extraction des resultats dans ip
-  x = ip->x;
-  if (steps) *steps = ip->steps;
-  ip->shared_x = ip->shared_b = TRUE;
-  iter_free(ip);
+    if(duree>0 && chrono::duration<double>(chrono::steady_clock::now()-debut).count()>=duree)
+      for(l=0;l<m;l++)
+	if(sys[actif[l]].etat!=MGCR_FINI) {
+	  mgcr_arrete(sys[actif[l]]);
+	  Ferr <<" MGCR-HD : systeme "<<actif[l]<<" arrete apres "<<duree<<" s\n";
+	}
+  }
+  for(l=0;l<nrhs;l++) {
+    if (steps) steps[l] = sys[l].steps;
+    if (resid) {
+      resid[l] = (sys[l].init_res > 0.0)? sys[l].dd/sys[l].init_res : 0.0;
+      if (sys[l].jacobi)
+	resid[l] = -1.0;
+    }
+    if (borne) {
+      xmax=v_norm_inf(x[l]);
+      if (sys[l].init_res == 0.0)
+	borne[l]=0.0;
+      else
+	borne[l]=(mat.kmax < 1.0 && xmax > 0.0)? sys[l].dd/((1.0-mat.kmax)*xmax) : -1.0;
+      if (sys[l].jacobi && borne[l] > 0.0)
+	borne[l]*=mat.kmax;
+    }
+    if (hist) hist[l].swap(sys[l].hist);
+    mgcr_libere(sys[l]);
+  }
+}//hd_mgcr_multi()
+
+// x en entree : solution initiale (demarrage a chaud si non nulle)
+// resid en sortie : residu relatif final (estimation de MGCR, /||b||)
+void hd_mgcr(VEC *x,VEC *b, Diffuseur **TabDiff,double tol,int krylov,int limit, int *steps,int nbth,double *resid) {
+  hd_mgcr_multi(1,&x,&b,TabDiff,tol,krylov,limit,steps,nbth,resid);
 }//hd_mgcr()
 
 void print_hd_mat(Diffuseur **TabDiff) {
@@ -394,6 +599,8 @@ int	i,is, j_idx,j, n,iff,nd,*diag=NULL;//i : indice prim, is indice face
       fread(&j,sizeof(int),1,fic);
       //Ferr <<"j = "<<j<<endl;
       fread(&iff,sizeof(int),1,fic);
+      if(j>=n)//inconnue d'amas (radiosite hierarchique)
+	continue;
       if(iff>0)
 	po=rho[0];
       else
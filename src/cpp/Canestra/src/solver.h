@@ -3,5 +3,9 @@
 #else
 #define EXTR extern 
 #endif
-EXTR void hd_mgcr(VEC *x,VEC *b, Diffuseur **TabDiff,double tol,int krylov,int limit, int *steps);
+EXTR void hd_mgcr(VEC *x,VEC *b, Diffuseur **TabDiff,double tol,int krylov,int limit, int *steps,int nbth=1,double *resid=NULL);
+EXTR void hd_mgcr_multi(int nrhs,VEC **x,VEC **b, Diffuseur **TabDiff,double tol,int krylov,int limit,
+			 int *steps=NULL,int nbth=1,double *resid=NULL,double duree=0.0,
+			 double *borne=NULL,std::vector<float> *hist=NULL);
+EXTR void hd_libere_mat();
 EXTR void print_hd_mat(Diffuseur **TabDiff);
@@ -22,6 +22,7 @@ using namespace std;
 
 
 #include "GetOpt.h"
+#include <system.h>
 
 
 #include "canopyL.h"
@@ -56,7 +57,7 @@ int periodise(int argc,char **argv){
     fout=fopen("motif.can","w");
   else
     fout=fopen(outname,"w");
-  fz=fopen("Bz.dat","w");
+  fz=(LEAN_IO)? NULL : fopen("Bz.dat","w");
   char i;
   Diffuseur * pdiff;
   Canopy scene(false, false,false,1);
@@ -87,9 +88,11 @@ int periodise(int argc,char **argv){
 //      fprintf(fout,"p  1 -1 3 0 0 0  0 0 0  0 0 0\n");
 //    } else {
       Gz = pdiff->primi().centre()[2] + delta[2];
-      fprintf(fz,"%g\n",Gz);
-      if (!pdiff->isopaque())
+      if (fz != NULL) {
 	fprintf(fz,"%g\n",Gz);
+	if (!pdiff->isopaque())
+	  fprintf(fz,"%g\n",Gz);
+      }
       nbs = pdiff->primi().nb_sommet();
       fprintf(fout,"p  1 %.0f %d \t",pdiff->primi().name(),nbs);// fflush(fout);
       for (i = 0; i < 2; i++) {
@@ -119,7 +122,8 @@ int periodise(int argc,char **argv){
 //    }//if pas bon triangle
   }//for Ldiff
   fclose(fout);
-  fclose(fz);
+  if (fz != NULL)
+    fclose(fz);
   return 0;
 }//main::periodise
 
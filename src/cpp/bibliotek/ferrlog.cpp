@@ -13,6 +13,10 @@ void ferrlog::open(char *filename)
   // La destruction du fichier pr�c�dent n'est possible que si
   // aucun autre process ne l'utilise, l'ouverture est soumise
   // aux memes conditions et "resette" l'ancien ==> on le laisse.
+    if (LEAN_IO) {// messages sur clog seulement
+      out = (ofstream*) NULL ;
+      return ;
+    }
     out = new ofstream(filename, ios::out) ;
     if (!out->good())
       {
@@ -50,7 +54,7 @@ ferrlog::~ferrlog()
   clog << "Destruction du flux Ferr" << endl ;
 #endif
 
-    if (out->good()) {
+    if (out != NULL && out->good()) {
       *out << "ferrlog stream close by ~ferrlog()" << endl ;
       *out << "\t(may be abnormal)" << endl ;
       out->flush() ;
@@ -195,7 +199,7 @@ ferrlog & ferrlog::operator << ( string msg)
 } ;
 
 void ferrlog::close(void) {
-    if (out->good()) {
+    if (out != NULL && out->good()) {
       *out << "ferrlog stream close() called." << endl ;
       out->flush() ;
       out->close() ;
@@ -54,6 +54,8 @@ public:
   
   Lambert(double refl,double transmi)
   { reflectance=refl;  transmit=transmi;}
+  void maj(double refl,double transmi) // autre bande spectrale
+  { reflectance=refl;  transmit=transmi;}
   double rho() {return  reflectance;}
   double tau() { return transmit;}
   void show()
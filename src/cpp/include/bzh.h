@@ -12,6 +12,7 @@ extern void hd_calc_Bfar(VEC *,char *,Diffuseur **,double);
 extern char pcNzName[];
 extern char pcDgName[];
 extern char pcBfName[];
+extern char pcAmName[];
 
 /** efface les fichiers de donnees persistantes de Canestra
 * definition dans bzh.cpp
@@ -14,6 +14,8 @@ using namespace std ;
 
 #include<fstream> //.h>
 #include<iomanip> //.h>
+#include <vector>
+#include <utility>
 
 using namespace std ;
 
@@ -25,6 +27,11 @@ extern "C" {
 #include "diffuseur.h"
 #include "voxel.h"
 
+struct TamponZ; //tampons de projplan() (canopy_E.cpp)
+
+// contributions des sources a l'eclairement direct d'une face : (source, E)
+typedef vector< pair<int,double> > Esources;
+
 // Canopy : contient les caracteristiques de la scene
 // Elle contiendra les resultats du lance de la simulation
 class Canopy{
@@ -39,17 +46,29 @@ class Canopy{
   ListeD<Diffuseur *> Ldiff;
   ListeD<double> Ldiff0; //liste des labels des diffuseurs du .can (bon et pas bons) - MC10
   int Timg; //Resolution de l'image projplan (Avant en #define) - 0699 (default 1536)
+  int nbray; //nb de rayons par diffuseur du direct par lancer de rayons (0 : projplan)
+  int nbphot; //nb de photons des rediffusions par Monte Carlo (0 : radiosite)
+  unsigned int graine; //graine des flux aleatoires de Monte Carlo
   //member function
   unsigned int radim; // nombre de faces visibles de la scene
   // necessaire au capteur virtuel
   unsigned int nb_face; 
   unsigned int nbcell; 
   unsigned int nbprim; 
+  // proprietes optiques par espece (pointees par les diffuseurs)
+  Tabdyn<Actop*,1> tabopaque;
+  Tabdyn<Actop*,2> tabtransp;
+  // diffuseurs de Ldiff en tableau (parcours concurrent par projplan)
+  Diffuseur **Tdiff;
+  unsigned int nbdiff;
+  void liste_diff();
   
-  Canopy() {Etot=Einit=0.0;}
+  Canopy() {Etot=Einit=0.0; Tdiff=NULL; nbdiff=0; nbray=0; nbphot=0; graine=0;}
   // cree la liste des diffuseurs de la scene
   long int  parse_can(char *,char *,char *,reel *,reel*,int,char *,Diffuseur **&);
   long int  read_shm(int,char *,char *,reel *,reel*,int,char *,Diffuseur **&);
+  // relit les proprietes optiques (autre bande) sans recharger la scene
+  void maj_opt(char *);
   void cstruit_grille(double Renv) {mesh.construction(bmin,bmax,Renv,Ldiff);}
   void sail_pur(VEC **Cfar,double *Esource,char* envname);
 
@@ -60,7 +79,8 @@ class Canopy{
 		    char * envname,
 		    bool bias,
 		    double denv=0.3,
-		    int nbsim=1) ;
+		    int nbsim=1,
+		    int nbth=1) ;
 #else
   void calc_FF_Bfar(SPMAT *FF,
 		    VEC **Cfar,
@@ -68,11 +88,17 @@ class Canopy{
 		    char * envname,
 		    bool bias,
 		    double denv=0.3,
-		    int nbsim=1) ; 
+		    int nbsim=1,
+		    int nbth=1) ; 
   void calc_FF(SPMAT *FF);
 #endif
   
-  void projplan(Vecteur &,bool,double *);
+  void projplan(Vecteur &,bool,double *,TamponZ &);
+  void rayplan(Vecteur &,bool,double *);
+  void cameras(int,const double *,int,bool,int *,int);
+  void eclairement_direct(int,Vecteur *,double *,bool,double *,double *,int,
+			  Esources *Esrc=NULL);
+  void monte_carlo(int,Vecteur *,double *,double *,double *,double *,double *,bool,int);
   void data3d(int tx,int ty,Vecteur &visee,bool infty,long int ** &Zno) ;
   // bool converge(double seuil);
   //void xabs(char*,double *,double*,bool normme=false);
@@ -30,6 +30,13 @@ public:
   void  show(char *texte=(char *)"",ostream& out=cout) // montre!
   { prim->show(texte,out);  }
   virtual  unsigned int num()=0;
+  // num des faces vue et cachee depuis dir, sans changer la face active (projplan multithread)
+  virtual  unsigned int num_vu(Vecteur &dir)=0;
+  virtual  unsigned int num_dos(Vecteur &dir)=0;
+  // num et prop. optiques de la face cefa, sans changer la face active (calc_FF_Bfar multithread)
+  virtual  unsigned int num(unsigned char cefa)=0;
+  virtual double rho(unsigned char cefa)=0;
+  virtual double tau(unsigned char cefa)=0;
   virtual  void togle_face()=0;
   virtual void active(Vecteur&)=0;
   virtual void active(unsigned char)=0;
@@ -57,7 +64,12 @@ public:
   bool isreal()   {return true;}
   double rho() {return  opti->rho();}
   double tau() {return opti->tau();} 
+  double rho(unsigned char cefa) {return  opti->rho();}
+  double tau(unsigned char cefa) {return opti->tau();} 
   unsigned int num() {return no;}
+  unsigned int num(unsigned char cefa) {return no;}
+  unsigned int num_vu(Vecteur &dir) {return no;}
+  unsigned int num_dos(Vecteur &dir) {return no;}
   void togle_face() {}
   void active(Vecteur &dir) {}
   void active(unsigned char cefa) {}
@@ -97,8 +109,15 @@ public:
  
   double rho() {return  popt(actif)->rho();}
   double tau() {return popt(actif)->tau();} 
+  double rho(unsigned char cefa) {return  popt((cefa==1)?inf:sup)->rho();}
+  double tau(unsigned char cefa) {return popt((cefa==1)?inf:sup)->tau();} 
  
   unsigned int num() {return no[actif];}
+  unsigned int num(unsigned char cefa) {return no[(cefa==1)?inf:sup];}
+  unsigned int num_vu(Vecteur &dir)
+  {return (dir.prod_scalaire(prim->normal())<0)? no[sup] : no[inf];}
+  unsigned int num_dos(Vecteur &dir)
+  {return (dir.prod_scalaire(prim->normal())<0)? no[inf] : no[sup];}
   void togle_face() {actif =1-actif;}
   void active(Vecteur &dir) {
     if(  dir.prod_scalaire(prim->normal())<0)
@@ -52,6 +52,13 @@
 #define DG_NAME  "diag_"
 #define NZ_NAME  "nz_"
 #define BF_NAME  "Bfar_"
+#define AM_NAME  "amas_"
+
+// Mode "lean" (positionne par caribu) : les executables n'ecrivent que
+// les fichiers lus par l'etape suivante (ni logs, ni fichiers de debug)
+#include <stdlib.h>
+#define LEAN_IO_ENV "CARIBU_LEAN_IO"
+#define LEAN_IO (getenv(LEAN_IO_ENV)!=NULL)
 
 
 // 1 standard compatible CD iso-9660
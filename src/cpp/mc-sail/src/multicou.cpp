@@ -196,12 +196,16 @@ int main(int argc, char **argv){
     //BUG Scons: MC08 : -DNDEBUG Supprime la fonction assert() donc les fichiers n'�taient pas ouvert
     if(!brdf){
       printf("=> Ecriture des resultats\n");
-      fout=fopen("profout","w") ; //unit=2
+      // en mode lean (CARIBU_LEAN_IO), seul mlsail.env est ecrit
+      fout=fpvf=NULL;
+      if(!LEAN_IO){
+	fout=fopen("profout","w") ; //unit=2
+	fpvf=fopen("proflux.dat","w"); ;//unit=16
+	assert (fout != NULL ) ; //unit=2
+	assert (fpvf != NULL ) ;//unit=16
+      }
       fenv=fopen("mlsail.env","w") ;//unit=15
-      fpvf=fopen("proflux.dat","w"); ;//unit=16
-      assert (fout != NULL ) ; //unit=2
       assert (fenv != NULL ) ;//unit=15
-      assert (fpvf != NULL ) ;//unit=16
       
       fprintf(fenv,"%d  %lf\n",N-1,dz);
       printf("ic  alti  clai   l(ic)  pene   Fdown  Fup  Rf   Tf\n");fflush(stdout);
@@ -209,13 +213,17 @@ int main(int argc, char **argv){
 	profout=Cprofout[i];
 	clai += msailin.l[i-1];
 	printf("%2d  %5.3f  %5.3f  %5.3f  %5.3f  %5.3f  %5.3f  %5.3f  %5.3f\n",i+1,(i-1)*dz,sf-clai,msailin.l[i],profout.transdir,profout.transdif,Cprofout[i-1].refdif, msailin.roo[i],msailin.tau[i]);
-	fprintf(fout,"%f  %f  %f %f %f %f %f %f\n", clai,msailin.l[i],profout.trans,profout.transdir,profout.transdif,profout.absc,profout.refdif,profout.refdir);
+	if(fout!=NULL)
+	  fprintf(fout,"%f  %f  %f %f %f %f %f %f\n", clai,msailin.l[i],profout.trans,profout.transdir,profout.transdif,profout.absc,profout.refdif,profout.refdir);
 	fprintf(fenv,"%f  %f  %f\n",(i-1)*dz,profout.transdif,Cprofout[i-1].refdif);
-	fprintf(fpvf,"%8.6f  %8.6f  %8.6f  %8.6f  %8.6f  %8.6f  %8.6f\n", (i-1)*dz, sf-clai, msailin.l[i],profout.transdir,profout.transdif,Cprofout[i-1].refdif,Tlayout[i].tss);
+	if(fpvf!=NULL)
+	  fprintf(fpvf,"%8.6f  %8.6f  %8.6f  %8.6f  %8.6f  %8.6f  %8.6f\n", (i-1)*dz, sf-clai, msailin.l[i],profout.transdir,profout.transdif,Cprofout[i-1].refdif,Tlayout[i].tss);
       }
-      fclose(fout);
+      if(fout!=NULL)
+	fclose(fout);
       fclose(fenv);
-      fclose(fpvf);
+      if(fpvf!=NULL)
+	fclose(fpvf);
     }//if !brdf
     else{
       if(phi_v==0)
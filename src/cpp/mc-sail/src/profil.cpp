@@ -4,6 +4,7 @@
 using namespace std ;
 
 #include "multicou.h"
+#include <system.h>
 
 /*******************************************************************************
 *             Albert OLIOSO                                                    *
@@ -155,7 +156,9 @@ void mprofil(Limit& limit,Profout* Tprof,Mlayout* Tlay){
     }
   }//for ic
 
-  //Ecriture des fichers
+  //Ecriture des fichers (de debug : inutiles en mode lean)
+  if(LEAN_IO)
+    return;
   FILE *mat;
   mat=fopen("Mcoef.dat","w"); 
   for (i=0; i<4*(N); i++) {
@@ -248,7 +248,9 @@ int s2v(int argc, char **argv){
   // Initialisation
   Stot=nbtt=nbts=0;
   fmlsail=fopen("leafarea","w");
-  fsail=fopen("out.dang","w");
+  // out.dang, s2v.can et s2v.area ne sont pas lus par mcsail/canestrad
+  if(!LEAN_IO)
+    fsail=fopen("out.dang","w");
   if(argc>1){// by shared memory (called by caribu)
     genopt=true;
     if(isid(argv[1])){//by seg
@@ -321,7 +323,7 @@ int s2v(int argc, char **argv){
     nji=18;
     nja=1;
 
-    gencan=true;
+    gencan=!LEAN_IO;
 
     // Optical properties
     genopt=true;
@@ -635,9 +637,11 @@ int s2v(int argc, char **argv){
     Ferr << "genere le fichier out.dang => entree de sailM pour calculer la BRDF"<<'\n' ;
     //if (fsail == NULL){Ferr <<"! le FILE *fsail est NULL"<<'\n'; //HA }
 
-    fprintf(fsail,"%lf\n",xlai[0]);
-    for (ji=0; ji<nji; ji++) 
-      fprintf(fsail,"%lf ",disti(0,ji));
+    if(fsail!=NULL){
+      fprintf(fsail,"%lf\n",xlai[0]);
+      for (ji=0; ji<nji; ji++) 
+	fprintf(fsail,"%lf ",disti(0,ji));
+    }
     //genere stat par cellule et leafarea
     double t = 0.;
     printf("\n STATISTIQUES PAR CELLULE\n");
@@ -727,7 +731,8 @@ int s2v(int argc, char **argv){
     Sfclose(&fcan,__LINE__);
     Sfclose(&fsurf,__LINE__);
   }
-  Sfclose(&fsail,__LINE__);
+  if(fsail!=NULL)
+    Sfclose(&fsail,__LINE__);
   Sfclose(&fmlsail,__LINE__);
 
   if (xlai!=NULL) 
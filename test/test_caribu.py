@@ -1,7 +1,11 @@
+import numpy
 from pytest import raises as assert_raises
 
 from alinea.caribu.caribu import green_leaf_PAR, radiosity, raycasting, \
-    x_radiosity, x_raycasting, mixed_radiosity, x_mixed_radiosity
+    x_radiosity, x_raycasting, mixed_radiosity, x_mixed_radiosity, \
+    x_radiosity_series, x_mixed_radiosity_series, x_raycasting_series, monte_carlo, \
+    gap_fraction, hemispherical_cameras
+from alinea.caribu.caribu_shell import CaribuOptionError
 
 DEBUG = False
 
@@ -72,6 +76,264 @@ def test_other_algos():
     assert 'NIR' in res
     assert 'Eabs' in res['PAR']
 
+def test_raycasting_nb_rays():
+    pts1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    pts2 = [(0, 0, 1), (1, 0, 1), (0, 1, 1)]
+    pts3 = [(0.6, 0.6, 0.5), (1.6, 0.6, 0.5), (0.6, 1.6, 0.5)]
+    triangles = [pts1, pts2, pts3]
+    mats = [green_leaf_PAR] * 3
+    sensors = [[(0, 0, 2), (1, 0, 2), (0, 1, 2)], [(0, 0, -1), (1, 0, -1), (0, 1, -1)]]
+    lights = [(1, (0, 0, -1))]
+
+    res = raycasting(triangles, mats, lights=lights, sensors=sensors, debug=DEBUG, nb_rays=16)
+    assert res['Ei'][1] == 1
+    assert res['Ei'][0] == 0
+    assert res['Ei'][2] == 1
+    assert res['sensors']['Ei'] == [1, 0]
+
+    # in the infinite canopy, pts3 shades the neighbouring copy of pts1
+    leaf = [(0.2, 0.2, 0.5), (0.7, 0.2, 0.5), (0.2, 0.7, 0.5)]
+    lights = [(1, (1, 0.6, -1))]
+    res = raycasting([pts1, leaf], mats[:2], lights=lights, nb_rays=64, debug=DEBUG)
+    assert res['Ei'] == [1, 1]
+    expected = raycasting([pts1, leaf], mats[:2], lights=lights, domain=(0, 0, 1, 1),
+                          screen_size=2048, debug=DEBUG)
+    res = raycasting([pts1, leaf], mats[:2], lights=lights, domain=(0, 0, 1, 1), nb_rays=256,
+                     debug=DEBUG)
+    assert res['Ei'][0] < 0.99
+    for a, b in zip(res['Ei'], expected['Ei']):
+        assert abs(a - b) < 0.01
+
+    assert_raises(CaribuOptionError, lambda: raycasting(triangles, mats, nb_rays=0, debug=DEBUG))
+
+
+def test_raycasting_sources():
+    pts1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    pts2 = [(0, 0, 1), (1, 0, 1), (0, 1, 1)]
+    pts3 = [(0, 0, 0.5), (0, 1, 0.5), (0, 0, 1.5)]
+    triangles = [pts1, pts2, pts3]
+    mats = [green_leaf_PAR, (0.1,), green_leaf_PAR]
+    lights = [(1, (0, 0, -1)), (0, (0, 0, -1)), (0.5, (0.5, 0.2, -1)), (2, (-0.3, 0, -1))]
+
+    for nb_rays in (None, 64):
+        res = raycasting(triangles, mats, lights=lights, source_output='dense', nb_rays=nb_rays,
+                         debug=DEBUG)
+        sources = res['Ei_sources']
+        assert sources.shape == (3, 4)
+        numpy.testing.assert_allclose(sources.sum(axis=1), res['Ei'], rtol=1e-4, atol=1e-6)
+        # the zenithal source only lights pts2, the null one nothing
+        numpy.testing.assert_allclose(sources[:, 0], [0, 1, 0], atol=0.01)
+        assert (sources[:, 1] == 0).all()
+        # pts3 is lit on either face by the sources 2 and 3
+        assert sources[2, 2] > 0 and sources[2, 3] > 0
+        expected = raycasting(triangles, mats, lights=lights, nb_rays=nb_rays, debug=DEBUG)
+        assert res['Ei'] == expected['Ei']
+        assert 'Ei_sources' not in expected
+
+    try:
+        import scipy.sparse
+    except ImportError:
+        pass
+    else:
+        res = raycasting(triangles, mats, lights=lights, source_output='sparse', debug=DEBUG)
+        assert scipy.sparse.issparse(res['Ei_sources'])
+        numpy.testing.assert_allclose(res['Ei_sources'].toarray(), sources, atol=1e-6)
+
+    assert_raises(ValueError, lambda: raycasting(triangles, mats, source_output='full', debug=DEBUG))
+
+
+def test_gap_fraction():
+    pts1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    pts2 = [(0, 0, 1), (1, 0, 1), (0, 1, 1)]
+    pts3 = [(0, 0, 0.5), (0, 1, 0.5), (0, 0, 1.5)]
+    triangles = [pts1, pts2, pts3]
+    directions = [(0, 0, -1), (0.5, 0.2, -1), (-0.3, 0, -1)]
+
+    # the shadow of each triangle is its horizontal irradiance under a unit light
+    res = gap_fraction(triangles, directions)
+    assert res['projected_area'].shape == (3, 3)
+    assert 'gap_fraction' not in res
+    mats = [(0.1,)] * 3
+    for i, d in enumerate(directions):
+        expected = raycasting(triangles, mats, lights=[(1, d)], debug=DEBUG)
+        numpy.testing.assert_allclose(res['projected_area'][:, i],
+                                      numpy.array(expected['Ei']) * expected['area'], atol=1e-5)
+
+    # a horizontal triangle covers half of the domain, whatever the direction
+    res = gap_fraction([pts2], directions, domain=(0, 0, 1, 1))
+    numpy.testing.assert_allclose(res['gap_fraction'], 0.5, atol=0.01)
+    numpy.testing.assert_allclose(res['covered_fraction'] + res['gap_fraction'], 1)
+    res = gap_fraction(triangles, directions, domain=(0, 0, 1, 1), nb_rays=64)
+    assert res['gap_fraction'][0] == 0.5
+    assert (res['gap_fraction'][1:] < 0.5).all()
+
+
+def test_hemispherical_cameras():
+    leaf = [(-5, -5, 1), (10, -5, 1), (-5, 10, 1)]
+    positions = [(0.25, 0.25, 0), (0.25, 0.25, 2)]
+    res = hemispherical_cameras([leaf], positions, image_size=32, nb_rings=4, nb_threads=2,
+                                debug=DEBUG)
+    images = res['images']
+    assert images.shape == (2, 32, 32)
+    # corners are out of the hemisphere, the zenith above the first camera is the leaf
+    assert images[0, 0, 0] == -2
+    assert images[0, 15, 15] == 0
+    assert set(numpy.unique(images[1])) == {-2, -1}
+    numpy.testing.assert_allclose(res['zenith'], [11.25, 33.75, 56.25, 78.75])
+    assert res['gap_fraction'].shape == (2, 4)
+    assert (res['gap_fraction'][0, :2] == 0).all()
+    assert res['gap_fraction'][0, 3] > 0
+    assert (res['gap_fraction'][1] == 1).all()
+    # same pictures whatever the number of threads
+    numpy.testing.assert_array_equal(
+        hemispherical_cameras([leaf], positions, image_size=32, nb_threads=1, debug=DEBUG)['images'], images)
+
+    # in the infinite canopy, the leaf covers half of the sky, and cameras are moved in the pattern
+    leaf = [(0, 0, 1), (1, 0, 1), (0, 1, 1)]
+    res = hemispherical_cameras([leaf], [(0.25, 0.25, 0), (2.25, -0.75, 0)], domain=(0, 0, 1, 1),
+                                image_size=64, debug=DEBUG)
+    assert abs(res['sky_fraction'][0] - 0.5) < 0.05
+    numpy.testing.assert_array_equal(res['images'][0], res['images'][1])
+
+
+def test_radiosity_series():
+    pts1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    pts2 = [(0, 0, 1), (1, 0, 1), (0, 1, 1)]
+    pts3 = [(0, 0, 0.5), (0, 1, 0.5), (0, 0, 1.5)]
+    triangles = [pts1, pts2, pts3]
+    domain = (0, 0, 1, 1)
+    mats = [green_leaf_PAR] * 3
+    x_mats = {'PAR': mats, 'NIR': [(0.4, 0.4)] * 3}
+    soil = {'PAR': 0.3, 'NIR': 0.1}
+    light_sets = [[(1, (0, 0, -1))], [(0.5, (0.5, 0.2, -1)), (2, (-0.3, 0, -1))]]
+
+    series = x_radiosity_series(triangles, x_mats, light_sets, debug=DEBUG)
+    assert len(series) == 2
+    for lights, res in zip(light_sets, series):
+        expected = x_radiosity(triangles, x_mats, lights=lights, debug=DEBUG)
+        for band in x_mats:
+            for k in ('Eabs', 'Ei_sup', 'Ei_inf'):
+                assert res[band][k] == expected[band][k]
+
+    series = x_mixed_radiosity_series(triangles, x_mats, light_sets, domain=domain,
+                                      soil_reflectance=soil, diameter=1, layers=2,
+                                      height=1.5, debug=DEBUG)
+    assert len(series) == 2
+    for lights, res in zip(light_sets, series):
+        expected = x_mixed_radiosity(triangles, x_mats, lights=lights, domain=domain,
+                                     soil_reflectance=soil, diameter=1, layers=2,
+                                     height=1.5, debug=DEBUG)
+        for band in x_mats:
+            for a, b in zip(res[band]['Eabs'], expected[band]['Eabs']):
+                assert abs(a - b) <= 1e-5 * max(1, abs(b))
+
+    series = x_raycasting_series(triangles, x_mats, light_sets, domain=domain, debug=DEBUG)
+    assert len(series) == 2
+    for lights, res in zip(light_sets, series):
+        expected = raycasting(triangles, mats, lights=lights, domain=domain, debug=DEBUG)
+        for k in ('Eabs', 'Ei_sup', 'Ei_inf'):
+            assert res['PAR'][k] == expected[k]
+        for a, b in zip(res['NIR']['Ei'], expected['Ei']):
+            assert abs(a - b) <= 1e-5 * max(1, abs(b))
+
+
+def test_hierarchical_radiosity():
+    triangles = []
+    for i in range(8):
+        for j in range(8):
+            for k in range(4):
+                x, y, z = 0.5 * i + 0.1 * (j % 3), 0.5 * j + 0.1 * (k % 2), 0.4 * k + 0.05 * (i % 4)
+                triangles.append([(x, y, z), (x + 0.15, y + 0.05 * (k - 1.5), z + 0.03),
+                                  (x + 0.02, y + 0.15, z - 0.04 * (j % 2))])
+    mats = [green_leaf_PAR] * len(triangles)
+    lights = [(1, (0.3, 0.2, -1))]
+
+    exact = radiosity(triangles, mats, lights=lights, debug=DEBUG)
+    res = radiosity(triangles, mats, lights=lights, debug=DEBUG, cluster_ratio=0.3)
+    total = sum(e * a for e, a in zip(exact['Eabs'], exact['area']))
+    approx = sum(e * a for e, a in zip(res['Eabs'], res['area']))
+    assert abs(approx - total) < 0.01 * total
+    mean = total / sum(exact['area'])
+    for a, b in zip(res['Eabs'], exact['Eabs']):
+        assert abs(a - b) < 0.1 * mean
+
+    assert_raises(CaribuOptionError, lambda: radiosity(triangles, mats, lights=lights, debug=DEBUG,
+                                                       cluster_ratio=1.5))
+
+
+def test_progressive_radiosity():
+    triangles = []
+    for i in range(6):
+        for j in range(6):
+            for k in range(3):
+                x, y, z = 0.5 * i + 0.1 * (j % 3), 0.5 * j + 0.1 * (k % 2), 0.4 * k + 0.05 * (i % 4)
+                triangles.append([(x, y, z), (x + 0.15, y + 0.05 * (k - 1), z + 0.03),
+                                  (x + 0.02, y + 0.15, z - 0.04 * (j % 2))])
+    mats = [(0.45, 0.45)] * len(triangles)
+    lights = [(1, (0.3, 0.2, -1))]
+
+    exact = radiosity(triangles, mats, lights=lights, debug=DEBUG, tolerance=1e-9)
+    assert exact['solver']['residual'] <= 1e-9
+    emax = max(exact['Eabs'])
+
+    res = radiosity(triangles, mats, lights=lights, debug=DEBUG, tolerance=1e-2)
+    info = res['solver']
+    assert info['iterations'] < exact['solver']['iterations']
+    assert info['residual'] <= 1e-2
+    assert info['residuals'][0] == 1
+    assert abs(info['residuals'][-1] - info['residual']) <= 1e-5 * info['residual']
+    assert info['error_bound'] is not None
+    assert max(abs(a - b) for a, b in zip(res['Eabs'], exact['Eabs'])) < 0.1 * emax
+
+    # budget exhausted by the first product: one more bounce than the direct lighting
+    res = radiosity(triangles, mats, lights=lights, debug=DEBUG, time_budget=1e-6)
+    info = res['solver']
+    assert info['iterations'] == 1
+    assert info['residual'] is None
+    assert info['error_bound'] is not None
+    assert max(abs(a - b) for a, b in zip(res['Eabs'], exact['Eabs'])) < 0.2 * emax
+
+    assert 'solver' not in radiosity(triangles, mats, lights=lights, debug=DEBUG)
+    assert_raises(CaribuOptionError, lambda: radiosity(triangles, mats, lights=lights, debug=DEBUG,
+                                                       time_budget=-1))
+
+
+def test_monte_carlo():
+    triangles = []
+    for i in range(5):
+        for j in range(5):
+            for k in range(3):
+                x, y, z = 0.5 * i + 0.1 * (j % 3), 0.5 * j + 0.1 * (k % 2), 0.4 * k + 0.05 * (i % 4)
+                triangles.append([(x, y, z), (x + 0.15, y + 0.05 * (k - 1), z + 0.03),
+                                  (x + 0.02, y + 0.15, z - 0.04 * (j % 2))])
+    mats = [(0.45, 0.45)] * len(triangles)
+    lights = [(1, (0.3, 0.2, -1))]
+
+    exact = radiosity(triangles, mats, lights=lights, debug=DEBUG)
+    res = monte_carlo(triangles, mats, lights=lights, nb_photons=50000, debug=DEBUG)
+    total = sum(e * a for e, a in zip(exact['Eabs'], exact['area']))
+    approx = sum(e * a for e, a in zip(res['Eabs'], res['area']))
+    assert abs(approx - total) < 0.02 * total
+    assert all(se > 0 for se in res['Eabs_se'])
+    assert all(se > 0 for se in res['Ei_se'])
+    # independent seeded batches: results do not depend on the number of threads
+    same = monte_carlo(triangles, mats, lights=lights, nb_photons=50000, nb_threads=1, debug=DEBUG)
+    assert same['Eabs'] == res['Eabs']
+    other = monte_carlo(triangles, mats, lights=lights, nb_photons=50000, seed=1, debug=DEBUG)
+    assert other['Eabs'] != res['Eabs']
+
+    # a transmitting leaf plane over a reflecting soil
+    plane = [[(0, 0, 0.5), (1, 0, 0.5), (0, 1, 0.5)], [(1, 0, 0.5), (1, 1, 0.5), (0, 1, 0.5)]]
+    sensor = [[(0, 0, 0.1), (1, 0, 0.1), (0, 1, 0.1)]]
+    res = monte_carlo(plane, [(0.0001, 0.5)] * 2, domain=(0, 0, 1, 1), soil_reflectance=0.5,
+                      nb_photons=20000, sensors=sensor, debug=DEBUG)
+    assert abs(res['sensors']['Ei'][0] - 0.5) < 0.02
+    for e in res['Ei_inf']:
+        assert abs(e - 0.25) < 0.02
+
+    assert_raises(CaribuOptionError, lambda: monte_carlo(triangles, mats, nb_photons=0, debug=DEBUG))
+
+
 def test_raycasting_exception():
     points = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
     triangles = [points]
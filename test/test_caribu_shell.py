@@ -1,8 +1,17 @@
 """ Unit Tests for caribu_shell module """
 
-from alinea.caribu.caribu_shell import Caribu, CaribuOptionError, vcaribu
+import os
+import shutil
+import tempfile
+
+from alinea.caribu.caribu import opt_string_and_labels, triangles_string, \
+    light_string, pattern_string
+from alinea.caribu.caribu_shell import Caribu, CaribuOptionError, vcaribu, \
+    SharedCanopy, FormFactorCache, RadiosityState
 from alinea.caribu.data_samples import data_path
 
+from .tools import assert_almost_equal
+
 
 # Original test of caribu.csh script by M. Chelle
 def test_case_1_projection_non_toric_scene(debug=False):
@@ -191,6 +200,249 @@ def test_sensor(debug=False):
     assert isinstance(sim.measures, dict)
     assert 'par' in sim.measures
 
+
+def test_shared_canopy(debug=False):
+    triangles = [[(0, 0, -1), (1, 0, -1), (0, 1, -1)],
+                 [(0, 0, 1), (1, 0, 1), (0, 1, 1)],
+                 [(3, 0, 2), (4, 0, 2), (3, 1, 2)]]
+    materials = [(0.1,), (0.06, 0.07), (0.06, 0.07)]
+    o_string, labels = opt_string_and_labels(materials)
+    sky = light_string([(1, (0, 0, -1))])
+    domain = (0, 0, 2, 2)
+
+    for wrap in (None, domain):
+        infinite = wrap is not None
+        pattern = pattern_string(wrap) if infinite else None
+        ref = Caribu(canfile=triangles_string(triangles, labels), skyfile=sky,
+                     optfiles=o_string, patternfile=pattern, infinitise=infinite,
+                     resdir=None, resfile=None, debug=debug)
+        ref.run()
+        with SharedCanopy(triangles, labels, domain=wrap) as shared:
+            sim = Caribu(skyfile=sky, optfiles=o_string, patternfile=pattern,
+                         infinitise=infinite, shared_canopy=shared,
+                         resdir=None, resfile=None, debug=debug)
+            sim.run()
+        expected = ref.nrj['band0']['data']
+        res = sim.nrj['band0']['data']
+        assert res['label'] == expected['label']
+        for k in ('index', 'area', 'Eabs', 'Ei_sup', 'Ei_inf'):
+            assert res[k] == expected[k]
+
+
+def test_binary_output(debug=False):
+    can = data_path('filterT.can')
+    sky = data_path('zenith.light')
+    opts = [data_path('par.opt'), data_path('nir.opt')]
+
+    ref = Caribu(canfile=can, skyfile=sky, optfiles=opts, infinitise=False,
+                 resdir=None, resfile=None, debug=debug)
+    ref.run()
+    sim = Caribu(canfile=can, skyfile=sky, optfiles=opts, infinitise=False,
+                 binary_output=True, resdir=None, resfile=None, debug=debug)
+    sim.run()
+    for w in ('par', 'nir'):
+        expected = ref.nrj[w]['data']
+        res = sim.nrj[w]['data']
+        assert list(res['index']) == expected['index']
+        assert list(res['label']) == expected['label']
+        for k in ('area', 'Eabs', 'Ei_sup', 'Ei_inf'):
+            assert len(res[k]) == len(expected[k])
+            for a, b in zip(res[k], expected[k]):
+                assert_almost_equal(a, b, 5)
+
+
+def test_lean_io(debug=False):
+    can = data_path('filterT.can')
+    sky = data_path('zenith.light')
+    opts = data_path('par.opt')
+
+    def _run(lean_io):
+        sim = Caribu(canfile=can, skyfile=sky, optfiles=opts,
+                     patternfile=data_path('filter.8'), direct=False,
+                     nb_layers=6, can_height=21, sphere_diameter=1,
+                     lean_io=lean_io, resdir=None, resfile=None, debug=debug)
+        sim.run()
+        return sim, set(f.basename() for f in sim.tempdir.files())
+
+    ref, ref_files = _run(False)
+    sim, files = _run(True)
+    assert sim.nrj['par']['data'] == ref.nrj['par']['data']
+    for aux in ('E0.dat', 'B.dat', 'Etri.vec', 'scene.can', 'canestra.log',
+                'profout', 'proflux.dat', 'Mcoef.dat', 'Mvec.dat', 'Bz.dat',
+                'out.dang', 's2v.can'):
+        assert aux in ref_files
+        assert aux not in files
+
+
+def test_form_factor_cache(debug=False):
+    can = data_path('filterT.can')
+    sky = data_path('zenith.light')
+
+    def _run(opts, ff_cache):
+        sim = Caribu(canfile=can, skyfile=sky, optfiles=opts,
+                     patternfile=data_path('filter.8'), direct=False,
+                     nb_layers=6, can_height=21, sphere_diameter=1,
+                     ff_cache=ff_cache, resdir=None, resfile=None, debug=debug)
+        sim.run()
+        return sim
+
+    directory = tempfile.mkdtemp()
+    try:
+        cache = FormFactorCache(directory)
+        _run(data_path('par.opt'), cache)
+        assert len(cache.directory.dirs()) == 1
+        # same geometry, new optical properties: matrices are read from the cache
+        sim = _run(data_path('nir.opt'), cache)
+        assert len(cache.directory.dirs()) == 1
+        ref = _run(data_path('nir.opt'), None)
+        res, expected = sim.nrj['nir']['data'], ref.nrj['nir']['data']
+        assert res['label'] == expected['label']
+        for k in ('area', 'Eabs', 'Ei_sup', 'Ei_inf'):
+            for a, b in zip(res[k], expected[k]):
+                assert_almost_equal(a, b, 5)
+        # size bound
+        cache.max_size = 0
+        cache.store('other', sim.tempdir, sim.FF_name)
+        assert [e.basename() for e in cache.directory.dirs()] == ['other']
+        # directories being written by other runs are not evicted
+        staging = cache.directory / (cache.staging + 'run')
+        staging.mkdir()
+        cache.store('last', sim.tempdir, sim.FF_name)
+        assert sorted(e.basename() for e in cache.directory.dirs()) == ['last', staging.basename()]
+        # a file removed during the copy is a cache miss that leaves no partial matrices
+        out = tempfile.mkdtemp()
+        path_class = type(cache.directory)
+        copy = path_class.copy
+        copied = []
+
+        def _copy_and_remove_next(src, dst):
+            if copied:
+                os.remove(src)
+            copied.append(src)
+            return copy(src, dst)
+
+        path_class.copy = _copy_and_remove_next
+        try:
+            assert not cache.fetch('last', out, 'ff')
+            assert len(copied) == 2
+            assert os.listdir(out) == []
+            assert not cache.fetch('unknown', out, 'ff')
+        finally:
+            path_class.copy = copy
+            shutil.rmtree(out)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_form_factor_key_soil(debug=False):
+    triangles = [[(0, 0, 0), (1, 0, 0), (0, 1, 0)],
+                 [(0, 0, 1), (1, 0, 1), (0, 1, 1)]]
+    o_string, labels = opt_string_and_labels([(0.1,), (0.06, 0.07)])
+    sky = light_string([(1, (0, 0, -1))])
+    # the opaque triangle relabelled as soil
+    soil_labels = ['0' + labels[0][1:], labels[1]]
+
+    def _key(lab):
+        sim = Caribu(canfile=triangles_string(triangles, lab), skyfile=sky, optfiles=o_string,
+                     direct=False, infinitise=False, resdir=None, resfile=None, debug=debug)
+        sim.init()
+        return sim.form_factor_key()
+
+    assert _key(labels) == _key(labels)
+    assert _key(soil_labels) != _key(labels)
+    with SharedCanopy(triangles, labels) as shared, SharedCanopy(triangles, soil_labels) as soil:
+        assert shared.geometry_digest != soil.geometry_digest
+
+
+def test_bands_in_one_canestrad_call(debug=False):
+    can = data_path('filterT.can')
+    sky = data_path('zenith.light')
+    opts = [data_path('par.opt'), data_path('nir.opt')]
+
+    def _caribu():
+        return Caribu(canfile=can, skyfile=sky, optfiles=opts,
+                      patternfile=data_path('filter.8'), direct=False,
+                      nb_layers=6, can_height=21, sphere_diameter=1,
+                      resdir=None, resfile=None, debug=debug)
+
+    # one canestrad call per band
+    ref = _caribu()
+    ref.init()
+    ref.periodise()
+    ref.s2v()
+    for opt in ref.opticals:
+        ref.mcsail(opt)
+    for opt in ref.opticals:
+        ref.canestra(opt)
+    sim = _caribu()
+    sim.run()
+    for w in ('par', 'nir'):
+        assert sim.nrj[w]['data'] == ref.nrj[w]['data']
+
+
+def test_threaded_direct_projection(debug=False):
+    can = data_path('filterT.can')
+    # 8 directions, not all visible from the same face
+    lights = [(1, (0, 0, -1)), (0.5, (0.3, 0.2, -1)), (0.5, (-0.4, 0.1, -1)),
+              (0.3, (0.2, -0.6, -1)), (0.3, (-0.5, -0.5, -1)),
+              (0.2, (1, 0.2, -0.3)), (0.2, (-0.2, 1, -0.5)),
+              (0.1, (0.6, -0.8, -0.2))]
+    sky = '\n'.join(' '.join(map(str, (e,) + v)) for e, v in lights)
+    for pattern in (None, data_path('filter.8')):
+        res = []
+        for n in (1, 3):
+            sim = Caribu(canfile=can, skyfile=sky, optfiles=data_path('par.opt'),
+                         patternfile=pattern, infinitise=pattern is not None,
+                         direct=True, nb_threads=n, resdir=None, resfile=None,
+                         debug=debug)
+            sim.run()
+            res.append(sim.nrj['par']['data'])
+        for k in ('Eabs', 'Ei_sup', 'Ei_inf'):
+            for a, b in zip(res[0][k], res[1][k]):
+                assert_almost_equal(a, b, 8)
+
+
+def test_threaded_form_factors(debug=False):
+    can = data_path('filterT.can')
+    sky = data_path('zenith.light')
+    opts = [data_path('par.opt'), data_path('nir.opt')]
+    res = []
+    for n in (1, 3):
+        sim = Caribu(canfile=can, skyfile=sky, optfiles=opts,
+                     patternfile=data_path('filter.8'), direct=False,
+                     nb_layers=6, can_height=21, sphere_diameter=1,
+                     nb_threads=n, resdir=None, resfile=None, debug=debug)
+        sim.run()
+        res.append(sim.nrj)
+    for w in ('par', 'nir'):
+        assert res[0][w]['data'] == res[1][w]['data']
+
+
+def test_warm_start(debug=False):
+    can = data_path('filterT.can')
+
+    def _run(sky, state):
+        sim = Caribu(canfile=can, skyfile=data_path(sky), optfiles=data_path('par.opt'),
+                     direct=False, infinitise=False, sphere_diameter=-1,
+                     warm_start=state, resdir=None, resfile=None, debug=debug)
+        sim.run()
+        return sim
+
+    state = RadiosityState()
+    cold = _run('zenith.light', state)
+    assert 'par' in state.solutions
+    assert state.iterations['par'] == cold.solver_info['par']['iterations']
+    warm = _run('zenith.light', state)
+    assert warm.solver_info['par']['iterations'] < cold.solver_info['par']['iterations']
+    assert warm.solver_info['par']['residual'] < 1e-6
+    res, expected = warm.nrj['par']['data'], cold.nrj['par']['data']
+    for k in ('Eabs', 'Ei_sup', 'Ei_inf'):
+        for a, b in zip(res[k], expected[k]):
+            assert_almost_equal(a, b, 5)
+    state.clear()
+    assert state.get(state.key, 'par') is None
+    assert state.iterations == {} and state.residual == {}
+
 if __name__ == '__main__':
     tests = [(fname,func) for fname, func in globals().items() if 'test_' in fname]
     for fname,func in tests:
@@ -0,0 +1,58 @@
+run_test = True
+try:
+    import openalea.plantgl.all as pgl
+except ImportError:
+    run_test = False
+
+if run_test:
+    from alinea.caribu.caribu_star import caribu_star, caribu_stars, rain_and_light_star
+
+
+    class Properties(object):
+        """ the property interface of a MTG """
+
+        def __init__(self, **properties):
+            self._properties = properties
+
+        def properties(self):
+            return self._properties
+
+        def add_property(self, name):
+            self._properties[name] = {}
+
+        def property(self, name):
+            return self._properties[name]
+
+
+    def scene():
+        pts_1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+        pts_2 = [(0, 0, 0.5), (1, 0, 0.5), (0, 1, 1)]
+        pts_3 = [(1, 0, 0), (1, 1, 0), (0, 1, 0)]
+        return {1: [pts_1, pts_3], 2: [pts_2]}
+
+
+    def test_caribu_stars():
+        geom = scene()
+        stars = caribu_stars(geom, directions=(1, 16, 46), convUnit=1)
+        for d in (1, 16, 46):
+            star, exposed_area = stars[d]
+            expected, expected_area = caribu_star(geom, directions=d, convUnit=1)
+            for vid in geom:
+                assert abs(star[vid] - expected[vid]) < 1e-6
+                assert abs(exposed_area[vid] - expected_area[vid]) < 1e-6
+
+        star, exposed_area = caribu_stars(geom, directions=(16,), output_by_triangle=True, convUnit=1)[16]
+        assert len(star[1]) == len(exposed_area[1]) == 2
+
+
+    def test_rain_and_light_star():
+        geom = scene()
+        g = Properties(geometry=geom)
+        rain_and_light_star(g, light_sectors=16, convUnit=1)
+        rain_star, _ = caribu_star(geom, directions=1, convUnit=1)
+        light_star, _ = caribu_star(geom, directions=16, convUnit=1)
+        for vid in geom:
+            assert abs(g.property('rain_star')[vid] - rain_star[vid]) < 1e-6
+            assert abs(g.property('light_star')[vid] - light_star[vid]) < 1e-6
+        assert 'rain_exposed_area' in g.properties()
+        assert 'light_exposed_area' in g.properties()
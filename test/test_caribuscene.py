@@ -224,6 +224,50 @@ if run_test:
         assert_almost_equal(sum(out['Ei']['upper']), 1, 0)
 
 
+    def test_reduce_lights():
+        pts = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+        lights = [(0.5, (0, 0, -1)), (0.25, (0.01, 0, -1)), (0.25, (0, 0.01, -1))]
+        cscene = CaribuScene({'leaf': [pts]}, light=lights)
+        out, agg = cscene.run(direct=True, simplify=True, light_angle=5)
+        assert cscene.light_reduction['nb_lights'] == 1
+        assert_almost_equal(agg['Ei']['leaf'], 1, 2)
+        out, agg = cscene.run(direct=True, simplify=True)
+        assert cscene.light_reduction is None
+
+
+    def test_gap_fraction():
+        pts_1 = [(0, 0, 0.5), (1, 0, 0.5), (0, 1, 0.5)]
+        pts_2 = [(0, 0, 1), (1, 0, 1), (0, 1, 1)]
+        pts_3 = [(1, 0, 1), (1, 1, 1), (0, 1, 1)]
+        cscene = CaribuScene({'lower': [pts_1], 'upper': [pts_2, pts_3]},
+                             pattern=(0, 0, 1, 1))
+        directions = [(0, 0, -1), (0.3, 0.2, -1)]
+        gap, area = cscene.gap_fraction(directions, infinite=True)
+        # upper layer covers the pattern
+        for g in gap:
+            assert_almost_equal(g, 0, 2)
+        assert len(area['upper']) == 2
+        assert_almost_equal(area['upper'][0], 1, 2)
+        assert_almost_equal(area['lower'][0], 0, 2)
+        gap, area = cscene.gap_fraction(directions)
+        assert gap is None
+        # defaults to the lights of the scene
+        gap, area = cscene.gap_fraction(infinite=True)
+        assert len(gap) == len(cscene.light)
+
+
+    def test_hemispherical_photos():
+        pts_1 = [(0, 0, 1), (1, 0, 1), (0, 1, 1)]
+        cscene = CaribuScene({'leaf': [pts_1]}, pattern=(0, 0, 1, 1))
+        out = cscene.hemispherical_photos([(0.25, 0.25, 0), (0.25, 0.25, 2)], infinite=True,
+                                          image_size=32)
+        assert out['images'].shape == (2, 32, 32)
+        assert out['primitive_id'] == ['leaf']
+        assert out['gap_fraction'][0][0] == 0
+        assert_almost_equal(out['sky_fraction'][0], 0.5, 1)
+        assert (out['gap_fraction'][1] == 1).all()
+
+
     def test_run_monochrome():
         pts_1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
         pts_2 = [(0, 0, 1e-5), (1, 0, 1e-5), (0, 1, 1e-5)]
@@ -256,9 +300,57 @@ if run_test:
         assert len(out[cscene.default_band]['Eabs']['lower']) == 2
         assert len(out[cscene.default_band]['Eabs']['upper']) == 1
 
+        # monte carlo
+        out, agg = cscene.run(direct=False, infinite=True, nb_photons=1000)
+        assert len(out[cscene.default_band]['Eabs']['lower']) == 2
+        assert len(out[cscene.default_band]['Eabs_se']['lower']) == 2
+        assert len(out[cscene.default_band]['Ei_se']['upper']) == 1
+        assert 'Eabs_se' not in agg[cscene.default_band]
+
         return out, agg
 
 
+    def test_run_series():
+        pts_1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+        pts_2 = [(0, 0, 1e-5), (1, 0, 1e-5), (0, 1, 1e-5)]
+        pts_3 = [(1, 0, 0), (1, 1, 0), (0, 1, 0.5)]
+        pyscene = {'lower': [pts_1, pts_3], 'upper': [pts_2]}
+        light_sets = [[(1, (0, 0, -1))], [(2, (0.5, 0, -1))], [], [(1, (0, 0, -1))],
+                      [(3, (0, 0.3, -1)), (1, (0.2, 0.2, -1))]]
+        cscene = CaribuScene(pyscene, pattern=(0, 0, 1, 1))
+        for options in (dict(direct=True), dict(direct=False),
+                        dict(direct=False, infinite=True)):
+            series = list(cscene.run_series(light_sets, batch_size=2, workers=2,
+                                            simplify=True, **options))
+            assert len(series) == len(light_sets)
+            for lights, (raw, agg) in zip(light_sets, series):
+                cscene.setLight(lights or [(0, (0, 0, -1))])
+                expected, expected_agg = cscene.run(simplify=True, **options)
+                assert sorted(raw) == sorted(expected)
+                for k in expected:
+                    for pid in expected[k]:
+                        for a, b in zip(raw[k][pid], expected[k][pid]):
+                            assert abs(a - b) <= 1e-5 * max(1, abs(b))
+            # identical light sets give equal, but independent, results
+            assert series[0] == series[3]
+            assert series[0][0] is not series[3][0]
+            assert agg['Ei']['upper'] == expected_agg['Ei']['upper']
+
+        # light sets are streamed: results come out before the input is exhausted
+        read = []
+
+        def _hourly():
+            for i in range(20):
+                read.append(i)
+                yield [(1 + i % 3, (0, 0.1 * i, -1))]
+
+        series = cscene.run_series(_hourly(), batch_size=2, workers=1)
+        next(series)
+        assert len(read) < 20
+        assert len(list(series)) == 19
+        assert len(read) == 20
+
+
     def test_run_polychrome():
         pts_1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
         pts_2 = [(0, 0, 1e-5), (1, 0, 1e-5), (0, 1, 1e-5)]
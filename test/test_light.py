@@ -2,7 +2,7 @@ from math import sqrt, radians, cos
 from .tools import assert_almost_equal
 
 from alinea.caribu.caribu import green_leaf_PAR, raycasting
-from alinea.caribu.light import light_sources
+from alinea.caribu.light import light_sources, cumulative_sky, reduce_lights
 import numpy
 
 
@@ -142,3 +142,71 @@ def test_sources():
     # East source has X- look_at vector, west source a X+
     numpy.testing.assert_allclose(east[1], [-0.71, 0, -0.71], atol=0.01)
     numpy.testing.assert_allclose(west[1], [0.71, 0, -0.71], atol=0.01)
+
+
+def test_cumulative_sky():
+    # a week of hourly suns along the sun path
+    hours = numpy.tile(numpy.arange(24) + 0.5, 7)
+    ah = numpy.radians(15 * (hours - 12))
+    dec = numpy.radians(numpy.repeat(numpy.linspace(20, 23, 7), 24))
+    lat = numpy.radians(43.6)
+    sinh = numpy.sin(lat) * numpy.sin(dec) + numpy.cos(lat) * numpy.cos(dec) * numpy.cos(ah)
+    elevation = numpy.degrees(numpy.arcsin(sinh))
+    azimuth = 180 + numpy.degrees(numpy.arctan2(numpy.sin(ah), numpy.sin(lat) * numpy.cos(ah) -
+                                                numpy.cos(lat) * numpy.tan(dec)))
+    direct = numpy.where(elevation > 0, 500 * sinh, 0)
+    diffuse = numpy.full(len(hours), 50.)
+
+    errors = []
+    for bins in (1, 5, 20):
+        lights, error = cumulative_sky(diffuse, direct, elevation, azimuth, sun_bins=bins)
+        assert len(lights) == 46 + bins
+        suns = lights[46:]
+        assert_almost_equal(sum(e for e, _ in suns), direct.sum(), 6)
+        assert_almost_equal(sum(e for e, _ in lights[:46]) / diffuse.sum(), 1, 2)
+        errors.append(error['mean'])
+        assert error['max'] >= error['mean']
+    assert errors[0] > errors[1] > errors[2]
+    lights, error = cumulative_sky(diffuse, direct, elevation, azimuth, sun_bins=None)
+    assert len(lights) == 46 + (direct > 0).sum()
+    assert error['max'] < 1e-3
+
+    # one run for the period gives the sum of the hourly runs on a tilted leaf
+    # lit by all the suns on its upper side
+    triangles = [[(0, 0, 0), (1, 0, 0), (0, 1, 0.2)]]
+    materials = [(0.1,)]
+    direct = numpy.where(elevation > 15, direct, 0)
+    lights, error = cumulative_sky(0, direct, elevation, azimuth, sun_bins=5)
+    res = raycasting(triangles, materials, lights)
+    hourly = light_sources(elevation[direct > 0], azimuth[direct > 0], direct[direct > 0])
+    ref = raycasting(triangles, materials, hourly)
+    assert abs(res['Ei'][0] / ref['Ei'][0] - 1) < 1e-3
+
+
+def test_reduce_lights():
+    # a fine sky and a sun
+    elevation, azimuth = numpy.meshgrid(numpy.arange(2.5, 90, 5), numpy.arange(0, 360, 10))
+    lights = light_sources(elevation.ravel(), azimuth.ravel(), [1. / elevation.size] * elevation.size)
+    lights += light_sources(60, 180, 2)
+    for angle in (5, 20, 40):
+        reduced, error = reduce_lights(lights, max_angle=angle)
+        assert len(reduced) == error['nb_lights'] < len(lights)
+        assert_almost_equal(sum(e for e, _ in reduced), 3, 9)
+        assert error['max'] <= angle
+        assert error['mean'] <= error['max']
+    # the weak sources are merged into the sun
+    reduced, error = reduce_lights(lights, max_angle=5, threshold=0.1)
+    assert len(reduced) == 1
+    assert_almost_equal(reduced[0][0], 3, 9)
+    # weak sources do not move the groups away from their major sources
+    lights = [(1, (0, 0, -1)), (1, (numpy.sin(numpy.radians(4.9)), 0, -numpy.cos(numpy.radians(4.9))))]
+    lights += light_sources([30] * 20, [0] * 20, [0.08] * 20)
+    reduced, error = reduce_lights(lights, max_angle=10, threshold=0.05)
+    assert len(reduced) == 1
+    assert_almost_equal(reduced[0][0], 3.6, 9)
+    for _, v in lights[:2]:
+        assert numpy.degrees(numpy.arccos(numpy.dot(v, reduced[0][1]) / numpy.linalg.norm(v))) <= 10
+    # sources without energy are dropped, sources from below are kept
+    reduced, error = reduce_lights([(0, (0, 0, -1)), (1, (0, 0, 1)), (1, (0, 0, -1))])
+    assert reduced == [(1, (0, 0, -1)), (1, (0, 0, 1))]
+    assert error['nb_lights'] == 2
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import numpy
+
+from alinea.caribu.sky_tools.meteo_table import read_meteo, iter_meteo, iter_groups, \
+    split_groups, add_diffuse_fraction
+from alinea.caribu.sky_tools.read_meteo_file import read_meteo_file
+from alinea.caribu.sky_tools.spitters_horaire import spitters_horaire, RdRsH
+from alinea.caribu.sky_tools.group_seq import group_seq
+from alinea.caribu.sky_tools.get_meteo_dat import get_meteo_dat
+
+
+def meteo_file(ndays=3, rdrg=False):
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w') as f:
+        f.write('DOY;Hour;Rg;RdRg;Group\n' if rdrg else 'DOY;Hour;Rg;Group\n')
+        for d in range(ndays):
+            for h in range(1, 25):
+                rg = max(0, 500 * numpy.sin(numpy.pi * (h - 6) / 12))
+                if rdrg:
+                    f.write('%d;%d;%s;0.3;%d\n' % (150 + d, h, rg, d))
+                else:
+                    f.write('%d;%d;%s;%d\n' % (150 + d, h, rg, d))
+    return path
+
+
+def test_read_meteo():
+    path = meteo_file(3, rdrg=True)
+    try:
+        table = read_meteo(path)
+        assert table.dtype.names == ('DOY', 'Hour', 'Rg', 'RdRg', 'Group')
+        assert table['DOY'].dtype.kind == 'i'
+        assert table['Rg'].dtype.kind == 'f'
+        assert len(table) == 72
+        groups = split_groups(table)
+        assert [len(g) for g in groups] == [24] * 3
+        assert [g['Group'][0] for g in groups] == [0, 1, 2]
+
+        # streaming gives the same rows and groups, whatever the chunk size
+        for chunk_size in (5, 24, 1000):
+            chunks = list(iter_meteo(path, chunk_size))
+            assert all(len(c) <= chunk_size for c in chunks)
+            numpy.testing.assert_array_equal(numpy.concatenate(chunks), table)
+            streamed = list(iter_groups(path, chunk_size))
+            assert len(streamed) == 3
+            for g, s in zip(groups, streamed):
+                numpy.testing.assert_array_equal(g, s)
+    finally:
+        os.remove(path)
+
+
+def test_sky_tools():
+    path = meteo_file(2)
+    try:
+        tab, = read_meteo_file()(path)
+        assert len(tab) == 2
+        tab, = spitters_horaire()(tab, 43.6)
+        assert tab[0].dtype.names == ('DOY', 'Hour', 'Rg', 'RdRg', 'Group')
+        for group in range(2):
+            seq, = group_seq()(tab, group)
+            assert seq == list(range(24))
+            for i in seq:
+                Rd, Rsun, DOY, HU = get_meteo_dat()(tab, group, i)
+                rg = tab[group]['Rg'][i]
+                rdrg = RdRsH(rg, DOY, HU, 43.6)
+                assert (DOY, HU) == (150 + group, i + 1)
+                numpy.testing.assert_allclose((Rd, Rsun), (rg * rdrg * 0.0036,
+                                                           rg * (1 - rdrg) * 0.0036))
+        # an existing RdRg column is updated
+        table = add_diffuse_fraction(read_meteo(path), 43.6)
+        assert add_diffuse_fraction(table, 43.6).dtype == table.dtype
+    finally:
+        os.remove(path)
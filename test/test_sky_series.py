@@ -0,0 +1,96 @@
+import numpy
+
+from alinea.caribu.sky_tools.Sky import Sky, sector_index
+from alinea.caribu.sky_tools.mergeNskies import mergeNskies
+from alinea.caribu.sky_tools.Gensun import Gensun
+from alinea.caribu.sky_tools.spitters_horaire import RdRsH
+from alinea.caribu.sky_tools.sky_series import sun_position, diffuse_fraction, \
+    sky_arrays, sky_series
+
+
+def test_sun_position():
+    gensun = Gensun()
+    doy, hours, lat = 200, numpy.arange(4, 20, 0.5), 43.6
+    elev, azim = sun_position(doy, hours, lat)
+    for h, e, a in zip(hours, elev, azim):
+        s = gensun(1, doy, h, lat)
+        numpy.testing.assert_allclose((e, a), (s.elev, s.azim), atol=1e-12)
+    # broadcasting over sites
+    elev, azim = sun_position(doy, hours, numpy.array([[0.], [43.6]]))
+    assert elev.shape == (2, len(hours))
+
+
+def test_diffuse_fraction():
+    hours = numpy.arange(6, 19)
+    for rg in (0, 50, 200, 500, 900):
+        frac = diffuse_fraction(rg, 172, hours, 48.8)
+        numpy.testing.assert_allclose(frac, [RdRsH(rg, 172, h, 48.8) for h in hours],
+                                      atol=1e-12)
+    # sun below the horizon
+    assert diffuse_fraction(100, 172, 0, 48.8) == 1
+
+
+def test_sky_series():
+    rg = numpy.array([0, 150., 600., 300.])
+    hours = numpy.array([2, 8, 12, 17])
+    lights = sky_series(rg, 150, hours, 43.6, nazi=6, nzen=4, sky_type='uoc')
+    assert len(lights) == 4
+    assert lights[0] == []
+    # step by step with Sky and Sun
+    for i in range(1, 4):
+        rdrg = RdRsH(rg[i], 150, hours[i], 43.6)
+        sky = Sky(6, 4)
+        sky.set_Rd(rg[i] * rdrg * 0.0036, 'uoc')
+        sky.set_Rsun2(Gensun()(rg[i] * (1 - rdrg) * 0.0036, 150, hours[i], 43.6))
+        expected = [(s[0], tuple(s[1:4])) for s in sky.sky if s[0] > 0]
+        assert len(lights[i]) == len(expected)
+        for (e, v), (ee, vv) in zip(lights[i], expected):
+            numpy.testing.assert_allclose([e] + list(v), [ee] + list(vv), atol=1e-12)
+
+    energies, sectors, sun = sky_arrays(rg, 150, hours, 43.6, nazi=6, nzen=4)
+    assert energies.shape == (4, 25)
+    assert sectors.shape == (24, 3)
+    assert sun.shape == (4, 3)
+    numpy.testing.assert_allclose(energies.sum(axis=1), rg * 0.0036)
+
+
+def test_sky():
+    sky = Sky(6, 4)
+    sky.set_Rd(2., 'soc')
+    assert abs(sky.get_Rs() - 2) < 1e-12
+    for row in sky.sky:
+        i, dx, dy, dz, j, k = row
+        elv, azim = (k + 0.5) * sky.dt, (j + 0.5) * sky.dp
+        assert abs(i - 2 * sky.soc(elv, sky.dt, azim, sky.dp)) < 1e-12
+        numpy.testing.assert_allclose((dx, dy, dz), sky.Vdir(elv, azim), atol=1e-12)
+        # a direction is binned in the sector around it
+        assert sector_index(6, 4, elv, azim) == j * 4 + k
+    assert sector_index(6, 4, numpy.pi / 2 + 0.1, 0) == -1
+
+    # hourly skies accumulated at once, or one by one
+    hours = numpy.arange(5, 20, 0.5)
+    elev, azim = sun_position(172, hours, 43.6)
+    rsun = numpy.linspace(0.1, 1, len(hours))
+    rd = rsun / 2
+    gensun = Gensun()
+    skies = []
+    for h, rs, r in zip(hours, rsun, rd):
+        s = Sky(6, 4)
+        s.set_Rd(r, 'uoc')
+        s.set_Rsun(gensun(rs, 172, h, 43.6))
+        skies.append(s)
+    merged = mergeNskies()(skies)
+    total = Sky(6, 4)
+    total.add_series(rd, 'uoc', rsun, elev, azim)
+    numpy.testing.assert_allclose(total.I, merged.I, atol=1e-12)
+    day = elev < numpy.pi / 2
+    assert abs(total.get_Rs() - rd.sum() - rsun[day].sum()) < 1e-9
+
+    # sources at exact position are kept by merges
+    s = Sky(6, 4)
+    s.set_Rsun2(gensun(1, 172, 12, 43.6))
+    merged = s + skies[0]
+    assert len(merged.sky) == 25
+    assert merged.sky[-1][4:] == [-1, -1]
+    assert abs(merged.get_Rs() - 1 - skies[0].get_Rs()) < 1e-12
+    assert abs(merged.Noralised_Sky().get_Rs() - 1) < 1e-12